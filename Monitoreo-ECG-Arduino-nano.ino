@@ -24,6 +24,38 @@ int baseline2 = 0;
 
 
 
+
+
+
+
+// --- CANAL DE COMANDOS (una línea por comando, respuesta "OK ..." o "ERR ...") ---
+
+// S1 / S0   -> transmitir o pausar las tramas
+
+// R<hz>     -> frecuencia de muestreo (1 a 60 Hz)
+
+// A<alpha>  -> suavizado del filtro EMA (0 < alpha <= 1)
+
+// C         -> recalibrar la línea base sin reiniciar la placa
+
+// V         -> versión del firmware
+
+const char VERSION_FIRMWARE[] = "ECG-EMG 1.1";
+
+bool transmitiendo = true;
+
+unsigned long periodoUs = 20000; // 50 Hz
+
+// Número de muestra enviado en cada trama (N:) para que el host estime el reloj real
+
+unsigned long secuencia = 0;
+
+char comando[24];
+
+byte largoComando = 0;
+
+
+
 void setup() {
 
   Serial.begin(115200);
@@ -38,27 +70,47 @@ void setup() {
 
   // ¡IMPORTANTE!: No muevas los músculos durante los primeros 2 segundos al encender.
 
+  calibrarLineaBase(100, 10);
+
+ 
+
+  // Inicializamos filtros con la base detectada
+
+  filtered1 = baseline1;
+
+  filtered2 = baseline2;
+
+}
+
+
+
+
+
+
+
+// Promedio de "muestras" lecturas separadas "esperaMs" milisegundos.
+
+// El comando C usa una ventana corta para recalibrar entre pacientes sin reiniciar.
+
+void calibrarLineaBase(int muestras, int esperaMs) {
+
   long suma1 = 0;
 
   long suma2 = 0;
 
-  for(int i=0; i<100; i++) {
+  for(int i=0; i<muestras; i++) {
 
     suma1 += analogRead(PIN_SENSOR_1);
 
     suma2 += analogRead(PIN_SENSOR_2);
 
-    delay(10);
+    delay(esperaMs);
 
   }
 
-  baseline1 = suma1 / 100;
-
-  baseline2 = suma2 / 100;
+  baseline1 = suma1 / muestras;
 
- 
-
-  // Inicializamos filtros con la base detectada
+  baseline2 = suma2 / muestras;
 
   filtered1 = baseline1;
 
@@ -68,8 +120,138 @@ void setup() {
 
 
 
+
+
+
+
+// Junta los caracteres recibidos sin bloquear y ejecuta cada línea completa.
+
+void atenderComandos() {
+
+  while (Serial.available() > 0) {
+
+    char c = Serial.read();
+
+    if (c == '\n' || c == '\r') {
+
+      if (largoComando > 0) {
+
+        comando[largoComando] = '\0';
+
+        ejecutarComando(comando);
+
+        largoComando = 0;
+
+      }
+
+    } else if (largoComando < sizeof(comando) - 1) {
+
+      comando[largoComando++] = c;
+
+    }
+
+  }
+
+}
+
+
+
+
+
+
+
+void ejecutarComando(char *cmd) {
+
+  char tipo = cmd[0];
+
+  if (tipo == 'S' && (cmd[1] == '0' || cmd[1] == '1') && cmd[2] == '\0') {
+
+    transmitiendo = (cmd[1] == '1');
+
+    Serial.print("OK S");
+
+    Serial.println(transmitiendo ? 1 : 0);
+
+  } else if (tipo == 'R') {
+
+    int hz = atoi(cmd + 1);
+
+    if (hz < 1 || hz > 60) {
+
+      Serial.println("ERR R");
+
+      return;
+
+    }
+
+    periodoUs = 1000000UL / hz;
+
+    Serial.print("OK R");
+
+    Serial.println(hz);
+
+  } else if (tipo == 'A') {
+
+    float a = atof(cmd + 1);
+
+    if (a <= 0.0 || a > 1.0) {
+
+      Serial.println("ERR A");
+
+      return;
+
+    }
+
+    alpha = a;
+
+    Serial.print("OK A");
+
+    Serial.println(alpha, 3);
+
+  } else if (tipo == 'C' && cmd[1] == '\0') {
+
+    calibrarLineaBase(50, 2);
+
+    Serial.print("OK C");
+
+    Serial.print(baseline1);
+
+    Serial.print(" ");
+
+    Serial.println(baseline2);
+
+  } else if (tipo == 'V' && cmd[1] == '\0') {
+
+    Serial.print("OK V");
+
+    Serial.println(VERSION_FIRMWARE);
+
+  } else {
+
+    Serial.print("ERR ");
+
+    Serial.println(cmd);
+
+  }
+
+}
+
+
+
 void loop() {
 
+  unsigned long inicioCiclo = micros();
+
+  atenderComandos();
+
+  if (!transmitiendo) {
+
+    return;
+
+  }
+
+
+
   // 1. LECTURA "ANTI-GHOSTING" (Optimizada)
 
   // Bajamos de 10000 a 7500 microsegundos. Es mucho más rápido y funciona igual.
@@ -132,10 +314,22 @@ void loop() {
 
   Serial.print("Musculo_2:");
 
-  Serial.println(plot2);
+  Serial.print(plot2);
 
+  Serial.print(",N:");
 
+  Serial.println(secuencia++);
 
-  delay(5);
+
+
+  // 6. RITMO DE MUESTREO
+
+  // Completa el periodo pedido (R<hz>) atendiendo comandos mientras espera.
+
+  while (micros() - inicioCiclo < periodoUs) {
+
+    atenderComandos();
+
+  }
 
   }
@@ -0,0 +1,4981 @@
+"""Núcleo sin interfaz del sistema de rehabilitación CNC con monitoreo ECG.
+
+Dispositivos (ArduinoSensorReader, ServicioSensores, ControladorCNC, descubrimiento de
+puertos), G-code y trayectorias, generadores de rutinas, almacenamiento de pacientes y
+sesiones, bus de eventos y registro. No importa pygame ni tkinter: lo usan tanto
+programatesis9.py (la interfaz) como scripts, servicios y pruebas sin pantalla.
+"""
+from threading import Thread, Lock, Condition, Event, current_thread
+from collections import deque
+from typing import NamedTuple
+import os
+import time
+import json
+import importlib
+import importlib.util
+import contextlib
+import logging
+import logging.handlers
+import queue
+import sys
+import numpy as np
+import math
+
+class ConexionCancelada(Exception):
+    """El usuario canceló una conexión en curso."""
+    pass
+
+class BufferCircular:
+    """Búfer circular de tamaño fijo sobre numpy (sin pop(0) ni copias por muestra).
+
+    total cuenta todas las muestras añadidas desde el inicio y sirve de cursor para leer
+    solo lo nuevo con desde(); lo más antiguo se pierde al llenarse.
+    """
+
+    def __init__(self, capacidad: int, dtype=float):
+        self.capacidad = max(1, int(capacidad))
+        self._datos = np.zeros(self.capacidad, dtype=dtype)
+        self.total = 0
+
+    def __len__(self):
+        return min(self.total, self.capacidad)
+
+    def agregar(self, valor):
+        self._datos[self.total % self.capacidad] = valor
+        self.total += 1
+
+    def ultimos(self, n: int | None = None) -> np.ndarray:
+        """Copia de las últimas n muestras (todas si n es None), de la más antigua a la más reciente."""
+        llenos = len(self)
+        n = llenos if n is None else max(0, min(int(n), llenos))
+        if n == 0:
+            return self._datos[:0].copy()
+        fin = self.total % self.capacidad
+        inicio = fin - n
+        if inicio >= 0:
+            return self._datos[inicio:fin].copy()
+        return np.concatenate((self._datos[inicio:], self._datos[:fin]))
+
+    def desde(self, cursor: int):
+        """Muestras añadidas desde el cursor (limitadas a la capacidad) y el cursor nuevo."""
+        return self.ultimos(self.total - max(0, int(cursor))), self.total
+
+class AjusteRelojMuestras:
+    """Ajuste lineal en línea de la hora de llegada al host frente al número de muestra (N:)
+    del firmware: llegada ≈ t0 + periodo·(n − n0) + latencia.
+
+    Mínimos cuadrados ponderados con olvido exponencial (forma centrada, estable en sesiones
+    de horas). La pendiente da el periodo real del reloj del Nano y su deriva frente al
+    nominal; la envolvente inferior de los residuos separa el retraso variable del transporte
+    (USB, planificador) y la hora corregida de cada muestra se toma sobre esa envolvente.
+    Los tiempos son de time.monotonic().
+    """
+
+    def __init__(self, periodo_nominal: float = 0.02, olvido: float = 0.9999,
+                 latencia_base: float = 0.0):
+        self.periodo_nominal = float(periodo_nominal)
+        self.olvido = float(olvido)
+        # Retraso mínimo conocido (duración de la trama en el cable)
+        self.latencia_base = float(latencia_base)
+        self.reiniciar()
+
+    def reiniciar(self):
+        self.n0 = None
+        self.t0 = None
+        self.muestras = 0
+        self._ultimo_n = None
+        self._peso = 0.0
+        self._media_x = 0.0
+        self._media_y = 0.0
+        self._cxx = 0.0
+        self._cxy = 0.0
+        self._envolvente = None  # residuo mínimo (con relajación lenta)
+        self._jitter = 0.0
+
+    @property
+    def valido(self) -> bool:
+        return self.muestras >= 20 and self._cxx > 0
+
+    @property
+    def periodo(self) -> float:
+        return self._cxy / self._cxx if self.valido else self.periodo_nominal
+
+    def _recta(self, x: float) -> float:
+        return self._media_y + self.periodo * (x - self._media_x)
+
+    def agregar(self, n: int, t: float) -> float:
+        """Incorpora la muestra n llegada en t y devuelve su hora corregida."""
+        if self._ultimo_n is not None and n <= self._ultimo_n:
+            # Contador reiniciado (placa reiniciada): el reloj anterior ya no vale
+            self.reiniciar()
+        if self.n0 is None:
+            self.n0, self.t0 = n, t
+        self._ultimo_n = n
+        x, y = float(n - self.n0), t - self.t0
+        self._peso = self.olvido * self._peso + 1.0
+        dx = x - self._media_x
+        self._media_x += dx / self._peso
+        self._media_y += (y - self._media_y) / self._peso
+        self._cxx = self.olvido * self._cxx + dx * (x - self._media_x)
+        self._cxy = self.olvido * self._cxy + dx * (y - self._media_y)
+        self.muestras += 1
+        residuo = y - self._recta(x)
+        if self._envolvente is None or residuo < self._envolvente:
+            self._envolvente = residuo
+        else:
+            # Relajación de 2 µs por muestra: sigue a la recta si la pendiente se corrige
+            self._envolvente = min(residuo, self._envolvente + 2e-6)
+        self._jitter += 0.01 * ((residuo - self._envolvente) - self._jitter)
+        return self.hora_muestra(n)
+
+    def hora_muestra(self, n: int) -> float:
+        """Hora (monotónica) estimada en que el firmware tomó la muestra n."""
+        if self.n0 is None:
+            return 0.0
+        return self.t0 + self._recta(float(n - self.n0)) + (self._envolvente or 0.0) - self.latencia_base
+
+    def estado(self) -> dict:
+        periodo = self.periodo
+        return {
+            'valido': self.valido,
+            'muestras': self.muestras,
+            'tasa_hz': 1.0 / periodo if periodo > 0 else 0.0,
+            'deriva_ppm': (periodo / self.periodo_nominal - 1.0) * 1e6 if self.valido else 0.0,
+            'latencia_ms': (self.latencia_base + self._jitter) * 1000.0,
+            'jitter_ms': self._jitter * 1000.0,
+        }
+
+# Clase para leer datos de sensores ECG del Arduino
+class ArduinoSensorReader:
+    def __init__(self, puerto=None, baudrate=115200, capacidad: int = 15000):
+        self.puerto = puerto
+        self.baudrate = baudrate
+        self.conexion = None
+        self.conectado = False
+        # ~5 min a 50 Hz: el historial sobrevive a las ventanas que lo consultan
+        self.data_buffer_hombro = BufferCircular(capacidad)  # Canal ECG Hombro (A0)
+        self.data_buffer_antebrazo = BufferCircular(capacidad)  # Canal ECG Antebrazo (A1)
+        self.tiempos_buffer = BufferCircular(capacidad)  # Hora de llegada de cada muestra
+        # Hora corregida de cada muestra (reloj del Nano ajustado al del host, en time.time())
+        self.tiempos_corregidos_buffer = BufferCircular(capacidad)
+        # Trama típica "Musculo_1:123,Musculo_2:45,N:678" = ~34 bytes de 10 bits en el cable
+        self.reloj = AjusteRelojMuestras(latencia_base=34 * 10.0 / baudrate)
+        self._desfase_reloj = time.time() - time.monotonic()
+        # Solo placas identificadas como ECG: sin el primer puerto libre como último recurso
+        self.solo_identificado = False
+        self.lock = Lock()
+        self.thread = None
+        self.running = False
+        # Último dato recibido: un flujo en silencio también cuenta como pérdida
+        self.ultimo_dato_ts = 0.0
+        self.silencio_max = 3.0
+        self.supervisor = None
+        # Identidad USB de la placa que entregó tramas ECG: el supervisor sólo reconecta a ésa
+        self.clave_usb = None
+        self._clave_conexion = None  # identidad del puerto abierto, aún sin confirmar como ECG
+        self._ts_conexion = 0.0
+        # Canal de comandos del firmware: una orden a la vez, respondida con "OK ..."/"ERR ..."
+        self.flujo_activo = True
+        self.version_fw = None
+        self._comando_lock = Lock()
+        self._comando_pendiente = None  # letra del comando que espera respuesta
+        self._respuesta_comando = None
+        self._respuesta_evento = Event()
+
+    def autodetectar_puerto(self):
+        """Busca el puerto de la placa ECG: primero por identificación del servicio de
+        descubrimiento; si no la hay, el primer ACM/USB que no sea de otra placa conocida."""
+        if not SERIAL_OK:
+            print("[AVISO] pyserial no está instalado; no se puede autodetectar puertos.")
+            return None
+        descubrimiento = descubrimiento_dispositivos()
+        puerto_ecg = descubrimiento.puerto_para('ecg')
+        if puerto_ecg:
+            print(f"Puerto ECG identificado: {puerto_ecg}")
+            return puerto_ecg
+        if self.solo_identificado:
+            return None
+        try:
+            import serial.tools.list_ports
+        except Exception:
+            print("[AVISO] No se pudo importar serial.tools.list_ports.")
+            return None
+        
+        ocupados = descubrimiento.puertos_de_otros('ecg')
+        puertos = [p for p in serial.tools.list_ports.comports() if p.device not in ocupados]
+        for puerto in puertos:
+            if "ACM" in puerto.device or "USB" in puerto.device:
+                print(f"Puerto Arduino detectado: {puerto.device}")
+                return puerto.device
+        if puertos:
+            print(f"No se encontró un puerto Arduino específico, usando el primero: {puertos[0].device}")
+            return puertos[0].device
+        return None
+
+    def conectar(self):
+        if not SERIAL_OK:
+            print("[AVISO] pyserial no está instalado.")
+            return False
+        if self.conectado and self.thread and self.thread.is_alive():
+            return True
+        if self.puerto is None:
+            self.puerto = self.autodetectar_puerto()
+            if self.puerto is None:
+                print("No se pudo encontrar un puerto serial.")
+                return False
+        descubrimiento = descubrimiento_dispositivos()
+        # Reservar el puerto antes de abrirlo: ningún sondeo debe abrirlo (y reiniciar la placa) a la vez
+        reservado = descubrimiento.marcar_en_uso(self.puerto)
+        try:
+            # Reutilizar la conexión del sondeo si existe (evita otro reinicio y recalibración)
+            conn = descubrimiento.tomar_conexion(self.puerto)
+            if conn is not None:
+                conn.timeout = 1
+                self.conexion = conn
+            else:
+                self.conexion = serial.Serial(self.puerto, self.baudrate, timeout=1)
+            ident = descubrimiento.identidad(self.puerto) or {}
+            self._clave_conexion = ident.get('clave') or descubrimiento.clave_de_puerto(self.puerto)
+            if ident.get('tipo') == 'ecg':
+                self.clave_usb = self._clave_conexion
+            self.conectado = True
+            self.running = True
+            # Abrir el puerto reinicia el Nano: vuelve a transmitir con su configuración inicial
+            self.flujo_activo = True
+            self._reiniciar_reloj(0.02)
+            # Margen para la calibración de línea base del sketch tras el reinicio
+            self.ultimo_dato_ts = time.time()
+            self._ts_conexion = self.ultimo_dato_ts
+            self.thread = Thread(target=self._leer_datos)
+            self.thread.daemon = True
+            self.thread.start()
+            print(f"Conectado a Arduino en {self.puerto}")
+            self.iniciar_supervisor()
+            return True
+        except serial.SerialException as e:
+            print(f"Error al conectar a {self.puerto}: {e}")
+            self.conectado = False
+            if reservado:
+                descubrimiento.liberar(self.puerto)
+            return False
+
+    def iniciar_supervisor(self):
+        """Arranca (una vez) el supervisor que reconecta el ECG ante errores o silencio."""
+        if self.supervisor is None:
+            self.supervisor = SupervisorReconexion('ECG', self._supervisor_vivo, self._supervisor_reconectar)
+        self.supervisor.iniciar()
+
+    def _supervisor_vivo(self) -> bool:
+        if not (self.conectado and self.running and self.thread and self.thread.is_alive()):
+            return False
+        if not self.flujo_activo:
+            # Flujo pausado a propósito: el silencio no es una pérdida
+            return True
+        return (time.time() - self.ultimo_dato_ts) < self.silencio_max
+
+    def _supervisor_reconectar(self) -> bool:
+        """Cierra lo que quede y reabre el mismo lector: los búferes y quien los usa se conservan.
+        Sólo vuelve a abrir la placa ECG conocida (por identidad USB); no sondea otros puertos,
+        porque abrir un puerto reinicia el Arduino que haya detrás (p. ej. la CNC).
+        """
+        print("[AVISO] ECG sin datos: intentando reconectar...")
+        descubrimiento = descubrimiento_dispositivos()
+        if self.clave_usb is None and self.ultimo_dato_ts > self._ts_conexion:
+            # El puerto entregó tramas ECG aunque el sondeo no lo identificara: es la placa
+            self.clave_usb = self._clave_conexion
+        self.running = False
+        if self.thread and self.thread is not current_thread():
+            self.thread.join(2.0)
+        try:
+            if self.conexion and self.conexion.is_open:
+                self.conexion.close()
+        except Exception:
+            pass
+        self.conectado = False
+        if self.puerto:
+            descubrimiento.liberar(self.puerto)
+        if self.clave_usb is None:
+            # Nunca llegaron tramas ECG por este puerto: no hay placa conocida que reabrir
+            return False
+        # El puerto puede cambiar de nombre al reconectar el USB: resolver por identidad
+        puerto = descubrimiento.puerto_de_clave(self.clave_usb)
+        if puerto is None:
+            return False
+        self.puerto = puerto
+        return self.conectar()
+
+    def _leer_datos(self):
+        while self.running and self.conexion:
+            try:
+                linea = self.conexion.readline().decode('utf-8').strip()
+                if linea.startswith(('OK ', 'ERR ')):
+                    self._recibir_respuesta(linea)
+                elif linea and "Musculo_1:" in linea and "Musculo_2:" in linea:
+                    partes = linea.split(',')
+                    valor_hombro_str = partes[0].split(':')[1]
+                    valor_antebrazo_str = partes[1].split(':')[1]
+                    
+                    valor_hombro = float(valor_hombro_str)
+                    valor_antebrazo = float(valor_antebrazo_str)
+                    # Firmware con número de muestra: "...,N:<n>"
+                    secuencia = int(partes[2][2:]) if len(partes) > 2 and partes[2].startswith('N:') else None
+                    llegada = time.monotonic()
+
+                    with self.lock:
+                        self.ultimo_dato_ts = llegada + self._desfase_reloj
+                        if secuencia is not None:
+                            corregido = self.reloj.agregar(secuencia, llegada) + self._desfase_reloj
+                        else:
+                            corregido = self.ultimo_dato_ts
+                        self.data_buffer_hombro.agregar(valor_hombro)
+                        self.data_buffer_antebrazo.agregar(valor_antebrazo)
+                        self.tiempos_buffer.agregar(self.ultimo_dato_ts)
+                        self.tiempos_corregidos_buffer.agregar(corregido)
+
+            except (ValueError, UnicodeDecodeError, IndexError):
+                # Ignorar líneas mal formadas o con errores
+                _LOG_ECG_DATOS.debug("Trama ECG descartada")
+            except (serial.SerialException, OSError) as e:
+                _LOG_ECG.warning("Error de lectura ECG: %s", e)
+                self._desconectar_interno()
+                break
+
+    def _recibir_respuesta(self, linea: str):
+        """Entrega al comando en espera su respuesta (la llama el hilo lector)."""
+        _LOG_ECG_DATOS.debug("Firmware ECG: %s", linea)
+        estado, _, resto = linea.partition(' ')
+        if self._comando_pendiente and resto.startswith(self._comando_pendiente):
+            if estado == 'OK':
+                self._respuesta_comando = (True, resto[1:].strip())
+            else:
+                self._respuesta_comando = (False, f"Firmware rechazó el comando: {linea}")
+            self._respuesta_evento.set()
+
+    def enviar_comando(self, comando: str, plazo: float = 1.0):
+        """Envía una orden al firmware por la conexión abierta y espera su confirmación.
+        Devuelve (ok, respuesta); un firmware sin canal de comandos no responde y da (False, ...)."""
+        if not (self.conectado and self.conexion):
+            return False, "Sensor ECG no conectado"
+        with self._comando_lock:
+            self._respuesta_evento.clear()
+            self._respuesta_comando = None
+            self._comando_pendiente = comando[:1]
+            try:
+                self.conexion.write((comando + "\n").encode())
+                if not self._respuesta_evento.wait(plazo):
+                    return False, f"Sin respuesta del firmware a '{comando}'"
+                return self._respuesta_comando
+            except (serial.SerialException, OSError) as e:
+                return False, f"Error enviando '{comando}': {e}"
+            finally:
+                self._comando_pendiente = None
+
+    def iniciar_flujo(self):
+        ok, resp = self.enviar_comando("S1")
+        if ok:
+            # El contador sigue, pero el hueco de la pausa rompe la recta: ajuste nuevo
+            self._reiniciar_reloj()
+            self.flujo_activo = True
+            self.ultimo_dato_ts = time.time()
+        return ok, resp
+
+    def detener_flujo(self):
+        ok, resp = self.enviar_comando("S0")
+        if ok:
+            self.flujo_activo = False
+        return ok, resp
+
+    def fijar_frecuencia(self, hz: int):
+        """Frecuencia de muestreo del firmware (1 a 60 Hz)."""
+        ok, resp = self.enviar_comando(f"R{int(hz)}")
+        if ok:
+            self._reiniciar_reloj(1.0 / int(hz))
+        return ok, resp
+
+    def fijar_alpha(self, alpha: float):
+        """Suavizado del filtro EMA del firmware (0 < alpha <= 1)."""
+        return self.enviar_comando(f"A{float(alpha):.3f}")
+
+    def recalibrar(self):
+        """Repite la línea base en la placa (~100 ms) sin reabrir el puerto.
+        Devuelve (ok, (base_hombro, base_antebrazo)) o (False, mensaje)."""
+        ok, resp = self.enviar_comando("C", plazo=2.0)
+        if not ok:
+            return ok, resp
+        try:
+            b1, b2 = resp.split()
+            return True, (int(b1), int(b2))
+        except ValueError:
+            return False, f"Respuesta de calibración inválida: {resp}"
+
+    def version_firmware(self):
+        ok, resp = self.enviar_comando("V")
+        if ok:
+            self.version_fw = resp
+        return ok, resp
+
+    def _desconectar_interno(self):
+        """Desconexión interna sin join() - para llamar desde el mismo hilo"""
+        self.running = False
+        if self.conexion and self.conexion.is_open:
+            self.conexion.close()
+        self.conectado = False
+        if self.puerto:
+            descubrimiento_dispositivos().liberar(self.puerto)
+        print("Desconectado de Arduino (error de conexión).")
+
+    def desconectar(self):
+        """Desconexión externa - para llamar desde otro hilo"""
+        # Desconexión voluntaria: no reconectar
+        if self.supervisor is not None:
+            self.supervisor.detener()
+        self.running = False
+        if self.thread and self.thread != current_thread():
+            self.thread.join()
+        if self.conexion and self.conexion.is_open:
+            self.conexion.close()
+        self.conectado = False
+        if self.puerto:
+            descubrimiento_dispositivos().liberar(self.puerto)
+        print("Desconectado de Arduino.")
+
+    def obtener_datos_hombro(self):
+        with self.lock:
+            return self.data_buffer_hombro.ultimos(500).tolist()
+
+    def obtener_datos_antebrazo(self):
+        with self.lock:
+            return self.data_buffer_antebrazo.ultimos(500).tolist()
+
+    def muestras_totales(self) -> int:
+        with self.lock:
+            return self.data_buffer_hombro.total
+
+    def obtener_desde(self, cursor: int):
+        """Muestras nuevas desde el cursor: (hombro, antebrazo, cursor_nuevo) como arrays numpy."""
+        with self.lock:
+            hombro, nuevo = self.data_buffer_hombro.desde(cursor)
+            antebrazo, _ = self.data_buffer_antebrazo.desde(cursor)
+        return hombro, antebrazo, nuevo
+
+    def estado_reloj(self) -> dict:
+        """Tasa real, deriva (ppm) y latencia de transporte estimadas por el ajuste de reloj."""
+        with self.lock:
+            return self.reloj.estado()
+
+    def tiempos_corregidos(self, n: int | None = None) -> np.ndarray:
+        """Hora corregida (time.time()) de las últimas n muestras, alineable con la CNC."""
+        with self.lock:
+            return self.tiempos_corregidos_buffer.ultimos(n)
+
+    def _reiniciar_reloj(self, periodo_nominal: float | None = None):
+        with self.lock:
+            if periodo_nominal:
+                self.reloj.periodo_nominal = periodo_nominal
+            self.reloj.reiniciar()
+
+    def historial(self, n: int | None = None):
+        """Últimas n muestras de ambos canales, incluidas las anteriores a quien pregunta."""
+        with self.lock:
+            return self.data_buffer_hombro.ultimos(n), self.data_buffer_antebrazo.ultimos(n)
+
+    def tasa_muestreo(self, ventana: int = 100) -> float:
+        """Muestras por segundo: la del ajuste de reloj si ya es válido; si no, estimada con
+        las últimas llegadas (0.0 si no hay suficientes)."""
+        with self.lock:
+            if self.reloj.valido:
+                return 1.0 / self.reloj.periodo
+            t = self.tiempos_buffer.ultimos(ventana)
+        if len(t) < 2 or t[-1] <= t[0]:
+            return 0.0
+        return (len(t) - 1) / float(t[-1] - t[0])
+
+class SuscripcionSensor:
+    """Vista de una ventana sobre el servicio de sensores: lee lo nuevo desde su cursor."""
+
+    def __init__(self, servicio, nombre: str, cursor: int):
+        self.servicio = servicio
+        self.nombre = nombre
+        self.lector = servicio.lector
+        self.cursor = cursor
+        self.activa = True
+
+    def nuevas(self):
+        """Muestras llegadas desde la última llamada (o desde la suscripción): (hombro, antebrazo)."""
+        hombro, antebrazo, self.cursor = self.lector.obtener_desde(self.cursor)
+        return hombro, antebrazo
+
+    def cancelar(self):
+        if self.activa:
+            self.activa = False
+            self.servicio.desuscribir(self)
+
+class ServicioSensores:
+    """Lector ECG único del proceso: conecta al arrancar y sigue llenando su búfer circular
+    aunque no haya ninguna ventana abierta. Las ventanas se suscriben y se desuscriben; abrir
+    o cerrar una ventana ya no reinicia la placa (ni su calibración) ni pierde el historial.
+    """
+
+    def __init__(self):
+        self.lector = ArduinoSensorReader()
+        self.lector.solo_identificado = True
+        self._lock = Lock()
+        self._suscripciones = []
+        self.iniciado = False
+        # Pausar las tramas en la placa cuando ninguna ventana las usa (se pierde el historial
+        # de ese intervalo, por eso no es el comportamiento por defecto)
+        self.pausar_sin_suscriptores = False
+        self.paciente_actual = None
+
+    def iniciar(self):
+        """Conecta en segundo plano; si no hay placa, el supervisor la sigue buscando."""
+        with self._lock:
+            if self.iniciado or not SERIAL_OK:
+                return
+            self.iniciado = True
+        Thread(target=self._conectar_inicial, name="servicio-sensores", daemon=True).start()
+
+    def _conectar_inicial(self):
+        if self.lector.conectar():
+            print("[ECG] Servicio de sensores conectado")
+            bus_eventos().publicar('ecg', 'conexion', {'estado': 'conectado', 'puerto': self.lector.puerto})
+        else:
+            print("[ECG] Sensor no disponible al iniciar; se seguirá buscando en segundo plano")
+        self.lector.iniciar_supervisor()
+
+    def suscribir(self, nombre: str, id_paciente=None) -> SuscripcionSensor:
+        """Registra una ventana. Con un paciente distinto al anterior se recalibra la línea
+        base en la placa (sin reiniciarla); si las tramas estaban pausadas, se reanudan."""
+        self.iniciar()
+        suscripcion = SuscripcionSensor(self, nombre, self.lector.muestras_totales())
+        with self._lock:
+            self._suscripciones.append(suscripcion)
+            cambio_paciente = id_paciente is not None and id_paciente != self.paciente_actual
+            if cambio_paciente:
+                self.paciente_actual = id_paciente
+        if self.lector.conectado and (cambio_paciente or not self.lector.flujo_activo):
+            Thread(target=self._preparar_flujo, args=(cambio_paciente,), daemon=True).start()
+        return suscripcion
+
+    def _preparar_flujo(self, recalibrar: bool):
+        if not self.lector.flujo_activo:
+            self.lector.iniciar_flujo()
+        if recalibrar:
+            ok, resultado = self.lector.recalibrar()
+            bus_eventos().publicar('ecg', 'calibracion', {'ok': ok, 'resultado': resultado,
+                                                          'paciente': self.paciente_actual})
+            if ok:
+                print(f"[ECG] Línea base recalibrada para el paciente: {resultado}")
+            else:
+                print(f"[ECG] No se pudo recalibrar: {resultado}")
+
+    def desuscribir(self, suscripcion: SuscripcionSensor):
+        with self._lock:
+            if suscripcion in self._suscripciones:
+                self._suscripciones.remove(suscripcion)
+            pausar = self.pausar_sin_suscriptores and not self._suscripciones
+        if pausar and self.lector.conectado:
+            Thread(target=self.lector.detener_flujo, daemon=True).start()
+
+    def suscriptores(self) -> list:
+        with self._lock:
+            return [s.nombre for s in self._suscripciones]
+
+    def detener(self):
+        """Cierre al salir del programa."""
+        with self._lock:
+            self._suscripciones = []
+            iniciado, self.iniciado = self.iniciado, False
+        if iniciado:
+            self.lector.desconectar()
+
+_SERVICIO_SENSORES = None
+
+def servicio_sensores() -> ServicioSensores:
+    """Servicio de sensores compartido del proceso."""
+    global _SERVICIO_SENSORES
+    if _SERVICIO_SENSORES is None:
+        _SERVICIO_SENSORES = ServicioSensores()
+    return _SERVICIO_SENSORES
+
+# Constantes de configuración
+INTERVALO_DIARIO_POSICION = 1.0  # segundos mínimos entre escrituras de save.txt
+TIEMPOS_RUTINAS = {
+    'rutina1': 1.0,
+    'rutina2': 1.0,
+}
+
+# Base directory for all app data files (CSV backups, patient data, etc.)
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backups')
+
+# Registro por subsistemas ('cnc', 'cnc.serie', 'ecg', 'ecg.datos', 'pacientes', 'progreso').
+# Los niveles se pueden cambiar en backups/registro.json, p. ej. {"cnc.serie": "DEBUG"}.
+NIVELES_REGISTRO = {
+    'cnc': 'INFO',
+    'cnc.serie': 'WARNING',  # cada comando/respuesta: solo para depurar
+    'ecg': 'INFO',
+    'ecg.datos': 'WARNING',
+    'pacientes': 'WARNING',
+    'progreso': 'INFO',
+}
+
+class RegistroCircular(logging.Handler):
+    """Últimos registros en memoria para el panel de depuración (F12).
+
+    Guarda el LogRecord tal cual en una deque acotada (append atómico, sin el candado del
+    Handler) y solo lo formatea cuando el panel lo muestra.
+    """
+
+    def __init__(self, capacidad: int = 500):
+        super().__init__(logging.DEBUG)
+        self.registros = deque(maxlen=capacidad)
+
+    def handle(self, record):
+        self.registros.append(record)
+        return True
+
+    def emit(self, record):
+        self.registros.append(record)
+
+    def recientes(self, n: int = 20) -> list:
+        ultimos = list(self.registros)[-n:]
+        lineas = []
+        for r in ultimos:
+            try:
+                hora = time.strftime('%H:%M:%S', time.localtime(r.created))
+                lineas.append(f"{hora} {r.levelname[:4]} {r.name[6:]}: {r.getMessage()}")
+            except Exception:
+                pass
+        return lineas
+
+class _ArchivoRegistro(logging.handlers.RotatingFileHandler):
+    """Archivo rotativo que crea su carpeta al escribir la primera línea (no al importar)."""
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+_REGISTRO_CIRCULAR = None
+_REGISTRO_ESCUCHA = None
+
+def configurar_registro(niveles: dict | None = None):
+    """Configura (una vez) el registro 'rehab': anillo en memoria en el hilo que registra; consola
+    y archivo (backups/registro/app.log, rotativo) en un hilo aparte a través de una cola, para
+    que una terminal lenta no frene el streaming."""
+    global _REGISTRO_CIRCULAR, _REGISTRO_ESCUCHA
+    raiz = logging.getLogger('rehab')
+    if _REGISTRO_CIRCULAR is None:
+        raiz.setLevel(logging.DEBUG)
+        raiz.propagate = False
+        _REGISTRO_CIRCULAR = RegistroCircular()
+        raiz.addHandler(_REGISTRO_CIRCULAR)
+        consola = logging.StreamHandler()
+        consola.setLevel(logging.INFO)
+        consola.setFormatter(logging.Formatter('[%(levelname)s] %(message)s'))
+        destinos = [consola]
+        try:
+            archivo = _ArchivoRegistro(
+                os.path.join(BASE_DIR, 'registro', 'app.log'), maxBytes=1_000_000, backupCount=3,
+                encoding='utf-8', delay=True)
+            archivo.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(threadName)s] %(message)s'))
+            destinos.append(archivo)
+        except Exception as e:
+            print(f"[AVISO] Registro sin archivo: {e}")
+        cola = queue.SimpleQueue()
+        raiz.addHandler(logging.handlers.QueueHandler(cola))
+        _REGISTRO_ESCUCHA = logging.handlers.QueueListener(cola, *destinos, respect_handler_level=True)
+        _REGISTRO_ESCUCHA.start()
+        try:
+            import atexit
+            atexit.register(_REGISTRO_ESCUCHA.stop)
+        except Exception:
+            pass
+        if niveles is None:
+            niveles = dict(NIVELES_REGISTRO)
+            try:
+                with open(os.path.join(BASE_DIR, 'registro.json'), 'r', encoding='utf-8') as f:
+                    niveles.update(json.load(f))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"[AVISO] No se pudo leer registro.json: {e}")
+    for nombre, nivel in (niveles or {}).items():
+        try:
+            logging.getLogger(f'rehab.{nombre}').setLevel(str(nivel).upper())
+        except Exception:
+            pass
+    return raiz
+
+def registro(subsistema: str) -> logging.Logger:
+    """Logger de un subsistema, sin destinos propios: importar el núcleo no arranca hilos ni lee
+    archivos. Los puntos de entrada (main, main_linea_ordenes) llaman a configurar_registro().
+    En rutas calientes usar argumentos %s (no f-strings): con el nivel desactivado la llamada no
+    formatea nada."""
+    return logging.getLogger(f'rehab.{subsistema}')
+
+def registros_recientes(n: int = 20) -> list:
+    return _REGISTRO_CIRCULAR.recientes(n) if _REGISTRO_CIRCULAR is not None else []
+
+_LOG_CNC = registro('cnc')
+_LOG_SERIE = registro('cnc.serie')
+_LOG_ECG = registro('ecg')
+_LOG_ECG_DATOS = registro('ecg.datos')
+_LOG_PACIENTES = registro('pacientes')
+_LOG_PROGRESO = registro('progreso')
+
+
+class _ModuloPerezoso:
+    """Módulo que se importa la primera vez que se usa uno de sus atributos."""
+
+    def __init__(self, nombre, *submodulos):
+        self._nombre = nombre
+        self._submodulos = submodulos
+        self._modulo = None
+
+    def __getattr__(self, atributo):
+        modulo = self._modulo
+        if modulo is None:
+            modulo = importlib.import_module(self._nombre)
+            for sub in self._submodulos:
+                importlib.import_module(f"{self._nombre}.{sub}")
+            self._modulo = modulo
+        return getattr(modulo, atributo)
+
+# pyserial se importa al primer uso: el descubrimiento y las conexiones van en hilos de
+# fondo, así que su coste (y el de list_ports) sale del camino hasta la primera pantalla
+SERIAL_OK = importlib.util.find_spec('serial') is not None
+serial = _ModuloPerezoso('serial', 'tools.list_ports') if SERIAL_OK else None
+if not SERIAL_OK:
+    print("[AVISO] 'pyserial' no está instalado. La conexión con Arduino se deshabilitará.\n       Instale con: pip install pyserial")
+
+# Pandas - importación perezosa
+PANDAS_OK = False
+pd = None
+
+def _try_import_pandas():
+    """Intenta importar pandas de forma perezosa. Devuelve True si está disponible."""
+    global PANDAS_OK, pd
+    if PANDAS_OK and pd is not None:
+        return True
+    try:
+        pd = importlib.import_module('pandas')
+        PANDAS_OK = True
+        return True
+    except Exception:
+        PANDAS_OK = False
+        pd = None
+        return False
+
+# Almacén de pacientes y sesiones (SQLite)
+CAMPOS_PACIENTE = ['primer_nombre', 'segundo_nombre', 'primer_apellido', 'segundo_apellido',
+                   'año_nacimiento', 'sexo', 'telefono', 'email', 'observaciones']
+
+class AlmacenPacientes:
+    """Pacientes, sesiones, rutinas y referencias a datos crudos en SQLite (modo WAL).
+
+    Sustituye a backup_pacientes.csv (que se reescribía entero en cada alta) y a los
+    sesiones_<id>.csv: cada alta o sesión es un INSERT indexado y una transacción, y las
+    consultas por paciente, nombre normalizado o fecha van por índice. Una sola conexión
+    compartida entre hilos, serializada con un Lock; transaccion() agrupa escrituras.
+    """
+
+    VERSION_ESQUEMA = 1
+    _COLUMNAS_PACIENTE = ', '.join(f'"{c}"' for c in CAMPOS_PACIENTE)
+
+    def __init__(self, ruta: str):
+        import sqlite3
+        self.ruta = ruta
+        os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+        self._lock = Lock()
+        # isolation_level=None: las transacciones se abren a mano (BEGIN) en transaccion()
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conexion.row_factory = sqlite3.Row
+        with self._lock:
+            self._conexion.execute("PRAGMA journal_mode=WAL")
+            self._conexion.execute("PRAGMA synchronous=NORMAL")
+            self._conexion.execute("PRAGMA foreign_keys=ON")
+            self._crear_esquema()
+
+    def _crear_esquema(self):
+        columnas = ',\n                '.join(f'"{c}" TEXT DEFAULT \'\'' for c in CAMPOS_PACIENTE)
+        self._conexion.executescript(f"""
+            BEGIN;
+            CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT);
+            CREATE TABLE IF NOT EXISTS pacientes (
+                id INTEGER PRIMARY KEY,
+                id_paciente TEXT NOT NULL,
+                nombre_normalizado TEXT NOT NULL UNIQUE,
+                {columnas},
+                creado TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_pacientes_id ON pacientes(id_paciente);
+            CREATE TABLE IF NOT EXISTS rutinas (
+                id INTEGER PRIMARY KEY,
+                nombre TEXT NOT NULL UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS sesiones (
+                id INTEGER PRIMARY KEY,
+                paciente TEXT NOT NULL,
+                fecha TEXT NOT NULL,
+                esfuerzo_hombro REAL,
+                esfuerzo_antebrazo REAL,
+                duracion REAL,
+                observaciones TEXT DEFAULT '',
+                rutina_id INTEGER REFERENCES rutinas(id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_sesiones_paciente_fecha ON sesiones(paciente, fecha);
+            CREATE INDEX IF NOT EXISTS idx_sesiones_fecha ON sesiones(fecha);
+            CREATE TABLE IF NOT EXISTS datos_crudos (
+                id INTEGER PRIMARY KEY,
+                sesion_id INTEGER NOT NULL REFERENCES sesiones(id) ON DELETE CASCADE,
+                tipo TEXT NOT NULL,
+                ruta TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_datos_crudos_sesion ON datos_crudos(sesion_id);
+            INSERT OR IGNORE INTO meta (clave, valor) VALUES ('version_esquema', '{self.VERSION_ESQUEMA}');
+            COMMIT;
+        """)
+
+    @contextlib.contextmanager
+    def transaccion(self):
+        """Agrupa varias escrituras en una sola transacción (un solo fsync del WAL)."""
+        with self._lock:
+            self._conexion.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conexion
+            except BaseException:
+                self._conexion.execute("ROLLBACK")
+                raise
+            self._conexion.execute("COMMIT")
+
+    def _consultar(self, sql: str, parametros=()) -> list:
+        with self._lock:
+            return self._conexion.execute(sql, parametros).fetchall()
+
+    def meta(self, clave: str, valor=None):
+        """Lee (valor=None) o escribe un valor de la tabla meta."""
+        if valor is None:
+            filas = self._consultar("SELECT valor FROM meta WHERE clave = ?", (clave,))
+            return filas[0]['valor'] if filas else None
+        with self.transaccion() as c:
+            c.execute("INSERT OR REPLACE INTO meta (clave, valor) VALUES (?, ?)", (clave, str(valor)))
+
+    # --- Pacientes ---
+    def _fila_paciente(self, nombre_normalizado, id_paciente, datos) -> tuple:
+        return ((id_paciente, nombre_normalizado) + tuple(str(datos.get(c, '') or '') for c in CAMPOS_PACIENTE)
+                + (time.strftime("%Y-%m-%d %H:%M:%S"),))
+
+    def guardar_pacientes(self, filas, conexion=None):
+        """Alta o actualización por nombre normalizado. filas: [(nombre_normalizado, id_paciente, datos)]."""
+        sql = (f"INSERT INTO pacientes (id_paciente, nombre_normalizado, {self._COLUMNAS_PACIENTE}, creado) "
+               f"VALUES ({', '.join('?' * (len(CAMPOS_PACIENTE) + 3))}) "
+               f"ON CONFLICT(nombre_normalizado) DO UPDATE SET id_paciente = excluded.id_paciente, "
+               + ', '.join(f'"{c}" = excluded."{c}"' for c in CAMPOS_PACIENTE))
+        valores = [self._fila_paciente(n, i, d) for n, i, d in filas]
+        if conexion is not None:
+            conexion.executemany(sql, valores)
+            return
+        with self.transaccion() as c:
+            c.executemany(sql, valores)
+
+    def paciente(self, nombre_normalizado: str) -> dict | None:
+        filas = self._consultar("SELECT * FROM pacientes WHERE nombre_normalizado = ?", (nombre_normalizado,))
+        return dict(filas[0]) if filas else None
+
+    def paciente_por_id(self, id_paciente: str) -> dict | None:
+        filas = self._consultar("SELECT * FROM pacientes WHERE id_paciente = ? ORDER BY id LIMIT 1", (id_paciente,))
+        return dict(filas[0]) if filas else None
+
+    def buscar_parcial(self, nombre_normalizado: str) -> dict | None:
+        """Primer paciente cuyo nombre contiene al buscado o está contenido en él (recorre la tabla)."""
+        filas = self._consultar(
+            "SELECT * FROM pacientes WHERE instr(nombre_normalizado, ?) > 0 OR instr(?, nombre_normalizado) > 0 "
+            "ORDER BY id LIMIT 1", (nombre_normalizado, nombre_normalizado))
+        return dict(filas[0]) if filas else None
+
+    def contar_pacientes(self) -> int:
+        return self._consultar("SELECT COUNT(*) AS n FROM pacientes")[0]['n']
+
+    # --- Sesiones ---
+    def _id_rutina(self, conexion, nombre: str | None):
+        if not nombre:
+            return None
+        conexion.execute("INSERT OR IGNORE INTO rutinas (nombre) VALUES (?)", (nombre,))
+        return conexion.execute("SELECT id FROM rutinas WHERE nombre = ?", (nombre,)).fetchone()[0]
+
+    def insertar_sesiones(self, sesiones, conexion=None) -> list:
+        """Inserta sesiones (dicts con paciente, fecha, esfuerzos, duracion, observaciones y,
+        opcionales, rutina y datos_crudos=[(tipo, ruta)]). Devuelve sus ids."""
+        if conexion is None:
+            with self.transaccion() as c:
+                return self.insertar_sesiones(sesiones, c)
+        ids = []
+        for s in sesiones:
+            cursor = conexion.execute(
+                "INSERT INTO sesiones (paciente, fecha, esfuerzo_hombro, esfuerzo_antebrazo, duracion, observaciones, rutina_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (s['paciente'], s.get('fecha') or time.strftime("%Y-%m-%d %H:%M:%S"),
+                 _a_real(s.get('esfuerzo_hombro')), _a_real(s.get('esfuerzo_antebrazo')),
+                 _a_real(s.get('duracion')), s.get('observaciones', '') or '',
+                 self._id_rutina(conexion, s.get('rutina'))))
+            sesion_id = cursor.lastrowid
+            for tipo, ruta in s.get('datos_crudos') or ():
+                conexion.execute("INSERT INTO datos_crudos (sesion_id, tipo, ruta) VALUES (?, ?, ?)",
+                                 (sesion_id, tipo, ruta))
+            ids.append(sesion_id)
+        return ids
+
+    def sesiones(self, paciente: str, desde: str | None = None, hasta: str | None = None) -> list:
+        """Sesiones del paciente en orden de fecha (índice paciente+fecha), como dicts."""
+        sql = ("SELECT s.*, r.nombre AS rutina FROM sesiones s LEFT JOIN rutinas r ON r.id = s.rutina_id "
+               "WHERE s.paciente = ?")
+        parametros = [paciente]
+        if desde:
+            sql += " AND s.fecha >= ?"
+            parametros.append(desde)
+        if hasta:
+            sql += " AND s.fecha <= ?"
+            parametros.append(hasta)
+        return [dict(f) for f in self._consultar(sql + " ORDER BY s.fecha, s.id", parametros)]
+
+    def datos_crudos(self, sesion_id: int) -> list:
+        return [(f['tipo'], f['ruta']) for f in
+                self._consultar("SELECT tipo, ruta FROM datos_crudos WHERE sesion_id = ? ORDER BY id", (sesion_id,))]
+
+    def cerrar(self):
+        with self._lock:
+            try:
+                self._conexion.close()
+            except Exception:
+                pass
+
+def _a_real(valor):
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return None
+
+_ALMACENES = {}
+_ALMACENES_LOCK = Lock()
+
+def almacen_pacientes(ruta: str | None = None) -> AlmacenPacientes:
+    """Almacén compartido del proceso (backups/rehabilitacion.db por defecto)."""
+    ruta = ruta or os.path.join(BASE_DIR, 'rehabilitacion.db')
+    with _ALMACENES_LOCK:
+        almacen = _ALMACENES.get(ruta)
+        if almacen is None:
+            almacen = _ALMACENES[ruta] = AlmacenPacientes(ruta)
+        return almacen
+
+# Clase GestorPacientes
+class GestorPacientes:
+    def __init__(self, almacen: AlmacenPacientes | None = None):
+        self.almacen = almacen or almacen_pacientes()
+        self.ruta_backup = os.path.join(BASE_DIR, 'backup_pacientes.csv')
+        self._cargar_pacientes()
+
+    def _cargar_pacientes(self):
+        """Importa los CSV antiguos la primera vez; los pacientes ya no se cargan en memoria."""
+        if self.almacen.meta('migracion_csv') is None:
+            ok, msg = self.migrar_csv()
+            print(f"[INFO] {msg}" if ok else f"[ERROR] {msg}")
+        _LOG_PACIENTES.info("%d paciente(s) en %s", self.almacen.contar_pacientes(), self.almacen.ruta)
+
+    def migrar_csv(self):
+        """Migrador de una sola vez: backup_pacientes.csv y sesiones_<id>.csv al almacén SQLite,
+        en una transacción. Los CSV se conservan como respaldo. Devuelve (ok, mensaje)."""
+        if self.almacen.meta('migracion_csv') is not None:
+            return True, "Migración CSV ya realizada"
+        import csv
+        pacientes, sesiones = [], []
+        try:
+            if os.path.exists(self.ruta_backup):
+                with open(self.ruta_backup, 'r', encoding='utf-8') as f:
+                    for fila in csv.DictReader(f):
+                        nombre_completo = self._construir_nombre_completo(fila)
+                        if not nombre_completo:
+                            continue
+                        id_paciente = self.generar_id_paciente(fila.get('primer_nombre'), fila.get('primer_apellido'),
+                                                               fila.get('año_nacimiento', '0000'))
+                        pacientes.append((self._normalizar_nombre(nombre_completo), id_paciente, fila))
+            import glob
+            for ruta in sorted(glob.glob(os.path.join(BASE_DIR, 'sesiones_*.csv'))):
+                paciente = os.path.basename(ruta)[len('sesiones_'):-len('.csv')]
+                with open(ruta, 'r', encoding='utf-8') as f:
+                    for fila in csv.DictReader(f):
+                        observaciones = fila.get('observaciones', '') or ''
+                        sesion = {'paciente': paciente, 'fecha': fila.get('fecha'),
+                                  'esfuerzo_hombro': fila.get('esfuerzo_hombro'),
+                                  'esfuerzo_antebrazo': fila.get('esfuerzo_antebrazo'),
+                                  'duracion': fila.get('duracion'), 'observaciones': observaciones}
+                        if observaciones.startswith('Rutina: '):
+                            sesion['rutina'] = observaciones[len('Rutina: '):]
+                        elif observaciones.startswith('Archivo CSV: '):
+                            sesion['datos_crudos'] = [('musculares', observaciones[len('Archivo CSV: '):])]
+                        sesiones.append(sesion)
+            with self.almacen.transaccion() as c:
+                self.almacen.guardar_pacientes(pacientes, c)
+                self.almacen.insertar_sesiones(sesiones, c)
+                c.execute("INSERT OR REPLACE INTO meta (clave, valor) VALUES ('migracion_csv', ?)",
+                          (time.strftime("%Y-%m-%d %H:%M:%S"),))
+        except Exception as e:
+            return False, f"No se pudo migrar los CSV de pacientes: {e}"
+        return True, f"Migración CSV: {len(pacientes)} paciente(s) y {len(sesiones)} sesión(es) importados"
+    
+    def _construir_nombre_completo(self, datos):
+        """Construye el nombre completo desde un diccionario de datos."""
+        partes = [
+            datos.get('primer_nombre', '').strip(),
+            datos.get('segundo_nombre', '').strip(),
+            datos.get('primer_apellido', '').strip(),
+            datos.get('segundo_apellido', '').strip()
+        ]
+        return ' '.join([p for p in partes if p])
+    
+    def _normalizar_nombre(self, nombre):
+        """Normaliza un nombre eliminando espacios extras y convirtiendo a minúsculas."""
+        return ' '.join(nombre.lower().split())
+
+    def registrar_paciente(self, datos):
+        """Registra un paciente usando los datos proporcionados. Devuelve (exito, resultado)."""
+        primer_nombre = datos.get('primer_nombre', '').strip()
+        primer_apellido = datos.get('primer_apellido', '').strip()
+        
+        if not primer_nombre or not primer_apellido:
+            return False, 'Nombre y apellido son obligatorios'
+        
+        # Construir nombre completo y generar ID
+        nombre_completo = self._construir_nombre_completo(datos)
+        nombre_normalizado = self._normalizar_nombre(nombre_completo)
+        
+        id_paciente = self.generar_id_paciente(
+            primer_nombre, 
+            primer_apellido, 
+            datos.get('año_nacimiento', '0000')
+        )
+        
+        self.guardar_paciente(nombre_normalizado, datos, id_paciente)
+        
+        print(f"[INFO] Paciente registrado: {nombre_completo} (ID: {id_paciente})")
+        return True, id_paciente
+
+    def guardar_paciente(self, nombre_completo, datos, id_paciente=None):
+        """Alta (o actualización) de un paciente en el almacén: un INSERT indexado."""
+        if id_paciente is None:
+            id_paciente = self.generar_id_paciente(datos.get('primer_nombre'), datos.get('primer_apellido'),
+                                                   datos.get('año_nacimiento', '0000'))
+        try:
+            self.almacen.guardar_pacientes([(nombre_completo, id_paciente, datos)])
+            _LOG_PACIENTES.info("Paciente guardado: %s", nombre_completo)
+        except Exception as e:
+            print(f"[ERROR] No se pudo guardar el paciente: {e}")
+            return False
+        return True
+
+    def obtener_paciente(self, nombre_normalizado):
+        """Datos del paciente por nombre normalizado (o None)."""
+        return self.almacen.paciente(self._normalizar_nombre(nombre_normalizado))
+
+    def buscar_paciente_por_nombre(self, nombre_completo):
+        """Busca paciente por coincidencia parcial, ignorando mayúsculas y espacios extra."""
+        nombre_normalizado = self._normalizar_nombre(nombre_completo)
+        
+        print(f"[INFO] Buscando paciente: '{nombre_completo}' (normalizado: '{nombre_normalizado}')")
+        if not nombre_normalizado:
+            return None, {}
+        
+        # Buscar coincidencia exacta (índice único)
+        datos = self.almacen.paciente(nombre_normalizado)
+        if datos:
+            print(f"[INFO] Coincidencia exacta encontrada")
+            return nombre_normalizado, datos
+        
+        # Buscar coincidencia parcial
+        datos = self.almacen.buscar_parcial(nombre_normalizado)
+        if datos:
+            print(f"[INFO] Coincidencia parcial encontrada: {datos['nombre_normalizado']}")
+            return datos['nombre_normalizado'], datos
+        
+        print(f"[INFO] No se encontró el paciente")
+        return None, {}
+    
+    def generar_id_paciente(self, primer_nombre, primer_apellido, año_nacimiento):
+        """Genera un ID basado en nombre/apellido/año."""
+        pn = (primer_nombre or "").strip().upper()[:3] or "XXX"
+        pa = (primer_apellido or "").strip().upper()[:3] or "XXX"
+        anio = str(año_nacimiento).strip()
+        anio = anio if anio.isdigit() and len(anio) == 4 else "0000"
+        base = f"{pn}{pa}{anio}".replace(" ", "")
+        return base
+    
+    def guardar_sesion(self, id_paciente, esfuerzo_hombro, esfuerzo_antebrazo, duracion, observaciones="", rutina=None):
+        """Guarda una sesión de forma simple. Wrapper para registrar_sesion."""
+        datos_sesion = {
+            'esfuerzo_hombro': esfuerzo_hombro,
+            'esfuerzo_antebrazo': esfuerzo_antebrazo,
+            'duracion': duracion,
+            'observaciones': observaciones,
+            'rutina': rutina,
+        }
+        exito, resultado = self.registrar_sesion(id_paciente, datos_sesion)
+        return exito
+    
+    def registrar_sesion(self, id_paciente, datos_sesion):
+        """Registra una nueva sesión para un paciente. Devuelve (exito, id de sesión | error).
+        datos_sesion admite 'rutina' y 'archivo_datos' (CSV de datos crudos de la sesión)."""
+        try:
+            # Usar el id_paciente tal como viene (puede ser nombre completo o ID)
+            sesion = {
+                'paciente': id_paciente.strip(),
+                'esfuerzo_hombro': datos_sesion.get('esfuerzo_hombro', 0),
+                'esfuerzo_antebrazo': datos_sesion.get('esfuerzo_antebrazo', 0),
+                'duracion': datos_sesion.get('duracion', 0),
+                'observaciones': datos_sesion.get('observaciones', ''),
+                'rutina': datos_sesion.get('rutina'),
+            }
+            if datos_sesion.get('archivo_datos'):
+                sesion['datos_crudos'] = [('musculares', datos_sesion['archivo_datos'])]
+            sesion_id = self.almacen.insertar_sesiones([sesion])[0]
+            print(f"[INFO] Sesión guardada exitosamente")
+            return True, sesion_id
+        except Exception as e:
+            print(f"[ERROR] No se pudo registrar sesión: {e}")
+            import traceback
+            traceback.print_exc()
+            return False, str(e)
+    
+    def obtener_datos_progreso(self, id_paciente):
+        """Obtiene los datos de progreso de un paciente (método simplificado)"""
+        try:
+            # Asegurar que pandas esté disponible
+            if not _try_import_pandas():
+                print("[ERROR] pandas no está disponible para cargar datos de progreso")
+                return None
+            
+            # Normalizar el id_paciente
+            id_normalizado = id_paciente.strip()
+            
+            sesiones = self.almacen.sesiones(id_normalizado)
+            if not sesiones:
+                _LOG_PROGRESO.info("No hay sesiones registradas para %s", id_normalizado)
+                return None
+            _LOG_PROGRESO.debug("Sesiones leídas: %d (paciente '%s')", len(sesiones), id_normalizado)
+            df = pd.DataFrame(sesiones)
+            
+            # Transformar los datos al formato esperado por las gráficas
+            df_transformado = pd.DataFrame({
+                'Fecha': pd.to_datetime(df['fecha']),
+                'Numero_Sesion': range(1, len(df) + 1),
+                'Esfuerzo_Hombro_Promedio': pd.to_numeric(df['esfuerzo_hombro'], errors='coerce'),
+                'Esfuerzo_Antebrazo_Promedio': pd.to_numeric(df['esfuerzo_antebrazo'], errors='coerce'),
+                'Duracion_Minutos': pd.to_numeric(df['duracion'], errors='coerce'),
+                'Observaciones': df['observaciones'].fillna('')
+            })
+            
+            if _LOG_PROGRESO.isEnabledFor(logging.DEBUG):
+                _LOG_PROGRESO.debug("Primeras filas:\n%s", df_transformado.head())
+            
+            return df_transformado
+                
+        except Exception as e:
+            print(f"[ERROR] Error al obtener datos de progreso: {e}")
+            import traceback
+            traceback.print_exc()
+            return None
+
+
+class DiarioEscrituraDiferida:
+    """Escritor en segundo plano para archivos de estado pequeños (save.txt, punto de control).
+
+    publicar() sólo deja el contenido pendiente: varias actualizaciones del mismo archivo se
+    coalescen y un hilo las escribe de forma atómica (temporal + rename) como máximo una vez
+    cada intervalo_min segundos. vaciar() fuerza la escritura y cerrar() la hace al salir.
+    podar() deja al mismo hilo la limpieza de archivos viejos de una carpeta.
+    """
+
+    def __init__(self, intervalo_min: float = 1.0):
+        self.intervalo_min = float(intervalo_min)
+        self._pendientes = {}  # ruta -> contenido (str) o None para borrar
+        self._podas = {}  # carpeta -> (prefijo, sufijo, conservar)
+        self._cond = Condition()
+        self._hilo = None
+        self._cerrado = False
+        self._forzar = False
+        self._escribiendo = False
+        self._ultima_escritura = 0.0
+        self.escrituras = 0
+        self.coalescidas = 0
+        self.errores = 0
+
+    def publicar(self, ruta: str, contenido: str | None):
+        """Encola (o reemplaza) el contenido de un archivo. No toca el disco."""
+        with self._cond:
+            if self._cerrado:
+                return
+            if ruta in self._pendientes:
+                self.coalescidas += 1
+            self._pendientes[ruta] = contenido
+            self._despertar_hilo()
+
+    def podar(self, carpeta: str, prefijo: str, sufijo: str, conservar: int):
+        """Encola la limpieza de 'carpeta': tras la siguiente escritura el hilo borra los archivos
+        prefijo*sufijo más antiguos (por nombre) y deja los 'conservar' últimos. No toca el disco."""
+        with self._cond:
+            if self._cerrado:
+                return
+            self._podas[carpeta] = (prefijo, sufijo, int(conservar))
+            self._despertar_hilo()
+
+    def _despertar_hilo(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._hilo = Thread(target=self._bucle, name="diario-posicion", daemon=True)
+            self._hilo.start()
+        self._cond.notify_all()
+
+    def vaciar(self, timeout: float = 2.0) -> bool:
+        """Escribe ya lo pendiente y espera a que termine. Devuelve False si se agotó el tiempo."""
+        fin = time.time() + timeout
+        with self._cond:
+            if not self._pendientes and not self._podas and not self._escribiendo:
+                return True
+            self._forzar = True
+            self._cond.notify_all()
+            while self._pendientes or self._podas or self._escribiendo:
+                restante = fin - time.time()
+                if restante <= 0:
+                    return False
+                self._cond.wait(restante)
+            return True
+
+    def cerrar(self, timeout: float = 2.0):
+        """Vacía lo pendiente y detiene el hilo escritor."""
+        self.vaciar(timeout)
+        with self._cond:
+            self._cerrado = True
+            self._cond.notify_all()
+        hilo = self._hilo
+        if hilo is not None and hilo is not current_thread():
+            hilo.join(timeout)
+
+    def _bucle(self):
+        while True:
+            with self._cond:
+                while not self._pendientes and not self._podas and not self._cerrado:
+                    self._cond.wait()
+                if not self._pendientes and not self._podas:
+                    return
+                espera = self._ultima_escritura + self.intervalo_min - time.time()
+                if espera > 0 and not (self._forzar or self._cerrado):
+                    self._cond.wait(espera)
+                    continue
+                lote = self._pendientes
+                podas = self._podas
+                self._pendientes = {}
+                self._podas = {}
+                self._forzar = False
+                self._escribiendo = True
+            try:
+                for ruta, contenido in lote.items():
+                    self._escribir(ruta, contenido)
+                for carpeta, (prefijo, sufijo, conservar) in podas.items():
+                    self._podar(carpeta, prefijo, sufijo, conservar)
+            finally:
+                with self._cond:
+                    self._escribiendo = False
+                    self._ultima_escritura = time.time()
+                    self._cond.notify_all()
+
+    def _escribir(self, ruta: str, contenido: str | None):
+        try:
+            if contenido is None:
+                if os.path.exists(ruta):
+                    os.remove(ruta)
+            else:
+                os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+                tmp = ruta + '.tmp'
+                with open(tmp, 'w') as f:
+                    f.write(contenido)
+                os.replace(tmp, ruta)
+            self.escrituras += 1
+        except Exception as e:
+            self.errores += 1
+            print(f"Error en escritura diferida de {ruta}: {e}")
+
+    def _podar(self, carpeta: str, prefijo: str, sufijo: str, conservar: int):
+        try:
+            archivos = sorted(f for f in os.listdir(carpeta) if f.startswith(prefijo) and f.endswith(sufijo))
+        except OSError:
+            return
+        for viejo in archivos[:-conservar] if conservar > 0 else archivos:
+            try:
+                os.remove(os.path.join(carpeta, viejo))
+            except OSError:
+                pass
+
+_DIARIO_POSICION = None
+
+def diario_posicion() -> DiarioEscrituraDiferida:
+    """Diario compartido del proceso; se vacía al salir."""
+    global _DIARIO_POSICION
+    if _DIARIO_POSICION is None:
+        _DIARIO_POSICION = DiarioEscrituraDiferida(intervalo_min=INTERVALO_DIARIO_POSICION)
+        try:
+            import atexit
+            atexit.register(_DIARIO_POSICION.cerrar)
+        except Exception:
+            pass
+    return _DIARIO_POSICION
+
+def cerrar_servicios():
+    """Detiene el servicio de sensores y vacía el diario de posición (al salir del proceso)."""
+    try:
+        if _SERVICIO_SENSORES is not None:
+            _SERVICIO_SENSORES.detener()
+    except Exception:
+        pass
+    try:
+        if _DIARIO_POSICION is not None:
+            _DIARIO_POSICION.cerrar()
+    except Exception:
+        pass
+
+class DescubrimientoDispositivos:
+    """Descubre e identifica en paralelo las placas conectadas: ECG (Nano), GRBL o Marlin.
+
+    Todos los puertos candidatos se sondean a la vez con un plazo compartido, de modo que el
+    arranque con ambas placas cuesta una sola ventana de handshake. La identidad se guarda en
+    backups/dispositivos.json por número de serie USB (o vid:pid:ubicación si no hay serie) y
+    en arranques siguientes se reutiliza sin abrir el puerto. La conexión abierta durante el
+    sondeo se entrega a la clase consumidora (tomar_conexion) para no reiniciar la placa otra vez.
+    """
+
+    TIPOS_CNC = ('grbl', 'marlin')
+    # Adaptadores USB de las placas del equipo: Arduino (2341/2a03), CH340 (1a86) y FTDI (0403).
+    # Sólo a éstos (o a los ya vistos en la caché) se les pregunta con $I/M115 si callan.
+    VID_CONOCIDOS = (0x2341, 0x2a03, 0x1a86, 0x0403)
+
+    def __init__(self, baudrate: int = 115200, archivo_cache: str | None = None):
+        self.baudrate = baudrate
+        self.archivo_cache = archivo_cache or os.path.join(BASE_DIR, 'dispositivos.json')
+        self._lock = Lock()
+        # Un solo descubrimiento a la vez: supervisores ECG/CNC y el arranque pueden pedirlo a la par
+        self._lock_descubrir = Lock()
+        self._listo = Event()
+        self._listo.set()
+        self._ejecutado = False
+        self.dispositivos = {}  # puerto -> {'tipo', 'info', 'clave', 'origen'}
+        self._parciales = {}  # resultados del descubrimiento en curso
+        self._conexiones = {}  # puerto -> (Serial abierto en el sondeo, instante), pendiente de entregar
+        self._en_uso = set()
+        self._cache = self._cargar_cache()
+        self.ultima_duracion = 0.0
+
+    def _cargar_cache(self) -> dict:
+        try:
+            if os.path.exists(self.archivo_cache):
+                with open(self.archivo_cache, 'r') as f:
+                    data = json.load(f)
+                if isinstance(data, dict):
+                    return data
+        except Exception as e:
+            print(f"[AVISO] No se pudo leer caché de dispositivos: {e}")
+        return {}
+
+    def _guardar_cache(self):
+        try:
+            with self._lock:
+                contenido = json.dumps(self._cache, indent=2)
+            diario_posicion().publicar(self.archivo_cache, contenido)
+        except Exception as e:
+            print(f"[AVISO] No se pudo guardar caché de dispositivos: {e}")
+
+    @staticmethod
+    def _clave_usb(info) -> str:
+        """Identidad estable del adaptador USB: número de serie, o vid:pid + ubicación física."""
+        sn = getattr(info, 'serial_number', None)
+        if sn:
+            return f"sn:{sn}"
+        vid = getattr(info, 'vid', None)
+        pid = getattr(info, 'pid', None)
+        if vid is not None and pid is not None:
+            return f"usb:{vid:04x}:{pid:04x}:{getattr(info, 'location', None) or info.device}"
+        return f"dev:{info.device}"
+
+    @staticmethod
+    def _candidatos() -> list:
+        try:
+            import serial.tools.list_ports
+            puertos = list(serial.tools.list_ports.comports())
+        except Exception:
+            return []
+        out = []
+        for p in puertos:
+            dev = str(p.device)
+            if "ACM" in dev or "USB" in dev or "COM" in dev or "usb" in dev:
+                out.append(p)
+        return out
+
+    def _se_puede_preguntar(self, info, clave: str) -> bool:
+        """True si el adaptador es de una placa conocida o su identidad ya está en la caché."""
+        if getattr(info, 'vid', None) in self.VID_CONOCIDOS:
+            return True
+        with self._lock:
+            return clave in self._cache
+
+    @staticmethod
+    def clasificar_linea(linea: str):
+        """Identifica la placa por una línea recibida. Devuelve (tipo|None, info)."""
+        if 'Musculo_1:' in linea:
+            return 'ecg', 'ECG (tramas de texto)'
+        if linea.startswith('OK VECG') or linea == 'ERR $I':
+            return 'ecg', linea
+        if 'Grbl' in linea or linea.startswith('[VER:'):
+            return 'grbl', linea
+        if 'FIRMWARE_NAME' in linea or 'Marlin' in linea or linea == 'start':
+            return 'marlin', linea
+        return None, ''
+
+    def _sondear(self, puerto: str, clave: str, fin: float, resultados: dict, preguntar: bool = True):
+        """Abre el puerto y escucha banner/tramas; si la placa calla y 'preguntar', pregunta con
+        $I y M115. A un puerto desconocido no se le escribe nada: sólo se le escucha."""
+        try:
+            conn = serial.Serial(puerto, self.baudrate, timeout=0.1)
+        except Exception:
+            return
+        tipo, info = None, ''
+        t0 = time.time()
+        preguntado = False
+        try:
+            while time.time() < fin and tipo is None:
+                if preguntar and not preguntado and time.time() - t0 >= 1.5:
+                    # Tras el arranque del bootloader; el ECG responde "ERR $I" si tiene canal de comandos
+                    conn.write(b"$I\nM115\n")
+                    preguntado = True
+                linea = conn.readline().decode(errors='ignore').strip()
+                if linea:
+                    tipo, info = self.clasificar_linea(linea)
+        except Exception:
+            tipo = None
+        if tipo is None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return
+        with self._lock:
+            resultados[puerto] = {'tipo': tipo, 'info': info, 'clave': clave, 'origen': 'sondeo'}
+            self._conexiones[puerto] = (conn, time.time())
+
+    def _cerrar_no_entregadas(self, presentes=(), antiguedad: float = 30.0):
+        """Cierra las conexiones del sondeo que nadie tomó: las de puertos desaparecidos y las que
+        llevan más de 'antiguedad' segundos. Las recientes quedan para el consumidor que las espera."""
+        ahora = time.time()
+        with self._lock:
+            viejas = [p for p, (_, ts) in self._conexiones.items()
+                      if p not in presentes or ahora - ts > antiguedad]
+            conexiones = [self._conexiones.pop(p)[0] for p in viejas]
+        for conn in conexiones:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def descubrir(self, plazo: float = 3.0, forzar: bool = False) -> dict:
+        """Sondea en paralelo los puertos sin identidad en caché (o todos si forzar).
+        Devuelve {puerto: {'tipo', 'info', 'clave', 'origen'}}. Las llamadas concurrentes se
+        serializan: cada una ve el resultado completo y no cierra las conexiones de otra.
+        """
+        if not SERIAL_OK:
+            return {}
+        with self._lock_descubrir:
+            return self._descubrir(plazo, forzar)
+
+    def _descubrir(self, plazo: float, forzar: bool) -> dict:
+        self._listo.clear()
+        inicio = time.time()
+        try:
+            candidatos = self._candidatos()
+            self._cerrar_no_entregadas({info.device for info in candidatos})
+            fin = inicio + plazo
+            resultados = {}
+            self._parciales = resultados
+            hilos = []
+            for info in candidatos:
+                puerto = info.device
+                clave = self._clave_usb(info)
+                with self._lock:
+                    en_uso = puerto in self._en_uso
+                    pendiente = puerto in self._conexiones
+                    previo = self.dispositivos.get(puerto)
+                    cache = self._cache.get(clave)
+                if en_uso or (pendiente and previo):
+                    # Puerto ya abierto por este proceso (o sondeado y aún sin entregar): no interferir
+                    if previo:
+                        with self._lock:
+                            resultados[puerto] = previo
+                    continue
+                if cache and cache.get('tipo') and not forzar:
+                    with self._lock:
+                        resultados[puerto] = {'tipo': cache['tipo'], 'info': cache.get('info', ''), 'clave': clave, 'origen': 'cache'}
+                    continue
+                preguntar = self._se_puede_preguntar(info, clave)
+                h = Thread(target=self._sondear, args=(puerto, clave, fin, resultados, preguntar), daemon=True)
+                h.start()
+                hilos.append(h)
+            for h in hilos:
+                h.join(max(0.0, fin - time.time()) + 0.3)
+            with self._lock:
+                self.dispositivos = dict(resultados)
+                for dato in resultados.values():
+                    if dato.get('origen') == 'sondeo':
+                        self._cache[dato['clave']] = {'tipo': dato['tipo'], 'info': dato['info']}
+            if any(d.get('origen') == 'sondeo' for d in resultados.values()):
+                self._guardar_cache()
+            self.ultima_duracion = time.time() - inicio
+            resumen = ", ".join(f"{p}={d['tipo']}" for p, d in resultados.items()) or "ninguno"
+            print(f"[INFO] Dispositivos: {resumen} ({self.ultima_duracion:.2f} s)")
+            return dict(resultados)
+        finally:
+            self._ejecutado = True
+            self._listo.set()
+
+    def descubrir_en_segundo_plano(self, plazo: float = 3.0):
+        """Lanza descubrir() en un hilo; puerto_para() espera su resultado."""
+        if not SERIAL_OK:
+            return
+        self._listo.clear()
+        Thread(target=self.descubrir, args=(plazo,), daemon=True).start()
+
+    def _buscar(self, tipos, fuente: dict) -> str | None:
+        with self._lock:
+            for puerto, dato in list(fuente.items()):
+                if dato.get('tipo') in tipos:
+                    return puerto
+        return None
+
+    def puerto_para(self, tipo: str, plazo: float = 3.5) -> str | None:
+        """Puerto identificado para 'ecg' o 'cnc' (GRBL/Marlin). Descubre si aún no se hizo.
+        Durante un descubrimiento en curso responde en cuanto aparece la placa pedida.
+        """
+        tipos = self.TIPOS_CNC if tipo == 'cnc' else (tipo,)
+        fin = time.time() + plazo
+        while not self._listo.is_set():
+            puerto = self._buscar(tipos, self._parciales)
+            if puerto:
+                return puerto
+            restante = fin - time.time()
+            if restante <= 0:
+                return None
+            self._listo.wait(min(0.05, restante))
+        if not self._ejecutado:
+            self.descubrir(min(plazo, 3.0))
+        return self._buscar(tipos, self.dispositivos)
+
+    def identidad(self, puerto: str) -> dict | None:
+        with self._lock:
+            dato = self.dispositivos.get(puerto)
+            return dict(dato) if dato else None
+
+    def puertos_de_otros(self, tipo: str) -> set:
+        """Puertos identificados como otra clase de placa (para no reclamarlos por error)."""
+        tipos = self.TIPOS_CNC if tipo == 'cnc' else (tipo,)
+        with self._lock:
+            return {p for p, d in self.dispositivos.items() if d.get('tipo') not in tipos}
+
+    def tomar_conexion(self, puerto: str):
+        """Entrega (y olvida) la conexión abierta en el sondeo para ese puerto, si sigue abierta."""
+        with self._lock:
+            conn, _ = self._conexiones.pop(puerto, (None, 0.0))
+        if conn is not None and getattr(conn, 'is_open', False):
+            return conn
+        return None
+
+    def clave_de_puerto(self, puerto: str) -> str | None:
+        """Identidad USB del adaptador conectado ahora en 'puerto' (sólo lista puertos, no abre)."""
+        for info in self._candidatos():
+            if info.device == puerto:
+                return self._clave_usb(info)
+        return None
+
+    def puerto_de_clave(self, clave: str) -> str | None:
+        """Puerto actual del adaptador con esa identidad USB, si está presente y libre. No abre
+        ningún puerto: sirve para reconectar una placa conocida sin sondear (ni reiniciar) las demás."""
+        for info in self._candidatos():
+            if self._clave_usb(info) == clave:
+                with self._lock:
+                    return None if info.device in self._en_uso else info.device
+        return None
+
+    def marcar_en_uso(self, puerto: str) -> bool:
+        """Reserva el puerto para este proceso. True si no estaba reservado ya."""
+        with self._lock:
+            nuevo = puerto not in self._en_uso
+            self._en_uso.add(puerto)
+            return nuevo
+
+    def liberar(self, puerto: str):
+        with self._lock:
+            self._en_uso.discard(puerto)
+
+    def invalidar(self, puerto: str):
+        """Olvida la identidad de un puerto (p. ej. si el handshake real no coincide)."""
+        with self._lock:
+            dato = self.dispositivos.pop(puerto, None)
+            if dato:
+                self._cache.pop(dato.get('clave'), None)
+        if dato:
+            self._guardar_cache()
+
+_DESCUBRIMIENTO = None
+
+def descubrimiento_dispositivos() -> DescubrimientoDispositivos:
+    """Servicio de descubrimiento compartido del proceso."""
+    global _DESCUBRIMIENTO
+    if _DESCUBRIMIENTO is None:
+        _DESCUBRIMIENTO = DescubrimientoDispositivos()
+    return _DESCUBRIMIENTO
+
+class Evento(NamedTuple):
+    """Registro inmutable publicado en el bus (se comparte entre suscriptores sin copiarlo)."""
+    origen: str  # 'cnc' | 'ecg' | 'captura'
+    tipo: str
+    datos: dict
+    ts: float
+
+class SuscriptorEventos:
+    """Cola acotada de un consumidor del bus; si se llena se descartan los más antiguos."""
+    __slots__ = ('nombre', 'origenes', 'tipos', 'callback', 'cola', 'entregados',
+                 'descartados', 'errores', 'max_pendientes')
+
+    def __init__(self, nombre: str, origenes=None, tipos=None, capacidad: int = 256, callback=None):
+        self.nombre = nombre
+        self.origenes = frozenset(origenes) if origenes else None
+        self.tipos = frozenset(tipos) if tipos else None
+        self.callback = callback
+        self.cola = deque(maxlen=max(1, int(capacidad)))
+        self.entregados = 0
+        self.descartados = 0
+        self.errores = 0
+        self.max_pendientes = 0
+
+    def acepta(self, evento: Evento) -> bool:
+        return ((self.origenes is None or evento.origen in self.origenes)
+                and (self.tipos is None or evento.tipo in self.tipos))
+
+class BusEventos:
+    """Bus de eventos del proceso (publicar/suscribir) con colas acotadas por suscriptor.
+
+    Cada suscriptor recibe los eventos que filtra por origen y tipo: en su cola, que vacía con
+    consumir(), o por callback síncrono en el hilo que publica (debe ser breve). Si un
+    consumidor deja de leer solo pierde sus eventos más antiguos (contados en descartados);
+    ni la memoria ni los demás consumidores se ven afectados.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._suscriptores = ()  # tupla inmutable: publicar la recorre sin copiarla
+        self.publicados = 0
+
+    def suscribir(self, nombre: str, origenes=None, tipos=None, capacidad: int = 256,
+                  callback=None) -> SuscriptorEventos:
+        suscriptor = SuscriptorEventos(nombre, origenes, tipos, capacidad, callback)
+        with self._lock:
+            self._suscriptores = self._suscriptores + (suscriptor,)
+        return suscriptor
+
+    def desuscribir(self, suscriptor: SuscriptorEventos):
+        with self._lock:
+            self._suscriptores = tuple(s for s in self._suscriptores if s is not suscriptor)
+
+    def publicar(self, origen: str, tipo: str, datos: dict | None = None):
+        suscriptores = self._suscriptores
+        self.publicados += 1
+        if not suscriptores:
+            return
+        evento = Evento(origen, tipo, datos or {}, time.time())
+        for s in suscriptores:
+            if not s.acepta(evento):
+                continue
+            if s.callback is not None:
+                try:
+                    s.callback(evento)
+                    s.entregados += 1
+                except Exception:
+                    s.errores += 1
+                continue
+            with self._lock:
+                if len(s.cola) == s.cola.maxlen:
+                    s.descartados += 1
+                s.cola.append(evento)
+                if len(s.cola) > s.max_pendientes:
+                    s.max_pendientes = len(s.cola)
+
+    def consumir(self, suscriptor: SuscriptorEventos) -> list:
+        with self._lock:
+            eventos = list(suscriptor.cola)
+            suscriptor.cola.clear()
+            suscriptor.entregados += len(eventos)
+        return eventos
+
+    def metricas(self) -> dict:
+        """Contadores de contrapresión por suscriptor."""
+        with self._lock:
+            return {
+                'publicados': self.publicados,
+                'suscriptores': {
+                    s.nombre: {
+                        'pendientes': len(s.cola),
+                        'max_pendientes': s.max_pendientes,
+                        'capacidad': s.cola.maxlen,
+                        'entregados': s.entregados,
+                        'descartados': s.descartados,
+                        'errores': s.errores,
+                    } for s in self._suscriptores
+                },
+            }
+
+_BUS_EVENTOS = None
+
+def bus_eventos() -> BusEventos:
+    """Bus de eventos compartido del proceso."""
+    global _BUS_EVENTOS
+    if _BUS_EVENTOS is None:
+        _BUS_EVENTOS = BusEventos()
+    return _BUS_EVENTOS
+
+class SupervisorReconexion:
+    """Hilo que vigila un dispositivo y lo reconecta con espera exponencial.
+
+    esta_vivo() detecta la pérdida (errores, flujo en silencio, sin respuesta de estado) y
+    reconectar() intenta recuperar la conexión sobre el mismo objeto, de modo que quien ya lo
+    usa (ventanas, captura) sigue funcionando sin reabrir nada.
+    """
+
+    def __init__(self, nombre: str, esta_vivo, reconectar, intervalo: float = 1.0,
+                 espera_min: float = 0.5, espera_max: float = 30.0):
+        self.nombre = nombre
+        self._esta_vivo = esta_vivo
+        self._reconectar = reconectar
+        self.intervalo = float(intervalo)
+        self.espera_min = float(espera_min)
+        self.espera_max = float(espera_max)
+        self.estado = 'detenido'  # 'vigilando' | 'reconectando' | 'detenido'
+        self.intentos = 0
+        self.reconexiones = 0
+        self._parar = Event()
+        self._hilo = None
+
+    def iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._parar.clear()
+        self._hilo = Thread(target=self._bucle, name=f"supervisor-{self.nombre}", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._parar.set()
+        self.estado = 'detenido'
+
+    def activo(self) -> bool:
+        return self._hilo is not None and self._hilo.is_alive() and not self._parar.is_set()
+
+    def _bucle(self):
+        espera = self.espera_min
+        self.estado = 'vigilando'
+        while not self._parar.is_set():
+            try:
+                vivo = bool(self._esta_vivo())
+            except Exception:
+                vivo = False
+            if vivo:
+                espera = self.espera_min
+                self.intentos = 0
+                self.estado = 'vigilando'
+                self._parar.wait(self.intervalo)
+                continue
+            self.estado = 'reconectando'
+            self.intentos += 1
+            try:
+                ok = bool(self._reconectar())
+            except Exception as e:
+                print(f"[AVISO] Supervisor {self.nombre}: error al reconectar: {e}")
+                ok = False
+            if self._parar.is_set():
+                break
+            if ok:
+                self.reconexiones += 1
+                print(f"[INFO] Supervisor {self.nombre}: reconectado (intento {self.intentos})")
+                espera = self.espera_min
+                self.intentos = 0
+                self.estado = 'vigilando'
+                self._parar.wait(self.intervalo)
+            else:
+                self._parar.wait(espera)
+                espera = min(self.espera_max, espera * 2.0)
+        self.estado = 'detenido'
+
+class HistogramaLatencia:
+    """Histograma de latencias en cubetas logarítmicas fijas (ms); sin guardar cada muestra."""
+    LIMITES_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+    def __init__(self):
+        self.cubetas = [0] * (len(self.LIMITES_MS) + 1)
+        self.n = 0
+        self.suma = 0.0
+        self.minimo = None
+        self.maximo = 0.0
+
+    def agregar(self, ms: float):
+        import bisect
+        self.cubetas[bisect.bisect_left(self.LIMITES_MS, ms)] += 1
+        self.n += 1
+        self.suma += ms
+        if self.minimo is None or ms < self.minimo:
+            self.minimo = ms
+        if ms > self.maximo:
+            self.maximo = ms
+
+    def percentil(self, p: float) -> float:
+        """Cota superior de la cubeta donde cae el percentil p (acotada por el máximo observado)."""
+        if self.n == 0:
+            return 0.0
+        objetivo = p / 100.0 * self.n
+        acumulado = 0
+        for i, c in enumerate(self.cubetas):
+            acumulado += c
+            if acumulado >= objetivo:
+                return min(float(self.LIMITES_MS[i]), self.maximo) if i < len(self.LIMITES_MS) else self.maximo
+        return self.maximo
+
+    def resumen(self) -> dict:
+        etiquetas = [f"<={l}" for l in self.LIMITES_MS] + [f">{self.LIMITES_MS[-1]}"]
+        return {
+            'n': self.n,
+            'media': round(self.suma / self.n, 3) if self.n else 0.0,
+            'min': round(self.minimo or 0.0, 3),
+            'max': round(self.maximo, 3),
+            'p50': self.percentil(50),
+            'p95': self.percentil(95),
+            'p99': self.percentil(99),
+            'cubetas': {e: c for e, c in zip(etiquetas, self.cubetas) if c},
+        }
+
+class MetricasCNC:
+    """Instrumentación del controlador: latencia envío→ok por clase de comando, escritura de
+    bytes de tiempo real, líneas/s en streaming, ocupación de la ventana de 'ok' pendientes y
+    reparto del tiempo del bucle (espera de 'ok', feed hold, comandos bloqueantes, Python).
+    Todo son contadores: registrar cuesta unos microsegundos y no toca el disco.
+    """
+
+    def __init__(self, ventana: int = 12):
+        self._lock = Lock()
+        self.ventana = ventana
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self.latencias = {}
+            self._enviados = deque()  # (t_envio, clase) de líneas en vuelo, en orden FIFO
+            self.ocupacion = [0] * (self.ventana + 1)
+            self.lineas = 0
+            self.inicio = None
+            self.fin = None
+            self.espera_ok_s = 0.0
+            self.espera_hold_s = 0.0
+            self.bloqueantes_s = 0.0
+
+    @staticmethod
+    def clase_comando(linea: str) -> str:
+        token = linea.split(None, 1)[0].upper() if linea and linea.strip() else ''
+        if token.startswith('$'):
+            return '$'
+        if token in ('G0', 'G00'):
+            return 'G0'
+        if token in ('G1', 'G01'):
+            return 'G1'
+        if token in ('G2', 'G02', 'G3', 'G03'):
+            return 'G2/G3'
+        if token in ('G90', 'G91', 'G92'):
+            return token
+        if token.startswith('M'):
+            return 'M'
+        return 'otro'
+
+    def registrar_latencia(self, clase: str, segundos: float):
+        with self._lock:
+            h = self.latencias.get(clase)
+            if h is None:
+                h = self.latencias[clase] = HistogramaLatencia()
+            h.agregar(segundos * 1000.0)
+
+    def registrar_envio(self, clase: str, inflight: int):
+        with self._lock:
+            self._enviados.append((time.perf_counter(), clase))
+            self.ocupacion[min(max(0, inflight), self.ventana)] += 1
+
+    def registrar_oks(self, n: int):
+        """n 'ok' recibidos: cierran las n líneas en vuelo más antiguas."""
+        ahora = time.perf_counter()
+        for _ in range(n):
+            with self._lock:
+                if not self._enviados:
+                    return
+                t0, clase = self._enviados.popleft()
+            self.registrar_latencia(clase, ahora - t0)
+
+    def inicio_streaming(self):
+        self.reiniciar()
+        self.inicio = time.perf_counter()
+
+    def fin_streaming(self, lineas: int):
+        with self._lock:
+            self.lineas = lineas
+            self.fin = time.perf_counter()
+            self._enviados.clear()
+
+    def instantanea(self) -> dict:
+        with self._lock:
+            if self.inicio is not None:
+                duracion = (self.fin or time.perf_counter()) - self.inicio
+            else:
+                duracion = 0.0
+            esperas = self.espera_ok_s + self.espera_hold_s + self.bloqueantes_s
+            total_ocupacion = sum(self.ocupacion)
+            return {
+                'latencias_ms': {c: h.resumen() for c, h in sorted(self.latencias.items())},
+                'streaming': {
+                    'en_curso': self.inicio is not None and self.fin is None,
+                    'lineas': self.lineas,
+                    'segundos': round(duracion, 3),
+                    'lineas_por_s': round(self.lineas / duracion, 2) if duracion > 0 else 0.0,
+                    'espera_ok_s': round(self.espera_ok_s, 3),
+                    'espera_hold_s': round(self.espera_hold_s, 3),
+                    'comandos_bloqueantes_s': round(self.bloqueantes_s, 3),
+                    'bucle_python_s': round(max(0.0, duracion - esperas), 3),
+                },
+                'ventana': {
+                    'tamano': self.ventana,
+                    'ocupacion': list(self.ocupacion),
+                    'media': round(sum(i * c for i, c in enumerate(self.ocupacion)) / total_ocupacion, 2)
+                             if total_ocupacion else 0.0,
+                },
+            }
+
+class ControladorCNC:
+    def set_cmd_en_progreso(self, valor):
+        self._cmd_en_progreso = valor
+
+    def __init__(self, puerto=None, baudrate=115200):
+        self.puerto = puerto
+        self.baudrate = baudrate
+        self.conexion = None
+        self.conectado = False
+        self.paso = 1.0
+        self.posicion_x = 0.0
+        self.posicion_y = 0.0
+        self.modo_relativo = False
+        self.velocidad_actual = 50
+        self.override_actual = 100  # Override de feed/velocidad en %
+        self.archivo_velocidad = os.path.join(BASE_DIR, 'velocidad_cnc.json')
+        self.ov_feed = 100
+        self.ov_rapid = 100
+        self.ov_spindle = 100
+        self.feed_reportado = 0.0
+        self._last_status_poll = 0.0
+        self._status_poll_interval = 0.15
+        self._serial_lock = Lock()
+        self.metricas = MetricasCNC(ventana=12)
+        # Opcional (REHAB_METRICAS=1): volcar las métricas de cada rutina a backups/metricas/
+        # (se conservan las últimas 30)
+        self.volcar_metricas = os.environ.get('REHAB_METRICAS', '') not in ('', '0')
+        self.firmware = 'desconocido'  # 'grbl' | 'marlin' | 'desconocido'
+        self.firmware_info = ""
+        self._ultimo_ping = 0.0
+        self._intervalo_ping = 2.0
+        self._fallos_ping = 0
+        self.ejecutando_rutina = False
+        self._cmd_en_progreso = False
+        self._ultimo_aplicar_ov = 0.0
+        self._intervalo_aplicar_ov = 0.08
+        self.mascara_direccion = None
+        self.junction_deviation = None
+        self.feed_base = 600
+        # Conexión en segundo plano: etapa visible para la interfaz y petición de cancelación
+        self.etapa_conexion = ''
+        self._cancelar_conexion = Event()
+        # Avisos para la interfaz (límites, conexión) a través del bus del proceso: la suscripción
+        # se crea al primer consumir_eventos() y se cancela en desconectar()
+        self._suscripcion_eventos = None
+        self.ultimo_tiempo_verificacion = time.time()
+        self.intervalo_verificacion = 1.0  # segundos, ajustar según necesidad
+        self.ultimo_guardado = time.time()
+        self.thread_monitor = None
+        self.origen_establecido = False
+        self.limites_activos = False
+        self.debug_limites = False
+        self.ultimo_limite = ""
+        self.limite_x_min = -20.0
+        self.limite_x_max = 20.0
+        self.limite_y_min = -20.0
+        self.limite_y_max = 20.0
+        self.abortado_por_limite = False
+        self.en_hold = False
+        # Paro de emergencia durante una rutina: el hilo de streaming corta y hace el reset suave
+        self._paro_solicitado = False
+        # Hilo que ejecuta un ProgramaGcode ya validado contra los límites vigentes (omite el chequeo por línea)
+        self._hilo_programa_verificado = None
+        self._bloque_rechazado = False
+        # Punto de control de la rutina en curso (línea confirmada) para reanudar tras una interrupción
+        self.linea_confirmada = 0
+        self.motivo_interrupcion = ""
+        self.checkpoint_rutina = None
+        self.archivo_checkpoint = os.path.join(BASE_DIR, 'checkpoint_rutina.json')
+        self._ultimo_dir_x = 1.0
+        self._ultimo_dir_y = 1.0
+        self.archivo_grbl_config = os.path.join(BASE_DIR, 'grbl_config.json')
+        self.archivo_parametros_grbl = os.path.join(BASE_DIR, 'grbl_parametros.json')
+        # Supervisor de reconexión (se arranca tras la primera conexión correcta)
+        self.supervisor = None
+        self._reconectando = False
+        # Identidad USB de la placa conectada: el supervisor la reabre sin sondear otros puertos
+        self.clave_usb = None
+
+    def aplicar_mascara_direccion(self, mascara: int | None = None):
+        """Aplica $3 (Direction port invert mask) en GRBL. X=1, Y=2, Z=4. Rango 0..7.
+        Si mascara es None, usa la cargada en self.mascara_direccion.
+        """
+        try:
+            if mascara is None:
+                mascara = self.mascara_direccion
+            if mascara is None:
+                return False
+            mascara = max(0, min(7, int(mascara)))
+            ok = self.enviar_comando(f"$3={mascara}")
+            if ok:
+                print(f"GRBL $3 (mascara de dirección) aplicada: {mascara}")
+                self.mascara_direccion = mascara
+            return ok
+        except Exception as e:
+            print(f"Error aplicando máscara de dirección $3: {e}")
+            return False
+
+    def set_mascara_direccion(self, mascara: int):
+        """Actualiza y persiste la máscara $3 y la aplica en GRBL."""
+        try:
+            mascara = max(0, min(7, int(mascara)))
+            # Persistir
+            os.makedirs(os.path.dirname(self.archivo_grbl_config), exist_ok=True)
+            with open(self.archivo_grbl_config, 'w') as f:
+                json.dump({'mascara_direccion': mascara}, f)
+            self.mascara_direccion = mascara
+            # Aplicar inmediatamente si conectado
+            if self.conectado:
+                return self.aplicar_mascara_direccion(mascara)
+            return True
+        except Exception as e:
+            print(f"Error guardando/aplicando máscara $3: {e}")
+            return False
+
+    def aplicar_junction_deviation(self, jd: float | None = None):
+        """Aplica $11 (junction deviation) en GRBL para suavizar esquinas sin bajar velocidad.
+        Valores típicos: 0.02 (fino), 0.05, 0.1 (más redondo)."""
+        try:
+            if self.firmware != 'grbl':
+                return False
+            if jd is None:
+                jd = self.junction_deviation
+            if jd is None:
+                # Valor recomendado para suavizar sin perder precisión excesiva (un poco más suave)
+                jd = 0.15
+            jd = max(0.005, min(1.0, float(jd)))
+            ok = self.enviar_comando(f"$11={jd}")
+            if ok:
+                print(f"GRBL $11 (junction deviation) aplicada: {jd} mm")
+                self.junction_deviation = jd
+            return ok
+        except Exception as e:
+            print(f"Error aplicando junction deviation $11: {e}")
+            return False
+
+    def set_junction_deviation(self, jd: float):
+        """Actualiza y persiste junction deviation ($11)."""
+        try:
+            jd = max(0.005, min(1.0, float(jd)))
+            os.makedirs(os.path.dirname(self.archivo_grbl_config), exist_ok=True)
+            data = {}
+            if os.path.exists(self.archivo_grbl_config):
+                try:
+                    with open(self.archivo_grbl_config, 'r') as f:
+                        data = json.load(f) or {}
+                except Exception:
+                    data = {}
+            data['junction_deviation'] = jd
+            with open(self.archivo_grbl_config, 'w') as f:
+                json.dump(data, f)
+            self.junction_deviation = jd
+            if self.conectado and self.firmware == 'grbl':
+                return self.aplicar_junction_deviation(jd)
+            return True
+        except Exception as e:
+            print(f"Error guardando/aplicando $11: {e}")
+            return False
+        
+    def autodetectar_puerto(self):
+        """Busca automáticamente el puerto donde está conectado el Arduino."""
+        if not SERIAL_OK:
+            print("[AVISO] pyserial no está instalado; no se puede autodetectar puertos.")
+            return None
+        try:
+            import serial.tools.list_ports
+        except Exception:
+            print("[AVISO] No se pudo importar serial.tools.list_ports.")
+            return None
+        
+        puerto_cnc = descubrimiento_dispositivos().puerto_para('cnc')
+        if puerto_cnc:
+            print(f"Puerto CNC identificado: {puerto_cnc}")
+            return puerto_cnc
+        ocupados = descubrimiento_dispositivos().puertos_de_otros('cnc')
+        puertos = [p for p in serial.tools.list_ports.comports() if p.device not in ocupados]
+        if not puertos:
+            print("No se encontraron puertos seriales.")
+            return None
+        
+        candidatos = []
+        for puerto in puertos:
+            port_str = str(puerto.device)
+            if "ACM" in port_str or "USB" in port_str or "tty" in port_str:
+                candidatos.append(puerto.device)
+        
+        for candidato in candidatos:
+            if "ACM" in candidato:
+                print(f"Puerto Arduino detectado: {candidato}")
+                return candidato
+        
+        if candidatos:
+            print(f"Puerto posible: {candidatos[0]}")
+            return candidatos[0]
+        
+        for puerto in puertos:
+            if "COM" in puerto.device:
+                print(f"Puerto Windows detectado: {puerto.device}")
+                return puerto.device
+        
+        print("No se pudo identificar un puerto Arduino.")
+        return None
+            
+    def conectar(self, rapida: bool | None = None):
+        """Abre el puerto, identifica el firmware y aplica la configuración.
+
+        rapida=None usa la reconexión en caliente cuando la identidad GRBL del puerto está en caché:
+        abre sin pulso DTR donde el adaptador lo permite, espera el banner o una respuesta de
+        estado en lugar de dormir 2 s y sólo escribe los $ que difieren de la instantánea $$.
+        Si la placa no se reinició (hubo estado sin banner), conserva el origen G92 vigente.
+        Publica las etapas en etapa_conexion; cancelar_conexion() la aborta entre etapas.
+        """
+        self._cancelar_conexion.clear()
+        reservado = False
+        try:
+            self._avanzar_conexion('puerto')
+            if not SERIAL_OK:
+                print("[AVISO] pyserial no está instalado; no se puede establecer conexión serie.")
+                return False
+            origen_previo = (self.origen_establecido, self.limites_activos)
+            # Al conectar, asumir que no hay origen de trabajo establecido aún
+            self.origen_establecido = False
+            self.limites_activos = False
+            if self.puerto is None:
+                self.puerto = self.autodetectar_puerto()
+                if self.puerto is None:
+                    print("No se pudo detectar un puerto para Arduino.")
+                    return False
+            self._avanzar_conexion('handshake')
+            
+            descubrimiento = descubrimiento_dispositivos()
+            # Reservar el puerto antes de abrirlo: el supervisor del ECG o un sondeo no deben
+            # abrirlo (y reiniciar la placa) en mitad del arranque en frío
+            reservado = descubrimiento.marcar_en_uso(self.puerto)
+            conn = descubrimiento.tomar_conexion(self.puerto)
+            ident = descubrimiento.identidad(self.puerto) or {}
+            if rapida is None:
+                rapida = ident.get('tipo') == 'grbl'
+            en_caliente = False
+            reiniciada = True
+            if conn is not None and ident.get('tipo') in DescubrimientoDispositivos.TIPOS_CNC:
+                # La placa ya arrancó e identificó su firmware durante el sondeo: sin espera ni handshake
+                conn.timeout = 1
+                self.conexion = conn
+                self.firmware = ident['tipo']
+                self.firmware_info = ident.get('info', '') or self.firmware_info
+                handshake_ok = True
+                try:
+                    with self._serial_lock:
+                        self.conexion.reset_input_buffer()
+                except Exception:
+                    pass
+            elif rapida:
+                self.conexion = self._abrir_puerto(sin_reset=True)
+                listo, banner, reiniciada = self._esperar_grbl_listo(2.5)
+                if listo:
+                    en_caliente = True
+                    self.firmware = 'grbl'
+                    self.firmware_info = banner or ident.get('info', '') or self.firmware_info
+                    handshake_ok = True
+                else:
+                    handshake_ok = self._handshake_firmware()
+            else:
+                self.conexion = self._abrir_puerto(sin_reset=False)
+                # Espera del bootloader interrumpible por cancelar_conexion()
+                self._cancelar_conexion.wait(2)
+                self._avanzar_conexion('handshake')
+                try:
+                    # Limpiar buffers iniciales
+                    with self._serial_lock:
+                        self.conexion.reset_input_buffer()
+                        self.conexion.reset_output_buffer()
+                except Exception as e:
+                    pass
+                handshake_ok = self._handshake_firmware()
+
+            if not handshake_ok:
+                try:
+                    self.conexion.close()
+                except Exception as e:
+                    pass
+                self.conectado = False
+                # La identidad en caché no coincide con lo que respondió el puerto
+                descubrimiento.invalidar(self.puerto)
+                return False
+
+            self._avanzar_conexion('configuracion')
+            # Marcar como conectado y configurar según firmware
+            self.conectado = True
+            self.clave_usb = descubrimiento.clave_de_puerto(self.puerto) or self.clave_usb
+            self.iniciar_supervisor()
+            if en_caliente and not reiniciada:
+                # Sin reinicio GRBL conserva G92 y la posición: el origen sigue siendo válido
+                self.origen_establecido, self.limites_activos = origen_previo
+            if self.firmware == 'grbl':
+                if en_caliente:
+                    # $X sólo si realmente quedó en alarma
+                    if self._leer_status_line(0.3).startswith('<Alarm'):
+                        self.enviar_comando("$X")
+                else:
+                    self.enviar_comando("$X")
+                self.override_actual = 100
+                self._aplicar_configuracion_grbl(usar_cache=en_caliente)
+            self.cargar_velocidad()
+            self.aplicar_velocidad()
+            self._avanzar_conexion('lista')
+            return True
+        except ConexionCancelada:
+            _LOG_CNC.info("Conexión cancelada durante la etapa '%s'", self.etapa_conexion)
+            self.desconectar()
+            self.conectado = False
+            self.etapa_conexion = 'cancelada'
+            return False
+        except Exception as e:
+            self.conectado = False
+            return False
+        finally:
+            if self.etapa_conexion not in ('lista', 'cancelada'):
+                self.etapa_conexion = 'fallida'
+            if reservado and self.etapa_conexion != 'lista':
+                descubrimiento_dispositivos().liberar(self.puerto)
+            self._publicar_evento('conexion', {'estado': self.etapa_conexion})
+
+    def _avanzar_conexion(self, etapa: str):
+        """Registra la etapa de conectar() y aborta si se pidió cancelar."""
+        self.etapa_conexion = etapa
+        if self._cancelar_conexion.is_set():
+            raise ConexionCancelada(etapa)
+
+    def cancelar_conexion(self):
+        """Pide abortar un conectar() en curso en otro hilo (efectivo en la siguiente etapa)."""
+        self._cancelar_conexion.set()
+
+    def _abrir_puerto(self, sin_reset: bool = False):
+        """Abre el puerto serie. Con sin_reset deja DTR/RTS bajos antes de abrir para no
+        disparar el auto-reset del Arduino (efectivo según adaptador y sistema operativo)."""
+        if not sin_reset:
+            return serial.Serial(self.puerto, self.baudrate, timeout=1)
+        conn = serial.Serial()
+        conn.port = self.puerto
+        conn.baudrate = self.baudrate
+        conn.timeout = 1
+        conn.dtr = False
+        conn.rts = False
+        conn.open()
+        return conn
+
+    def _esperar_grbl_listo(self, plazo: float = 2.5):
+        """Espera el banner 'Grbl' o una línea de estado '<...>' en vez de dormir un tiempo fijo.
+        Devuelve (listo, banner, reiniciada): reiniciada es False si respondió estado sin banner.
+        """
+        timeout_prev = self.conexion.timeout
+        try:
+            self.conexion.timeout = 0.05
+            fin = time.time() + plazo
+            proximo_estado = 0.0
+            while time.time() < fin:
+                ahora = time.time()
+                if ahora >= proximo_estado:
+                    # '?' es tiempo real: GRBL responde al instante; el bootloader lo ignora
+                    with self._serial_lock:
+                        self.conexion.write(b"?")
+                    proximo_estado = ahora + 0.1
+                with self._serial_lock:
+                    linea = self.conexion.readline().decode(errors='ignore').strip()
+                if not linea:
+                    continue
+                if 'Grbl' in linea:
+                    # Dejar pasar los [MSG:...] del arranque
+                    time.sleep(0.05)
+                    with self._serial_lock:
+                        self.conexion.reset_input_buffer()
+                    return True, linea, True
+                if linea.startswith('<'):
+                    with self._serial_lock:
+                        self.conexion.reset_input_buffer()
+                    return True, '', False
+            return False, '', True
+        except Exception:
+            return False, '', True
+        finally:
+            try:
+                self.conexion.timeout = timeout_prev
+            except Exception:
+                pass
+
+    def _clave_parametros(self) -> str:
+        ident = descubrimiento_dispositivos().identidad(self.puerto) if self.puerto else None
+        return (ident or {}).get('clave') or f"dev:{self.puerto}"
+
+    def _cargar_parametros_cache(self) -> dict:
+        try:
+            if os.path.exists(self.archivo_parametros_grbl):
+                with open(self.archivo_parametros_grbl, 'r') as f:
+                    data = json.load(f) or {}
+                snap = data.get(self._clave_parametros())
+                if isinstance(snap, dict):
+                    return snap
+        except Exception as e:
+            print(f"[AVISO] No se pudo leer instantánea $$: {e}")
+        return {}
+
+    def _guardar_parametros_cache(self, snapshot: dict):
+        try:
+            data = {}
+            if os.path.exists(self.archivo_parametros_grbl):
+                with open(self.archivo_parametros_grbl, 'r') as f:
+                    data = json.load(f) or {}
+            data[self._clave_parametros()] = snapshot
+            diario_posicion().publicar(self.archivo_parametros_grbl, json.dumps(data, indent=2))
+        except Exception as e:
+            print(f"[AVISO] No se pudo guardar instantánea $$: {e}")
+
+    @staticmethod
+    def _mismo_parametro(actual, deseado) -> bool:
+        if actual is None:
+            return False
+        try:
+            return abs(float(actual) - float(deseado)) < 1e-6
+        except Exception:
+            return str(actual).strip() == str(deseado).strip()
+
+    def _aplicar_configuracion_grbl(self, usar_cache: bool = False) -> bool:
+        """Aplica $21=0, $20=0, $3 y $11 escribiendo sólo los que difieren de la instantánea $$.
+        Muchos de estos $ escriben EEPROM en GRBL, por eso se evita reescribirlos en cada conexión.
+        Con usar_cache se compara contra la instantánea guardada sin volver a leer $$.
+        """
+        deseados = {'21': '0', '20': '0'}  # Límites duros y blandos desactivados
+        if self.mascara_direccion is not None:
+            deseados['3'] = str(max(0, min(7, int(self.mascara_direccion))))
+        jd = self.junction_deviation if self.junction_deviation is not None else 0.15
+        deseados['11'] = str(max(0.005, min(1.0, float(jd))))
+        snapshot = self._cargar_parametros_cache() if usar_cache else {}
+        if not all(k in snapshot for k in deseados):
+            snapshot = self._leer_parametros_grbl()
+        escritos = 0
+        for k, v in deseados.items():
+            if self._mismo_parametro(snapshot.get(k), v):
+                continue
+            if self.enviar_comando(f"${k}={v}"):
+                snapshot[k] = v
+                escritos += 1
+        if self.mascara_direccion is not None:
+            self.mascara_direccion = int(deseados['3'])
+        self.junction_deviation = float(deseados['11'])
+        if snapshot:
+            self._guardar_parametros_cache(snapshot)
+        print(f"[INFO] Configuración GRBL: {escritos} parámetro(s) escrito(s)")
+        return True
+
+    def _handshake_firmware(self) -> bool:
+        """Identifica GRBL ($I) o Marlin (M115) en la conexión abierta. Ajusta self.firmware."""
+        # Intentar identificar firmware con handshake real
+        handshake_ok = False
+        try:
+            with self._serial_lock:
+                self.conexion.write(b"$I\n")  # Info de GRBL
+            time.sleep(0.2)
+            buf = []
+            inicio = time.time()
+            # Leer hasta 1s esperando alguna respuesta significativa
+            while time.time() - inicio < 1.0:
+                with self._serial_lock:
+                    if self.conexion.in_waiting:
+                        linea = self.conexion.readline().decode(errors='ignore').strip()
+                    else:
+                        linea = ''
+                if linea:
+                    buf.append(linea)
+                    if 'Grbl' in linea or linea.lower().startswith('ok'):
+                        handshake_ok = True
+                        self.firmware = 'grbl'
+                        if 'Grbl' in linea:
+                            self.firmware_info = linea
+                        break
+                else:
+                    time.sleep(0.05)
+        except Exception as e:
+            handshake_ok = False
+
+        # Intentar Marlin si no fue GRBL
+        if not handshake_ok:
+            try:
+                with self._serial_lock:
+                    self.conexion.write(b"M115\n")
+                inicio = time.time()
+                while time.time() - inicio < 1.0 and not handshake_ok:
+                    with self._serial_lock:
+                        if self.conexion.in_waiting:
+                            linea = self.conexion.readline().decode(errors='ignore').strip()
+                        else:
+                            linea = ''
+                    if linea:
+                        if 'FIRMWARE_NAME' in linea or linea.lower().startswith('ok'):
+                            handshake_ok = True
+                            self.firmware = 'marlin'
+                            if 'FIRMWARE_NAME' in linea:
+                                self.firmware_info = linea
+                            break
+                    else:
+                        time.sleep(0.05)
+            except Exception as e:
+                handshake_ok = False
+
+        return handshake_ok
+
+    def _leer_parametros_grbl(self) -> dict:
+        """Lee $$ y devuelve un dict { 'n': 'valor' } con parámetros de GRBL."""
+        out = {}
+        if not (self.conectado and self.firmware == 'grbl' and self.conexion and self.conexion.is_open):
+            return out
+        try:
+            with self._serial_lock:
+                try:
+                    self.conexion.reset_input_buffer()
+                except Exception:
+                    pass
+                self.conexion.write(b"$$\n")
+            limite = time.time() + 1.2
+            while time.time() < limite:
+                with self._serial_lock:
+                    hay = self.conexion.in_waiting if self.conexion else 0
+                if hay <= 0:
+                    time.sleep(0.02)
+                    continue
+                with self._serial_lock:
+                    linea = self.conexion.readline().decode(errors='ignore').strip()
+                if not linea:
+                    continue
+                if linea.lower() == 'ok':
+                    break
+                if linea.startswith('$') and '=' in linea:
+                    try:
+                        s = linea.split('(')[0].strip()
+                        k, v = s.split('=', 1)
+                        k = k.lstrip('$').strip()
+                        v = v.strip()
+                        if k:
+                            out[k] = v
+                    except Exception:
+                        continue
+        except Exception:
+            pass
+        return out
+
+    def consultar_info_firmware(self) -> str:
+        """Consulta y devuelve una cadena con la información del firmware detectado."""
+        try:
+            if self.firmware == 'grbl':
+                with self._serial_lock:
+                    if self.conexion and self.conexion.is_open:
+                        self.conexion.reset_input_buffer()
+                        self.conexion.write(b"$I\n")
+                time.sleep(0.2)
+                info_line = ""
+                limite = time.time() + 0.6
+                while time.time() < limite:
+                    with self._serial_lock:
+                        if not (self.conexion and self.conexion.in_waiting):
+                            break
+                        linea = self.conexion.readline().decode(errors='ignore').strip()
+                    if 'Grbl' in linea or linea.lower().startswith('['):
+                        info_line = linea
+                        break
+                if info_line:
+                    self.firmware_info = info_line
+                return self.firmware_info or 'GRBL (sin detalles)'
+            elif self.firmware == 'marlin':
+                with self._serial_lock:
+                    if self.conexion and self.conexion.is_open:
+                        self.conexion.reset_input_buffer()
+                        self.conexion.write(b"M115\n")
+                time.sleep(0.2)
+                info_line = ""
+                limite = time.time() + 0.6
+                while time.time() < limite:
+                    with self._serial_lock:
+                        if not (self.conexion and self.conexion.in_waiting):
+                            break
+                        linea = self.conexion.readline().decode(errors='ignore').strip()
+                    if 'FIRMWARE_NAME' in linea:
+                        info_line = linea
+                        break
+                if info_line:
+                    self.firmware_info = info_line
+                return self.firmware_info or 'Marlin (sin detalles)'
+            else:
+                return self.firmware_info or 'Firmware desconocido'
+        except Exception as e:
+            return self.firmware_info or f"No se pudo consultar firmware: {e}"
+            
+    def desconectar(self):
+        # Desconexión voluntaria: no reconectar
+        if self.supervisor is not None:
+            self.supervisor.detener()
+        if self.conexion and self.conexion.is_open:
+            self.conexion.close()
+            self.conectado = False
+        if self.puerto:
+            descubrimiento_dispositivos().liberar(self.puerto)
+        # Al desconectar, desactivar límites y origen
+        self.origen_establecido = False
+        self.limites_activos = False
+        self._cancelar_suscripcion_eventos()
+
+    def iniciar_supervisor(self):
+        """Arranca (una vez) el supervisor que reconecta la CNC si se pierde la conexión."""
+        if self.supervisor is None:
+            self.supervisor = SupervisorReconexion('CNC', self._supervisor_vivo, self._supervisor_reconectar,
+                                                   intervalo=self._intervalo_ping)
+        self.supervisor.iniciar()
+
+    def _supervisor_vivo(self) -> bool:
+        if self._reconectando:
+            return True
+        return self.esta_conectado()
+
+    def _supervisor_reconectar(self) -> bool:
+        """Reabre la CNC (puerto por identidad USB) y restaura origen G92 desde save.txt y overrides."""
+        if self.ejecutando_rutina:
+            # Esperar a que el hilo de la rutina termine de cerrar su punto de control
+            return False
+        self._reconectando = True
+        try:
+            origen_previo = self.origen_establecido
+            limites_previos = self._limites_vigentes()
+            print("[AVISO] CNC sin respuesta: intentando reconectar...")
+            self._publicar_evento('conexion', {'estado': 'perdida'})
+            try:
+                if self.conexion and self.conexion.is_open:
+                    self.conexion.close()
+            except Exception:
+                pass
+            self.conectado = False
+            descubrimiento = descubrimiento_dispositivos()
+            if self.puerto:
+                descubrimiento.liberar(self.puerto)
+            # Tras desenchufar, el puerto puede cambiar de nombre: resolver por identidad USB,
+            # sin sondear otros puertos (abrirlos reiniciaría la placa ECG)
+            if self.clave_usb:
+                puerto = descubrimiento.puerto_de_clave(self.clave_usb)
+                if puerto is None:
+                    return False
+                self.puerto = puerto
+            if not self.conectar():
+                return False
+            self._fallos_ping = 0
+            if origen_previo and not self.origen_establecido:
+                # La placa se reinició: restaurar el sistema de coordenadas desde la última posición guardada
+                diario_posicion().vaciar()
+                if self.establecer_posicion_guardada():
+                    self.origen_establecido = True
+                    self.activar_limites_estandar(limites_previos[0], limites_previos[2], limites_previos[1], limites_previos[3])
+            self._publicar_evento('conexion', {'estado': 'reconectada', 'origen': self.origen_establecido})
+            return True
+        finally:
+            self._reconectando = False
+
+    def esta_conectado(self):
+        """Devuelve True solo si hay un puerto serie abierto y operativo.
+        Realiza un ping suave no intrusivo cada ~1s para validar que el dispositivo responde.
+        """
+        if not SERIAL_OK:
+            self.conectado = False
+            return False
+        if not self.conexion or not getattr(self.conexion, 'is_open', False):
+            self.conectado = False
+            return False
+        # Si estamos ejecutando una rutina, evitar pings que puedan interferir
+        if getattr(self, 'ejecutando_rutina', False):
+            self.conectado = True
+            return True
+        ahora = time.time()
+        if (ahora - self._ultimo_ping) < self._intervalo_ping and self.conectado:
+            return True  # usar estado reciente solo si seguía conectado
+        try:
+            # Evitar competir por el puerto mientras se procesa un comando
+            if self._cmd_en_progreso:
+                return self.conectado
+            with self._serial_lock:
+                # Usar un ping seguro y verificar respuesta breve
+                if self.firmware == 'grbl':
+                    self.conexion.write(b"?\n")
+                elif self.firmware == 'marlin':
+                    self.conexion.write(b"M114\n")  # reporte de posición
+                else:
+                    self.conexion.write(b"\n")
+            # Intentar leer algo durante un corto periodo
+            inicio = time.time()
+            recibio = False
+            while time.time() - inicio < 0.4:
+                with self._serial_lock:
+                    hay = self.conexion.in_waiting if self.conexion else 0
+                if hay:
+                    with self._serial_lock:
+                        linea = self.conexion.readline().decode(errors='ignore').strip()
+                    if linea:
+                        if self.firmware == 'grbl':
+                            # GRBL responde con línea de estado <...> o ok
+                            if linea.startswith('<') or linea.lower().startswith('ok'):
+                                recibio = True
+                                break
+                        elif self.firmware == 'marlin':
+                            # Marlin suele responder con posiciones y 'ok'
+                            if 'ok' in linea.lower() or 'x:' in linea.lower():
+                                recibio = True
+                                break
+                        else:
+                            recibio = True
+                            break
+                time.sleep(0.05)
+            self._ultimo_ping = ahora
+            if not recibio:
+                # Debounce de fallos de ping: no cerrar el puerto, mantener estado
+                self._fallos_ping += 1
+                # Solo si hay muchos fallos seguidos, marcar desconexión lógica
+                if self._fallos_ping >= 10:
+                    self.conectado = False
+                    return False
+                # Mantener estado anterior y asumir conexión si el puerto sigue abierto
+                self.conectado = True
+                return True
+            # Éxito: resetear contador de fallos
+            self._fallos_ping = 0
+            return True
+        except Exception:
+            try:
+                self.conexion.close()
+            except Exception:
+                pass
+            self.conectado = False
+            return False
+
+    def cargar_velocidad(self):
+        """Carga el valor de velocidad desde el archivo temporal."""
+        try:
+            if os.path.exists(self.archivo_velocidad):
+                with open(self.archivo_velocidad, 'r') as f:
+                    datos = json.load(f)
+                    nueva_velocidad = datos.get('velocidad', 50)
+                    if nueva_velocidad != self.velocidad_actual:
+                        self.velocidad_actual = nueva_velocidad
+                        return True
+        except Exception as e:
+            print(f"Error al cargar velocidad: {e}")
+        return False
+
+    def aplicar_velocidad(self):
+        """Aplica la velocidad actual al CNC."""
+        # Permitir aplicar si el puerto serie está abierto aunque 'conectado' esté desfasado
+        # No modificar la velocidad mientras una rutina esté en ejecución
+        if getattr(self, 'ejecutando_rutina', False):
+            return False
+        try:
+            puerto_abierto = bool(self.conexion) and bool(getattr(self.conexion, 'is_open', False))
+        except Exception:
+            puerto_abierto = False
+        if not (self.conectado or puerto_abierto):
+            return False
+        try:
+            # Tratar firmware desconocido como GRBL por defecto para permitir override en la mayoría de controladores
+            if self.firmware == 'grbl' or self.firmware == 'desconocido':
+                # Ajustar override de feed en GRBL v1.1 con comandos en tiempo real
+                objetivo = max(10, min(200, int(self.velocidad_actual)))
+                # Limitar rango razonable 10%-200%
+                diff = objetivo - self.override_actual
+                # Atajo: reset a 100 si cambio grande y objetivo cercano a 100
+                if objetivo == 100 and self.override_actual != 100:
+                    try:
+                        self._escribir_tiempo_real(b"\x93")  # Reset feed override
+                    except Exception:
+                        pass
+                    self.override_actual = 100
+                    return True
+                paso10 = 0
+                paso1 = 0
+                if diff > 0:
+                    paso10 = diff // 10
+                    paso1 = diff % 10
+                    for _ in range(paso10):
+                        self._escribir_tiempo_real(b"\x91")  # +10%
+                        time.sleep(0.02)
+                    for _ in range(paso1):
+                        self._escribir_tiempo_real(b"\x94")  # +1%
+                        time.sleep(0.01)
+                elif diff < 0:
+                    diff = -diff
+                    paso10 = diff // 10
+                    paso1 = diff % 10
+                    for _ in range(paso10):
+                        self._escribir_tiempo_real(b"\x92")  # -10%
+                        time.sleep(0.02)
+                    for _ in range(paso1):
+                        self._escribir_tiempo_real(b"\x95")  # -1%
+                        time.sleep(0.01)
+                self.override_actual = objetivo
+                return True
+            elif self.firmware == 'marlin':
+                # Marlin: M220 Sxx
+                comando = f"M220 S{int(self.velocidad_actual)}"
+                self.enviar_comando(comando)
+                return True
+            else:
+                # Fallback conservador: intentar patrón GRBL
+                objetivo = max(10, min(200, int(self.velocidad_actual)))
+                diff = objetivo - self.override_actual
+                if objetivo == 100 and self.override_actual != 100:
+                    try:
+                        self._escribir_tiempo_real(b"\x93")
+                    except Exception:
+                        pass
+                    self.override_actual = 100
+                    return True
+                if diff != 0:
+                    if diff > 0:
+                        paso10 = diff // 10
+                        paso1 = diff % 10
+                        for _ in range(paso10):
+                            self._escribir_tiempo_real(b"\x91")
+                            time.sleep(0.02)
+                        for _ in range(paso1):
+                            self._escribir_tiempo_real(b"\x94")
+                            time.sleep(0.01)
+                    else:
+                        diff = -diff
+                        paso10 = diff // 10
+                        paso1 = diff % 10
+                        for _ in range(paso10):
+                            self._escribir_tiempo_real(b"\x92")
+                            time.sleep(0.02)
+                        for _ in range(paso1):
+                            self._escribir_tiempo_real(b"\x95")
+                            time.sleep(0.01)
+                    self.override_actual = objetivo
+                    return True
+        except Exception as e:
+            print(f"Error aplicando velocidad: {e}")
+            return False
+        return False
+
+    # --- Estado GRBL: parseo y consulta ligera ---
+    def _parsear_estado_grbl(self, linea: str):
+        """Parsea una línea de estado de GRBL (<...>) para extraer Ov y F/FS.
+        Actualiza self.ov_feed, self.ov_rapid, self.ov_spindle y self.feed_reportado.
+        """
+        try:
+            if not linea or not linea.startswith('<'):
+                return
+            # Ejemplos:
+            # <Run|MPos:0.000,0.000,0.000|FS:500,0|Ov:120,100,100>
+            # <Idle|WPos:..|F:600|Ov:100,100,100>
+            parts = linea.strip('<>').split('|')
+            for p in parts:
+                if p.startswith('Ov:'):
+                    try:
+                        vals = p[3:].split(',')
+                        if len(vals) >= 3:
+                            self.ov_feed = int(float(vals[0]))
+                            self.ov_rapid = int(float(vals[1]))
+                            self.ov_spindle = int(float(vals[2]))
+                            # Mantener override_actual alineado al estado real reportado por GRBL
+                            try:
+                                if 0 < self.ov_feed <= 250:
+                                    self.override_actual = int(self.ov_feed)
+                            except Exception:
+                                pass
+                    except Exception:
+                        pass
+                elif p.startswith('FS:'):
+                    try:
+                        vals = p[3:].split(',')
+                        if vals:
+                            self.feed_reportado = float(vals[0])
+                    except Exception:
+                        pass
+                elif p.startswith('F:'):
+                    try:
+                        self.feed_reportado = float(p[2:])
+                    except Exception:
+                        pass
+        except Exception:
+            pass
+
+    def obtener_estado_velocidad(self):
+        """Consulta (ligero) el estado para conocer override y feed actuales en GRBL.
+        Devuelve (ov_feed:int, feed_reportado:float|0).
+        """
+        try:
+            firmware_tipo = getattr(self, 'firmware', 'desconocido')
+            
+            if self.firmware != 'grbl':
+                # Para firmware no-GRBL, usar override_actual si ejecutando rutina
+                # Si no, usar velocidad_actual para reflejar el slider
+                if getattr(self, 'ejecutando_rutina', False):
+                    try:
+                        ov = int(getattr(self, 'override_actual', 100))
+                    except Exception:
+                        ov = 100
+                else:
+                    try:
+                        ov = int(getattr(self, 'velocidad_actual', 100))
+                    except Exception:
+                        ov = 100
+                f = getattr(self, 'feed_reportado', 0.0)
+                return ov, f
+            
+            # Para GRBL, usar lógica original
+            ov = self.ov_feed if isinstance(getattr(self, 'ov_feed', None), int) else 0
+            f = self.feed_reportado
+            ahora = time.time()
+            if (ahora - self._last_status_poll) < self._status_poll_interval:
+                return ov, f
+            self._last_status_poll = ahora
+            # Enviar '?' y leer brevemente
+            with self._serial_lock:
+                if self.conexion and getattr(self.conexion, 'is_open', False):
+                    self.conexion.write(b"?\n")
+            time.sleep(0.03)
+            limite = time.time() + 0.08
+            while time.time() < limite:
+                with self._serial_lock:
+                    if not (self.conexion and self.conexion.in_waiting):
+                        break
+                    linea = self.conexion.readline().decode(errors='ignore').strip()
+                if linea:
+                    self._parsear_estado_grbl(linea)
+            # Fallback a override_actual si GRBL no reporta Ov
+            ov_local = self.ov_feed
+            if not ov_local:
+                try:
+                    ov_local = int(getattr(self, 'override_actual', 0))
+                except Exception:
+                    ov_local = 0
+            return ov_local, self.feed_reportado
+        except Exception as e:
+            # En caso de error, devolver velocidad_actual si no está ejecutando rutina
+            if getattr(self, 'ejecutando_rutina', False):
+                try:
+                    ov = int(getattr(self, 'override_actual', 100))
+                except Exception:
+                    ov = 100
+            else:
+                try:
+                    ov = int(getattr(self, 'velocidad_actual', 100))
+                except Exception:
+                    ov = 100
+            f = getattr(self, 'feed_reportado', 0.0)
+            return ov, f
+
+    # --- Respaldo y restauración de configuración ($$) ---
+    def guardar_configuracion_grbl(self, ruta: str | None = None):
+        """Solicita $$ y guarda la configuración de GRBL en un archivo JSON.
+        Si ruta no se especifica, crea un nombre con timestamp y además actualiza grbl_backup_last.json.
+        Devuelve (ok: bool, mensaje_ruta_o_error: str)
+        """
+        try:
+            if not (self.conectado and self.firmware == 'grbl' and self.conexion and self.conexion.is_open):
+                return False, "CNC no conectada o firmware no es GRBL"
+            # Limpiar buffer y pedir $$
+            with self._serial_lock:
+                try:
+                    self.conexion.reset_input_buffer()
+                except Exception:
+                    pass
+                self.conexion.write(b"$$\n")
+            lineas = []
+            limite = time.time() + 2.0
+            while time.time() < limite:
+                with self._serial_lock:
+                    hay = self.conexion.in_waiting if self.conexion else 0
+                if hay:
+                    with self._serial_lock:
+                        l = self.conexion.readline().decode(errors='ignore').strip()
+                    if l:
+                        # Termina con ok
+                        if l.lower() == 'ok':
+                            break
+                        lineas.append(l)
+                else:
+                    time.sleep(0.02)
+            # Parsear parámetros $n=v (desc)
+            params = {}
+            for l in lineas:
+                if not l.startswith('$'):
+                    continue
+                try:
+                    s = l.split('(')[0].strip()
+                    if '=' in s:
+                        k, v = s.split('=', 1)
+                        k = k.lstrip('$').strip()
+                        v = v.strip()
+                        if k.isdigit():
+                            params[k] = v
+                except Exception:
+                    continue
+            if not params:
+                return False, "No se pudo leer configuración $$"
+            data = {
+                'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
+                'puerto': self.puerto,
+                'firmware': self.firmware_info or self.firmware,
+                'raw': lineas,
+                'params': params,
+            }
+            # Ruta de salida
+            try:
+                os.makedirs(BASE_DIR, exist_ok=True)
+            except Exception:
+                pass
+            if not ruta:
+                stamp = time.strftime("%Y%m%d-%H%M%S")
+                ruta = os.path.join(BASE_DIR, f"grbl_backup_{stamp}.json")
+            with open(ruta, 'w') as f:
+                json.dump(data, f, indent=2)
+            # También actualizar puntero al último respaldo
+            try:
+                ruta_last = os.path.join(BASE_DIR, 'grbl_backup_last.json')
+                with open(ruta_last, 'w') as f:
+                    json.dump(data, f, indent=2)
+            except Exception:
+                pass
+            return True, ruta
+        except Exception as e:
+            return False, f"Error guardando $$: {e}"
+
+    def restablecer_configuracion_grbl(self, ruta: str | None = None):
+        """Lee un archivo JSON de respaldo y aplica los parámetros $n=v a GRBL.
+        Si ruta es None, usa grbl_backup_last.json. Devuelve (ok, mensaje_detalle).
+        """
+        try:
+            if not (self.conectado and self.firmware == 'grbl' and self.conexion and self.conexion.is_open):
+                return False, "CNC no conectada o firmware no es GRBL"
+            if not ruta:
+                ruta = os.path.join(BASE_DIR, 'grbl_backup_last.json')
+            if not os.path.exists(ruta):
+                # Buscar el más reciente grbl_backup_*.json
+                candidatos = [p for p in os.listdir(BASE_DIR) if p.startswith('grbl_backup_') and p.endswith('.json')]
+                if candidatos:
+                    candidatos.sort(reverse=True)
+                    ruta = os.path.join(BASE_DIR, candidatos[0])
+                else:
+                    return False, "No hay respaldos para restaurar"
+            with open(ruta, 'r') as f:
+                data = json.load(f)
+            params = (data or {}).get('params') or {}
+            if not params:
+                return False, "Respaldo inválido (sin params)"
+            enviados = 0
+            ok_count = 0
+            for k, v in params.items():
+                cmd = f"${k}={v}"
+                enviados += 1
+                try:
+                    if self.enviar_comando(cmd):
+                        ok_count += 1
+                except Exception:
+                    pass
+                time.sleep(0.03)
+            return True, f"Aplicados {ok_count}/{enviados} parámetros desde {os.path.basename(ruta)}"
+        except Exception as e:
+            return False, f"Error restaurando $$: {e}"
+            
+    def verificar_cambios_velocidad(self):
+        """Verifica si hay cambios en el archivo de velocidad y los aplica."""
+        tiempo_actual = time.time()
+        if tiempo_actual - self.ultimo_tiempo_verificacion >= self.intervalo_verificacion:
+            self.ultimo_tiempo_verificacion = tiempo_actual
+            # Durante ejecución de rutina, verificar si velocidad_actual difiere de override_actual
+            if getattr(self, 'ejecutando_rutina', False):
+                objetivo = max(10, min(200, int(self.velocidad_actual)))
+                if objetivo != self.override_actual:
+                    try:
+                        if self.firmware == 'grbl' or self.firmware == 'desconocido':
+                            diff = objetivo - self.override_actual
+                            if diff > 0:
+                                paso10 = diff // 10
+                                paso1 = diff % 10
+                                for _ in range(paso10):
+                                    self._escribir_tiempo_real(b"\x91")  # +10%
+                                    time.sleep(0.01)
+                                for _ in range(paso1):
+                                    self._escribir_tiempo_real(b"\x94")  # +1%
+                                    time.sleep(0.005)
+                            elif diff < 0:
+                                diff = -diff
+                                paso10 = diff // 10
+                                paso1 = diff % 10
+                                for _ in range(paso10):
+                                    self._escribir_tiempo_real(b"\x92")  # -10%
+                                    time.sleep(0.01)
+                                for _ in range(paso1):
+                                    self._escribir_tiempo_real(b"\x95")  # -1%
+                                    time.sleep(0.005)
+                            self.override_actual = objetivo
+                            return True, self.velocidad_actual
+                        elif self.firmware == 'marlin':
+                            comando = f"M220 S{int(self.velocidad_actual)}"
+                            self.enviar_comando(comando)
+                            self.override_actual = objetivo
+                            return True, self.velocidad_actual
+                    except Exception as e:
+                        print(f"Error aplicando velocidad durante rutina: {e}")
+                return False, self.velocidad_actual
+            # Fuera de rutina, usar cargar_velocidad y aplicar_velocidad
+            if self.cargar_velocidad():
+                return self.aplicar_velocidad(), self.velocidad_actual
+        return False, self.velocidad_actual
+
+    def guardar_posicion(self, forzar=False):
+        """Publica la posición actual en el diario de escritura diferida (save.txt).
+        Sin forzar no toca el disco: el hilo del diario coalesce y escribe a ritmo acotado.
+        Con forzar espera a que la escritura quede en disco.
+        """
+        try:
+            diario = diario_posicion()
+            diario.publicar(os.path.join(BASE_DIR, 'save.txt'), f"{self.posicion_x},{self.posicion_y}")
+            self.ultimo_guardado = time.time()
+            if forzar:
+                if not diario.vaciar():
+                    return False
+                print(f"Posición guardada: X={self.posicion_x}, Y={self.posicion_y}")
+            return True
+        except Exception as e:
+            print(f"Error al guardar posición: {e}")
+        return False
+
+    def cargar_posicion(self):
+        """Carga la última posición guardada desde el archivo."""
+        try:
+            save_path = os.path.join(BASE_DIR, 'save.txt')
+            if os.path.exists(save_path):
+                with open(save_path, 'r') as f:
+                    contenido = f.read().strip()
+                    if ',' in contenido:
+                        x, y = map(float, contenido.split(','))
+                        return x, y
+        except Exception as e:
+            print(f"Error al cargar posición: {e}")
+        return None, None
+
+    def establecer_posicion_guardada(self):
+        """Establece el origen en la última posición guardada."""
+        x, y = self.cargar_posicion()
+        if x is not None and y is not None:
+            dx = x - self.posicion_x
+            dy = y - self.posicion_y
+            
+            comando = f"G92 X{x} Y{y}"
+            if self.enviar_comando(comando):
+                self.posicion_x = x
+                self.posicion_y = y
+                return True
+        return False
+
+
+
+
+    def _leer_status_line(self, timeout: float = 0.2) -> str:
+        """Envía '?' y devuelve una línea de estado <...> si se recibe dentro del timeout."""
+        if not (self.conectado and self.conexion and self.conexion.is_open):
+            return ""
+        try:
+            with self._serial_lock:
+                self.conexion.write(b"?\n")
+            fin = time.time() + timeout
+            while time.time() < fin:
+                with self._serial_lock:
+                    hay = self.conexion.in_waiting if self.conexion else 0
+                if hay:
+                    with self._serial_lock:
+                        linea = self.conexion.readline().decode(errors='ignore').strip()
+                    if linea.startswith('<'):
+                        return linea
+                time.sleep(0.02)
+        except Exception:
+            return ""
+        return ""
+
+    def _publicar_evento(self, tipo: str, datos: dict | None = None):
+        try:
+            bus_eventos().publicar('cnc', tipo, datos)
+        except Exception:
+            pass
+
+    def consumir_eventos(self) -> list:
+        """Eventos de la CNC pendientes para la interfaz (lista de Evento). La primera llamada
+        suscribe al controlador; sólo llegan los eventos publicados desde entonces."""
+        try:
+            if self._suscripcion_eventos is None:
+                self._suscripcion_eventos = bus_eventos().suscribir('cnc-interfaz', origenes=('cnc',), capacidad=64)
+                return []
+            return bus_eventos().consumir(self._suscripcion_eventos)
+        except Exception:
+            return []
+
+    def _cancelar_suscripcion_eventos(self):
+        suscripcion, self._suscripcion_eventos = self._suscripcion_eventos, None
+        if suscripcion is not None:
+            try:
+                bus_eventos().desuscribir(suscripcion)
+            except Exception:
+                pass
+            
+    def enviar_comando(self, comando):
+        # Control extra: asegurar que _cmd_en_progreso nunca quede activado indefinidamente
+        self.set_cmd_en_progreso(True)
+        try:
+            if not self.conectado:
+                if self.conexion and getattr(self.conexion, 'is_open', False):
+                    self.conectado = True
+                else:
+                    self.set_cmd_en_progreso(False)
+                    return False
+            comando = comando.strip() + "\n"
+            # Control de modos G90/G91 si vienen en el comando
+            try:
+                tokens = comando.strip().split()
+                if any(t.upper() == 'G91' for t in tokens):
+                    self.modo_relativo = True
+                elif any(t.upper() == 'G90' for t in tokens):
+                    self.modo_relativo = False
+            except Exception:
+                pass
+            # Enforce soft-limits si origen establecido y límites activos, solo para G0/G1 (sin inversiones)
+            try:
+                if not self._movimiento_permitido(comando):
+                    self.set_cmd_en_progreso(False)
+                    return False
+            except Exception:
+                pass
+            t_envio = time.perf_counter()
+            with self._serial_lock:
+                self.conexion.write(comando.encode())
+            # Leer hasta 'ok' o agotar timeout
+            respuesta = ""
+            ok_recibido = False
+            alarm_detectada = False
+            inicio = time.time()
+            while time.time() - inicio < 1.5:
+                with self._serial_lock:
+                    linea = self.conexion.readline().decode(errors='ignore').strip()
+                if not linea:
+                    continue
+                respuesta = linea
+                # Detección de alarmas o límites duros
+                lcl = linea.lower()
+                if lcl.startswith('alarm') or 'hard limit' in lcl or ('alarm' in lcl and '<' not in linea):
+                    alarm_detectada = True
+                    break
+                if linea.lower().startswith('ok') or 'ok' == linea.lower():
+                    ok_recibido = True
+                    self.metricas.registrar_latencia(MetricasCNC.clase_comando(comando), time.perf_counter() - t_envio)
+                    break
+            _LOG_SERIE.debug("Enviado: %s, Respuesta: %s", comando.strip(), respuesta)
+            if alarm_detectada or '[MSG:Reset to continue]' in respuesta:
+                _LOG_CNC.warning("Alarma detectada (%s). Enviando $X para desbloquear GRBL.", respuesta)
+                with self._serial_lock:
+                    self.conexion.write(b'$X\n')
+                # Leer respuesta de desbloqueo
+                time.sleep(0.2)
+                try:
+                    linea = self.conexion.readline().decode(errors='ignore').strip()
+                    _LOG_SERIE.debug("Respuesta a $X: %s", linea)
+                except Exception:
+                    pass
+            if ok_recibido and (comando.startswith("G0") or comando.startswith("G1")):
+                self.actualizar_posicion(comando)
+            return ok_recibido
+        except (OSError, IOError) as e:
+            # Error de I/O: probablemente se desconectó el Arduino
+            _LOG_CNC.error("Error de I/O al enviar comando: %s", e)
+            self.conectado = False
+            try:
+                if self.conexion:
+                    self.conexion.close()
+            except:
+                pass
+            return False
+        except Exception as e:
+            _LOG_CNC.error("Error al enviar comando: %s", e)
+            return False
+        finally:
+            # Bloque finally vacío, ya no se usa _cmd_en_progreso
+            pass
+
+    def _movimiento_permitido(self, cmd: str) -> bool:
+        """Valida que un comando G0/G1 no salga de los límites lógicos [-20..20]."""
+        try:
+            cmd_str = cmd.strip()
+            if not (self.origen_establecido and self.limites_activos):
+                return True
+            if self._hilo_programa_verificado is not None and self._hilo_programa_verificado is current_thread():
+                return True
+            if not (cmd_str.upper().startswith('G0') or cmd_str.upper().startswith('G1')):
+                return True
+            objetivo_x = self.posicion_x
+            objetivo_y = self.posicion_y
+            x_presente = False
+            y_presente = False
+            for parte in cmd_str.split():
+                up = parte.upper()
+                if up.startswith('X'):
+                    x_presente = True
+                    try:
+                        val = float(parte[1:])
+                    except Exception:
+                        val = 0.0
+                    if self.modo_relativo:
+                        objetivo_x = self.posicion_x + val
+                    else:
+                        objetivo_x = val
+                elif up.startswith('Y'):
+                    y_presente = True
+                    try:
+                        val = float(parte[1:])
+                    except Exception:
+                        val = 0.0
+                    if self.modo_relativo:
+                        objetivo_y = self.posicion_y + val
+                    else:
+                        objetivo_y = val
+            lim_x_min = self.limite_x_min
+            lim_x_max = self.limite_x_max
+            lim_y_min = self.limite_y_min
+            lim_y_max = self.limite_y_max
+            check_x = objetivo_x
+            check_y = objetivo_y
+            violacion = False
+            detalles = []
+            if x_presente and (check_x < lim_x_min or check_x > lim_x_max):
+                violacion = True
+                detalles.append(f"X={check_x:.2f} fuera de [{lim_x_min:.2f}, {lim_x_max:.2f}]")
+            if y_presente and (check_y < lim_y_min or check_y > lim_y_max):
+                violacion = True
+                detalles.append(f"Y={check_y:.2f} fuera de [{lim_y_min:.2f}, {lim_y_max:.2f}]")
+            if violacion:
+                msg = "Movimiento bloqueado por límites: " + "; ".join(detalles)
+                self.ultimo_limite = msg
+                if self.debug_limites:
+                    _LOG_CNC.info(msg)
+                return False
+            return True
+        except Exception:
+            return True
+
+    def _escribir_tiempo_real(self, dato: bytes):
+        """Escribe un byte de tiempo real (!, ~, overrides) midiendo espera del candado + escritura."""
+        t0 = time.perf_counter()
+        try:
+            with self._serial_lock:
+                if self.conexion and getattr(self.conexion, 'is_open', False):
+                    self.conexion.write(dato)
+        finally:
+            self.metricas.registrar_latencia('tiempo_real', time.perf_counter() - t0)
+
+    def _write_line_fast(self, linea: str) -> bool:
+        """Escribe una línea al puerto sin esperar 'ok'."""
+        try:
+            if not (self.conectado and self.conexion and getattr(self.conexion, 'is_open', False)):
+                return False
+            with self._serial_lock:
+                self.conexion.write((linea.strip() + "\n").encode())
+            return True
+        except (OSError, IOError) as e:
+            # Error de I/O: probablemente se desconectó el Arduino
+            _LOG_CNC.error("Error de I/O en _write_line_fast: %s", e)
+            self.conectado = False
+            try:
+                if self.conexion:
+                    self.conexion.close()
+            except:
+                pass
+            return False
+        except Exception as e:
+            _LOG_CNC.error("Error en _write_line_fast: %s", e)
+            return False
+
+    def _drain_ok_nonblock(self, max_ms: float = 60.0) -> int:
+        """Lee respuestas disponibles sin bloquear mucho tiempo. Devuelve cuántos 'ok' se leyeron."""
+        if not (self.conectado and self.conexion and getattr(self.conexion, 'is_open', False)):
+            return 0
+        ok_count = 0
+        fin = time.time() + (max_ms / 1000.0)
+        while time.time() < fin:
+            try:
+                with self._serial_lock:
+                    hay = self.conexion.in_waiting if self.conexion else 0
+            except Exception:
+                hay = 0
+            if hay <= 0:
+                time.sleep(0.002)
+                continue
+            try:
+                with self._serial_lock:
+                    linea = self.conexion.readline().decode(errors='ignore').strip()
+            except Exception:
+                linea = ''
+            if not linea:
+                continue
+            if linea.lower().startswith('ok') or ' ok' in linea.lower():
+                ok_count += 1
+                self.metricas.registrar_oks(1)
+        return ok_count
+
+    def paro_emergencia(self):
+        """Detiene la máquina preservando el origen.
+        Envía '!' (Feed Hold) como comando en tiempo real y cancela jog (0x85) si aplica.
+        Si hay una rutina en curso, además pide al hilo de streaming que la corte: éste guarda el
+        punto de control en la última línea confirmada, vacía el planificador con un reset suave
+        y restaura el origen G92 (ver _reinicio_suave_tras_paro).
+        """
+        if not (self.conectado and self.conexion and self.conexion.is_open):
+            print("paro_emergencia(): No hay conexión activa")
+            return False
+        try:
+            # Feed hold: pausa segura sin perder G92 ni offsets
+            self._escribir_tiempo_real(b"!")
+            # Si estuviera en jogging, enviar cancel (0x85)
+            try:
+                self._escribir_tiempo_real(b"\x85")
+            except Exception:
+                pass
+            print("Paro de emergencia enviado: Feed Hold ('!') + Cancel Jog (0x85)")
+            self.en_hold = True
+            if self.ejecutando_rutina:
+                self._paro_solicitado = True
+            return True
+        except Exception as e:
+            print(f"Error en paro_emergencia(): {e}")
+            return False
+
+    def reanudar_movimiento(self):
+        """Reanuda el movimiento después de un Feed Hold enviando '~' (Cycle Start)."""
+        if not (self.conectado and self.conexion and self.conexion.is_open):
+            print("reanudar_movimiento(): No hay conexión activa")
+            return False
+        if self._paro_solicitado:
+            # La rutina se está cortando tras un paro: reanudar con reanudar_programa()
+            print("reanudar_movimiento(): Paro de emergencia en curso; la rutina se reanuda desde su punto de control")
+            return False
+        try:
+            self._escribir_tiempo_real(b"~")
+            self.en_hold = False
+            print("Reanudar enviado: '~' (Cycle Start)")
+            return True
+        except Exception as e:
+            print(f"Error en reanudar_movimiento(): {e}")
+            return False
+            
+    def actualizar_posicion(self, comando):
+        partes = comando.split()
+        dx_calc = None
+        dy_calc = None
+        for parte in partes:
+            if parte.startswith("X"):
+                try:
+                    val = float(parte[1:])
+                    if self.modo_relativo:
+                        self.posicion_x += val
+                        dx_calc = val
+                    else:
+                        dx_calc = val - self.posicion_x
+                        self.posicion_x = val
+                except ValueError:
+                    pass
+            elif parte.startswith("Y"):
+                try:
+                    val = float(parte[1:])
+                    if self.modo_relativo:
+                        self.posicion_y += val
+                        dy_calc = val
+                    else:
+                        dy_calc = val - self.posicion_y
+                        self.posicion_y = val
+                except ValueError:
+                    pass
+        try:
+            if dx_calc is not None and dx_calc != 0:
+                self._ultimo_dir_x = 1.0 if dx_calc > 0 else -1.0
+            if dy_calc is not None and dy_calc != 0:
+                self._ultimo_dir_y = 1.0 if dy_calc > 0 else -1.0
+        except Exception:
+            pass
+        
+    def mover(self, direccion_x=0, direccion_y=0):
+        """
+        Mueve el CNC en modo relativo.
+        Construye correctamente comandos GRBL solo con ejes que se mueven y coord. [-20..20] desde el origen.
+        """
+        if not self.conectado:
+            print("mover(): No hay conexión activa")
+            return False
+        if getattr(self, 'abortado_por_limite', False) or getattr(self, 'en_hold', False):
+            print("mover(): Bloqueado por activación de límite o hold")
+            return False
+        if direccion_x == 0 and direccion_y == 0:
+            print("mover(): Sin movimiento (ambos ejes en 0)")
+            return False
+        # Validación de límites suaves si están activos y se ha establecido el origen
+        if self.origen_establecido and self.limites_activos:
+            # Calcular posición futura física en el mismo espacio [-20..20] desde el origen
+            futuro_x = self.posicion_x
+            futuro_y = self.posicion_y
+            if direccion_x != 0:
+                futuro_x += direccion_x * self.paso
+            if direccion_y != 0:
+                futuro_y += direccion_y * self.paso
+            lim_x_min = self.limite_x_min
+            lim_x_max = self.limite_x_max
+            lim_y_min = self.limite_y_min
+            lim_y_max = self.limite_y_max
+            if (
+                futuro_x < lim_x_min or futuro_x > lim_x_max or
+                futuro_y < lim_y_min or futuro_y > lim_y_max
+            ):
+                print("mover(): Movimiento bloqueado por límites suaves")
+                # No mostrar popup modal; sólo cancelar la acción
+                return False
+        
+        self.enviar_comando("G91")
+        self.modo_relativo = True
+        
+        partes_comando = ["G0"]
+        
+        if direccion_x != 0:
+            desplazamiento_x = direccion_x * self.paso
+            partes_comando.append(f"X{desplazamiento_x}")
+            _LOG_SERIE.debug("Movimiento en X: %s", desplazamiento_x)
+        
+        if direccion_y != 0:
+            desplazamiento_y = direccion_y * self.paso
+            partes_comando.append(f"Y{desplazamiento_y}")
+            _LOG_SERIE.debug("Movimiento en Y: %s", desplazamiento_y)
+        
+        comando = " ".join(partes_comando)
+        _LOG_SERIE.debug("Comando GRBL generado: %s", comando)
+        
+        resultado = self.enviar_comando(comando)
+        if not resultado:
+            print("[PARO DE EMERGENCIA] Fallo al enviar comando de movimiento")
+            self.paro_emergencia()
+        self.enviar_comando("G90")
+        self.modo_relativo = False
+        return resultado
+        
+    def ir_a_home(self):
+        if not self.conectado:
+            print("ir_a_home(): No hay conexión activa")
+            return False
+        self.enviar_comando("G90")
+        self.modo_relativo = False
+        resultado = self.enviar_comando("G0 X0 Y0")
+        if resultado:
+            self.posicion_x = self.posicion_y = 0.0
+            # No cambies origen_establecido aquí; Home no crea G92
+        return resultado
+        
+    def establecer_origen(self):
+        if not self.conectado:
+            print("establecer_origen(): No hay conexión activa")
+            return False
+        resultado = self.enviar_comando("G92 X0 Y0")
+        if resultado:
+            self.posicion_x = self.posicion_y = 0.0
+            self.guardar_posicion(forzar=True)
+            self.origen_establecido = True
+            # Activar límites estándar lógicos [-20..20] al fijar origen
+            try:
+                self.activar_limites_estandar()
+            except Exception:
+                self.limites_activos = True
+        return resultado
+
+    def activar_limites_estandar(self, xmin: float = -20.0, ymin: float = -20.0, xmax: float = 20.0, ymax: float = 20.0):
+        """Activa límites lógicos relativos al origen en el rango [-20..20] por eje."""
+        self.limite_x_min = float(xmin)
+        self.limite_y_min = float(ymin)
+        self.limite_x_max = float(xmax)
+        self.limite_y_max = float(ymax)
+        self.limites_activos = True
+
+    def obtener_posicion_logica(self):
+        """Devuelve (X, Y) en [-20..20] desde el punto de origen establecido (sin inversión).
+        Si no hay límites activos/origen, devuelve la posición actual.
+        """
+        try:
+            if not getattr(self, 'origen_establecido', False) or not getattr(self, 'limites_activos', False):
+                return float(self.posicion_x), float(self.posicion_y)
+            lim_x_min = float(getattr(self, 'limite_x_min', -20.0) or -20.0)
+            lim_x_max = float(getattr(self, 'limite_x_max', 20.0) or 20.0)
+            lim_y_min = float(getattr(self, 'limite_y_min', -20.0) or -20.0)
+            lim_y_max = float(getattr(self, 'limite_y_max', 20.0) or 20.0)
+            x_log = max(lim_x_min, min(lim_x_max, float(self.posicion_x)))
+            y_log = max(lim_y_min, min(lim_y_max, float(self.posicion_y)))
+            return x_log, y_log
+            return x_log, y_log
+        except Exception:
+            # Fallback seguro
+            return float(self.posicion_x), float(self.posicion_y)
+        
+    def _invertir_linea_abs(self, linea: str, lim_max: float = 40.0) -> str:
+        """Invierte la coordenada X en modo absoluto (para sistema centrado en 0).
+        Para coordenadas centradas [-20, 20]: X_invertido = -X
+        """
+        try:
+            # Buscar coordenada X en la línea
+            partes = linea.split()
+            nueva_linea = []
+            
+            for parte in partes:
+                if parte.upper().startswith('X'):
+                    try:
+                        # Extraer el valor de X
+                        x_str = parte[1:]  # Quitar la 'X'
+                        x_val = float(x_str)
+                        # Invertir: X_nuevo = -X_original
+                        x_invertido = -x_val
+                        # Reemplazar con el valor invertido
+                        nueva_linea.append(f'X{x_invertido:.3f}')
+                    except ValueError:
+                        # Si no se puede convertir, dejar como está
+                        nueva_linea.append(parte)
+                else:
+                    nueva_linea.append(parte)
+            
+            return ' '.join(nueva_linea)
+        except Exception as e:
+            print(f"Error al invertir línea absoluta: {e}")
+            return linea
+
+    def _invertir_linea_rel(self, linea: str) -> str:
+        """Invierte la coordenada X en modo relativo.
+        Para movimientos relativos: X_invertido = -X
+        """
+        try:
+            # Buscar coordenada X en la línea
+            partes = linea.split()
+            nueva_linea = []
+            
+            for parte in partes:
+                if parte.upper().startswith('X'):
+                    try:
+                        # Extraer el valor de X
+                        x_str = parte[1:]  # Quitar la 'X'
+                        x_val = float(x_str)
+                        # Invertir: X_nuevo = -X_original
+                        x_invertido = -x_val
+                        # Reemplazar con el valor invertido
+                        nueva_linea.append(f'X{x_invertido:.3f}')
+                    except ValueError:
+                        # Si no se puede convertir, dejar como está
+                        nueva_linea.append(parte)
+                else:
+                    nueva_linea.append(parte)
+            
+            return ' '.join(nueva_linea)
+        except Exception as e:
+            print(f"Error al invertir línea relativa: {e}")
+            return linea
+
+    def _esperar_oks_pendientes(self, inflight: int, timeout: float = 1.0, max_ms: float = 80.0) -> int:
+        """Drena 'ok' pendientes de la ventana hasta vaciarla o agotar timeout. Devuelve los que quedan."""
+        tlim = time.time() + timeout
+        while inflight > 0 and time.time() < tlim:
+            okc = self._drain_ok_nonblock(max_ms)
+            if okc:
+                inflight = max(0, inflight - okc)
+            else:
+                time.sleep(0.01)
+        return inflight
+
+    def _transmitir_lineas(self, lineas, indice_inicial: int = 0) -> bool:
+        """Envía líneas ya compiladas con una ventana de 12 'ok' pendientes para G1.
+        Consume cualquier iterable (lista o generador). Mantiene en self.linea_confirmada el índice
+        (relativo al programa) de la siguiente línea sin 'ok': sólo cuentan las líneas escritas con
+        éxito en el puerto. Devuelve False si se interrumpió (límite, fallo de escritura o pérdida
+        de conexión); el motivo queda en self.motivo_interrupcion.
+        """
+        enviadas = 0
+        inflight = 0
+        ventana = 12
+        completado = True
+        self.motivo_interrupcion = ""
+        self.linea_confirmada = indice_inicial
+        metricas = self.metricas
+        metricas.inicio_streaming()
+        reloj = time.perf_counter
+        for linea in lineas:
+            if getattr(self, 'abortado_por_limite', False):
+                _LOG_CNC.warning("Ejecución abortada por límite")
+                self.motivo_interrupcion = "limite"
+                completado = False
+                break
+            # Pausa reactiva si hay feed hold activo
+            if getattr(self, 'en_hold', False):
+                t0 = reloj()
+                while getattr(self, 'en_hold', False) and self.conectado and not self._paro_solicitado:
+                    time.sleep(0.05)
+                metricas.espera_hold_s += reloj() - t0
+            if self._paro_solicitado:
+                _LOG_CNC.warning("Ejecución interrumpida: paro de emergencia")
+                self.motivo_interrupcion = "paro"
+                completado = False
+                break
+            if not self.conectado:
+                _LOG_CNC.warning("Ejecución interrumpida: se perdió la conexión")
+                self.motivo_interrupcion = "desconexion"
+                completado = False
+                break
+            # Aplicar cambios de velocidad ocasionalmente
+            if (enviadas % 5) == 0:
+                self.verificar_cambios_velocidad()
+            token0 = linea.split()[0] if linea else ""
+            if token0.upper() == 'G1':
+                # Extraer feed rate si está presente en el comando
+                try:
+                    import re
+                    match = re.search(r'F([\d.]+)', linea, re.IGNORECASE)
+                    if match:
+                        self.feed_reportado = float(match.group(1))
+                except Exception:
+                    pass
+                if not self._write_line_fast(linea):
+                    # La línea no llegó al controlador: no cuenta para el punto de control
+                    _LOG_CNC.warning("Ejecución interrumpida: no se pudo escribir en el puerto")
+                    self.motivo_interrupcion = "desconexion" if not self.conectado else "escritura"
+                    completado = False
+                    break
+                enviadas += 1
+                inflight += 1
+                metricas.registrar_envio('G1', inflight)
+                if inflight >= ventana:
+                    t0 = reloj()
+                    okc = self._drain_ok_nonblock(80)
+                    metricas.espera_ok_s += reloj() - t0
+                    if okc:
+                        inflight = max(0, inflight - okc)
+            else:
+                # Antes de comandos bloqueantes, drenar pendientes
+                t0 = reloj()
+                if inflight > 0:
+                    inflight = self._esperar_oks_pendientes(inflight, 1.0, 80)
+                t1 = reloj()
+                ok = self.enviar_comando(linea)
+                metricas.espera_ok_s += t1 - t0
+                metricas.bloqueantes_s += reloj() - t1
+                if not ok and not self.conectado:
+                    _LOG_CNC.warning("Ejecución interrumpida: se perdió la conexión")
+                    self.motivo_interrupcion = "desconexion"
+                    completado = False
+                    break
+                enviadas += 1
+            self.linea_confirmada = indice_inicial + enviadas - inflight
+            if (enviadas % 10) == 0:
+                self.guardar_posicion()
+        # Drenar 'ok' pendientes
+        if inflight > 0 and not self._paro_solicitado:
+            t0 = reloj()
+            inflight = self._esperar_oks_pendientes(inflight, 2.0, 120)
+            metricas.espera_ok_s += reloj() - t0
+        if self._paro_solicitado:
+            # Paro durante el envío o con la ventana aún pendiente: cuentan los 'ok' ya recibidos
+            # y el reset suave descarta el resto
+            self.motivo_interrupcion = "paro"
+            completado = False
+            if inflight > 0:
+                inflight = max(0, inflight - self._drain_ok_nonblock(60))
+            self._reinicio_suave_tras_paro()
+        self.linea_confirmada = indice_inicial + enviadas - inflight
+        if completado and getattr(self, 'abortado_por_limite', False):
+            self.motivo_interrupcion = "limite"
+            completado = False
+        metricas.fin_streaming(enviadas)
+        if self.volcar_metricas:
+            self._volcar_metricas(completado)
+        return completado
+
+    def _reinicio_suave_tras_paro(self):
+        """Cierra un paro de emergencia durante una rutina: espera a que el Feed Hold detenga la
+        máquina (así GRBL conserva la posición), envía reset suave (0x18) para vaciar el
+        planificador y la ventana de líneas, y vuelve a fijar con G92 la posición de trabajo
+        previa, porque GRBL 1.1 pierde el offset G92 con el reset.
+        """
+        try:
+            if self.firmware != 'grbl':
+                # Sin reset suave conocido: el Feed Hold queda activo y no se envían más líneas
+                return
+            pos_trabajo = None
+            fin = time.time() + 4.0
+            while time.time() < fin and self.conectado:
+                estado = self._leer_status_line(0.2)
+                campos = estado.strip('<>').split('|') if estado else []
+                if campos and campos[0] in ('Hold:0', 'Idle'):
+                    pos_trabajo = _posicion_trabajo_grbl(campos)
+                    if pos_trabajo is not None:
+                        break
+                time.sleep(0.05)
+            self._escribir_tiempo_real(b"\x18")
+            alarma = False
+            fin = time.time() + 2.0
+            while time.time() < fin:
+                with self._serial_lock:
+                    linea = self.conexion.readline().decode(errors='ignore').strip()
+                if not linea:
+                    continue
+                if linea.lower().startswith('alarm'):
+                    alarma = True
+                if linea.startswith('Grbl'):
+                    break
+            time.sleep(0.1)
+            with self._serial_lock:
+                self.conexion.reset_input_buffer()
+            self.en_hold = False
+            self.override_actual = 100
+            if alarma or pos_trabajo is None:
+                # Reset con la máquina en movimiento (o sin posición): el origen ya no es fiable
+                self.origen_establecido = False
+                _LOG_CNC.warning("Paro de emergencia: no se pudo preservar el origen; establézcalo de nuevo")
+                self._publicar_evento('aviso', {'titulo': "Paro de emergencia",
+                                                'mensaje': "Origen perdido tras el paro. Establezca el origen antes de reanudar."})
+                if alarma:
+                    self.enviar_comando("$X")
+            else:
+                x, y = pos_trabajo
+                if self.enviar_comando(f"G92 X{_fmt_coord(x)} Y{_fmt_coord(y)}"):
+                    self.posicion_x, self.posicion_y = x, y
+            self.aplicar_velocidad()
+        except Exception as e:
+            _LOG_CNC.error("Error en el reset tras paro de emergencia: %s", e)
+        finally:
+            self._paro_solicitado = False
+
+    def metricas_instantanea(self) -> dict:
+        """Copia de las métricas actuales (o de la última rutina) para mostrar o guardar."""
+        return self.metricas.instantanea()
+
+    def _volcar_metricas(self, completado: bool):
+        """Publica las métricas de la rutina en backups/metricas/ mediante el diario. El hilo de
+        streaming no toca el disco: la carpeta, la escritura y la poda de los volcados viejos
+        las hace el hilo del diario."""
+        try:
+            datos = self.metricas.instantanea()
+            datos['fecha'] = time.strftime("%Y-%m-%d %H:%M:%S")
+            datos['completado'] = completado
+            datos['motivo_interrupcion'] = self.motivo_interrupcion
+            carpeta = os.path.join(BASE_DIR, 'metricas')
+            ruta = os.path.join(carpeta, f"rutina_{time.strftime('%Y%m%d-%H%M%S')}.json")
+            diario = diario_posicion()
+            diario.publicar(ruta, json.dumps(datos, ensure_ascii=False, indent=1))
+            diario.podar(carpeta, 'rutina_', '.json', 30)
+        except Exception as e:
+            _LOG_CNC.warning("No se pudieron volcar las métricas: %s", e)
+
+    def _lineas_de_bloques_validados(self, bloques):
+        """Generador: valida cada bloque antes de entregar sus líneas (lookahead acotado a un bloque).
+        Si un bloque viola los límites, se detiene sin enviar ninguna de sus líneas.
+        """
+        validar = self.origen_establecido and self.limites_activos
+        lx0, lx1, ly0, ly1 = self._limites_vigentes()
+        estado = (0.0, 0.0, 0.0, 0.0)
+        for bloque in bloques:
+            if validar:
+                ok, _, msg, _ = validar_programa_gcode(bloque, lx0, lx1, ly0, ly1, *estado)
+                if not ok:
+                    self.ultimo_limite = msg or "Programa fuera de límites"
+                    _LOG_CNC.warning("Streaming detenido: %s", self.ultimo_limite)
+                    self._bloque_rechazado = True
+                    return
+                estado = bloque.estado_final
+            yield from bloque.lineas
+
+    def ejecutar_archivo_gcode(self, ruta_archivo, base_tiempo=1, invert: bool = False, tam_bloque: int = 32):
+        """Ejecuta un archivo G-code en streaming: lectura, limpieza, inversión, validación y envío
+        encadenados como generadores. La memoria es constante (un bloque de tam_bloque líneas por
+        delante) y la primera línea sale en cuanto se valida su bloque, sin parsear el archivo completo.
+        """
+        self.motivo_interrupcion = ""
+        if not self.conectado:
+            print("ejecutar_archivo_gcode(): No hay conexión con el Arduino")
+            return False
+        # Guardar: no ejecutar rutinas si no se ha establecido el origen
+        if not getattr(self, 'origen_establecido', False):
+            print("ejecutar_archivo_gcode(): Bloqueado. Aún no se ha establecido Punto de Origen (G92)")
+            self._publicar_evento('aviso', {'titulo': "Aviso", 'mensaje': "Aún no se ha establecido Punto de Origen"})
+            return False
+        try:
+            self._paro_solicitado = False
+            self.ejecutando_rutina = True
+            self._bloque_rechazado = False
+            with open(ruta_archivo, 'r') as archivo:
+                bloques = iterar_bloques_gcode(archivo, invertir=invert, tam_bloque=tam_bloque)
+                lineas = self._lineas_de_bloques_validados(bloques)
+                # Validar el primer bloque antes del pre-movimiento al origen
+                primera = next(lineas, None)
+                if primera is None:
+                    return not self._bloque_rechazado
+                # Ir al punto de origen antes de comenzar la rutina
+                try:
+                    self.enviar_comando("G90")
+                    self.enviar_comando("G0 X0 Y0")
+                    # Asegurar feed definido para G1
+                    try:
+                        self.enviar_comando(f"G1 F{int(self.feed_base)}")
+                    except Exception:
+                        pass
+                except Exception:
+                    pass
+                # Cada línea entregada ya pasó la validación de su bloque
+                if self.origen_establecido and self.limites_activos:
+                    self._hilo_programa_verificado = current_thread()
+                from itertools import chain
+                completado = self._transmitir_lineas(chain((primera,), lineas))
+                if completado:
+                    self.limpiar_checkpoint()
+                elif not self._bloque_rechazado:
+                    self._registrar_checkpoint(None, self.linea_confirmada, self.motivo_interrupcion)
+            # Regresar al punto de origen al finalizar la rutina (no tras perder la conexión ni tras un paro)
+            try:
+                self._hilo_programa_verificado = None
+                if self.motivo_interrupcion not in ('desconexion', 'paro'):
+                    self.enviar_comando("G90")
+                    self.enviar_comando("G0 X0 Y0")
+            except Exception:
+                pass
+            return completado and not self._bloque_rechazado
+        except Exception as e:
+            print(f"Error al ejecutar archivo G-code: {e}")
+            return False
+        finally:
+            self._hilo_programa_verificado = None
+            self.ejecutando_rutina = False
+
+    def _limites_vigentes(self):
+        return (float(self.limite_x_min), float(self.limite_x_max), float(self.limite_y_min), float(self.limite_y_max))
+
+    def preparar_programa(self, lineas, invert: bool = False):
+        """Compila (si hace falta) y valida un programa contra los límites vigentes.
+        Devuelve (programa, ok, msg). Sin origen/límites activos no se exige validación.
+        """
+        programa = lineas if isinstance(lineas, ProgramaGcode) else compilar_programa_gcode(lineas, invertir=invert)
+        if not (self.origen_establecido and self.limites_activos):
+            return programa, True, None
+        lx0, lx1, ly0, ly1 = self._limites_vigentes()
+        previos = programa.limites_validados
+        if programa.validado and previos and previos[0] >= lx0 and previos[1] <= lx1 and previos[2] >= ly0 and previos[3] <= ly1:
+            return programa, True, None
+        ok, _, msg, _ = validar_programa_gcode(programa, lx0, lx1, ly0, ly1)
+        return programa, ok, msg
+
+    def ejecutar_lineas_gcode(self, lineas, base_tiempo=0.5, invert: bool = False):
+        """Ejecuta una lista de líneas G-code en memoria o un ProgramaGcode compilado.
+        Respeta el override de velocidad (M220) y verifica cambios en tiempo real.
+        Aplica guard de origen. Un ProgramaGcode ya trae aplicada su inversión (se ignora invert).
+        Si el programa está validado contra los límites, se omite el chequeo por línea al enviar.
+        Si la ejecución se interrumpe, queda un punto de control para reanudar_programa().
+        """
+        return self._ejecutar_programa(lineas, invert=invert, desde=0)
+
+    def reanudar_programa(self, programa, desde: int | None = None):
+        """Reanuda un ProgramaGcode desde la línea indicada o desde el punto de control guardado.
+        Hace un acercamiento seguro (G1 a feed_base) a la posición de la última línea confirmada
+        y restaura el modo G90/G91 y el feed vigentes en ese punto antes de seguir enviando.
+        """
+        self.motivo_interrupcion = ""
+        if not isinstance(programa, ProgramaGcode):
+            programa = compilar_programa_gcode(programa)
+        if desde is None:
+            cp = self.checkpoint_rutina or self.cargar_checkpoint()
+            if not cp:
+                print("reanudar_programa(): No hay punto de control")
+                return False
+            # El índice sólo vale para el mismo programa (mismas líneas y misma inversión)
+            if cp.get('huella') != programa.huella():
+                print("reanudar_programa(): El punto de control pertenece a otro programa; no se reanuda")
+                return False
+            desde = int(cp.get('indice', 0))
+        if desde < 0 or desde >= len(programa):
+            print(f"reanudar_programa(): Línea {desde} fuera del programa ({len(programa)} líneas)")
+            return False
+        return self._ejecutar_programa(programa, desde=desde)
+
+    def _preambulo_reanudacion(self, programa, desde: int):
+        """Comandos para retomar en 'desde': acercamiento, feed y modo de distancia. None si no es posible."""
+        if desde <= 0:
+            return None
+        if programa.g92[:desde].any():
+            # La posición de retorno dependería de un sistema de coordenadas redefinido en el propio programa
+            return None
+        pos_x, pos_y, _ = calcular_trayectoria(programa)
+        x, y = float(pos_x[desde - 1]), float(pos_y[desde - 1])
+        feed = None
+        import re
+        for linea in reversed(programa.lineas[:desde]):
+            match = re.search(r'F([\d.]+)', linea, re.IGNORECASE)
+            if match:
+                feed = float(match.group(1))
+                break
+        cmds = ["G90", f"G1 X{_fmt_coord(x)} Y{_fmt_coord(y)} F{int(self.feed_base)}"]
+        if feed is not None:
+            cmds.append(f"G1 F{feed:g}")
+        if not bool(programa.absoluto[desde - 1]):
+            cmds.append("G91")
+        return cmds
+
+    @staticmethod
+    def _lineas_reanudacion(programa, desde: int) -> list:
+        """Líneas a enviar desde 'desde' con el movimiento modal (G0/G1/G2/G3) vigente restaurado.
+        El acercamiento del preámbulo deja G1 activo: la primera línea que sólo trae coordenadas
+        recibe de nuevo la palabra de movimiento que heredaba en el programa original. Se antepone
+        a esa línea en lugar de enviarla sola porque GRBL rechaza un G2/G3 sin ejes (error:26).
+        """
+        lineas = programa.lineas[desde:]
+        if desde <= 0:
+            return lineas
+        for k in range(desde, len(programa)):
+            movimiento = int(programa.movimiento[k])
+            if movimiento < 0:
+                continue
+            if not any(letra == 'G' and float(valor) in (0.0, 1.0, 2.0, 3.0)
+                       for letra, valor in _palabras_gcode(programa.lineas[k])):
+                lineas = list(lineas)
+                lineas[k - desde] = f"G{movimiento} {programa.lineas[k]}"
+            break
+        return lineas
+
+    def _ejecutar_programa(self, lineas, invert: bool = False, desde: int = 0):
+        # Resultado propio de esta ejecución: vacío si ni siquiera empezó a transmitir
+        self.motivo_interrupcion = ""
+        if not self.conectado:
+            print("ejecutar_lineas_gcode(): No hay conexión con el Arduino")
+            return False
+        if not getattr(self, 'origen_establecido', False):
+            print("ejecutar_lineas_gcode(): Bloqueado. Aún no se ha establecido Punto de Origen (G92)")
+            self._publicar_evento('aviso', {'titulo': "Aviso", 'mensaje': "Aún no se ha establecido Punto de Origen"})
+            return False
+        try:
+            programa, ok_lim, msg_lim = self.preparar_programa(lineas, invert)
+        except Exception as e:
+            print(f"Error al compilar G-code: {e}")
+            return False
+        if not ok_lim:
+            self.ultimo_limite = msg_lim or "Programa fuera de límites"
+            print(f"ejecutar_lineas_gcode(): {self.ultimo_limite}")
+            return False
+        desde = max(0, min(int(desde), len(programa)))
+        preambulo = None
+        if desde > 0:
+            preambulo = self._preambulo_reanudacion(programa, desde)
+            if preambulo is None:
+                print("reanudar_programa(): No se puede reanudar este programa desde un punto intermedio")
+                return False
+        try:
+            self._paro_solicitado = False
+            self.ejecutando_rutina = True
+            try:
+                if preambulo:
+                    # Acercamiento seguro al punto de reanudación (dentro de la caja ya validada)
+                    for cmd in preambulo:
+                        self.enviar_comando(cmd)
+                else:
+                    # Ir al punto de origen antes de comenzar la rutina
+                    self.enviar_comando("G90")
+                    self.enviar_comando("G0 X0 Y0")
+                    # Asegurar feed definido para G1
+                    try:
+                        self.enviar_comando(f"G1 F{int(self.feed_base)}")
+                    except Exception:
+                        pass
+            except Exception:
+                pass
+            if programa.validado:
+                self._hilo_programa_verificado = current_thread()
+            lineas = self._lineas_reanudacion(programa, desde) if preambulo else programa.lineas[desde:]
+            completado = self._transmitir_lineas(lineas, indice_inicial=desde)
+            if completado:
+                self.limpiar_checkpoint()
+            else:
+                self._registrar_checkpoint(programa, self.linea_confirmada, self.motivo_interrupcion)
+            # Regresar al punto de origen al finalizar la rutina (no tras perder la conexión:
+            # la placa pudo reiniciarse y el supervisor restaura el origen antes de mover;
+            # ni tras un paro de emergencia, que debe dejar la máquina quieta)
+            try:
+                self._hilo_programa_verificado = None
+                if self.motivo_interrupcion not in ('desconexion', 'paro'):
+                    self.enviar_comando("G90")
+                    self.enviar_comando("G0 X0 Y0")
+            except Exception:
+                pass
+            return completado
+        except Exception as e:
+            print(f"Error al ejecutar G-code en memoria: {e}")
+            return False
+        finally:
+            self._hilo_programa_verificado = None
+            self.ejecutando_rutina = False
+
+    def _registrar_checkpoint(self, programa, indice: int, motivo: str = ""):
+        """Guarda el punto de control (línea confirmada y posición planificada) en memoria y en disco."""
+        # Si algo falla, que no quede el punto de control de una ejecución anterior
+        self.checkpoint_rutina = None
+        try:
+            x = y = None
+            if isinstance(programa, ProgramaGcode) and indice > 0:
+                pos_x, pos_y, _ = calcular_trayectoria(programa)
+                x, y = float(pos_x[indice - 1]), float(pos_y[indice - 1])
+            self.checkpoint_rutina = {
+                'indice': int(indice),
+                'total': len(programa) if programa is not None else None,
+                'x': x,
+                'y': y,
+                'motivo': motivo or "",
+                'invertido': bool(getattr(programa, 'invertido', False)),
+                # Sin huella (streaming de archivo) el punto de control no se puede reanudar
+                'huella': programa.huella() if isinstance(programa, ProgramaGcode) else None,
+                'ts': time.time(),
+            }
+            # Escritura diferida: el hilo de streaming no toca el disco
+            diario_posicion().publicar(self.archivo_checkpoint, json.dumps(self.checkpoint_rutina))
+            _LOG_CNC.info("Punto de control: línea %d (%s)", indice, motivo or 'interrumpida')
+        except Exception as e:
+            _LOG_CNC.error("Error al guardar punto de control: %s", e)
+
+    def cargar_checkpoint(self) -> dict | None:
+        """Carga el último punto de control persistido, si existe."""
+        try:
+            if os.path.exists(self.archivo_checkpoint):
+                with open(self.archivo_checkpoint, 'r') as f:
+                    data = json.load(f)
+                if isinstance(data, dict) and 'indice' in data:
+                    self.checkpoint_rutina = data
+                    return data
+        except Exception as e:
+            _LOG_CNC.error("Error al cargar punto de control: %s", e)
+        return None
+
+    def limpiar_checkpoint(self):
+        self.checkpoint_rutina = None
+        diario_posicion().publicar(self.archivo_checkpoint, None)
+
+
+def limpiar_linea_gcode(linea: str) -> str:
+    """Elimina comentarios de una línea G-code y normaliza espacios.
+    - Quita comentarios entre paréntesis (...)
+    - Quita comentarios con ';' desde el punto y coma hacia el final
+    - Retorna la línea limpia con espacios normalizados o cadena vacía
+    """
+    try:
+        s = str(linea).strip()
+        if not s:
+            return ""
+        # Quitar comentarios entre paréntesis (anidados simple)
+        out = []
+        depth = 0
+        for ch in s:
+            if ch == '(':
+                depth += 1
+                continue
+            if ch == ')':
+                if depth > 0:
+                    depth -= 1
+                continue
+            if depth > 0:
+                continue
+            out.append(ch)
+        s = ''.join(out)
+        # Quitar desde ';' al final
+        if ';' in s:
+            s = s.split(';', 1)[0]
+        # Normalizar espacios
+        s = ' '.join(s.strip().split())
+        return s
+    except Exception:
+        return ""
+
+# === Programa G-code compilado y validación de límites ===
+_PALABRA_GCODE = None
+
+def _palabras_gcode(linea: str) -> list:
+    """Separa una línea limpia en pares (letra, valor) aceptando 'G1X10' o 'G1 X10'."""
+    global _PALABRA_GCODE
+    if _PALABRA_GCODE is None:
+        import re
+        _PALABRA_GCODE = re.compile(r'([A-Za-z])\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+    return [(l.upper(), v) for l, v in _PALABRA_GCODE.findall(linea)]
+
+def _posicion_trabajo_grbl(campos) -> tuple | None:
+    """(x, y) de trabajo a partir de los campos de un estado GRBL: WPos, o MPos menos WCO."""
+    valores = {}
+    for campo in campos:
+        nombre, _, datos = campo.partition(':')
+        if nombre in ('WPos', 'MPos', 'WCO'):
+            try:
+                valores[nombre] = [float(v) for v in datos.split(',')[:2]]
+            except ValueError:
+                pass
+    if 'WPos' in valores:
+        return tuple(valores['WPos'])
+    if 'MPos' in valores and 'WCO' in valores:
+        return (valores['MPos'][0] - valores['WCO'][0], valores['MPos'][1] - valores['WCO'][1])
+    return None
+
+def _fmt_coord(v: float) -> str:
+    if abs(v) < 5e-4:
+        v = 0.0
+    return f"{v:.3f}"
+
+class ProgramaGcode:
+    """Programa G-code limpio, transformado (inversión) y tabulado en arreglos numpy.
+
+    - lineas: texto exacto que se enviará (ya invertido si aplica)
+    - movimiento: -1 sin movimiento, 0/1/2/3 para G0/G1/G2/G3
+    - absoluto: modo vigente (G90/G91) en cada línea
+    - x, y, i, j, r: valores de las palabras (NaN si no aparecen)
+    - g92: True en líneas que redefinen coordenadas
+    """
+
+    def __init__(self, lineas, invertido: bool = False):
+        self.lineas = list(lineas)
+        self.invertido = bool(invertido)
+        # Índice de la primera línea dentro del programa completo (>0 en bloques de streaming)
+        self.linea_inicial = 0
+        n = len(self.lineas)
+        self.movimiento = np.full(n, -1, dtype=np.int8)
+        self.absoluto = np.ones(n, dtype=bool)
+        self.g92 = np.zeros(n, dtype=bool)
+        self.x = np.full(n, np.nan)
+        self.y = np.full(n, np.nan)
+        self.i = np.full(n, np.nan)
+        self.j = np.full(n, np.nan)
+        self.r = np.full(n, np.nan)
+        # Resultado de la última validación
+        self.validado = False
+        self.limites_validados = None
+        self.bbox = None
+        self.estado_final = None
+
+    def __len__(self):
+        return len(self.lineas)
+
+    def __iter__(self):
+        return iter(self.lineas)
+
+    def huella(self) -> dict:
+        """Identidad del programa para el punto de control: nº de líneas, inversión y hash del texto."""
+        import hashlib
+        h = hashlib.sha1('\n'.join(self.lineas).encode('utf-8', errors='replace')).hexdigest()
+        return {'total': len(self.lineas), 'invertido': self.invertido, 'sha1': h}
+
+def _transformar_palabras_invertidas(palabras: list, movimiento: int) -> list:
+    """Espeja el programa en X: niega X e I y cambia el sentido de los arcos (G2<->G3)."""
+    salida = []
+    for letra, valor in palabras:
+        if letra in ('X', 'I') and movimiento >= 0:
+            salida.append((letra, _fmt_coord(-float(valor))))
+        elif letra == 'G' and movimiento in (2, 3) and valor in ('2', '02', '3', '03'):
+            salida.append((letra, '3' if movimiento == 2 else '2'))
+        else:
+            salida.append((letra, valor))
+    return salida
+
+def tabular_lineas_gcode(lineas, invertir: bool = False):
+    """Generador: limpia, invierte (opcional) y tabula línea a línea manteniendo el estado modal.
+    Produce (texto, movimiento, absoluto, g92, valores). Las líneas sin movimiento conservan su texto;
+    las de movimiento se reescriben sólo si se invierten.
+    """
+    absoluto = True
+    modal = -1
+    for raw in lineas:
+        linea = limpiar_linea_gcode(raw)
+        if not linea:
+            continue
+        palabras = _palabras_gcode(linea)
+        movimiento = -1
+        g92 = False
+        for letra, valor in palabras:
+            if letra != 'G':
+                continue
+            try:
+                g = int(float(valor))
+            except Exception:
+                continue
+            if g == 90:
+                absoluto = True
+            elif g == 91:
+                absoluto = False
+            elif g == 92:
+                g92 = True
+            elif g in (0, 1, 2, 3):
+                movimiento = g
+        tiene_xy = any(l in ('X', 'Y') for l, _ in palabras)
+        if movimiento < 0 and tiene_xy and not g92 and modal >= 0:
+            # Línea con sólo coordenadas: hereda el movimiento modal
+            movimiento = modal
+        if movimiento >= 0:
+            modal = movimiento
+        if invertir and not g92 and movimiento >= 0:
+            palabras_tx = _transformar_palabras_invertidas(palabras, movimiento)
+            linea = ' '.join(f"{l}{v}" for l, v in palabras_tx)
+            movimiento = {2: 3, 3: 2}.get(movimiento, movimiento)
+            palabras = palabras_tx
+        vals = {}
+        for letra, valor in palabras:
+            if letra in ('X', 'Y', 'I', 'J', 'R'):
+                try:
+                    vals[letra] = float(valor)
+                except Exception:
+                    pass
+        yield linea, movimiento, absoluto, g92, vals
+
+def _programa_desde_filas(filas, invertir: bool = False) -> ProgramaGcode:
+    prog = ProgramaGcode([f[0] for f in filas], invertido=invertir)
+    for k, (_, movimiento, abs_k, g92, vals) in enumerate(filas):
+        prog.movimiento[k] = -1 if g92 else movimiento
+        prog.absoluto[k] = abs_k
+        prog.g92[k] = g92
+        prog.x[k] = vals.get('X', np.nan)
+        prog.y[k] = vals.get('Y', np.nan)
+        prog.i[k] = vals.get('I', np.nan)
+        prog.j[k] = vals.get('J', np.nan)
+        prog.r[k] = vals.get('R', np.nan)
+    return prog
+
+def compilar_programa_gcode(lineas, invertir: bool = False) -> ProgramaGcode:
+    """Limpia, invierte (opcional) y tabula un programa G-code completo en un ProgramaGcode."""
+    return _programa_desde_filas(list(tabular_lineas_gcode(lineas, invertir)), invertir)
+
+def iterar_bloques_gcode(lineas, invertir: bool = False, tam_bloque: int = 32):
+    """Generador de ProgramaGcode de a lo sumo tam_bloque líneas, leyendo la fuente de forma perezosa.
+    El estado modal (G90/G91, movimiento) se conserva entre bloques; memoria constante.
+    """
+    from itertools import islice
+    filas_iter = tabular_lineas_gcode(lineas, invertir)
+    tam_bloque = max(1, int(tam_bloque))
+    inicial = 0
+    while True:
+        filas = list(islice(filas_iter, tam_bloque))
+        if not filas:
+            return
+        bloque = _programa_desde_filas(filas, invertir)
+        bloque.linea_inicial = inicial
+        inicial += len(filas)
+        yield bloque
+
+def _trayectoria_eje(valores, absoluto, mueve, inicio: float, offset: float):
+    """Posición física por línea en un eje, vectorizada.
+    Las líneas absolutas fijan la posición (valor + offset G92); las relativas acumulan.
+    """
+    presente = mueve & ~np.isnan(valores)
+    delta = np.where(presente & ~absoluto, valores, 0.0)
+    acumulado = np.cumsum(delta)
+    reinicio = presente & absoluto
+    # Base = posición fijada en el último reinicio menos lo acumulado hasta ahí
+    base = np.where(reinicio, valores + offset - acumulado, np.nan)
+    idx = np.where(reinicio, np.arange(len(valores)), -1)
+    idx = np.maximum.accumulate(idx) if len(idx) else idx
+    base_ff = np.where(idx >= 0, base[np.maximum(idx, 0)], inicio)
+    return base_ff + acumulado
+
+def _extension_arcos(x0, y0, x1, y1, cx, cy, horario):
+    """Caja envolvente de arcos (vectorizado): extremos más los cuadrantes barridos."""
+    radio = np.hypot(x0 - cx, y0 - cy)
+    a0 = np.arctan2(y0 - cy, x0 - cx)
+    a1 = np.arctan2(y1 - cy, x1 - cx)
+    # Barrido antihorario desde a0 hasta a1 en [0, 2π); círculo completo si coinciden
+    barrido = np.where(horario, a0 - a1, a1 - a0) % (2.0 * np.pi)
+    barrido = np.where(barrido < 1e-9, 2.0 * np.pi, barrido)
+    xmin = np.minimum(x0, x1)
+    xmax = np.maximum(x0, x1)
+    ymin = np.minimum(y0, y1)
+    ymax = np.maximum(y0, y1)
+    for ang, eje, signo in ((0.0, 'x', 1.0), (0.5 * np.pi, 'y', 1.0), (np.pi, 'x', -1.0), (1.5 * np.pi, 'y', -1.0)):
+        desde = np.where(horario, a0 - ang, ang - a0) % (2.0 * np.pi)
+        cruza = desde <= barrido
+        if eje == 'x':
+            extremo = cx + signo * radio
+            xmax = np.where(cruza & (signo > 0), np.maximum(xmax, extremo), xmax)
+            xmin = np.where(cruza & (signo < 0), np.minimum(xmin, extremo), xmin)
+        else:
+            extremo = cy + signo * radio
+            ymax = np.where(cruza & (signo > 0), np.maximum(ymax, extremo), ymax)
+            ymin = np.where(cruza & (signo < 0), np.minimum(ymin, extremo), ymin)
+    return xmin, xmax, ymin, ymax
+
+def _centros_arcos(x0, y0, x1, y1, i, j, r, horario):
+    """Centro de cada arco desde I/J (incremental) o desde R (signo negativo = arco mayor)."""
+    usa_r = np.isnan(i) & np.isnan(j) & ~np.isnan(r)
+    cx = x0 + np.nan_to_num(i)
+    cy = y0 + np.nan_to_num(j)
+    if usa_r.any():
+        dx = x1 - x0
+        dy = y1 - y0
+        d = np.hypot(dx, dy)
+        rr = np.abs(np.nan_to_num(r))
+        h = np.sqrt(np.clip(rr * rr - (d * 0.5) ** 2, 0.0, None))
+        # Lado del centro según sentido y signo de R
+        lado = np.where(horario, -1.0, 1.0) * np.where(np.nan_to_num(r) < 0, -1.0, 1.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ux = np.where(d > 0, -dy / d, 0.0)
+            uy = np.where(d > 0, dx / d, 0.0)
+        cx = np.where(usa_r, x0 + dx * 0.5 + lado * h * ux, cx)
+        cy = np.where(usa_r, y0 + dy * 0.5 + lado * h * uy, cy)
+    return cx, cy
+
+def calcular_trayectoria(programa: ProgramaGcode, x_inicio: float = 0.0, y_inicio: float = 0.0,
+                         offset_x: float = 0.0, offset_y: float = 0.0):
+    """Posición física al final de cada línea (vectorizado por tramos entre G92).
+    Devuelve (pos_x, pos_y, (x_final, y_final, offset_x_final, offset_y_final)).
+    """
+    n = len(programa)
+    mueve = programa.movimiento >= 0
+    pos_x = np.empty(n)
+    pos_y = np.empty(n)
+    # Tramos entre G92 (normalmente uno solo): cada tramo se resuelve vectorizado
+    cortes = [0] + [int(k) + 1 for k in np.flatnonzero(programa.g92)] + [n]
+    px, py = float(x_inicio), float(y_inicio)
+    off_x, off_y = float(offset_x), float(offset_y)
+    for a, b in zip(cortes[:-1], cortes[1:]):
+        if b <= a:
+            continue
+        sl = slice(a, b)
+        pos_x[sl] = _trayectoria_eje(programa.x[sl], programa.absoluto[sl], mueve[sl], px, off_x)
+        pos_y[sl] = _trayectoria_eje(programa.y[sl], programa.absoluto[sl], mueve[sl], py, off_y)
+        px, py = float(pos_x[b - 1]), float(pos_y[b - 1])
+        if programa.g92[b - 1]:
+            # G92: la posición física no cambia, sólo el sistema de coordenadas
+            if not np.isnan(programa.x[b - 1]):
+                off_x = px - float(programa.x[b - 1])
+            if not np.isnan(programa.y[b - 1]):
+                off_y = py - float(programa.y[b - 1])
+    return pos_x, pos_y, (px, py, off_x, off_y)
+
+def validar_programa_gcode(programa, xmin: float = -20.0, xmax: float = 20.0, ymin: float = -20.0, ymax: float = 20.0,
+                           x_inicio: float = 0.0, y_inicio: float = 0.0, offset_x: float = 0.0, offset_y: float = 0.0):
+    """Valida un programa compilado contra los límites, simulando G90/G91/G92 y arcos G2/G3.
+    Devuelve (ok, indice_linea|None, mensaje|None, bbox) con bbox = (xmin, xmax, ymin, ymax) recorrido.
+    x/y_inicio y offset_x/y (G92 previos) permiten validar por bloques; el estado al final del
+    programa queda en programa.estado_final = (x, y, offset_x, offset_y).
+    """
+    if not isinstance(programa, ProgramaGcode):
+        programa = compilar_programa_gcode(programa)
+    n = len(programa)
+    if n == 0:
+        programa.validado = True
+        programa.limites_validados = (xmin, xmax, ymin, ymax)
+        programa.bbox = (x_inicio, x_inicio, y_inicio, y_inicio)
+        programa.estado_final = (float(x_inicio), float(y_inicio), float(offset_x), float(offset_y))
+        return True, None, None, programa.bbox
+    try:
+        mov = programa.movimiento
+        mueve = mov >= 0
+        pos_x, pos_y, (px, py, off_x, off_y) = calcular_trayectoria(programa, x_inicio, y_inicio, offset_x, offset_y)
+        prev_x = np.concatenate(([float(x_inicio)], pos_x[:-1]))
+        prev_y = np.concatenate(([float(y_inicio)], pos_y[:-1]))
+        lo_x = np.minimum(prev_x, pos_x)
+        hi_x = np.maximum(prev_x, pos_x)
+        lo_y = np.minimum(prev_y, pos_y)
+        hi_y = np.maximum(prev_y, pos_y)
+        arcos = np.flatnonzero((mov == 2) | (mov == 3))
+        if len(arcos):
+            horario = mov[arcos] == 2
+            x0, y0 = prev_x[arcos], prev_y[arcos]
+            x1, y1 = pos_x[arcos], pos_y[arcos]
+            cx, cy = _centros_arcos(x0, y0, x1, y1, programa.i[arcos], programa.j[arcos], programa.r[arcos], horario)
+            ax0, ax1, ay0, ay1 = _extension_arcos(x0, y0, x1, y1, cx, cy, horario)
+            lo_x[arcos], hi_x[arcos], lo_y[arcos], hi_y[arcos] = ax0, ax1, ay0, ay1
+        # Sólo las líneas de movimiento cuentan para la caja y la violación
+        tol = 1e-6
+        fuera = mueve & ((lo_x < xmin - tol) | (hi_x > xmax + tol) | (lo_y < ymin - tol) | (hi_y > ymax + tol))
+        if mueve.any():
+            bbox = (float(min(x_inicio, lo_x[mueve].min())), float(max(x_inicio, hi_x[mueve].max())),
+                    float(min(y_inicio, lo_y[mueve].min())), float(max(y_inicio, hi_y[mueve].max())))
+        else:
+            bbox = (float(x_inicio), float(x_inicio), float(y_inicio), float(y_inicio))
+        programa.bbox = bbox
+        programa.estado_final = (px, py, off_x, off_y)
+        if fuera.any():
+            k = int(np.argmax(fuera))
+            detalles = []
+            if lo_x[k] < xmin - tol or hi_x[k] > xmax + tol:
+                vx = lo_x[k] if lo_x[k] < xmin - tol else hi_x[k]
+                detalles.append(f"X fuera de rango [{xmin},{xmax}]: {vx:.3f}")
+            if lo_y[k] < ymin - tol or hi_y[k] > ymax + tol:
+                vy = lo_y[k] if lo_y[k] < ymin - tol else hi_y[k]
+                detalles.append(f"Y fuera de rango [{ymin},{ymax}]: {vy:.3f}")
+            msg = f"Línea {programa.linea_inicial + k + 1} ({programa.lineas[k]}): " + "; ".join(detalles)
+            programa.validado = False
+            programa.limites_validados = None
+            return False, k, msg, bbox
+        programa.validado = True
+        programa.limites_validados = (float(xmin), float(xmax), float(ymin), float(ymax))
+        return True, None, None, bbox
+    except Exception as e:
+        programa.validado = False
+        programa.limites_validados = None
+        return False, None, f"Error validando programa: {e}", None
+
+# === Generadores de rutinas (G90, área de trabajo [-20..20]) ===
+def validar_lineas_en_rango(lineas, xmin: float = -20.0, xmax: float = 20.0, ymin: float = -20.0, ymax: float = 20.0, invertir: bool = False):
+    """Valida que la trayectoria (G90/G91/G92, arcos e inversión) quede dentro del rango permitido.
+    Acepta líneas o un ProgramaGcode. Devuelve (ok: bool, mensaje_error: str|None).
+    """
+    try:
+        programa = lineas if isinstance(lineas, ProgramaGcode) else compilar_programa_gcode(lineas, invertir=invertir)
+        ok, _, msg, _ = validar_programa_gcode(programa, xmin, xmax, ymin, ymax)
+        return ok, msg
+    except Exception as e:
+        return False, f"Error validando rutina: {e}"
+
+def validar_archivo_rutina_en_rango(ruta: str, invertir: bool = False, lim_min: float = -20.0, lim_max: float = 20.0):
+    """Valida que un archivo G-code de rutina, simulando G90/G91 y la inversión opcional,
+    quede dentro del rango [-20..20]. Devuelve (ok, msg).
+    """
+    try:
+        if not os.path.exists(ruta):
+            return False, f"No existe: {ruta}"
+        with open(ruta, 'r') as f:
+            programa = compilar_programa_gcode(f, invertir=invertir)
+        return validar_lineas_en_rango(programa, lim_min, lim_max, lim_min, lim_max)
+    except Exception as e:
+        return False, f"Error validando archivo: {e}"
+
+def generar_rutina_dinamica(zona: str, numero: int, dificultad: int = 5, invertir: bool = False):
+    """Genera una lista de líneas G-code (G90) para una rutina en X/Y.
+    zona: 'Hombro' o 'Antebrazo'
+    numero: 1..5
+    dificultad: 0..10 (escala amplitud/repeticiones)
+    """
+    # Workspace permitido [-20..20]; usar margen de seguridad 2 mm
+    min_xy, max_xy = -20.0, 20.0
+    margin = 2.0
+    low, high = min_xy + margin, max_xy - margin
+    # Escalas por dificultad
+    amp = 5 + (dificultad * 2.5)  # 5..30 aprox
+    amp = max(3.0, min(amp, (high - low)))
+    rep = 3 + (dificultad // 2)   # 3..8
+    # Centro de trabajo en el origen (0, 0)
+    cx, cy = 0.0, 0.0
+    lines = ["G90"]
+    def clamp(v):
+        return max(min_xy, min(max_xy, v))
+    def _map_inv_x(v: float) -> float:
+        return max(min_xy, min(max_xy, (max_xy - v)))
+    def move(x, y, rapid=False):
+        x = clamp(x); y = clamp(y)
+        if invertir:
+            x = _map_inv_x(x)
+            # Y no se invierte cuando invertir=True
+        g = 'G0' if rapid else 'G1'
+        lines.append(f"{g} X{round(x,3)} Y{round(y,3)}")
+    # Patrones por número
+    if numero == 1:
+        # Cuadrado/rectángulo alrededor del centro, con repeticiones
+        w = amp; h = amp
+        for k in range(rep):
+            move(cx - w/2, cy - h/2, rapid=(k==0))
+            move(cx + w/2, cy - h/2)
+            move(cx + w/2, cy + h/2)
+            move(cx - w/2, cy + h/2)
+            move(cx - w/2, cy - h/2)
+    elif numero == 2:
+        # Zig-zag horizontal
+        span = amp
+        y0 = cy - span/2
+        y1 = cy + span/2
+        x_left = max(low, cx - span/2)
+        x_right = min(high, cx + span/2)
+        move(x_left, y0, rapid=True)
+        for k in range(rep):
+            move(x_right, y0)
+            move(x_right, y1)
+            move(x_left, y1)
+            move(x_left, y0)
+    elif numero == 3:
+        # Espiral cuadrada hacia afuera
+        step = max(2.0, amp / max(3, rep))
+        x0, y0 = cx, cy
+        move(x0, y0, rapid=True)
+        length = step
+        for i in range(1, rep*2+1):
+            # derecha, abajo, izquierda, arriba...
+            dx, dy = ((length, 0), (0, length), (-length, 0), (0, -length))[(i-1) % 4]
+            x0 = clamp(x0 + dx)
+            y0 = clamp(y0 + dy)
+            move(x0, y0)
+            if i % 2 == 0:
+                length += step
+    elif numero == 4:
+        # Barridos verticales
+        span = amp
+        x0 = clamp(cx - span/2)
+        x1 = clamp(cx + span/2)
+        y_bottom = low
+        y_top = high
+        move(x0, y_bottom, rapid=True)
+        for k in range(rep):
+            move(x0, y_top)
+            move(x1, y_top)
+            move(x1, y_bottom)
+            move(x0, y_bottom)
+    else:
+        # numero == 5: L-steps en cuadrante
+        step = max(2.0, amp / max(3, rep))
+        x0, y0 = clamp(cx - amp/2), clamp(cy - amp/2)
+        move(x0, y0, rapid=True)
+        for k in range(rep):
+            x1 = clamp(x0 + step)
+            move(x1, y0)
+            y1 = clamp(y0 + step)
+            move(x1, y1)
+            x0, y0 = x1, y1
+    return lines
+
+def mapear_dificultad_a_lado(dificultad: float | int) -> float:
+    """Lado del patrón (mm) para la dificultad 1..5."""
+    try:
+        n = int(round(float(dificultad)))
+    except Exception:
+        n = 1
+    n = max(1, min(5, n))
+    return {1: 10.0, 2: 15.0, 3: 20.0, 4: 30.0, 5: 40.0}[n]
+
+def generar_rutina_por_zona(zona: str, numero: int, dificultad: float | int, micro_step_mm: float = 0.5):
+    """G-code (G90) de la rutina `numero` de la zona ('Hombro' o 'Antebrazo'), dimensionada
+    por la dificultad 1..5; micro_step_mm es el micropaso de suavizado (0.1..2 mm)."""
+    lines = ["G90"]
+    # Centro de trabajo en el origen (0, 0) con límites [-20..20]
+    cx, cy = 0.0, 0.0
+    # Micropaso para suavidad (mm). Se puede exponer luego como ajuste en UI.
+    micro = float(micro_step_mm or 0.5)
+    micro = max(0.1, min(2.0, micro))
+    lado = mapear_dificultad_a_lado(dificultad)
+    half = lado / 2.0
+    def clamp(v):
+        return max(-20.0, min(20.0, v))
+    def move(x, y, rapid=False):
+        x = clamp(x); y = clamp(y)
+        g = 'G0' if rapid else 'G1'
+        lines.append(f"{g} X{round(x,3)} Y{round(y,3)}")
+    if zona == 'Hombro':
+        if numero == 1:
+            # Espiral cuadrada desde 1x1 hasta lado final según dificultad
+            half_ini = 0.5
+            half_fin = max(half_ini, half)
+            x, y = cx, cy
+            move(x, y, rapid=True)
+            # Longitud inicial de cada tramo en mm
+            L = 1.0
+            # Direcciones: +X, +Y, -X, -Y repetidamente
+            dirs = [(1,0), (0,1), (-1,0), (0,-1)]
+            di = 0
+            # Continuar hasta alcanzar el radio cuadrado deseado
+            # Incrementa L después de cada dos tramos para formar la espiral cuadrada
+            pasos = 0
+            while True:
+                for _ in range(2):
+                    dx, dy = dirs[di % 4]
+                    # Avanzar en micro-pasos para suavidad
+                    pasos_segmento = max(1, int(round(L / micro)))
+                    step = micro
+                    for _ in range(pasos_segmento):
+                        x = clamp(x + dx * step)
+                        y = clamp(y + dy * step)
+                        move(x, y)
+                    di += 1
+                    pasos += pasos_segmento
+                    # Condición de salida: cuando alcanzamos o sobrepasamos half_fin
+                    if max(abs(x - cx), abs(y - cy)) >= half_fin:
+                        break
+                if max(abs(x - cx), abs(y - cy)) >= half_fin:
+                    break
+                L += 1.0
+        elif numero == 2:
+            # Espiral circular: diámetro inicial 1 y final según mapa de dificultad (lado)
+            # Trazo con paso angular adaptativo para que la cuerda sea ≈ micro
+            d_ini = 1.0
+            d_fin = max(d_ini, min(40.0, lado))
+            r_ini = d_ini / 2.0
+            r_fin = d_fin / 2.0
+            try:
+                n = int(round(float(dificultad)))
+            except Exception:
+                n = 1
+            n = max(1, min(5, n))
+            vueltas_map = {1: 2, 2: 3, 3: 3, 4: 4, 5: 4}
+            vueltas = vueltas_map[n]
+            ang_total = 2.0 * math.pi * vueltas
+            ang = 0.0
+            first = True
+            while ang <= ang_total + 1e-6:
+                t = ang / ang_total if ang_total > 0 else 1.0
+                r = r_ini + (r_fin - r_ini) * t
+                x = cx + r * math.cos(ang)
+                y = cy + r * math.sin(ang)
+                move(x, y, rapid=first)
+                first = False
+                # Δángulo aproximando cuerda ≈ micro: delta = micro / r
+                if r <= 0.001:
+                    d_ang = 0.2  # evitar demasiados puntos al inicio
+                else:
+                    d_ang = micro / r
+                # Limitar paso angular para no exceder segmentos largos/cortos
+                d_ang = max(0.02, min(0.25, d_ang))
+                ang += d_ang
+        elif numero == 3:
+            # Zig Zag vertical: trazos principales verticales, con pasos horizontales entre columnas
+            ancho = lado
+            alto = lado
+            x_left = clamp(cx - ancho/2.0)
+            x_right = clamp(cx + ancho/2.0)
+            y_bottom = clamp(cy - alto/2.0)
+            y_top = clamp(cy + alto/2.0)
+            # Densidad por dificultad: más columnas (pasos horizontales)
+            try:
+                n = int(round(float(dificultad)))
+            except Exception:
+                n = 1
+            n = max(1, min(5, n))
+            cols_map = {1: 4, 2: 6, 3: 8, 4: 12, 5: 16}
+            cols = max(2, cols_map.get(n, 6))
+            step_x = (x_right - x_left) / cols if cols > 0 else (x_right - x_left)
+            # Iniciar abajo a la izquierda
+            move(x_left, y_bottom, rapid=True)
+            corner = min(micro * 1.2, abs(step_x) / 3.0) if step_x != 0 else micro * 1.2
+            for c in range(cols):
+                xk = clamp(x_left + c * step_x)
+                # Trazo vertical principal en micro-pasos de 0.5 mm para suavidad
+                y_inicio = y_bottom if c % 2 == 0 else y_top
+                y_fin = y_top if c % 2 == 0 else y_bottom
+                dy = micro if y_fin > y_inicio else -micro
+                y = y_inicio
+                while (dy > 0 and y < y_fin) or (dy < 0 and y > y_fin):
+                    y = clamp(y + dy)
+                    move(xk, y)
+                # Curvita de enlace antes de mover horizontal (aproximación con 2 puntos)
+                if c < cols - 1:
+                    x_next = clamp(x_left + (c + 1) * step_x)
+                    y_cur = y_fin
+                    # Pequeño offset para redondear la esquina
+                    # Primero desplaza un poco en X manteniendo Y
+                    mid1_x = clamp(xk + (corner if x_next > xk else -corner))
+                    move(mid1_x, y_cur)
+                    # Luego hasta la columna siguiente en Y constante
+                    move(x_next, y_cur)
+    else:
+        # Antebrazo: nuevas trayectorias, mismas reglas ([-20..20], G90, G0/G1, suavidad con micro)
+        # Helpers para trazar con suavidad
+        last = {'x': None, 'y': None}
+        def goto(x, y, rapid=False):
+            move(x, y, rapid)
+            last['x'], last['y'] = x, y
+        def line_to(x, y):
+            x = clamp(x); y = clamp(y)
+            if last['x'] is None or last['y'] is None:
+                goto(x, y, rapid=True)
+                return
+            x0, y0 = last['x'], last['y']
+            dx = x - x0; dy = y - y0
+            dist = math.hypot(dx, dy)
+            pasos = max(1, int(math.ceil(dist / micro)))
+            for i in range(1, pasos + 1):
+                px = x0 + dx * (i / pasos)
+                py = y0 + dy * (i / pasos)
+                move(px, py)
+            last['x'], last['y'] = x, y
+        if numero == 1:
+            # Estrella de 5 picos dentro de un cuadro lado x lado
+            R = half  # radio exterior
+            r = max(half * 0.38, R * 0.38)  # radio interior aproximado a proporción áurea
+            # Generar 10 vértices alternando radio exterior/interior
+            pts = []
+            ang0 = -math.pi / 2.0  # iniciar arriba
+            for k in range(10):
+                ang = ang0 + k * (math.pi / 5.0)
+                rad = R if (k % 2 == 0) else r
+                xk = clamp(cx + rad * math.cos(ang))
+                yk = clamp(cy + rad * math.sin(ang))
+                pts.append((xk, yk))
+            # Trazar estrella cerrando la figura
+            if pts:
+                goto(pts[0][0], pts[0][1], rapid=True)
+                for p in pts[1:]:
+                    line_to(p[0], p[1])
+                line_to(pts[0][0], pts[0][1])
+        elif numero == 2:
+            # Símbolo de infinito (Lissajous)
+            ax = half
+            ay = half
+            # Paso paramétrico acorde a micro
+            dt = max(0.02, min(0.12, micro / max(1e-3, half)))
+            t = 0.0
+            t_max = 2.0 * math.pi
+            x0 = clamp(cx + ax * math.sin(0.0))
+            y0 = clamp(cy + ay * math.sin(2.0 * 0.0))
+            goto(x0, y0, rapid=True)
+            while t <= t_max + 1e-6:
+                x = clamp(cx + ax * math.sin(t))
+                y = clamp(cy + ay * math.sin(2.0 * t))
+                move(x, y)
+                last['x'], last['y'] = x, y
+                t += dt
+            # cerrar suave al inicio
+            line_to(x0, y0)
+        elif numero == 3:
+            # Línea curva (S-curve) dentro del cuadro lado x lado
+            x_start = cx - half
+            x_end = cx + half
+            A = half  # amplitud vertical
+            # Muestras según micro
+            long_x = max(1e-6, x_end - x_start)
+            pasos = max(20, int(math.ceil(long_x / micro) * 2))
+            for i in range(pasos + 1):
+                s = i / pasos
+                x = x_start + long_x * s
+                # Onda suave: seno de dos medias ondas (S)
+                y = cy + A * math.sin(math.pi * (2.0 * s - 1.0))
+                if i == 0:
+                    goto(x, y, rapid=True)
+                else:
+                    move(clamp(x), clamp(y))
+                    last['x'], last['y'] = x, y
+    return lines
+
+NOMBRES_RUTINAS = {
+    'Hombro': ["Espiral Cuadrada", "Espiral Circular", "Zig Zag Vertical"],
+    'Antebrazo': ["Estrella 5 picos", "Infinito", "Línea curva"],
+}
+
+def nombres_rutinas_por_zona(zona: str) -> list:
+    # Nombres por zona; Antebrazo con diseños propios
+    return NOMBRES_RUTINAS['Antebrazo'] if zona == 'Antebrazo' else NOMBRES_RUTINAS['Hombro']
+
+def guardar_sesion_captura(gestor_pacientes, id_paciente, nombre_rutina, datos_hombro, datos_antebrazo,
+                           duracion_minutos: float):
+    """Cierra una captura ECG de rutina: publica captura/fin y guarda la sesión (promedios y
+    duración) en rehabilitacion.db a través de AlmacenPacientes. Devuelve (guardada,
+    esfuerzo_hombro, esfuerzo_antebrazo)."""
+    esfuerzo_hombro_promedio = sum(datos_hombro) / len(datos_hombro) if datos_hombro else 0
+    esfuerzo_antebrazo_promedio = sum(datos_antebrazo) / len(datos_antebrazo) if datos_antebrazo else 0
+    bus_eventos().publicar('captura', 'fin', {
+        'rutina': nombre_rutina, 'paciente': id_paciente,
+        'muestras': len(datos_hombro), 'duracion_min': duracion_minutos,
+    })
+    if not (gestor_pacientes and id_paciente):
+        print("[ECG] Rutina completada sin paciente activo - datos no guardados.")
+        return False, esfuerzo_hombro_promedio, esfuerzo_antebrazo_promedio
+    if not (datos_hombro or datos_antebrazo):
+        print("[ECG] Rutina completada sin captura de datos (sensor no disponible o sin datos).")
+        return False, esfuerzo_hombro_promedio, esfuerzo_antebrazo_promedio
+    try:
+        exito = gestor_pacientes.guardar_sesion(
+            id_paciente,
+            esfuerzo_hombro_promedio,
+            esfuerzo_antebrazo_promedio,
+            duracion_minutos,
+            f"Rutina: {nombre_rutina}",
+            rutina=nombre_rutina
+        )
+    except Exception as e:
+        print(f"[ECG] Error al guardar sesión: {e}")
+        exito = False
+    else:
+        if exito:
+            print(f"[ECG] Sesión guardada - Hombro: {esfuerzo_hombro_promedio:.1f}, Antebrazo: {esfuerzo_antebrazo_promedio:.1f}, Duración: {duracion_minutos:.2f} min")
+        else:
+            print("[ECG] Error al guardar sesión")
+    return exito, esfuerzo_hombro_promedio, esfuerzo_antebrazo_promedio
+
+# === Ejecución sin interfaz (línea de órdenes) ===
+PERIODO_MUESTREO_CAPTURA = 1.0 / 60.0  # cada cuánto se recogen las muestras nuevas del cursor
+
+def ejecutar_rutina_sin_interfaz(id_paciente: str, zona: str, rutina: int, dificultad: float = 3,
+                                 mano: str = 'Derecha', puerto: str | None = None,
+                                 establecer_origen: bool = False, velocidad: int | None = None,
+                                 espera_ecg: float = 5.0, sin_ecg: bool = False) -> int:
+    """Ejecuta una rutina como el botón de la ventana de Rutinas, sin pantalla.
+
+    Conecta la CNC (y el ECG salvo sin_ecg), genera y valida el programa contra los límites
+    vigentes, lo transmite, muestrea el ECG durante la ejecución y guarda la sesión del
+    paciente en rehabilitacion.db (AlmacenPacientes). Ctrl+C hace Feed Hold y guarda lo capturado. Devuelve el código de salida:
+    0 completada, 1 fallo o interrupción, 2 parámetros o preparación inválidos.
+    """
+    if zona not in NOMBRES_RUTINAS:
+        print(f"[ERROR] Zona desconocida: {zona} (opciones: {', '.join(NOMBRES_RUTINAS)})")
+        return 2
+    nombres = nombres_rutinas_por_zona(zona)
+    if not 1 <= int(rutina) <= len(nombres):
+        print(f"[ERROR] Rutina fuera de rango para {zona}: 1..{len(nombres)}")
+        return 2
+    if mano not in ('Derecha', 'Izquierda'):
+        print(f"[ERROR] Mano desconocida: {mano} (Derecha o Izquierda)")
+        return 2
+    gestor = GestorPacientes()
+    buscado = (id_paciente or '').strip()
+    # Nombre completo registrado o, si no, ID del paciente
+    paciente = (gestor.obtener_paciente(buscado) or gestor.almacen.paciente_por_id(buscado)
+                or gestor.almacen.paciente_por_id(buscado.upper()))
+    if not paciente:
+        print(f"[ERROR] Paciente no registrado: {buscado} (use el nombre completo o el ID del paciente)")
+        return 2
+    # Igual que la ventana principal: las sesiones se guardan bajo el nombre normalizado
+    id_paciente = paciente['nombre_normalizado']
+
+    lineas = generar_rutina_por_zona(zona, int(rutina), dificultad)
+    programa = compilar_programa_gcode(lineas, invertir=(mano == 'Izquierda'))
+    nombre_rutina = f"{mano} - {zona} - {nombres[int(rutina) - 1]}"
+
+    descubrimiento_dispositivos().descubrir_en_segundo_plano()
+    suscripcion = None
+    if not sin_ecg:
+        suscripcion = servicio_sensores().suscribir('linea-ordenes', id_paciente)
+    controlador = ControladorCNC(puerto=puerto)
+    try:
+        print(f"[INFO] Conectando CNC{f' en {puerto}' if puerto else ''}...")
+        if not controlador.conectar():
+            print("[ERROR] No se pudo conectar la CNC")
+            return 1
+        if establecer_origen and not controlador.establecer_origen():
+            print("[ERROR] No se pudo establecer el origen en la posición actual")
+            return 1
+        if not controlador.origen_establecido:
+            print("[ERROR] Aún no se ha establecido Punto de Origen (use --establecer-origen)")
+            return 2
+        ok_rng, msg_rng = validar_lineas_en_rango(programa, *controlador._limites_vigentes())
+        if not ok_rng:
+            print(f"[ERROR] {msg_rng or 'Rutina fuera de rango'}")
+            return 2
+        if velocidad is not None:
+            # Sólo en memoria: velocidad_cnc.json es la preferencia de la interfaz y durante la
+            # rutina verificar_cambios_velocidad() usa velocidad_actual sin releer el archivo
+            controlador.velocidad_actual = max(10, min(200, int(velocidad)))
+            controlador.aplicar_velocidad()
+
+        lector = suscripcion.lector if suscripcion is not None else None
+        if lector is not None:
+            limite = time.monotonic() + max(0.0, espera_ecg)
+            while not lector.conectado and time.monotonic() < limite:
+                time.sleep(0.1)
+            if not lector.conectado:
+                print("[ECG] Sensor ECG aún no conectado; se captará en cuanto esté disponible.")
+
+        datos_hombro, datos_antebrazo = [], []
+
+        def recoger():
+            # Todas las muestras llegadas desde la última llamada, no sólo la más reciente
+            hombro, antebrazo = suscripcion.nuevas()
+            datos_hombro.extend(hombro.tolist())
+            datos_antebrazo.extend(antebrazo.tolist())
+
+        if suscripcion is not None:
+            suscripcion.nuevas()  # la captura empieza aquí: se descarta lo anterior
+        resultado = {}
+        bus_eventos().publicar('captura', 'inicio', {'rutina': nombre_rutina, 'paciente': id_paciente})
+        print(f"[ECG] Captura iniciada para rutina: {nombre_rutina}")
+        inicio = time.time()
+        hilo = Thread(target=lambda: resultado.setdefault('ok', controlador.ejecutar_lineas_gcode(programa, base_tiempo=0.4)),
+                      name='rutina-linea-ordenes', daemon=True)
+        hilo.start()
+        try:
+            while hilo.is_alive():
+                if suscripcion is not None:
+                    recoger()
+                hilo.join(PERIODO_MUESTREO_CAPTURA)
+        except KeyboardInterrupt:
+            print("\n[AVISO] Interrumpido: Feed Hold y cierre de la sesión")
+            controlador.paro_emergencia()
+            resultado['ok'] = False
+        if suscripcion is not None:
+            recoger()
+        duracion_minutos = (time.time() - inicio) / 60.0
+        guardar_sesion_captura(gestor, id_paciente, nombre_rutina, datos_hombro, datos_antebrazo, duracion_minutos)
+        if resultado.get('ok'):
+            print(f"[INFO] Rutina {nombre_rutina} ejecutada")
+            return 0
+        detalle = getattr(controlador, 'ultimo_limite', '') or getattr(controlador, 'motivo_interrupcion', '')
+        print(f"[ERROR] La rutina no se completó{f': {detalle}' if detalle else ''}")
+        return 1
+    finally:
+        try:
+            controlador.desconectar()
+        except Exception:
+            pass
+        if suscripcion is not None:
+            suscripcion.cancelar()
+        cerrar_servicios()
+
+def main_linea_ordenes(argv=None) -> int:
+    """`run --patient ID --zona Hombro --rutina 2 --dificultad 4 --mano Izquierda` sin pantalla."""
+    import argparse
+    parser = argparse.ArgumentParser(description="Ejecución de rutinas sin interfaz gráfica")
+    ordenes = parser.add_subparsers(dest='orden', required=True)
+    run = ordenes.add_parser('run', help="Ejecuta una rutina con captura ECG y guarda la sesión")
+    run.add_argument('--patient', '--paciente', dest='paciente', required=True,
+                     help="ID del paciente o nombre completo registrado")
+    run.add_argument('--zona', required=True, choices=sorted(NOMBRES_RUTINAS))
+    run.add_argument('--rutina', required=True, type=int, help="Número de rutina de la zona (1..3)")
+    run.add_argument('--dificultad', type=float, default=3, help="1..5 (por defecto 3)")
+    run.add_argument('--mano', default='Derecha', choices=['Derecha', 'Izquierda'])
+    run.add_argument('--puerto', default=None, help="Puerto serie de la CNC (autodetectado si se omite)")
+    run.add_argument('--establecer-origen', action='store_true',
+                     help="Fija el origen (G92) en la posición actual antes de ejecutar")
+    run.add_argument('--velocidad', type=int, default=None, help="Override de avance en %% (10..200) sólo para esta ejecución")
+    run.add_argument('--espera-ecg', type=float, default=5.0,
+                     help="Segundos a esperar la conexión del ECG antes de empezar")
+    run.add_argument('--sin-ecg', action='store_true', help="No conectar ni capturar el ECG")
+    ordenes.add_parser('migrar', help="Importa backup_pacientes.csv y sesiones_*.csv al almacén SQLite")
+    args = parser.parse_args(argv)
+    configurar_registro()
+    if args.orden == 'migrar':
+        ok, msg = GestorPacientes().migrar_csv()
+        print(f"[INFO] {msg}" if ok else f"[ERROR] {msg}")
+        return 0 if ok else 1
+    return ejecutar_rutina_sin_interfaz(
+        args.paciente, args.zona, args.rutina, args.dificultad, args.mano, puerto=args.puerto,
+        establecer_origen=args.establecer_origen, velocidad=args.velocidad,
+        espera_ecg=args.espera_ecg, sin_ecg=args.sin_ecg)
+
+if __name__ == "__main__":
+    sys.exit(main_linea_ordenes())
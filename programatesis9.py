@@ -1,31 +1,38 @@
 # Importaciones básicas
-from tkinter import messagebox
-from threading import Thread, Lock, current_thread
+from threading import Thread, Lock
 from io import BytesIO
 from datetime import datetime
+from collections import deque, OrderedDict
 import os
 import time
+# Referencia para el perfil de arranque (ver perfil_arranque())
+_INICIO_ARRANQUE = time.perf_counter()
 import csv
 import json
 import traceback
 import importlib
+import importlib.util
+import contextlib
 import pygame
 import sys
+import numpy as np
+
+# Dispositivos, G-code, rutinas y almacenamiento viven en el núcleo sin interfaz
+from nucleo_rehab import (
+    BASE_DIR, TIEMPOS_RUTINAS,
+    configurar_registro, registro, registros_recientes, _LOG_CNC, _LOG_ECG, _LOG_ECG_DATOS,
+    bus_eventos, descubrimiento_dispositivos, servicio_sensores, cerrar_servicios,
+    GestorPacientes, ControladorCNC, _try_import_pandas,
+    limpiar_linea_gcode, compilar_programa_gcode, validar_lineas_en_rango,
+    validar_archivo_rutina_en_rango, generar_rutina_dinamica, mapear_dificultad_a_lado,
+    generar_rutina_por_zona, nombres_rutinas_por_zona, guardar_sesion_captura, main_linea_ordenes,
+)
 
 class CerrarPrograma(Exception):
     """Excepción personalizada para cerrar el programa limpiamente"""
     pass
-import subprocess
-import tkinter as tk
-import numpy as np
-import glob
-import math
 
-try:
-    import serial
-    import serial.tools.list_ports
-except ImportError:
-    serial = None
+import glob
 
 # Constantes de colores
 BLANCO = (255, 255, 255)
@@ -46,137 +53,7 @@ NARANJA = (255, 140, 0)
 ROSA = (255, 20, 147)
 GRIS_CLARO = (200, 200, 200)
 
-# Clase para leer datos de sensores ECG del Arduino
-class ArduinoSensorReader:
-    def __init__(self, puerto=None, baudrate=115200):
-        self.puerto = puerto
-        self.baudrate = baudrate
-        self.conexion = None
-        self.conectado = False
-        self.data_buffer_hombro = []  # Canal ECG Hombro (A0)
-        self.data_buffer_antebrazo = []  # Canal ECG Antebrazo (A1)
-        self.lock = Lock()
-        self.thread = None
-        self.running = False
-
-    def autodetectar_puerto(self):
-        """Busca automáticamente el puerto donde está conectado el Arduino."""
-        if not SERIAL_OK:
-            print("[AVISO] pyserial no está instalado; no se puede autodetectar puertos.")
-            return None
-        try:
-            import serial.tools.list_ports
-        except Exception:
-            print("[AVISO] No se pudo importar serial.tools.list_ports.")
-            return None
-        
-        puertos = list(serial.tools.list_ports.comports())
-        for puerto in puertos:
-            if "ACM" in puerto.device or "USB" in puerto.device:
-                print(f"Puerto Arduino detectado: {puerto.device}")
-                return puerto.device
-        if puertos:
-            print(f"No se encontró un puerto Arduino específico, usando el primero: {puertos[0].device}")
-            return puertos[0].device
-        return None
-
-    def conectar(self):
-        if not SERIAL_OK:
-            print("[AVISO] pyserial no está instalado.")
-            return False
-        if self.puerto is None:
-            self.puerto = self.autodetectar_puerto()
-            if self.puerto is None:
-                print("No se pudo encontrar un puerto serial.")
-                return False
-        try:
-            self.conexion = serial.Serial(self.puerto, self.baudrate, timeout=1)
-            self.conectado = True
-            self.running = True
-            self.thread = Thread(target=self._leer_datos)
-            self.thread.daemon = True
-            self.thread.start()
-            print(f"Conectado a Arduino en {self.puerto}")
-            return True
-        except serial.SerialException as e:
-            print(f"Error al conectar a {self.puerto}: {e}")
-            self.conectado = False
-            return False
-
-    def _leer_datos(self):
-        while self.running and self.conexion:
-            try:
-                linea = self.conexion.readline().decode('utf-8').strip()
-                if linea and "Musculo_1:" in linea and "Musculo_2:" in linea:
-                    partes = linea.split(',')
-                    valor_hombro_str = partes[0].split(':')[1]
-                    valor_antebrazo_str = partes[1].split(':')[1]
-                    
-                    valor_hombro = float(valor_hombro_str)
-                    valor_antebrazo = float(valor_antebrazo_str)
-
-                    with self.lock:
-                        self.data_buffer_hombro.append(valor_hombro)
-                        self.data_buffer_antebrazo.append(valor_antebrazo)
-                        
-                        # Mantener los buffers con un tamaño máximo
-                        if len(self.data_buffer_hombro) > 500:
-                            self.data_buffer_hombro.pop(0)
-                        if len(self.data_buffer_antebrazo) > 500:
-                            self.data_buffer_antebrazo.pop(0)
-
-            except (ValueError, UnicodeDecodeError, IndexError):
-                # Ignorar líneas mal formadas o con errores
-                pass
-            except serial.SerialException:
-                self._desconectar_interno()
-                break
-
-    def _desconectar_interno(self):
-        """Desconexión interna sin join() - para llamar desde el mismo hilo"""
-        self.running = False
-        if self.conexion and self.conexion.is_open:
-            self.conexion.close()
-        self.conectado = False
-        print("Desconectado de Arduino (error de conexión).")
-
-    def desconectar(self):
-        """Desconexión externa - para llamar desde otro hilo"""
-        self.running = False
-        if self.thread and self.thread != current_thread():
-            self.thread.join()
-        if self.conexion and self.conexion.is_open:
-            self.conexion.close()
-        self.conectado = False
-        print("Desconectado de Arduino.")
-
-    def obtener_datos_hombro(self):
-        with self.lock:
-            return list(self.data_buffer_hombro)
-
-    def obtener_datos_antebrazo(self):
-        with self.lock:
-            return list(self.data_buffer_antebrazo)
-
-# Constantes de configuración
-INTERVALO_GUARDADO = 60  # segundos
-TIEMPOS_RUTINAS = {
-    'rutina1': 1.0,
-    'rutina2': 1.0,
-}
-
-# Base directory for all app data files (CSV backups, patient data, etc.)
-BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backups')
-
-# Intentar importar pyserial
-SERIAL_OK = True
-try:
-    import serial
-    import serial.tools.list_ports
-except Exception:
-    serial = None
-    SERIAL_OK = False
-    print("[AVISO] 'pyserial' no está instalado. La conexión con Arduino se deshabilitará.\n       Instale con: pip install pyserial")
+_LOG_INTERFAZ = registro('interfaz')
 
 # Matplotlib - importación perezosa
 MATPLOTLIB_OK = False
@@ -219,24 +96,6 @@ def _try_import_matplotlib():
         FigureCanvasAgg = None
         return False
 
-# Pandas - importación perezosa
-PANDAS_OK = False
-pd = None
-
-def _try_import_pandas():
-    """Intenta importar pandas de forma perezosa. Devuelve True si está disponible."""
-    global PANDAS_OK, pd
-    if PANDAS_OK and pd is not None:
-        return True
-    try:
-        pd = importlib.import_module('pandas')
-        PANDAS_OK = True
-        return True
-    except Exception:
-        PANDAS_OK = False
-        pd = None
-        return False
-
 # Funciones auxiliares de Tkinter
 def maximizar_tk(root):
     try:
@@ -247,258 +106,6 @@ def maximizar_tk(root):
         except Exception:
             root.attributes('-fullscreen', True)  # Fallback
 
-# Clase GestorPacientes
-class GestorPacientes:
-    def __init__(self):
-        self.pacientes = {}
-        self.ruta_backup = os.path.join(BASE_DIR, 'backup_pacientes.csv')
-        self._cargar_pacientes()
-
-    def _cargar_pacientes(self):
-        """Carga pacientes desde el archivo CSV de backup."""
-        if not os.path.exists(self.ruta_backup):
-            return
-        
-        try:
-            import csv
-            with open(self.ruta_backup, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for fila in reader:
-                    nombre_completo = self._construir_nombre_completo(fila)
-                    if nombre_completo:
-                        nombre_normalizado = self._normalizar_nombre(nombre_completo)
-                        self.pacientes[nombre_normalizado] = fila
-                        print(f"[INFO] Paciente cargado: {nombre_completo}")
-        except Exception as e:
-            print(f"[ERROR] No se pudo cargar backup de pacientes: {e}")
-    
-    def _construir_nombre_completo(self, datos):
-        """Construye el nombre completo desde un diccionario de datos."""
-        partes = [
-            datos.get('primer_nombre', '').strip(),
-            datos.get('segundo_nombre', '').strip(),
-            datos.get('primer_apellido', '').strip(),
-            datos.get('segundo_apellido', '').strip()
-        ]
-        return ' '.join([p for p in partes if p])
-    
-    def _normalizar_nombre(self, nombre):
-        """Normaliza un nombre eliminando espacios extras y convirtiendo a minúsculas."""
-        return ' '.join(nombre.lower().split())
-
-    def registrar_paciente(self, datos):
-        """Registra un paciente usando los datos proporcionados. Devuelve (exito, resultado)."""
-        primer_nombre = datos.get('primer_nombre', '').strip()
-        primer_apellido = datos.get('primer_apellido', '').strip()
-        
-        if not primer_nombre or not primer_apellido:
-            return False, 'Nombre y apellido son obligatorios'
-        
-        # Construir nombre completo y generar ID
-        nombre_completo = self._construir_nombre_completo(datos)
-        nombre_normalizado = self._normalizar_nombre(nombre_completo)
-        
-        id_paciente = self.generar_id_paciente(
-            primer_nombre, 
-            primer_apellido, 
-            datos.get('año_nacimiento', '0000')
-        )
-        
-        # Guardar en memoria y archivo
-        self.guardar_paciente(nombre_normalizado, datos)
-        
-        print(f"[INFO] Paciente registrado: {nombre_completo} (ID: {id_paciente})")
-        return True, id_paciente
-
-    def guardar_paciente(self, nombre_completo, datos):
-        """Guarda un paciente en el registro y en backup_pacientes.csv."""
-        import csv
-        self.pacientes[nombre_completo] = datos
-        
-        campos = ['primer_nombre', 'segundo_nombre', 'primer_apellido', 'segundo_apellido', 
-                 'año_nacimiento', 'sexo', 'telefono', 'email', 'observaciones']
-        
-        try:
-            # Leer pacientes existentes
-            pacientes_existentes = self._leer_pacientes_csv(campos)
-            
-            # Agregar el nuevo paciente
-            fila = [datos.get(campo, '') for campo in campos]
-            pacientes_existentes.append(fila)
-            
-            # Escribir todos los pacientes al archivo
-            self._escribir_pacientes_csv(campos, pacientes_existentes)
-            
-            print(f"[INFO] Paciente guardado en CSV")
-        except Exception as e:
-            print(f"[ERROR] No se pudo guardar backup de paciente: {e}")
-        
-        return True
-    
-    def _leer_pacientes_csv(self, campos):
-        """Lee todos los pacientes existentes del CSV."""
-        pacientes = []
-        if os.path.exists(self.ruta_backup):
-            import csv
-            with open(self.ruta_backup, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    pacientes.append([row.get(campo, '') for campo in campos])
-        return pacientes
-    
-    def _escribir_pacientes_csv(self, campos, pacientes):
-        """Escribe todos los pacientes al CSV."""
-        import csv
-        with open(self.ruta_backup, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(campos)
-            writer.writerows(pacientes)
-
-    def buscar_paciente_por_nombre(self, nombre_completo):
-        """Busca paciente por coincidencia parcial, ignorando mayúsculas y espacios extra."""
-        nombre_normalizado = self._normalizar_nombre(nombre_completo)
-        
-        print(f"[INFO] Buscando paciente: '{nombre_completo}' (normalizado: '{nombre_normalizado}')")
-        print(f"[INFO] Pacientes en memoria: {len(self.pacientes)}")
-        
-        # Buscar coincidencia exacta
-        if nombre_normalizado in self.pacientes:
-            print(f"[INFO] Coincidencia exacta encontrada")
-            return nombre_normalizado, self.pacientes[nombre_normalizado]
-        
-        # Buscar coincidencia parcial
-        for nombre, datos in self.pacientes.items():
-            if nombre_normalizado in nombre or nombre in nombre_normalizado:
-                print(f"[INFO] Coincidencia parcial encontrada: {nombre}")
-                return nombre, datos
-        
-        print(f"[INFO] No se encontró el paciente")
-        return None, {}
-    
-    def generar_id_paciente(self, primer_nombre, primer_apellido, año_nacimiento):
-        """Genera un ID basado en nombre/apellido/año."""
-        pn = (primer_nombre or "").strip().upper()[:3] or "XXX"
-        pa = (primer_apellido or "").strip().upper()[:3] or "XXX"
-        anio = str(año_nacimiento).strip()
-        anio = anio if anio.isdigit() and len(anio) == 4 else "0000"
-        base = f"{pn}{pa}{anio}".replace(" ", "")
-        return base
-    
-    def guardar_sesion(self, id_paciente, esfuerzo_hombro, esfuerzo_antebrazo, duracion, observaciones=""):
-        """Guarda una sesión de forma simple. Wrapper para registrar_sesion."""
-        datos_sesion = {
-            'esfuerzo_hombro': esfuerzo_hombro,
-            'esfuerzo_antebrazo': esfuerzo_antebrazo,
-            'duracion': duracion,
-            'observaciones': observaciones
-        }
-        exito, resultado = self.registrar_sesion(id_paciente, datos_sesion)
-        return exito
-    
-    def registrar_sesion(self, id_paciente, datos_sesion):
-        """Registra una nueva sesión para un paciente (método simplificado)"""
-        try:
-            # Usar el id_paciente tal como viene (puede ser nombre completo o ID)
-            # Normalizar para asegurar consistencia
-            id_normalizado = id_paciente.strip()
-            
-            timestamp = time.strftime("%Y%m%d-%H%M%S")
-            nombre_archivo = f"sesion_{id_normalizado}_{timestamp}.csv"
-            
-            # Guardar datos en el directorio de backups
-            ruta_sesion = os.path.join(BASE_DIR, f'sesiones_{id_normalizado}.csv')
-            print(f"[DEBUG] Guardando sesión en: {ruta_sesion}")
-            
-            import csv
-            # Verificar si el archivo existe y está vacío para escribir encabezados
-            escribir_encabezados = not os.path.exists(ruta_sesion) or os.path.getsize(ruta_sesion) == 0
-            
-            with open(ruta_sesion, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                
-                if escribir_encabezados:
-                    writer.writerow(['fecha', 'esfuerzo_hombro', 'esfuerzo_antebrazo', 'duracion', 'observaciones'])
-                
-                writer.writerow([
-                    time.strftime("%Y-%m-%d %H:%M:%S"),
-                    datos_sesion.get('esfuerzo_hombro', 0),
-                    datos_sesion.get('esfuerzo_antebrazo', 0),
-                    datos_sesion.get('duracion', 0),
-                    datos_sesion.get('observaciones', '')
-                ])
-            
-            print(f"[INFO] Sesión guardada exitosamente")
-            return True, timestamp
-        except Exception as e:
-            print(f"[ERROR] No se pudo registrar sesión: {e}")
-            import traceback
-            traceback.print_exc()
-            return False, str(e)
-    
-    def obtener_datos_progreso(self, id_paciente):
-        """Obtiene los datos de progreso de un paciente (método simplificado)"""
-        try:
-            # Asegurar que pandas esté disponible
-            if not _try_import_pandas():
-                print("[ERROR] pandas no está disponible para cargar datos de progreso")
-                return None
-            
-            # Normalizar el id_paciente
-            id_normalizado = id_paciente.strip()
-            
-            ruta_sesion = os.path.join(BASE_DIR, f'sesiones_{id_normalizado}.csv')
-            print(f"[DEBUG] Buscando archivo: {ruta_sesion}")
-            print(f"[DEBUG] ID del paciente: '{id_normalizado}'")
-            
-            if not os.path.exists(ruta_sesion):
-                print(f"[INFO] No hay sesiones registradas para {id_normalizado}")
-                print(f"[INFO] Archivo no encontrado: {ruta_sesion}")
-                
-                # Listar archivos disponibles en el directorio para diagnóstico
-                print(f"[DEBUG] Archivos disponibles en {BASE_DIR}:")
-                try:
-                    import glob
-                    archivos_sesiones = glob.glob(os.path.join(BASE_DIR, 'sesiones_*.csv'))
-                    for archivo in archivos_sesiones:
-                        print(f"  - {os.path.basename(archivo)}")
-                except Exception:
-                    pass
-                
-                return None
-            
-            # Leer el archivo CSV con pandas
-            print(f"[DEBUG] Leyendo archivo CSV...")
-            df = pd.read_csv(ruta_sesion)
-            print(f"[DEBUG] Datos leídos exitosamente: {len(df)} filas")
-            print(f"[DEBUG] Columnas: {list(df.columns)}")
-            
-            if len(df) == 0:
-                print(f"[INFO] El archivo existe pero está vacío")
-                return None
-            
-            # Transformar los datos al formato esperado por las gráficas
-            df_transformado = pd.DataFrame({
-                'Fecha': pd.to_datetime(df['fecha']),
-                'Numero_Sesion': range(1, len(df) + 1),
-                'Esfuerzo_Hombro_Promedio': pd.to_numeric(df['esfuerzo_hombro'], errors='coerce'),
-                'Esfuerzo_Antebrazo_Promedio': pd.to_numeric(df['esfuerzo_antebrazo'], errors='coerce'),
-                'Duracion_Minutos': pd.to_numeric(df['duracion'], errors='coerce'),
-                'Observaciones': df['observaciones'] if 'observaciones' in df.columns else ''
-            })
-            
-            print(f"[DEBUG] Datos transformados exitosamente")
-            print(f"[DEBUG] Primeras filas:")
-            print(df_transformado.head())
-            
-            return df_transformado
-                
-        except Exception as e:
-            print(f"[ERROR] Error al obtener datos de progreso: {e}")
-            import traceback
-            traceback.print_exc()
-            return None
-
-
 class CheckBox:
     def __init__(self, x, y, texto, fuente):
         self.rect = pygame.Rect(x, y, 20, 20)
@@ -532,6 +139,9 @@ class CheckBox:
     def verificar_clic(self, pos):
         return self.rect.collidepoint(pos) or self.texto_rect.collidepoint(pos)
 
+    def firma_visual(self):
+        return (tuple(self.rect), self.texto, self.marcado)
+
     def alternar(self):
         self.marcado = not self.marcado
 
@@ -578,6 +188,9 @@ class CampoTexto:
         self.checkbox.texto_rect.y = self.checkbox.rect.y + (self.checkbox.rect.height - self.checkbox.texto_rect.height) // 2
         self.checkbox.dibujar(superficie)
 
+    def firma_visual(self):
+        return (tuple(self.rect), self.etiqueta, self.texto, self.activo, self.checkbox.firma_visual())
+
     def manejar_clic(self, pos):
         if self.rect.collidepoint(pos):
             self.activo = True
@@ -620,1606 +233,89 @@ class CampoTextoSimple:
         
         # Dibujar campo
         color_borde = AZUL if self.activo else NEGRO
-        pygame.draw.rect(superficie, BLANCO, self.rect)
-        pygame.draw.rect(superficie, color_borde, self.rect, 2)
-        
-        # Dibujar texto
-        texto_surface = self.fuente.render(self.texto, True, NEGRO)
-        superficie.blit(texto_surface, (self.rect.x + 5, self.rect.y + (self.rect.height - texto_surface.get_height()) // 2))
-
-    def manejar_clic(self, pos):
-        if self.rect.collidepoint(pos):
-            self.activo = True
-            return True
-        else:
-            self.activo = False
-            return False
-
-    def agregar_caracter(self, caracter):
-        if len(self.texto) < 50:  # Límite más alto para nombres completos
-            self.texto += caracter
-
-    def borrar_caracter(self):
-        if self.texto:
-            self.texto = self.texto[:-1]
-
-    def obtener_valor(self):
-        return self.texto
-
-class ControladorCNC:
-    def set_cmd_en_progreso(self, valor):
-        self._cmd_en_progreso = valor
-
-    def __init__(self, puerto=None, baudrate=115200):
-        self.puerto = puerto
-        self.baudrate = baudrate
-        self.conexion = None
-        self.conectado = False
-        self.paso = 1.0
-        self.posicion_x = 0.0
-        self.posicion_y = 0.0
-        self.modo_relativo = False
-        self.velocidad_actual = 50
-        self.override_actual = 100  # Override de feed/velocidad en %
-        self.archivo_velocidad = os.path.join(BASE_DIR, 'velocidad_cnc.json')
-        self.ov_feed = 100
-        self.ov_rapid = 100
-        self.ov_spindle = 100
-        self.feed_reportado = 0.0
-        self._last_status_poll = 0.0
-        self._status_poll_interval = 0.15
-        self._serial_lock = Lock()
-        self.firmware = 'desconocido'  # 'grbl' | 'marlin' | 'desconocido'
-        self.firmware_info = ""
-        self._ultimo_ping = 0.0
-        self._intervalo_ping = 2.0
-        self._fallos_ping = 0
-        self.ejecutando_rutina = False
-        self._cmd_en_progreso = False
-        self._ultimo_aplicar_ov = 0.0
-        self._intervalo_aplicar_ov = 0.08
-        self.mascara_direccion = None
-        self.junction_deviation = None
-        self.feed_base = 600
-        self._eventos = []
-        self._event_lock = Lock()
-        self.ultimo_tiempo_verificacion = time.time()
-        self.intervalo_verificacion = 1.0  # segundos, ajustar según necesidad
-        self.ultimo_guardado = time.time()
-        self.thread_monitor = None
-        self.origen_establecido = False
-        self.limites_activos = False
-        self.debug_limites = False
-        self.ultimo_limite = ""
-        self.limite_x_min = -20.0
-        self.limite_x_max = 20.0
-        self.limite_y_min = -20.0
-        self.limite_y_max = 20.0
-        self.abortado_por_limite = False
-        self.en_hold = False
-        self._ultimo_dir_x = 1.0
-        self._ultimo_dir_y = 1.0
-        self.archivo_grbl_config = os.path.join(BASE_DIR, 'grbl_config.json')
-
-    def aplicar_mascara_direccion(self, mascara: int | None = None):
-        """Aplica $3 (Direction port invert mask) en GRBL. X=1, Y=2, Z=4. Rango 0..7.
-        Si mascara es None, usa la cargada en self.mascara_direccion.
-        """
-        try:
-            if mascara is None:
-                mascara = self.mascara_direccion
-            if mascara is None:
-                return False
-            mascara = max(0, min(7, int(mascara)))
-            ok = self.enviar_comando(f"$3={mascara}")
-            if ok:
-                print(f"GRBL $3 (mascara de dirección) aplicada: {mascara}")
-                self.mascara_direccion = mascara
-            return ok
-        except Exception as e:
-            print(f"Error aplicando máscara de dirección $3: {e}")
-            return False
-
-    def set_mascara_direccion(self, mascara: int):
-        """Actualiza y persiste la máscara $3 y la aplica en GRBL."""
-        try:
-            mascara = max(0, min(7, int(mascara)))
-            # Persistir
-            os.makedirs(os.path.dirname(self.archivo_grbl_config), exist_ok=True)
-            with open(self.archivo_grbl_config, 'w') as f:
-                json.dump({'mascara_direccion': mascara}, f)
-            self.mascara_direccion = mascara
-            # Aplicar inmediatamente si conectado
-            if self.conectado:
-                return self.aplicar_mascara_direccion(mascara)
-            return True
-        except Exception as e:
-            print(f"Error guardando/aplicando máscara $3: {e}")
-            return False
-
-    def aplicar_junction_deviation(self, jd: float | None = None):
-        """Aplica $11 (junction deviation) en GRBL para suavizar esquinas sin bajar velocidad.
-        Valores típicos: 0.02 (fino), 0.05, 0.1 (más redondo)."""
-        try:
-            if self.firmware != 'grbl':
-                return False
-            if jd is None:
-                jd = self.junction_deviation
-            if jd is None:
-                # Valor recomendado para suavizar sin perder precisión excesiva (un poco más suave)
-                jd = 0.15
-            jd = max(0.005, min(1.0, float(jd)))
-            ok = self.enviar_comando(f"$11={jd}")
-            if ok:
-                print(f"GRBL $11 (junction deviation) aplicada: {jd} mm")
-                self.junction_deviation = jd
-            return ok
-        except Exception as e:
-            print(f"Error aplicando junction deviation $11: {e}")
-            return False
-
-    def set_junction_deviation(self, jd: float):
-        """Actualiza y persiste junction deviation ($11)."""
-        try:
-            jd = max(0.005, min(1.0, float(jd)))
-            os.makedirs(os.path.dirname(self.archivo_grbl_config), exist_ok=True)
-            data = {}
-            if os.path.exists(self.archivo_grbl_config):
-                try:
-                    with open(self.archivo_grbl_config, 'r') as f:
-                        data = json.load(f) or {}
-                except Exception:
-                    data = {}
-            data['junction_deviation'] = jd
-            with open(self.archivo_grbl_config, 'w') as f:
-                json.dump(data, f)
-            self.junction_deviation = jd
-            if self.conectado and self.firmware == 'grbl':
-                return self.aplicar_junction_deviation(jd)
-            return True
-        except Exception as e:
-            print(f"Error guardando/aplicando $11: {e}")
-            return False
-        
-    def autodetectar_puerto(self):
-        """Busca automáticamente el puerto donde está conectado el Arduino."""
-        if not SERIAL_OK:
-            print("[AVISO] pyserial no está instalado; no se puede autodetectar puertos.")
-            return None
-        try:
-            import serial.tools.list_ports
-        except Exception:
-            print("[AVISO] No se pudo importar serial.tools.list_ports.")
-            return None
-        
-        puertos = list(serial.tools.list_ports.comports())
-        if not puertos:
-            print("No se encontraron puertos seriales.")
-            return None
-        
-        candidatos = []
-        for puerto in puertos:
-            port_str = str(puerto.device)
-            if "ACM" in port_str or "USB" in port_str or "tty" in port_str:
-                candidatos.append(puerto.device)
-        
-        for candidato in candidatos:
-            if "ACM" in candidato:
-                print(f"Puerto Arduino detectado: {candidato}")
-                return candidato
-        
-        if candidatos:
-            print(f"Puerto posible: {candidatos[0]}")
-            return candidatos[0]
-        
-        for puerto in puertos:
-            if "COM" in puerto.device:
-                print(f"Puerto Windows detectado: {puerto.device}")
-                return puerto.device
-        
-        print("No se pudo identificar un puerto Arduino.")
-        return None
-            
-    def conectar(self):
-        try:
-            if not SERIAL_OK:
-                print("[AVISO] pyserial no está instalado; no se puede establecer conexión serie.")
-                return False
-            # Al conectar, asumir que no hay origen de trabajo establecido aún
-            self.origen_establecido = False
-            self.limites_activos = False
-            if self.puerto is None:
-                self.puerto = self.autodetectar_puerto()
-                if self.puerto is None:
-                    print("No se pudo detectar un puerto para Arduino.")
-                    return False
-            
-            self.conexion = serial.Serial(self.puerto, self.baudrate, timeout=1)
-            time.sleep(2)
-            try:
-                # Limpiar buffers iniciales
-                with self._serial_lock:
-                    self.conexion.reset_input_buffer()
-                    self.conexion.reset_output_buffer()
-            except Exception as e:
-                pass
-            # Intentar identificar firmware con handshake real
-            handshake_ok = False
-            try:
-                with self._serial_lock:
-                    self.conexion.write(b"$I\n")  # Info de GRBL
-                time.sleep(0.2)
-                buf = []
-                inicio = time.time()
-                # Leer hasta 1s esperando alguna respuesta significativa
-                while time.time() - inicio < 1.0:
-                    with self._serial_lock:
-                        if self.conexion.in_waiting:
-                            linea = self.conexion.readline().decode(errors='ignore').strip()
-                        else:
-                            linea = ''
-                    if linea:
-                        buf.append(linea)
-                        if 'Grbl' in linea or linea.lower().startswith('ok'):
-                            handshake_ok = True
-                            self.firmware = 'grbl'
-                            if 'Grbl' in linea:
-                                self.firmware_info = linea
-                            break
-                    else:
-                        time.sleep(0.05)
-            except Exception as e:
-                handshake_ok = False
-
-            # Intentar Marlin si no fue GRBL
-            if not handshake_ok:
-                try:
-                    with self._serial_lock:
-                        self.conexion.write(b"M115\n")
-                    inicio = time.time()
-                    while time.time() - inicio < 1.0 and not handshake_ok:
-                        with self._serial_lock:
-                            if self.conexion.in_waiting:
-                                linea = self.conexion.readline().decode(errors='ignore').strip()
-                            else:
-                                linea = ''
-                        if linea:
-                            if 'FIRMWARE_NAME' in linea or linea.lower().startswith('ok'):
-                                handshake_ok = True
-                                self.firmware = 'marlin'
-                                if 'FIRMWARE_NAME' in linea:
-                                    self.firmware_info = linea
-                                break
-                        else:
-                            time.sleep(0.05)
-                except Exception as e:
-                    handshake_ok = False
-
-            if not handshake_ok:
-                try:
-                    self.conexion.close()
-                except Exception as e:
-                    pass
-                self.conectado = False
-                return False
-
-            # Marcar como conectado y configurar según firmware
-            self.conectado = True
-            if self.firmware == 'grbl':
-                self.enviar_comando("$X")
-                self.enviar_comando("$21=0")  # Desactiva límites duros
-                self.enviar_comando("$20=0")  # Desactiva límites blandos
-                self.override_actual = 100
-                self.aplicar_mascara_direccion()
-                if not self.aplicar_junction_deviation(self.junction_deviation):
-                    try:
-                        self.aplicar_junction_deviation(0.15)
-                    except Exception:
-                        pass
-            self.cargar_velocidad()
-            self.aplicar_velocidad()
-            return True
-        except Exception as e:
-            self.conectado = False
-            return False
-
-
-    def _leer_parametros_grbl(self) -> dict:
-        """Lee $$ y devuelve un dict { 'n': 'valor' } con parámetros de GRBL."""
-        out = {}
-        if not (self.conectado and self.firmware == 'grbl' and self.conexion and self.conexion.is_open):
-            return out
-        try:
-            with self._serial_lock:
-                try:
-                    self.conexion.reset_input_buffer()
-                except Exception:
-                    pass
-                self.conexion.write(b"$$\n")
-            limite = time.time() + 1.2
-            while time.time() < limite:
-                with self._serial_lock:
-                    hay = self.conexion.in_waiting if self.conexion else 0
-                if hay <= 0:
-                    time.sleep(0.02)
-                    continue
-                with self._serial_lock:
-                    linea = self.conexion.readline().decode(errors='ignore').strip()
-                if not linea:
-                    continue
-                if linea.lower() == 'ok':
-                    break
-                if linea.startswith('$') and '=' in linea:
-                    try:
-                        s = linea.split('(')[0].strip()
-                        k, v = s.split('=', 1)
-                        k = k.lstrip('$').strip()
-                        v = v.strip()
-                        if k:
-                            out[k] = v
-                    except Exception:
-                        continue
-        except Exception:
-            pass
-        return out
-
-    def consultar_info_firmware(self) -> str:
-        """Consulta y devuelve una cadena con la información del firmware detectado."""
-        try:
-            if self.firmware == 'grbl':
-                with self._serial_lock:
-                    if self.conexion and self.conexion.is_open:
-                        self.conexion.reset_input_buffer()
-                        self.conexion.write(b"$I\n")
-                time.sleep(0.2)
-                info_line = ""
-                limite = time.time() + 0.6
-                while time.time() < limite:
-                    with self._serial_lock:
-                        if not (self.conexion and self.conexion.in_waiting):
-                            break
-                        linea = self.conexion.readline().decode(errors='ignore').strip()
-                    if 'Grbl' in linea or linea.lower().startswith('['):
-                        info_line = linea
-                        break
-                if info_line:
-                    self.firmware_info = info_line
-                return self.firmware_info or 'GRBL (sin detalles)'
-            elif self.firmware == 'marlin':
-                with self._serial_lock:
-                    if self.conexion and self.conexion.is_open:
-                        self.conexion.reset_input_buffer()
-                        self.conexion.write(b"M115\n")
-                time.sleep(0.2)
-                info_line = ""
-                limite = time.time() + 0.6
-                while time.time() < limite:
-                    with self._serial_lock:
-                        if not (self.conexion and self.conexion.in_waiting):
-                            break
-                        linea = self.conexion.readline().decode(errors='ignore').strip()
-                    if 'FIRMWARE_NAME' in linea:
-                        info_line = linea
-                        break
-                if info_line:
-                    self.firmware_info = info_line
-                return self.firmware_info or 'Marlin (sin detalles)'
-            else:
-                return self.firmware_info or 'Firmware desconocido'
-        except Exception as e:
-            return self.firmware_info or f"No se pudo consultar firmware: {e}"
-            
-    def desconectar(self):
-        if self.conexion and self.conexion.is_open:
-            self.conexion.close()
-            self.conectado = False
-        # Al desconectar, desactivar límites y origen
-        self.origen_establecido = False
-        self.limites_activos = False
-
-    def esta_conectado(self):
-        """Devuelve True solo si hay un puerto serie abierto y operativo.
-        Realiza un ping suave no intrusivo cada ~1s para validar que el dispositivo responde.
-        """
-        if not SERIAL_OK:
-            self.conectado = False
-            return False
-        if not self.conexion or not getattr(self.conexion, 'is_open', False):
-            self.conectado = False
-            return False
-        # Si estamos ejecutando una rutina, evitar pings que puedan interferir
-        if getattr(self, 'ejecutando_rutina', False):
-            self.conectado = True
-            return True
-        ahora = time.time()
-        if (ahora - self._ultimo_ping) < self._intervalo_ping and self.conectado:
-            return True  # usar estado reciente solo si seguía conectado
-        try:
-            # Evitar competir por el puerto mientras se procesa un comando
-            if self._cmd_en_progreso:
-                return self.conectado
-            with self._serial_lock:
-                # Usar un ping seguro y verificar respuesta breve
-                if self.firmware == 'grbl':
-                    self.conexion.write(b"?\n")
-                elif self.firmware == 'marlin':
-                    self.conexion.write(b"M114\n")  # reporte de posición
-                else:
-                    self.conexion.write(b"\n")
-            # Intentar leer algo durante un corto periodo
-            inicio = time.time()
-            recibio = False
-            while time.time() - inicio < 0.4:
-                with self._serial_lock:
-                    hay = self.conexion.in_waiting if self.conexion else 0
-                if hay:
-                    with self._serial_lock:
-                        linea = self.conexion.readline().decode(errors='ignore').strip()
-                    if linea:
-                        if self.firmware == 'grbl':
-                            # GRBL responde con línea de estado <...> o ok
-                            if linea.startswith('<') or linea.lower().startswith('ok'):
-                                recibio = True
-                                break
-                        elif self.firmware == 'marlin':
-                            # Marlin suele responder con posiciones y 'ok'
-                            if 'ok' in linea.lower() or 'x:' in linea.lower():
-                                recibio = True
-                                break
-                        else:
-                            recibio = True
-                            break
-                time.sleep(0.05)
-            self._ultimo_ping = ahora
-            if not recibio:
-                # Debounce de fallos de ping: no cerrar el puerto, mantener estado
-                self._fallos_ping += 1
-                # Solo si hay muchos fallos seguidos, marcar desconexión lógica
-                if self._fallos_ping >= 10:
-                    self.conectado = False
-                    return False
-                # Mantener estado anterior y asumir conexión si el puerto sigue abierto
-                self.conectado = True
-                return True
-            # Éxito: resetear contador de fallos
-            self._fallos_ping = 0
-            return True
-        except Exception:
-            try:
-                self.conexion.close()
-            except Exception:
-                pass
-            self.conectado = False
-            return False
-
-    def cargar_velocidad(self):
-        """Carga el valor de velocidad desde el archivo temporal."""
-        try:
-            if os.path.exists(self.archivo_velocidad):
-                with open(self.archivo_velocidad, 'r') as f:
-                    datos = json.load(f)
-                    nueva_velocidad = datos.get('velocidad', 50)
-                    if nueva_velocidad != self.velocidad_actual:
-                        self.velocidad_actual = nueva_velocidad
-                        return True
-        except Exception as e:
-            print(f"Error al cargar velocidad: {e}")
-        return False
-
-    def aplicar_velocidad(self):
-        """Aplica la velocidad actual al CNC."""
-        # Permitir aplicar si el puerto serie está abierto aunque 'conectado' esté desfasado
-        # No modificar la velocidad mientras una rutina esté en ejecución
-        if getattr(self, 'ejecutando_rutina', False):
-            return False
-        try:
-            puerto_abierto = bool(self.conexion) and bool(getattr(self.conexion, 'is_open', False))
-        except Exception:
-            puerto_abierto = False
-        if not (self.conectado or puerto_abierto):
-            return False
-        try:
-            # Tratar firmware desconocido como GRBL por defecto para permitir override en la mayoría de controladores
-            if self.firmware == 'grbl' or self.firmware == 'desconocido':
-                # Ajustar override de feed en GRBL v1.1 con comandos en tiempo real
-                objetivo = max(10, min(200, int(self.velocidad_actual)))
-                # Limitar rango razonable 10%-200%
-                diff = objetivo - self.override_actual
-                # Atajo: reset a 100 si cambio grande y objetivo cercano a 100
-                if objetivo == 100 and self.override_actual != 100:
-                    try:
-                        with self._serial_lock:
-                            self.conexion.write(b"\x93")  # Reset feed override
-                    except Exception:
-                        pass
-                    self.override_actual = 100
-                    return True
-                paso10 = 0
-                paso1 = 0
-                if diff > 0:
-                    paso10 = diff // 10
-                    paso1 = diff % 10
-                    for _ in range(paso10):
-                        with self._serial_lock:
-                            self.conexion.write(b"\x91")  # +10%
-                        time.sleep(0.02)
-                    for _ in range(paso1):
-                        with self._serial_lock:
-                            self.conexion.write(b"\x94")  # +1%
-                        time.sleep(0.01)
-                elif diff < 0:
-                    diff = -diff
-                    paso10 = diff // 10
-                    paso1 = diff % 10
-                    for _ in range(paso10):
-                        with self._serial_lock:
-                            self.conexion.write(b"\x92")  # -10%
-                        time.sleep(0.02)
-                    for _ in range(paso1):
-                        with self._serial_lock:
-                            self.conexion.write(b"\x95")  # -1%
-                        time.sleep(0.01)
-                self.override_actual = objetivo
-                return True
-            elif self.firmware == 'marlin':
-                # Marlin: M220 Sxx
-                comando = f"M220 S{int(self.velocidad_actual)}"
-                self.enviar_comando(comando)
-                return True
-            else:
-                # Fallback conservador: intentar patrón GRBL
-                objetivo = max(10, min(200, int(self.velocidad_actual)))
-                diff = objetivo - self.override_actual
-                if objetivo == 100 and self.override_actual != 100:
-                    try:
-                        with self._serial_lock:
-                            self.conexion.write(b"\x93")
-                    except Exception:
-                        pass
-                    self.override_actual = 100
-                    return True
-                if diff != 0:
-                    if diff > 0:
-                        paso10 = diff // 10
-                        paso1 = diff % 10
-                        for _ in range(paso10):
-                            with self._serial_lock:
-                                self.conexion.write(b"\x91")
-                            time.sleep(0.02)
-                        for _ in range(paso1):
-                            with self._serial_lock:
-                                self.conexion.write(b"\x94")
-                            time.sleep(0.01)
-                    else:
-                        diff = -diff
-                        paso10 = diff // 10
-                        paso1 = diff % 10
-                        for _ in range(paso10):
-                            with self._serial_lock:
-                                self.conexion.write(b"\x92")
-                            time.sleep(0.02)
-                        for _ in range(paso1):
-                            with self._serial_lock:
-                                self.conexion.write(b"\x95")
-                            time.sleep(0.01)
-                    self.override_actual = objetivo
-                    return True
-        except Exception as e:
-            print(f"Error aplicando velocidad: {e}")
-            return False
-        return False
-
-    # --- Estado GRBL: parseo y consulta ligera ---
-    def _parsear_estado_grbl(self, linea: str):
-        """Parsea una línea de estado de GRBL (<...>) para extraer Ov y F/FS.
-        Actualiza self.ov_feed, self.ov_rapid, self.ov_spindle y self.feed_reportado.
-        """
-        try:
-            if not linea or not linea.startswith('<'):
-                return
-            # Ejemplos:
-            # <Run|MPos:0.000,0.000,0.000|FS:500,0|Ov:120,100,100>
-            # <Idle|WPos:..|F:600|Ov:100,100,100>
-            parts = linea.strip('<>').split('|')
-            for p in parts:
-                if p.startswith('Ov:'):
-                    try:
-                        vals = p[3:].split(',')
-                        if len(vals) >= 3:
-                            self.ov_feed = int(float(vals[0]))
-                            self.ov_rapid = int(float(vals[1]))
-                            self.ov_spindle = int(float(vals[2]))
-                            # Mantener override_actual alineado al estado real reportado por GRBL
-                            try:
-                                if 0 < self.ov_feed <= 250:
-                                    self.override_actual = int(self.ov_feed)
-                            except Exception:
-                                pass
-                    except Exception:
-                        pass
-                elif p.startswith('FS:'):
-                    try:
-                        vals = p[3:].split(',')
-                        if vals:
-                            self.feed_reportado = float(vals[0])
-                    except Exception:
-                        pass
-                elif p.startswith('F:'):
-                    try:
-                        self.feed_reportado = float(p[2:])
-                    except Exception:
-                        pass
-        except Exception:
-            pass
-
-    def obtener_estado_velocidad(self):
-        """Consulta (ligero) el estado para conocer override y feed actuales en GRBL.
-        Devuelve (ov_feed:int, feed_reportado:float|0).
-        """
-        try:
-            firmware_tipo = getattr(self, 'firmware', 'desconocido')
-            
-            if self.firmware != 'grbl':
-                # Para firmware no-GRBL, usar override_actual si ejecutando rutina
-                # Si no, usar velocidad_actual para reflejar el slider
-                if getattr(self, 'ejecutando_rutina', False):
-                    try:
-                        ov = int(getattr(self, 'override_actual', 100))
-                    except Exception:
-                        ov = 100
-                else:
-                    try:
-                        ov = int(getattr(self, 'velocidad_actual', 100))
-                    except Exception:
-                        ov = 100
-                f = getattr(self, 'feed_reportado', 0.0)
-                return ov, f
-            
-            # Para GRBL, usar lógica original
-            ov = self.ov_feed if isinstance(getattr(self, 'ov_feed', None), int) else 0
-            f = self.feed_reportado
-            ahora = time.time()
-            if (ahora - self._last_status_poll) < self._status_poll_interval:
-                return ov, f
-            self._last_status_poll = ahora
-            # Enviar '?' y leer brevemente
-            with self._serial_lock:
-                if self.conexion and getattr(self.conexion, 'is_open', False):
-                    self.conexion.write(b"?\n")
-            time.sleep(0.03)
-            limite = time.time() + 0.08
-            while time.time() < limite:
-                with self._serial_lock:
-                    if not (self.conexion and self.conexion.in_waiting):
-                        break
-                    linea = self.conexion.readline().decode(errors='ignore').strip()
-                if linea:
-                    self._parsear_estado_grbl(linea)
-            # Fallback a override_actual si GRBL no reporta Ov
-            ov_local = self.ov_feed
-            if not ov_local:
-                try:
-                    ov_local = int(getattr(self, 'override_actual', 0))
-                except Exception:
-                    ov_local = 0
-            return ov_local, self.feed_reportado
-        except Exception as e:
-            # En caso de error, devolver velocidad_actual si no está ejecutando rutina
-            if getattr(self, 'ejecutando_rutina', False):
-                try:
-                    ov = int(getattr(self, 'override_actual', 100))
-                except Exception:
-                    ov = 100
-            else:
-                try:
-                    ov = int(getattr(self, 'velocidad_actual', 100))
-                except Exception:
-                    ov = 100
-            f = getattr(self, 'feed_reportado', 0.0)
-            return ov, f
-
-    # --- Respaldo y restauración de configuración ($$) ---
-    def guardar_configuracion_grbl(self, ruta: str | None = None):
-        """Solicita $$ y guarda la configuración de GRBL en un archivo JSON.
-        Si ruta no se especifica, crea un nombre con timestamp y además actualiza grbl_backup_last.json.
-        Devuelve (ok: bool, mensaje_ruta_o_error: str)
-        """
-        try:
-            if not (self.conectado and self.firmware == 'grbl' and self.conexion and self.conexion.is_open):
-                return False, "CNC no conectada o firmware no es GRBL"
-            # Limpiar buffer y pedir $$
-            with self._serial_lock:
-                try:
-                    self.conexion.reset_input_buffer()
-                except Exception:
-                    pass
-                self.conexion.write(b"$$\n")
-            lineas = []
-            limite = time.time() + 2.0
-            while time.time() < limite:
-                with self._serial_lock:
-                    hay = self.conexion.in_waiting if self.conexion else 0
-                if hay:
-                    with self._serial_lock:
-                        l = self.conexion.readline().decode(errors='ignore').strip()
-                    if l:
-                        # Termina con ok
-                        if l.lower() == 'ok':
-                            break
-                        lineas.append(l)
-                else:
-                    time.sleep(0.02)
-            # Parsear parámetros $n=v (desc)
-            params = {}
-            for l in lineas:
-                if not l.startswith('$'):
-                    continue
-                try:
-                    s = l.split('(')[0].strip()
-                    if '=' in s:
-                        k, v = s.split('=', 1)
-                        k = k.lstrip('$').strip()
-                        v = v.strip()
-                        if k.isdigit():
-                            params[k] = v
-                except Exception:
-                    continue
-            if not params:
-                return False, "No se pudo leer configuración $$"
-            data = {
-                'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
-                'puerto': self.puerto,
-                'firmware': self.firmware_info or self.firmware,
-                'raw': lineas,
-                'params': params,
-            }
-            # Ruta de salida
-            try:
-                os.makedirs(BASE_DIR, exist_ok=True)
-            except Exception:
-                pass
-            if not ruta:
-                stamp = time.strftime("%Y%m%d-%H%M%S")
-                ruta = os.path.join(BASE_DIR, f"grbl_backup_{stamp}.json")
-            with open(ruta, 'w') as f:
-                json.dump(data, f, indent=2)
-            # También actualizar puntero al último respaldo
-            try:
-                ruta_last = os.path.join(BASE_DIR, 'grbl_backup_last.json')
-                with open(ruta_last, 'w') as f:
-                    json.dump(data, f, indent=2)
-            except Exception:
-                pass
-            return True, ruta
-        except Exception as e:
-            return False, f"Error guardando $$: {e}"
-
-    def restablecer_configuracion_grbl(self, ruta: str | None = None):
-        """Lee un archivo JSON de respaldo y aplica los parámetros $n=v a GRBL.
-        Si ruta es None, usa grbl_backup_last.json. Devuelve (ok, mensaje_detalle).
-        """
-        try:
-            if not (self.conectado and self.firmware == 'grbl' and self.conexion and self.conexion.is_open):
-                return False, "CNC no conectada o firmware no es GRBL"
-            if not ruta:
-                ruta = os.path.join(BASE_DIR, 'grbl_backup_last.json')
-            if not os.path.exists(ruta):
-                # Buscar el más reciente grbl_backup_*.json
-                candidatos = [p for p in os.listdir(BASE_DIR) if p.startswith('grbl_backup_') and p.endswith('.json')]
-                if candidatos:
-                    candidatos.sort(reverse=True)
-                    ruta = os.path.join(BASE_DIR, candidatos[0])
-                else:
-                    return False, "No hay respaldos para restaurar"
-            with open(ruta, 'r') as f:
-                data = json.load(f)
-            params = (data or {}).get('params') or {}
-            if not params:
-                return False, "Respaldo inválido (sin params)"
-            enviados = 0
-            ok_count = 0
-            for k, v in params.items():
-                cmd = f"${k}={v}"
-                enviados += 1
-                try:
-                    if self.enviar_comando(cmd):
-                        ok_count += 1
-                except Exception:
-                    pass
-                time.sleep(0.03)
-            return True, f"Aplicados {ok_count}/{enviados} parámetros desde {os.path.basename(ruta)}"
-        except Exception as e:
-            return False, f"Error restaurando $$: {e}"
-            
-    def verificar_cambios_velocidad(self):
-        """Verifica si hay cambios en el archivo de velocidad y los aplica."""
-        tiempo_actual = time.time()
-        if tiempo_actual - self.ultimo_tiempo_verificacion >= self.intervalo_verificacion:
-            self.ultimo_tiempo_verificacion = tiempo_actual
-            # Durante ejecución de rutina, verificar si velocidad_actual difiere de override_actual
-            if getattr(self, 'ejecutando_rutina', False):
-                objetivo = max(10, min(200, int(self.velocidad_actual)))
-                if objetivo != self.override_actual:
-                    try:
-                        if self.firmware == 'grbl' or self.firmware == 'desconocido':
-                            diff = objetivo - self.override_actual
-                            if diff > 0:
-                                paso10 = diff // 10
-                                paso1 = diff % 10
-                                for _ in range(paso10):
-                                    with self._serial_lock:
-                                        if self.conexion and getattr(self.conexion, 'is_open', False):
-                                            self.conexion.write(b"\x91")  # +10%
-                                    time.sleep(0.01)
-                                for _ in range(paso1):
-                                    with self._serial_lock:
-                                        if self.conexion and getattr(self.conexion, 'is_open', False):
-                                            self.conexion.write(b"\x94")  # +1%
-                                    time.sleep(0.005)
-                            elif diff < 0:
-                                diff = -diff
-                                paso10 = diff // 10
-                                paso1 = diff % 10
-                                for _ in range(paso10):
-                                    with self._serial_lock:
-                                        if self.conexion and getattr(self.conexion, 'is_open', False):
-                                            self.conexion.write(b"\x92")  # -10%
-                                    time.sleep(0.01)
-                                for _ in range(paso1):
-                                    with self._serial_lock:
-                                        if self.conexion and getattr(self.conexion, 'is_open', False):
-                                            self.conexion.write(b"\x95")  # -1%
-                                    time.sleep(0.005)
-                            self.override_actual = objetivo
-                            return True, self.velocidad_actual
-                        elif self.firmware == 'marlin':
-                            comando = f"M220 S{int(self.velocidad_actual)}"
-                            self.enviar_comando(comando)
-                            self.override_actual = objetivo
-                            return True, self.velocidad_actual
-                    except Exception as e:
-                        print(f"Error aplicando velocidad durante rutina: {e}")
-                return False, self.velocidad_actual
-            # Fuera de rutina, usar cargar_velocidad y aplicar_velocidad
-            if self.cargar_velocidad():
-                return self.aplicar_velocidad(), self.velocidad_actual
-        return False, self.velocidad_actual
-
-    def guardar_posicion(self, forzar=False):
-        """Guarda la posición actual en un archivo de texto."""
-        tiempo_actual = time.time()
-        if forzar or (tiempo_actual - self.ultimo_guardado >= INTERVALO_GUARDADO):
-            self.ultimo_guardado = tiempo_actual
-            try:
-                with open(os.path.join(BASE_DIR, 'save.txt'), 'w') as f:
-                    f.write(f"{self.posicion_x},{self.posicion_y}")
-                print(f"Posición guardada: X={self.posicion_x}, Y={self.posicion_y}")
-                return True
-            except Exception as e:
-                print(f"Error al guardar posición: {e}")
-        return False
-
-    def cargar_posicion(self):
-        """Carga la última posición guardada desde el archivo."""
-        try:
-            save_path = os.path.join(BASE_DIR, 'save.txt')
-            if os.path.exists(save_path):
-                with open(save_path, 'r') as f:
-                    contenido = f.read().strip()
-                    if ',' in contenido:
-                        x, y = map(float, contenido.split(','))
-                        return x, y
-        except Exception as e:
-            print(f"Error al cargar posición: {e}")
-        return None, None
-
-    def establecer_posicion_guardada(self):
-        """Establece el origen en la última posición guardada."""
-        x, y = self.cargar_posicion()
-        if x is not None and y is not None:
-            dx = x - self.posicion_x
-            dy = y - self.posicion_y
-            
-            comando = f"G92 X{x} Y{y}"
-            if self.enviar_comando(comando):
-                self.posicion_x = x
-                self.posicion_y = y
-                return True
-        return False
-
-
-
-
-    def _leer_status_line(self, timeout: float = 0.2) -> str:
-        """Envía '?' y devuelve una línea de estado <...> si se recibe dentro del timeout."""
-        if not (self.conectado and self.conexion and self.conexion.is_open):
-            return ""
-        try:
-            with self._serial_lock:
-                self.conexion.write(b"?\n")
-            fin = time.time() + timeout
-            while time.time() < fin:
-                with self._serial_lock:
-                    hay = self.conexion.in_waiting if self.conexion else 0
-                if hay:
-                    with self._serial_lock:
-                        linea = self.conexion.readline().decode(errors='ignore').strip()
-                    if linea.startswith('<'):
-                        return linea
-                time.sleep(0.02)
-        except Exception:
-            return ""
-        return ""
-
-    def _publicar_evento(self, tipo: str, datos: dict | None = None):
-        try:
-            with self._event_lock:
-                self._eventos.append({'tipo': tipo, 'datos': datos or {}, 'ts': time.time()})
-        except Exception:
-            pass
-
-    def consumir_eventos(self) -> list:
-        try:
-            with self._event_lock:
-                evs = list(self._eventos)
-                self._eventos.clear()
-                return evs
-        except Exception:
-            return []
-            
-    def enviar_comando(self, comando):
-        # Control extra: asegurar que _cmd_en_progreso nunca quede activado indefinidamente
-        self.set_cmd_en_progreso(True)
-        try:
-            if not self.conectado:
-                if self.conexion and getattr(self.conexion, 'is_open', False):
-                    self.conectado = True
-                else:
-                    self.set_cmd_en_progreso(False)
-                    return False
-            comando = comando.strip() + "\n"
-            # Control de modos G90/G91 si vienen en el comando
-            try:
-                tokens = comando.strip().split()
-                if any(t.upper() == 'G91' for t in tokens):
-                    self.modo_relativo = True
-                elif any(t.upper() == 'G90' for t in tokens):
-                    self.modo_relativo = False
-            except Exception:
-                pass
-            # Enforce soft-limits si origen establecido y límites activos, solo para G0/G1 (sin inversiones)
-            try:
-                if not self._movimiento_permitido(comando):
-                    self.set_cmd_en_progreso(False)
-                    return False
-            except Exception:
-                pass
-            with self._serial_lock:
-                self.conexion.write(comando.encode())
-            # Leer hasta 'ok' o agotar timeout
-            respuesta = ""
-            ok_recibido = False
-            alarm_detectada = False
-            inicio = time.time()
-            while time.time() - inicio < 1.5:
-                with self._serial_lock:
-                    linea = self.conexion.readline().decode(errors='ignore').strip()
-                if not linea:
-                    continue
-                respuesta = linea
-                # Detección de alarmas o límites duros
-                lcl = linea.lower()
-                if lcl.startswith('alarm') or 'hard limit' in lcl or ('alarm' in lcl and '<' not in linea):
-                    alarm_detectada = True
-                    break
-                if linea.lower().startswith('ok') or 'ok' == linea.lower():
-                    ok_recibido = True
-                    break
-            print(f"Enviado: {comando.strip()}, Respuesta: {respuesta}")
-            if alarm_detectada or '[MSG:Reset to continue]' in respuesta:
-                print("[ALARM] Detectada. Enviando $X para desbloquear GRBL.")
-                with self._serial_lock:
-                    self.conexion.write(b'$X\n')
-                # Leer respuesta de desbloqueo
-                time.sleep(0.2)
-                try:
-                    linea = self.conexion.readline().decode(errors='ignore').strip()
-                    print(f"Respuesta a $X: {linea}")
-                except Exception:
-                    pass
-            if ok_recibido and (comando.startswith("G0") or comando.startswith("G1")):
-                self.actualizar_posicion(comando)
-            return ok_recibido
-        except (OSError, IOError) as e:
-            # Error de I/O: probablemente se desconectó el Arduino
-            print(f"Error de I/O al enviar comando: {e}")
-            self.conectado = False
-            try:
-                if self.conexion:
-                    self.conexion.close()
-            except:
-                pass
-            return False
-        except Exception as e:
-            print(f"Error al enviar comando: {e}")
-            return False
-        finally:
-            # Bloque finally vacío, ya no se usa _cmd_en_progreso
-            pass
-
-    def _movimiento_permitido(self, cmd: str) -> bool:
-        """Valida que un comando G0/G1 no salga de los límites lógicos [-20..20]."""
-        try:
-            cmd_str = cmd.strip()
-            if not (self.origen_establecido and self.limites_activos):
-                return True
-            if not (cmd_str.upper().startswith('G0') or cmd_str.upper().startswith('G1')):
-                return True
-            objetivo_x = self.posicion_x
-            objetivo_y = self.posicion_y
-            x_presente = False
-            y_presente = False
-            for parte in cmd_str.split():
-                up = parte.upper()
-                if up.startswith('X'):
-                    x_presente = True
-                    try:
-                        val = float(parte[1:])
-                    except Exception:
-                        val = 0.0
-                    if self.modo_relativo:
-                        objetivo_x = self.posicion_x + val
-                    else:
-                        objetivo_x = val
-                elif up.startswith('Y'):
-                    y_presente = True
-                    try:
-                        val = float(parte[1:])
-                    except Exception:
-                        val = 0.0
-                    if self.modo_relativo:
-                        objetivo_y = self.posicion_y + val
-                    else:
-                        objetivo_y = val
-            lim_x_min = self.limite_x_min
-            lim_x_max = self.limite_x_max
-            lim_y_min = self.limite_y_min
-            lim_y_max = self.limite_y_max
-            check_x = objetivo_x
-            check_y = objetivo_y
-            violacion = False
-            detalles = []
-            if x_presente and (check_x < lim_x_min or check_x > lim_x_max):
-                violacion = True
-                detalles.append(f"X={check_x:.2f} fuera de [{lim_x_min:.2f}, {lim_x_max:.2f}]")
-            if y_presente and (check_y < lim_y_min or check_y > lim_y_max):
-                violacion = True
-                detalles.append(f"Y={check_y:.2f} fuera de [{lim_y_min:.2f}, {lim_y_max:.2f}]")
-            if violacion:
-                msg = "Movimiento bloqueado por límites: " + "; ".join(detalles)
-                self.ultimo_limite = msg
-                if self.debug_limites:
-                    print(msg)
-                return False
-            return True
-        except Exception:
-            return True
-
-    def _write_line_fast(self, linea: str) -> bool:
-        """Escribe una línea al puerto sin esperar 'ok'."""
-        try:
-            if not (self.conectado and self.conexion and getattr(self.conexion, 'is_open', False)):
-                return False
-            with self._serial_lock:
-                self.conexion.write((linea.strip() + "\n").encode())
-            return True
-        except (OSError, IOError) as e:
-            # Error de I/O: probablemente se desconectó el Arduino
-            print(f"Error de I/O en _write_line_fast: {e}")
-            self.conectado = False
-            try:
-                if self.conexion:
-                    self.conexion.close()
-            except:
-                pass
-            return False
-        except Exception as e:
-            print(f"Error en _write_line_fast: {e}")
-            return False
-
-    def _drain_ok_nonblock(self, max_ms: float = 60.0) -> int:
-        """Lee respuestas disponibles sin bloquear mucho tiempo. Devuelve cuántos 'ok' se leyeron."""
-        if not (self.conectado and self.conexion and getattr(self.conexion, 'is_open', False)):
-            return 0
-        ok_count = 0
-        fin = time.time() + (max_ms / 1000.0)
-        while time.time() < fin:
-            try:
-                with self._serial_lock:
-                    hay = self.conexion.in_waiting if self.conexion else 0
-            except Exception:
-                hay = 0
-            if hay <= 0:
-                time.sleep(0.002)
-                continue
-            try:
-                with self._serial_lock:
-                    linea = self.conexion.readline().decode(errors='ignore').strip()
-            except Exception:
-                linea = ''
-            if not linea:
-                continue
-            if linea.lower().startswith('ok') or ' ok' in linea.lower():
-                ok_count += 1
-        return ok_count
-
-    def paro_emergencia(self):
-        """Detiene la máquina preservando el origen (sin reset de GRBL).
-        Enviar '!' (Feed Hold) como comando en tiempo real y cancelar jog (0x85) si aplica.
-        """
-        if not (self.conectado and self.conexion and self.conexion.is_open):
-            print("paro_emergencia(): No hay conexión activa")
-            return False
-        try:
-            # Feed hold: pausa segura sin perder G92 ni offsets
-            with self._serial_lock:
-                self.conexion.write(b"!")
-            # Si estuviera en jogging, enviar cancel (0x85)
-            try:
-                with self._serial_lock:
-                    self.conexion.write(b"\x85")
-            except Exception:
-                pass
-            print("Paro de emergencia enviado: Feed Hold ('!') + Cancel Jog (0x85)")
-            self.en_hold = True
-            return True
-        except Exception as e:
-            print(f"Error en paro_emergencia(): {e}")
-            return False
-
-    def reanudar_movimiento(self):
-        """Reanuda el movimiento después de un Feed Hold enviando '~' (Cycle Start)."""
-        if not (self.conectado and self.conexion and self.conexion.is_open):
-            print("reanudar_movimiento(): No hay conexión activa")
-            return False
-        try:
-            with self._serial_lock:
-                self.conexion.write(b"~")
-            self.en_hold = False
-            print("Reanudar enviado: '~' (Cycle Start)")
-            return True
-        except Exception as e:
-            print(f"Error en reanudar_movimiento(): {e}")
-            return False
-            
-    def actualizar_posicion(self, comando):
-        partes = comando.split()
-        dx_calc = None
-        dy_calc = None
-        for parte in partes:
-            if parte.startswith("X"):
-                try:
-                    val = float(parte[1:])
-                    if self.modo_relativo:
-                        self.posicion_x += val
-                        dx_calc = val
-                    else:
-                        dx_calc = val - self.posicion_x
-                        self.posicion_x = val
-                except ValueError:
-                    pass
-            elif parte.startswith("Y"):
-                try:
-                    val = float(parte[1:])
-                    if self.modo_relativo:
-                        self.posicion_y += val
-                        dy_calc = val
-                    else:
-                        dy_calc = val - self.posicion_y
-                        self.posicion_y = val
-                except ValueError:
-                    pass
-        try:
-            if dx_calc is not None and dx_calc != 0:
-                self._ultimo_dir_x = 1.0 if dx_calc > 0 else -1.0
-            if dy_calc is not None and dy_calc != 0:
-                self._ultimo_dir_y = 1.0 if dy_calc > 0 else -1.0
-        except Exception:
-            pass
-        
-    def mover(self, direccion_x=0, direccion_y=0):
-        """
-        Mueve el CNC en modo relativo.
-        Construye correctamente comandos GRBL solo con ejes que se mueven y coord. [-20..20] desde el origen.
-        """
-        if not self.conectado:
-            print("mover(): No hay conexión activa")
-            return False
-        if getattr(self, 'abortado_por_limite', False) or getattr(self, 'en_hold', False):
-            print("mover(): Bloqueado por activación de límite o hold")
-            return False
-        if direccion_x == 0 and direccion_y == 0:
-            print("mover(): Sin movimiento (ambos ejes en 0)")
-            return False
-        # Validación de límites suaves si están activos y se ha establecido el origen
-        if self.origen_establecido and self.limites_activos:
-            # Calcular posición futura física en el mismo espacio [-20..20] desde el origen
-            futuro_x = self.posicion_x
-            futuro_y = self.posicion_y
-            if direccion_x != 0:
-                futuro_x += direccion_x * self.paso
-            if direccion_y != 0:
-                futuro_y += direccion_y * self.paso
-            lim_x_min = self.limite_x_min
-            lim_x_max = self.limite_x_max
-            lim_y_min = self.limite_y_min
-            lim_y_max = self.limite_y_max
-            if (
-                futuro_x < lim_x_min or futuro_x > lim_x_max or
-                futuro_y < lim_y_min or futuro_y > lim_y_max
-            ):
-                print("mover(): Movimiento bloqueado por límites suaves")
-                # No mostrar popup modal; sólo cancelar la acción
-                return False
-        
-        self.enviar_comando("G91")
-        self.modo_relativo = True
-        
-        partes_comando = ["G0"]
-        
-        if direccion_x != 0:
-            desplazamiento_x = direccion_x * self.paso
-            partes_comando.append(f"X{desplazamiento_x}")
-            print(f"Movimiento en X: {desplazamiento_x}")
-        
-        if direccion_y != 0:
-            desplazamiento_y = direccion_y * self.paso
-            partes_comando.append(f"Y{desplazamiento_y}")
-            print(f"Movimiento en Y: {desplazamiento_y}")
-        
-        comando = " ".join(partes_comando)
-        print(f"Comando GRBL generado: {comando}")
-        
-        resultado = self.enviar_comando(comando)
-        if not resultado:
-            print("[PARO DE EMERGENCIA] Fallo al enviar comando de movimiento")
-            self.paro_emergencia()
-        self.enviar_comando("G90")
-        self.modo_relativo = False
-        return resultado
-        
-    def ir_a_home(self):
-        if not self.conectado:
-            print("ir_a_home(): No hay conexión activa")
-            return False
-        self.enviar_comando("G90")
-        self.modo_relativo = False
-        resultado = self.enviar_comando("G0 X0 Y0")
-        if resultado:
-            self.posicion_x = self.posicion_y = 0.0
-            # No cambies origen_establecido aquí; Home no crea G92
-        return resultado
-        
-    def establecer_origen(self):
-        if not self.conectado:
-            print("establecer_origen(): No hay conexión activa")
-            return False
-        resultado = self.enviar_comando("G92 X0 Y0")
-        if resultado:
-            self.posicion_x = self.posicion_y = 0.0
-            self.guardar_posicion(forzar=True)
-            self.origen_establecido = True
-            # Activar límites estándar lógicos [-20..20] al fijar origen
-            try:
-                self.activar_limites_estandar()
-            except Exception:
-                self.limites_activos = True
-        return resultado
-
-    def activar_limites_estandar(self, xmin: float = -20.0, ymin: float = -20.0, xmax: float = 20.0, ymax: float = 20.0):
-        """Activa límites lógicos relativos al origen en el rango [-20..20] por eje."""
-        self.limite_x_min = float(xmin)
-        self.limite_y_min = float(ymin)
-        self.limite_x_max = float(xmax)
-        self.limite_y_max = float(ymax)
-        self.limites_activos = True
-
-    def obtener_posicion_logica(self):
-        """Devuelve (X, Y) en [-20..20] desde el punto de origen establecido (sin inversión).
-        Si no hay límites activos/origen, devuelve la posición actual.
-        """
-        try:
-            if not getattr(self, 'origen_establecido', False) or not getattr(self, 'limites_activos', False):
-                return float(self.posicion_x), float(self.posicion_y)
-            lim_x_min = float(getattr(self, 'limite_x_min', -20.0) or -20.0)
-            lim_x_max = float(getattr(self, 'limite_x_max', 20.0) or 20.0)
-            lim_y_min = float(getattr(self, 'limite_y_min', -20.0) or -20.0)
-            lim_y_max = float(getattr(self, 'limite_y_max', 20.0) or 20.0)
-            x_log = max(lim_x_min, min(lim_x_max, float(self.posicion_x)))
-            y_log = max(lim_y_min, min(lim_y_max, float(self.posicion_y)))
-            return x_log, y_log
-            return x_log, y_log
-        except Exception:
-            # Fallback seguro
-            return float(self.posicion_x), float(self.posicion_y)
-        
-    def _invertir_linea_abs(self, linea: str, lim_max: float = 40.0) -> str:
-        """Invierte la coordenada X en modo absoluto (para sistema centrado en 0).
-        Para coordenadas centradas [-20, 20]: X_invertido = -X
-        """
-        try:
-            # Buscar coordenada X en la línea
-            partes = linea.split()
-            nueva_linea = []
-            
-            for parte in partes:
-                if parte.upper().startswith('X'):
-                    try:
-                        # Extraer el valor de X
-                        x_str = parte[1:]  # Quitar la 'X'
-                        x_val = float(x_str)
-                        # Invertir: X_nuevo = -X_original
-                        x_invertido = -x_val
-                        # Reemplazar con el valor invertido
-                        nueva_linea.append(f'X{x_invertido:.3f}')
-                    except ValueError:
-                        # Si no se puede convertir, dejar como está
-                        nueva_linea.append(parte)
-                else:
-                    nueva_linea.append(parte)
-            
-            return ' '.join(nueva_linea)
-        except Exception as e:
-            print(f"Error al invertir línea absoluta: {e}")
-            return linea
+        pygame.draw.rect(superficie, BLANCO, self.rect)
+        pygame.draw.rect(superficie, color_borde, self.rect, 2)
+        
+        # Dibujar texto
+        texto_surface = self.fuente.render(self.texto, True, NEGRO)
+        superficie.blit(texto_surface, (self.rect.x + 5, self.rect.y + (self.rect.height - texto_surface.get_height()) // 2))
 
-    def _invertir_linea_rel(self, linea: str) -> str:
-        """Invierte la coordenada X en modo relativo.
-        Para movimientos relativos: X_invertido = -X
-        """
-        try:
-            # Buscar coordenada X en la línea
-            partes = linea.split()
-            nueva_linea = []
-            
-            for parte in partes:
-                if parte.upper().startswith('X'):
-                    try:
-                        # Extraer el valor de X
-                        x_str = parte[1:]  # Quitar la 'X'
-                        x_val = float(x_str)
-                        # Invertir: X_nuevo = -X_original
-                        x_invertido = -x_val
-                        # Reemplazar con el valor invertido
-                        nueva_linea.append(f'X{x_invertido:.3f}')
-                    except ValueError:
-                        # Si no se puede convertir, dejar como está
-                        nueva_linea.append(parte)
-                else:
-                    nueva_linea.append(parte)
-            
-            return ' '.join(nueva_linea)
-        except Exception as e:
-            print(f"Error al invertir línea relativa: {e}")
-            return linea
+    def firma_visual(self):
+        return (tuple(self.rect), self.etiqueta, self.texto, self.activo)
 
-    def ejecutar_archivo_gcode(self, ruta_archivo, base_tiempo=1, es_rutina_1_1=False, invert: bool = False):
-        if not self.conectado:
-            print("ejecutar_archivo_gcode(): No hay conexión con el Arduino")
-            return False
-        # Guardar: no ejecutar rutinas si no se ha establecido el origen
-        if not getattr(self, 'origen_establecido', False):
-            print("ejecutar_archivo_gcode(): Bloqueado. Aún no se ha establecido Punto de Origen (G92)")
-            try:
-                mostrar_aviso_sistema("Aviso", "Aún no se ha establecido Punto de Origen")
-            except Exception:
-                pass
-            return False
-        try:
-            self.ejecutando_rutina = True
-            # Ir al punto de origen antes de comenzar la rutina
-            try:
-                self.enviar_comando("G90")
-                self.enviar_comando("G0 X0 Y0")
-                # Asegurar feed definido para G1
-                try:
-                    self.enviar_comando(f"G1 F{int(self.feed_base)}")
-                except Exception:
-                    pass
-            except Exception:
-                pass
-            with open(ruta_archivo, 'r') as archivo:
-                crudas = archivo.readlines()
-                lineas = []
-                for l in crudas:
-                    s = limpiar_linea_gcode(l)
-                    if s:
-                        lineas.append(s)
-            linea_actual = circulo_actual = 0
-            # Seguir modo para invertir solo en absolutas
-            absoluto = True
-            inflight = 0
-            ventana = 12
-            for linea in lineas:
-                if getattr(self, 'abortado_por_limite', False):
-                    print("Ejecución abortada por límite")
-                    break
-                # Pausa reactiva si hay feed hold activo
-                while getattr(self, 'en_hold', False):
-                    time.sleep(0.05)
-                # Aplicar cambios de velocidad ocasionalmente
-                if (linea_actual % 5) == 0:
-                    self.verificar_cambios_velocidad()
-                
-                linea_actual += 1
-                if es_rutina_1_1 and ("G2" in linea or "G3" in linea):
-                    circulo_actual += 1
-                token0 = linea.split()[0] if linea else ""
-                if token0.upper() == 'G90':
-                    absoluto = True
-                elif token0.upper() == 'G91':
-                    absoluto = False
-                to_send = linea
-                if invert and (token0.upper() in ('G0', 'G1')):
-                    if absoluto:
-                        to_send = self._invertir_linea_abs(linea)
-                    else:
-                        to_send = self._invertir_linea_rel(linea)
-                if token0.upper() == 'G1':
-                    # Extraer feed rate si está presente en el comando
-                    try:
-                        import re
-                        match = re.search(r'F([\d.]+)', to_send, re.IGNORECASE)
-                        if match:
-                            self.feed_reportado = float(match.group(1))
-                    except Exception:
-                        pass
-                    if self._write_line_fast(to_send):
-                        inflight += 1
-                    if inflight >= ventana:
-                        okc = self._drain_ok_nonblock(80)
-                        if okc:
-                            inflight = max(0, inflight - okc)
-                else:
-                    # Antes de comandos bloqueantes, drenar pendientes
-                    if inflight > 0:
-                        tlim = time.time() + 1.0
-                        while inflight > 0 and time.time() < tlim:
-                            okc = self._drain_ok_nonblock(80)
-                            if okc:
-                                inflight = max(0, inflight - okc)
-                            else:
-                                time.sleep(0.01)
-                    self.enviar_comando(to_send)
-                if (linea_actual % 10) == 0:
-                    self.guardar_posicion()
-            # Regresar al punto de origen al finalizar la rutina
-            try:
-                # Drenar 'ok' pendientes
-                if inflight > 0:
-                    tlim = time.time() + 2.0
-                    while inflight > 0 and time.time() < tlim:
-                        okc = self._drain_ok_nonblock(120)
-                        if okc:
-                            inflight = max(0, inflight - okc)
-                        else:
-                            time.sleep(0.01)
-                self.enviar_comando("G90")
-                self.enviar_comando("G0 X0 Y0")
-            except Exception:
-                pass
-            return False if getattr(self, 'abortado_por_limite', False) else True
-        except Exception as e:
-            print(f"Error al ejecutar archivo G-code: {e}")
+    def manejar_clic(self, pos):
+        if self.rect.collidepoint(pos):
+            self.activo = True
+            return True
+        else:
+            self.activo = False
             return False
-        finally:
-            self.ejecutando_rutina = False
 
-    def ejecutar_lineas_gcode(self, lineas, base_tiempo=0.5, invert: bool = False):
-        """Ejecuta una lista de líneas G-code en memoria.
-        Respeta el override de velocidad (M220) y verifica cambios en tiempo real.
-        Aplica guard de origen.
-        """
-        if not self.conectado:
-            print("ejecutar_lineas_gcode(): No hay conexión con el Arduino")
-            return False
-        if not getattr(self, 'origen_establecido', False):
-            print("ejecutar_lineas_gcode(): Bloqueado. Aún no se ha establecido Punto de Origen (G92)")
-            try:
-                mostrar_aviso_sistema("Aviso", "Aún no se ha establecido Punto de Origen")
-            except Exception:
-                pass
-            return False
+    def agregar_caracter(self, caracter):
+        if len(self.texto) < 50:  # Límite más alto para nombres completos
+            self.texto += caracter
+
+    def borrar_caracter(self):
+        if self.texto:
+            self.texto = self.texto[:-1]
+
+    def obtener_valor(self):
+        return self.texto
+
+class ConexionCNCAsincrona:
+    """Ejecuta ControladorCNC.conectar() en un hilo para que la ventana siga dibujando.
+
+    La interfaz consulta texto()/terminada en cada fotograma; cancelar() aborta en la
+    siguiente etapa (puerto, handshake, configuración) y cierra el puerto.
+    """
+
+    TEXTOS = {
+        'puerto': "Buscando puerto...",
+        'handshake': "Identificando firmware...",
+        'configuracion': "Aplicando configuración...",
+        'lista': "CNC conectada",
+        'fallida': "CNC no conectada",
+        'cancelada': "Conexión cancelada",
+    }
+
+    def __init__(self, controlador):
+        self.controlador = controlador
+        self.exito = False
+        self.inicio = time.time()
+        self._hilo = Thread(target=self._ejecutar, daemon=True, name='conexion-cnc')
+        self._hilo.start()
+
+    def _ejecutar(self):
         try:
-            self.ejecutando_rutina = True
-            # Ir al punto de origen antes de comenzar la rutina
-            try:
-                self.enviar_comando("G90")
-                self.enviar_comando("G0 X0 Y0")
-                # Asegurar feed definido para G1
-                try:
-                    self.enviar_comando(f"G1 F{int(self.feed_base)}")
-                except Exception:
-                    pass
-            except Exception:
-                pass
-            linea_actual = 0
-            absoluto = True
-            inflight = 0
-            ventana = 12
-            for raw in lineas:
-                if getattr(self, 'abortado_por_limite', False):
-                    print("Ejecución (memoria) abortada por límite")
-                    break
-                linea = limpiar_linea_gcode(raw)
-                if not linea:
-                    continue
-                # Pausa reactiva si hay feed hold activo
-                while getattr(self, 'en_hold', False):
-                    time.sleep(0.05)
-                if (linea_actual % 5) == 0:
-                    self.verificar_cambios_velocidad()
-                linea_actual += 1
-                token0 = linea.split()[0] if linea else ""
-                if token0.upper() == 'G90':
-                    absoluto = True
-                elif token0.upper() == 'G91':
-                    absoluto = False
-                to_send = linea
-                if invert and (token0.upper() in ('G0', 'G1')):
-                    if absoluto:
-                        to_send = self._invertir_linea_abs(linea)
-                    else:
-                        to_send = self._invertir_linea_rel(linea)
-                if token0.upper() == 'G1':
-                    # Extraer feed rate si está presente en el comando
-                    try:
-                        import re
-                        match = re.search(r'F([\d.]+)', to_send, re.IGNORECASE)
-                        if match:
-                            self.feed_reportado = float(match.group(1))
-                    except Exception:
-                        pass
-                    if self._write_line_fast(to_send):
-                        inflight += 1
-                    if inflight >= ventana:
-                        okc = self._drain_ok_nonblock(80)
-                        if okc:
-                            inflight = max(0, inflight - okc)
-                else:
-                    if inflight > 0:
-                        tlim = time.time() + 1.0
-                        while inflight > 0 and time.time() < tlim:
-                            okc = self._drain_ok_nonblock(80)
-                            if okc:
-                                inflight = max(0, inflight - okc)
-                            else:
-                                time.sleep(0.01)
-                    self.enviar_comando(to_send)
-                if (linea_actual % 10) == 0:
-                    self.guardar_posicion()
-            # Regresar al punto de origen al finalizar la rutina
-            try:
-                if inflight > 0:
-                    tlim = time.time() + 2.0
-                    while inflight > 0 and time.time() < tlim:
-                        okc = self._drain_ok_nonblock(120)
-                        if okc:
-                            inflight = max(0, inflight - okc)
-                        else:
-                            time.sleep(0.01)
-                self.enviar_comando("G90")
-                self.enviar_comando("G0 X0 Y0")
-            except Exception:
-                pass
-            return False if getattr(self, 'abortado_por_limite', False) else True
+            self.exito = bool(self.controlador.conectar())
         except Exception as e:
-            print(f"Error al ejecutar G-code en memoria: {e}")
-            return False
-        finally:
-            self.ejecutando_rutina = False
+            _LOG_CNC.warning("Error al conectar la CNC: %s", e)
+            self.exito = False
+
+    @property
+    def terminada(self) -> bool:
+        return not self._hilo.is_alive()
+
+    @property
+    def etapa(self) -> str:
+        return getattr(self.controlador, 'etapa_conexion', '') or 'puerto'
+
+    def texto(self) -> str:
+        if self.terminada:
+            return self.TEXTOS['lista'] if self.exito else self.TEXTOS.get(self.etapa, self.TEXTOS['fallida'])
+        puntos = "." * (1 + int((time.time() - self.inicio) * 2) % 3)
+        return self.TEXTOS.get(self.etapa, "Conectando...").rstrip('.') + puntos
+
+    def cancelar(self, esperar: float = 0.0):
+        """Pide cancelar; con esperar>0 bloquea hasta ese plazo a que el hilo termine."""
+        self.controlador.cancelar_conexion()
+        if esperar > 0:
+            self._hilo.join(esperar)
 
 class Boton:
+    # Pinta su rect completo: EscenaRetenida puede redibujarlo solo (hover) sin repintar el fondo
+    opaco = True
+
     def __init__(self, x, y, ancho, alto, texto, color=VERDE_CLARO, fuente_personalizada=None, texto_color=BLANCO):
         self.rect = pygame.Rect(x, y, ancho, alto)
         self.texto = texto
@@ -2232,9 +328,16 @@ class Boton:
         self.proporcion_y = 0  # Para redimensionamiento
         self.proporcion_ancho = 0  # Para redimensionamiento
         self.proporcion_alto = 0  # Para redimensionamiento
+        # Aspecto normal/hover ya renderizado: (clave de aspecto, activo) -> Surface
+        self._superficies = {}
         
+    def invalidar_superficies(self):
+        """Descarta los aspectos pre-renderizados (se regeneran en el próximo dibujar)."""
+        self._superficies = {}
+
     def actualizar_proporciones(self, ancho_ventana, alto_ventana):
         """Actualiza las proporciones del botón respecto al tamaño de la ventana."""
+        self.invalidar_superficies()
         self.proporcion_x = self.rect.x / ancho_ventana
         self.proporcion_y = self.rect.y / alto_ventana
         self.proporcion_ancho = self.rect.width / ancho_ventana
@@ -2248,11 +351,32 @@ class Boton:
             nuevo_ancho = int(self.proporcion_ancho * ancho_ventana)
             nuevo_alto = int(self.proporcion_alto * alto_ventana)
             self.rect = pygame.Rect(nuevo_x, nuevo_y, nuevo_ancho, nuevo_alto)
+            self.invalidar_superficies()
         
     def dibujar(self, superficie):
-        color_actual = self.color_hover if self.activo else self.color
-        pygame.draw.rect(superficie, color_actual, self.rect)
-        pygame.draw.rect(superficie, VERDE_BORDE, self.rect, 2)
+        # El aspecto depende del tamaño, no de la posición: mover el botón no obliga a re-renderizar
+        clave = ((self.rect.width, self.rect.height), self.texto, self.color, self.color_hover, self.texto_color,
+                 hasattr(self, '_color_personalizado'), id(self.fuente_personalizada), self.activo)
+        imagen = self._superficies.get(clave)
+        if imagen is None:
+            if len(self._superficies) >= 4:
+                # Cambió texto/tamaño/colores: los aspectos anteriores ya no sirven
+                self._superficies = {}
+            imagen = self._renderizar(self.activo)
+            self._superficies[clave] = imagen
+        superficie.blit(imagen, self.rect)
+
+    def _renderizar(self, activo):
+        """Renderiza el aspecto normal o hover en una Surface del tamaño del botón."""
+        imagen = pygame.Surface(self.rect.size)
+        try:
+            imagen = imagen.convert()
+        except Exception:
+            pass
+        rect = imagen.get_rect()
+        color_actual = self.color_hover if activo else self.color
+        pygame.draw.rect(imagen, color_actual, rect)
+        pygame.draw.rect(imagen, VERDE_BORDE, rect, 2)
         
         # Calcular el mejor color de texto basado en el color del botón
         def calcular_luminancia(color):
@@ -2265,7 +389,7 @@ class Boton:
         
         # Ajustar tamaño de fuente según el tamaño del botón
         tamano_fuente = min(30, max(12, int(self.rect.width / 10)))
-        fuente = self.fuente_personalizada or pygame.font.Font(None, tamano_fuente)
+        fuente = self.fuente_personalizada or fuente_cacheada(tamano_fuente)
         
         # Dividir el texto en palabras para ajustarlo al botón
         palabras = self.texto.split()
@@ -2285,21 +409,26 @@ class Boton:
             
             # Renderizar cada línea
             altura_total = len(lineas) * fuente.get_height()
-            y_inicial = self.rect.centery - altura_total // 2
+            y_inicial = rect.centery - altura_total // 2
             
             for i, linea in enumerate(lineas):
                 texto_surface = fuente.render(linea, True, color_texto_final)
-                texto_rect = texto_surface.get_rect(centerx=self.rect.centerx, y=y_inicial + i * fuente.get_height())
-                superficie.blit(texto_surface, texto_rect)
+                texto_rect = texto_surface.get_rect(centerx=rect.centerx, y=y_inicial + i * fuente.get_height())
+                imagen.blit(texto_surface, texto_rect)
         else:
             # Renderizar texto en una sola línea
             texto_surface = fuente.render(self.texto, True, color_texto_final)
-            texto_rect = texto_surface.get_rect(center=self.rect.center)
-            superficie.blit(texto_surface, texto_rect)
+            texto_rect = texto_surface.get_rect(center=rect.center)
+            imagen.blit(texto_surface, texto_rect)
+        return imagen
         
     def verificar_hover(self, pos):
         self.activo = self.rect.collidepoint(pos)
         return self.activo
+
+    def firma_visual(self):
+        return (tuple(self.rect), self.texto, self.activo, self.color, self.color_hover, self.texto_color,
+                hasattr(self, '_color_personalizado'), id(self.fuente_personalizada))
         
     def verificar_clic(self, pos):
         return self.rect.collidepoint(pos)
@@ -2312,22 +441,45 @@ class RadioButton:
         self.texto = texto
         self.color = color
         self.seleccionado = seleccionado
-        self.fuente = pygame.font.Font(None, 30)
+        self.fuente = fuente_cacheada(30)
+        # Aspecto marcado/sin marcar ya renderizado (círculo + etiqueta, con transparencia)
+        self._superficies = {}
         
     def dibujar(self, superficie):
-        pygame.draw.circle(superficie, NEGRO, (self.x, self.y), self.radio, 2)
-        pygame.draw.circle(superficie, self.color, (self.x, self.y), self.radio - 2)
+        clave = (self.radio, self.texto, self.color, self.seleccionado)
+        imagen = self._superficies.get(clave)
+        if imagen is None:
+            if len(self._superficies) >= 2:
+                self._superficies = {}
+            imagen = self._renderizar()
+            self._superficies[clave] = imagen
+        superficie.blit(imagen, (self.x - self.radio, self.y - imagen.get_height() // 2))
+
+    def _renderizar(self):
+        texto_surface = self.fuente.render(self.texto, True, NEGRO)
+        alto = max(2 * self.radio + 1, texto_surface.get_height())
+        imagen = pygame.Surface((2 * self.radio + 10 + texto_surface.get_width(), alto), pygame.SRCALPHA)
+        centro = (self.radio, alto // 2)
+        pygame.draw.circle(imagen, NEGRO, centro, self.radio, 2)
+        pygame.draw.circle(imagen, self.color, centro, self.radio - 2)
         
         if self.seleccionado:
-            pygame.draw.circle(superficie, VERDE_OSCURO, (self.x, self.y), self.radio - 6)
+            pygame.draw.circle(imagen, VERDE_OSCURO, centro, self.radio - 6)
         
-        texto_surface = self.fuente.render(self.texto, True, NEGRO)
-        superficie.blit(texto_surface, (self.x + self.radio + 10, self.y - texto_surface.get_height() // 2))
+        imagen.blit(texto_surface, (2 * self.radio + 10, alto // 2 - texto_surface.get_height() // 2))
+        try:
+            imagen = imagen.convert_alpha()
+        except Exception:
+            pass
+        return imagen
         
     def verificar_clic(self, pos):
         distancia = ((pos[0] - self.x) ** 2 + (pos[1] - self.y) ** 2) ** 0.5
         return distancia <= self.radio
 
+    def firma_visual(self):
+        return (self.x, self.y, self.radio, self.texto, self.color, self.seleccionado)
+
 class Dropdown:
     def __init__(self, x, y, ancho, alto, opciones, color=BLANCO, color_seleccionado=VERDE):
         self.rect = pygame.Rect(x, y, ancho, alto)
@@ -2336,7 +488,7 @@ class Dropdown:
         self.color_seleccionado = color_seleccionado
         self.seleccionado = opciones[0] if opciones else ""
         self.abierto = False
-        self.fuente = pygame.font.Font(None, 30)
+        self.fuente = fuente_cacheada(30)
         
         self.rects_opciones = []
         for i, _ in enumerate(opciones):
@@ -2346,7 +498,7 @@ class Dropdown:
         pygame.draw.rect(superficie, self.color, self.rect)
         pygame.draw.rect(superficie, NEGRO, self.rect, 2)
         
-        texto_surface = self.fuente.render(self.seleccionado, True, NEGRO)
+        texto_surface = texto_cacheado(self.seleccionado, self.fuente, NEGRO)
         texto_rect = texto_surface.get_rect(midleft=(self.rect.x + 10, self.rect.centery))
         superficie.blit(texto_surface, texto_rect)
         
@@ -2363,10 +515,13 @@ class Dropdown:
                 pygame.draw.rect(superficie, color, rect)
                 pygame.draw.rect(superficie, NEGRO, rect, 2)
                 
-                texto_surface = self.fuente.render(opcion, True, NEGRO)
+                texto_surface = texto_cacheado(opcion, self.fuente, NEGRO)
                 texto_rect = texto_surface.get_rect(midleft=(rect.x + 10, rect.centery))
                 superficie.blit(texto_surface, texto_rect)
 
+    def firma_visual(self):
+        return (tuple(self.rect), tuple(self.opciones), self.seleccionado, self.abierto)
+
     def verificar_clic(self, pos):
         if self.rect.collidepoint(pos):
             self.abierto = not self.abierto
@@ -2394,26 +549,47 @@ class Slider:
         self.color_indicador = color_indicador
         self.unidad = unidad
         self.arrastrando = False
-        self.fuente = pygame.font.Font(None, 30)
+        self.fuente = fuente_cacheada(30)
+        # Pista (fondo y borde) ya renderizada por tamaño y color; el relleno se pinta por fotograma
+        self._superficies = {}
         
+    def invalidar_superficies(self):
+        self._superficies = {}
+
     def dibujar(self, superficie):
-        pygame.draw.rect(superficie, self.color_barra, self.rect)
-        pygame.draw.rect(superficie, NEGRO, self.rect, 2)
-        
+        clave = ((self.rect.width, self.rect.height), self.color_barra)
+        pista = self._superficies.get(clave)
+        if pista is None:
+            if len(self._superficies) >= 2:
+                self._superficies = {}
+            pista = self._renderizar_pista()
+            self._superficies[clave] = pista
+        superficie.blit(pista, self.rect)
         porcentaje = (self.valor - self.valor_min) / (self.valor_max - self.valor_min)
         ancho_indicador = int(porcentaje * self.rect.width)
-        rect_indicador = pygame.Rect(self.rect.x, self.rect.y, ancho_indicador, self.rect.height)
-        
-        pygame.draw.rect(superficie, self.color_indicador, rect_indicador)
+        if ancho_indicador > 0:
+            pygame.draw.rect(superficie, self.color_indicador,
+                             pygame.Rect(self.rect.x, self.rect.y, ancho_indicador, self.rect.height))
         # Mostrar texto solo si se define una unidad no vacía
         try:
             unidad_str = str(self.unidad) if self.unidad is not None else ""
         except Exception:
             unidad_str = ""
         if unidad_str.strip():
-            texto_surface = self.fuente.render(f"{self.valor} {unidad_str}".strip(), True, NEGRO)
+            texto_surface = texto_cacheado(f"{self.valor} {unidad_str}".strip(), self.fuente, NEGRO)
             superficie.blit(texto_surface, (self.rect.right + 10, self.rect.centery - texto_surface.get_height() // 2))
 
+    def _renderizar_pista(self):
+        imagen = pygame.Surface(self.rect.size)
+        try:
+            imagen = imagen.convert()
+        except Exception:
+            pass
+        rect = imagen.get_rect()
+        pygame.draw.rect(imagen, self.color_barra, rect)
+        pygame.draw.rect(imagen, NEGRO, rect, 2)
+        return imagen
+
     def verificar_clic(self, pos):
         if self.rect.collidepoint(pos):
             self.arrastrando = True
@@ -2424,6 +600,9 @@ class Slider:
     def verificar_soltar(self):
         self.arrastrando = False
 
+    def firma_visual(self):
+        return (tuple(self.rect), self.valor, self.unidad, self.color_barra, self.color_indicador)
+
     def verificar_arrastre(self, pos):
         if self.arrastrando:
             self.actualizar_valor(pos[0])
@@ -2447,19 +626,15 @@ class VentanaConfiguracionRutina:
         # Iniciar maximizada en modo ventana (no fullscreen) y redimensionable
         info = pygame.display.Info()
         self.ancho, self.alto = info.current_w, info.current_h
-        self.pantalla = pygame.display.set_mode((self.ancho, self.alto), pygame.RESIZABLE)
+        self.pantalla = pantalla_app().establecer_modo((self.ancho, self.alto), pygame.RESIZABLE)
         pygame.display.set_caption("Configuración de Rutina")
         # Forzar maximizar en Linux si wmctrl está disponible
-        try:
-            import subprocess
-            subprocess.Popen(['wmctrl', '-r', ':ACTIVE:', '-b', 'add,maximized_vert,maximized_horz'])
-        except Exception:
-            pass
+        pantalla_app().maximizar()
         self.fullscreen = False
 
-        self.fuente_titulo = pygame.font.Font(None, 40)
-        self.fuente_subtitulo = pygame.font.Font(None, 36)
-        self.fuente_normal = pygame.font.Font(None, 30)
+        self.fuente_titulo = fuente_cacheada(40)
+        self.fuente_subtitulo = fuente_cacheada(36)
+        self.fuente_normal = fuente_cacheada(30)
 
         self.color_header = VERDE_OSCURO
         self.color_fondo = BLANCO
@@ -2490,7 +665,7 @@ class VentanaConfiguracionRutina:
         # Botones inferiores más grandes y con fuente más visible
         ancho_boton = 200
         alto_boton = 60
-        fuente_bot_inf = pygame.font.Font(None, 30)
+        fuente_bot_inf = fuente_cacheada(30)
 
         # Crear botones con posiciones provisionales (se recalcularán)
         self.boton_aplicar = Boton(0, 0, ancho_boton, alto_boton, "Aplicar", VERDE_OSCURO, fuente_bot_inf, NEGRO)
@@ -2511,13 +686,15 @@ class VentanaConfiguracionRutina:
         # Respetar configuración al iniciar ejecución (maximizada y resizable)
         info = pygame.display.Info()
         self.ancho, self.alto = info.current_w, info.current_h
-        self.pantalla = pygame.display.set_mode((self.ancho, self.alto), pygame.RESIZABLE)
+        self.pantalla = pantalla_app().establecer_modo((self.ancho, self.alto), pygame.RESIZABLE)
         self.recalcular_layout()
         
         clock = pygame.time.Clock()
         ejecutando = True
         
+        perfil = perfil_fotogramas()
         while ejecutando:
+            perfil.fotograma('Configuración')
             self.pantalla.fill(self.color_fondo)
             pos_mouse = pygame.mouse.get_pos()
             tiempo_actual = pygame.time.get_ticks()
@@ -2532,16 +709,19 @@ class VentanaConfiguracionRutina:
             try:
                 if self.controlador_cnc:
                     for ev in self.controlador_cnc.consumir_eventos():
-                        if ev.get('tipo') == 'limite':
-                            m = (ev.get('datos') or {}).get('mensaje') or "Se activó un limite físico, se volverá al origen automaticamente en 3 segundos."
+                        if ev.tipo == 'limite':
+                            m = ev.datos.get('mensaje') or "Se activó un limite físico, se volverá al origen automaticamente en 3 segundos."
                             try:
-                                mostrar_aviso_sistema("Límite activado", m)
+                                mostrar_aviso_sistema("Límite activado", m, modal=False, nivel='aviso')
                             except Exception:
                                 print(f"[AVISO] {m}")
             except Exception:
                 pass
 
+            perfil.marca('estado')
             for evento in pygame.event.get():
+                if atender_superposiciones(evento):
+                    continue
                 if evento.type == pygame.QUIT:
                     raise CerrarPrograma("Usuario cerró ventana configuración")
                 if evento.type == pygame.VIDEORESIZE:
@@ -2550,7 +730,7 @@ class VentanaConfiguracionRutina:
                     self.ancho, self.alto = w, h
                     info = pygame.display.Info()
                     w, h = info.current_w, info.current_h
-                    self.pantalla = pygame.display.set_mode((w, h), pygame.RESIZABLE)
+                    self.pantalla = pantalla_app().establecer_modo((w, h), pygame.RESIZABLE)
                     self.redimensionar(w, h)
                 if evento.type == pygame.KEYDOWN:
                     if evento.key == pygame.K_F11:
@@ -2558,13 +738,13 @@ class VentanaConfiguracionRutina:
                         if self.fullscreen:
                             info = pygame.display.Info()
                             w, h = info.current_w, info.current_h
-                            self.pantalla = pygame.display.set_mode((w, h), pygame.RESIZABLE)
+                            self.pantalla = pantalla_app().establecer_modo((w, h), pygame.RESIZABLE)
                             self.ancho, self.alto = w, h
                             self.redimensionar(w, h)
                         else:
                             info = pygame.display.Info()
                             w, h = info.current_w, info.current_h
-                            self.pantalla = pygame.display.set_mode((w, h), pygame.RESIZABLE)
+                            self.pantalla = pantalla_app().establecer_modo((w, h), pygame.RESIZABLE)
                             self.ancho, self.alto = w, h
                             self.redimensionar(w, h)
                         continue
@@ -2572,7 +752,7 @@ class VentanaConfiguracionRutina:
                         self.fullscreen = False
                         info = pygame.display.Info()
                         w, h = info.current_w, info.current_h
-                        self.pantalla = pygame.display.set_mode((w, h), pygame.RESIZABLE)
+                        self.pantalla = pantalla_app().establecer_modo((w, h), pygame.RESIZABLE)
                         self.ancho, self.alto = w, h
                         self.redimensionar(w, h)
                         continue
@@ -2663,12 +843,16 @@ class VentanaConfiguracionRutina:
             self.boton_restablecer.verificar_hover(pos_mouse)
             self.boton_regresar.verificar_hover(pos_mouse)
             
+            perfil.marca('eventos')
             self.dibujar_interfaz()
             
             if tiempo_actual < self.mostrar_mensaje_tiempo:
                 self.mostrar_mensaje()
+            dibujar_superposiciones(self.pantalla)
             
+            perfil.marca('dibujo')
             pygame.display.flip()
+            perfil.marca('flip')
             clock.tick(60)
         
         return not ejecutando  # Retorna True si salió normalmente, False si se cerró la ventana
@@ -2750,7 +934,7 @@ class VentanaConfiguracionRutina:
     def redimensionar(self, nuevo_ancho, nuevo_alto):
         info = pygame.display.Info()
         self.ancho, self.alto = info.current_w, info.current_h
-        self.pantalla = pygame.display.set_mode((self.ancho, self.alto), pygame.RESIZABLE)
+        self.pantalla = pantalla_app().establecer_modo((self.ancho, self.alto), pygame.RESIZABLE)
         self.recalcular_layout()
 
     def aplicar_configuracion(self):
@@ -2806,92 +990,939 @@ def ajustar_a_pantalla(ancho, alto, min_w=480, min_h=360, margen=20):
         # Si no se puede obtener info de pantalla, devolver originales limitados por mínimos
         return max(min_w, ancho), max(min_h, alto)
 
-def mostrar_aviso_sistema(titulo, mensaje):
-    try:
-        root = tk.Tk()
-        root.withdraw()
-        messagebox.showinfo(titulo, mensaje)
-        root.destroy()
-    except Exception as e:
-        print(f"[AVISO] {titulo}: {mensaje} (No se pudo mostrar ventana: {e})")
-    finally:
+class GestorPantalla:
+    """Una sola superficie de pantalla para toda la aplicación y una pila de escenas.
+
+    Las ventanas piden el modo con establecer_modo() en vez de pygame.display.set_mode: si
+    el tamaño y los flags coinciden con la superficie actual se reutiliza, así que navegar
+    entre ventanas no recrea la ventana de SDL (ni parpadea). set_mode solo se llama ante un
+    cambio real (redimensionar, F11). escena() apila la ventana que se abre y al volver
+    restaura el título de la anterior.
+    """
+
+    def __init__(self):
+        self._flags = None
+        self._pila = []
+        self._maximizada = False
+        self.recreaciones = 0
+        self.reutilizaciones = 0
+
+    def establecer_modo(self, tamano, flags=pygame.RESIZABLE):
+        # DOUBLEBUF no cambia nada en superficies por software: no obliga a recrear
+        flags &= ~pygame.DOUBLEBUF
+        tamano = (int(tamano[0]), int(tamano[1]))
+        actual = pygame.display.get_surface()
+        if actual is not None and flags == self._flags:
+            if tamano == actual.get_size() or (tamano == (0, 0) and flags & pygame.FULLSCREEN):
+                self.reutilizaciones += 1
+                return actual
+        superficie = pygame.display.set_mode(tamano, flags)
+        self._flags = flags
+        self.recreaciones += 1
+        return superficie
+
+    def maximizar(self):
+        """Maximiza la ventana con wmctrl (Linux) una sola vez por proceso."""
+        if self._maximizada:
+            return
+        self._maximizada = True
+        try:
+            import subprocess
+            subprocess.Popen(['wmctrl', '-r', ':ACTIVE:', '-b', 'add,maximized_vert,maximized_horz'],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except Exception:
+            pass
+
+    @property
+    def escenas(self) -> list:
+        return [nombre for nombre, _ in self._pila]
+
+    @contextlib.contextmanager
+    def escena(self, nombre: str):
+        """Abre una ventana hija sobre la actual; al salir restaura el título anterior."""
+        self._pila.append((nombre, pygame.display.get_caption()[0] if pygame.display.get_init() else ''))
+        try:
+            yield self
+        finally:
+            _, titulo = self._pila.pop()
+            try:
+                if titulo:
+                    pygame.display.set_caption(titulo)
+            except Exception:
+                pass
+
+_GESTOR_PANTALLA = None
+
+def pantalla_app() -> GestorPantalla:
+    global _GESTOR_PANTALLA
+    if _GESTOR_PANTALLA is None:
+        _GESTOR_PANTALLA = GestorPantalla()
+    return _GESTOR_PANTALLA
+
+class Notificacion:
+    """Aviso pendiente de ColaNotificaciones (rect es dónde se dibujó el toast)."""
+    __slots__ = ('id', 'titulo', 'mensaje', 'nivel', 'modal', 'vence', 'al_aceptar', 'rect')
+
+    def __init__(self, titulo, mensaje, nivel='info', modal=False, vence=None, al_aceptar=None):
+        self.id = 0
+        self.titulo = str(titulo)
+        self.mensaje = str(mensaje)
+        self.nivel = nivel
+        self.modal = modal
+        self.vence = vence
+        self.al_aceptar = al_aceptar
+        self.rect = None
+
+
+class ColaNotificaciones:
+    """Avisos al usuario dibujados dentro de pygame, sin Tk.
+
+    publicar() es seguro desde cualquier hilo y nunca bloquea: el hilo de la rutina o de la
+    captura ECG deja el aviso y sigue. Los avisos no modales son toasts que caducan solos;
+    los modales se muestran de uno en uno sobre la ventana actual, retienen su entrada hasta
+    pulsar Aceptar (clic, Enter o Esc) y entonces se llama a al_aceptar en el hilo de la interfaz.
+    """
+
+    MAX_TOASTS = 4
+    COLORES = {'info': VERDE_OSCURO, 'aviso': NARANJA, 'error': ROJO}
+
+    def __init__(self):
+        self._lock = Lock()
+        self._toasts = deque(maxlen=self.MAX_TOASTS)
+        self._modales = deque(maxlen=20)
+        self._siguiente_id = 1
+        self._boton_aceptar = None
+
+    def publicar(self, titulo, mensaje, nivel='info', modal=False, duracion=5.0, al_aceptar=None) -> int:
+        aviso = Notificacion(titulo, mensaje, nivel, modal,
+                             None if modal else time.time() + float(duracion), al_aceptar)
+        with self._lock:
+            aviso.id = self._siguiente_id
+            self._siguiente_id += 1
+            (self._modales if modal else self._toasts).append(aviso)
+        despertar_interfaz()
+        return aviso.id
+
+    def _purgar(self, ahora):
+        while self._toasts and self._toasts[0].vence <= ahora:
+            self._toasts.popleft()
+        # Un toast nuevo con duración corta puede caducar antes que los anteriores
+        if any(t.vence <= ahora for t in self._toasts):
+            self._toasts = deque((t for t in self._toasts if t.vence > ahora), maxlen=self.MAX_TOASTS)
+
+    def visibles(self) -> tuple:
+        """Ids de lo que hay en pantalla y hover de Aceptar (para la firma de EscenaRetenida)."""
+        with self._lock:
+            self._purgar(time.time())
+            modal = self._modales[0].id if self._modales else None
+            if modal is None and not self._toasts:
+                return ()
+            toasts = tuple(t.id for t in self._toasts)
+        hover = False
+        if modal is not None and self._boton_aceptar is not None:
+            try:
+                hover = self._boton_aceptar.rect.collidepoint(pygame.mouse.get_pos())
+            except Exception:
+                pass
+        return (modal, hover) + toasts
+
+    def proximo_vencimiento(self):
+        """Segundos hasta que caduque el siguiente toast, o None."""
+        with self._lock:
+            if not self._toasts:
+                return None
+            return max(0.0, min(t.vence for t in self._toasts) - time.time())
+
+    def modal_actual(self):
+        with self._lock:
+            return self._modales[0] if self._modales else None
+
+    def aceptar(self):
+        """Cierra el modal visible y ejecuta su al_aceptar."""
+        with self._lock:
+            aviso = self._modales.popleft() if self._modales else None
+        if aviso is not None and aviso.al_aceptar is not None:
+            try:
+                aviso.al_aceptar()
+            except Exception as e:
+                print(f"[AVISO] Error en la respuesta al aviso '{aviso.titulo}': {e}")
+
+    def atender_evento(self, evento) -> bool:
+        """True si el evento lo consume un aviso (con un modal abierto se consume toda la entrada)."""
+        if self.modal_actual() is not None:
+            if evento.type == pygame.KEYDOWN:
+                if evento.key in (pygame.K_RETURN, pygame.K_KP_ENTER, pygame.K_ESCAPE, pygame.K_SPACE):
+                    self.aceptar()
+                return True
+            if evento.type == pygame.MOUSEBUTTONDOWN:
+                boton = self._boton_aceptar
+                if boton is not None and boton.verificar_clic(evento.pos):
+                    self.aceptar()
+                return True
+            if evento.type in (pygame.MOUSEBUTTONUP, pygame.TEXTINPUT):
+                return True
+            return False
+        if evento.type == pygame.MOUSEBUTTONDOWN:
+            # Clic sobre un toast: descartarlo
+            with self._lock:
+                for t in list(self._toasts):
+                    if t.rect is not None and t.rect.collidepoint(evento.pos):
+                        self._toasts.remove(t)
+                        return True
+        return False
+
+    def dibujar(self, pantalla):
+        with self._lock:
+            self._purgar(time.time())
+            toasts = list(self._toasts)
+            modal = self._modales[0] if self._modales else None
+        if not toasts and modal is None:
+            return
+        try:
+            ancho, alto = pantalla.get_size()
+            self._dibujar_toasts(pantalla, toasts, ancho, alto)
+            if modal is not None:
+                self._dibujar_modal(pantalla, modal, ancho, alto)
+        except Exception:
+            pass
+
+    def _dibujar_toasts(self, pantalla, toasts, ancho, alto):
+        fuente_t = fuente_cacheada(24)
+        fuente_m = fuente_cacheada(20)
+        ancho_toast = min(420, ancho - 20)
+        y = alto - alto_barra_inferior(alto) - 10
+        for t in reversed(toasts):
+            lineas = _envolver_texto(t.mensaje, fuente_m, ancho_toast - 24)[:4]
+            alto_toast = 14 + fuente_t.get_linesize() + len(lineas) * fuente_m.get_linesize()
+            y -= alto_toast
+            rect = pygame.Rect(ancho - ancho_toast - 10, y, ancho_toast, alto_toast)
+            pygame.draw.rect(pantalla, (250, 250, 250), rect)
+            pygame.draw.rect(pantalla, self.COLORES.get(t.nivel, VERDE_OSCURO), (rect.x, rect.y, 6, rect.height))
+            pygame.draw.rect(pantalla, GRIS, rect, 1)
+            pantalla.blit(texto_cacheado(recortar_con_ellipsis(t.titulo, fuente_t, ancho_toast - 24), fuente_t, NEGRO),
+                          (rect.x + 14, rect.y + 7))
+            yl = rect.y + 7 + fuente_t.get_linesize()
+            for linea in lineas:
+                pantalla.blit(texto_cacheado(linea, fuente_m, (60, 60, 60)), (rect.x + 14, yl))
+                yl += fuente_m.get_linesize()
+            t.rect = rect
+            y -= 8
+
+    def _dibujar_modal(self, pantalla, modal, ancho, alto):
+        velo = pygame.Surface((ancho, alto), pygame.SRCALPHA)
+        velo.fill((0, 0, 0, 140))
+        pantalla.blit(velo, (0, 0))
+        fuente_t = fuente_cacheada(32)
+        fuente_m = fuente_cacheada(24)
+        ancho_panel = min(560, ancho - 40)
+        lineas = _envolver_texto(modal.mensaje, fuente_m, ancho_panel - 40)[:12]
+        alto_panel = 30 + fuente_t.get_linesize() + 12 + len(lineas) * fuente_m.get_linesize() + 20 + 44 + 20
+        panel = pygame.Rect((ancho - ancho_panel) // 2, (alto - alto_panel) // 2, ancho_panel, alto_panel)
+        pygame.draw.rect(pantalla, BLANCO, panel)
+        pygame.draw.rect(pantalla, self.COLORES.get(modal.nivel, VERDE_OSCURO), panel, 3)
+        titulo = texto_cacheado(recortar_con_ellipsis(modal.titulo, fuente_t, ancho_panel - 40), fuente_t, NEGRO)
+        pantalla.blit(titulo, (panel.x + 20, panel.y + 30))
+        y = panel.y + 30 + fuente_t.get_linesize() + 12
+        for linea in lineas:
+            pantalla.blit(texto_cacheado(linea, fuente_m, (40, 40, 40)), (panel.x + 20, y))
+            y += fuente_m.get_linesize()
+        rect_boton = pygame.Rect(panel.centerx - 70, panel.bottom - 64, 140, 44)
+        if self._boton_aceptar is None:
+            self._boton_aceptar = Boton(0, 0, 140, 44, "Aceptar", VERDE_BOTON, fuente_cacheada(26))
+        self._boton_aceptar.rect = rect_boton
+        self._boton_aceptar.verificar_hover(pygame.mouse.get_pos())
+        self._boton_aceptar.dibujar(pantalla)
+
+_NOTIFICACIONES = None
+
+def notificaciones() -> ColaNotificaciones:
+    global _NOTIFICACIONES
+    if _NOTIFICACIONES is None:
+        _NOTIFICACIONES = ColaNotificaciones()
+    return _NOTIFICACIONES
+
+def _envolver_texto(texto, fuente, ancho_max):
+    """Parte el texto en líneas que caben en ancho_max (respeta los saltos de línea)."""
+    lineas = []
+    for parrafo in str(texto).split('\n'):
+        actual = ''
+        for palabra in parrafo.split(' '):
+            prueba = f"{actual} {palabra}" if actual else palabra
+            if actual and fuente.size(prueba)[0] > ancho_max:
+                lineas.append(recortar_con_ellipsis(actual, fuente, ancho_max))
+                actual = palabra
+            else:
+                actual = prueba
+        lineas.append(recortar_con_ellipsis(actual, fuente, ancho_max))
+    return lineas
+
+def mostrar_aviso_sistema(titulo, mensaje, modal=True, nivel=None, al_aceptar=None):
+    """Muestra un aviso dentro de la ventana pygame sin bloquear al hilo que lo pide.
+
+    modal=True retiene la entrada de la ventana hasta pulsar Aceptar; modal=False es un toast.
+    Sin pantalla pygame (consola) el aviso se imprime.
+    """
+    if nivel is None:
+        titulo_min = str(titulo).lower()
+        nivel = 'error' if 'error' in titulo_min else ('aviso' if 'aviso' in titulo_min else 'info')
+    try:
+        disponible = pygame.display.get_init() and pygame.display.get_surface() is not None
+    except Exception:
+        disponible = False
+    if not disponible:
+        print(f"[AVISO] {titulo}: {mensaje}")
+        if al_aceptar is not None:
+            try:
+                al_aceptar()
+            except Exception:
+                pass
+        return
+    notificaciones().publicar(titulo, mensaje, nivel=nivel, modal=modal, al_aceptar=al_aceptar)
+
+class _CacheLRU:
+    """Diccionario acotado que descarta la entrada usada hace más tiempo."""
+
+    def __init__(self, capacidad):
+        self.capacidad = max(1, int(capacidad))
+        self._datos = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave, crear):
+        try:
+            valor = self._datos[clave]
+            self._datos.move_to_end(clave)
+            self.aciertos += 1
+            return valor
+        except KeyError:
+            pass
+        self.fallos += 1
+        valor = crear()
+        self._datos[clave] = valor
+        if len(self._datos) > self.capacidad:
+            self._datos.popitem(last=False)
+        return valor
+
+    def limpiar(self):
+        self._datos.clear()
+
+    def __len__(self):
+        return len(self._datos)
+
+
+# Las fuentes y los textos renderizados se comparten entre ventanas: crear un
+# pygame.font.Font lee el TTF de disco y render() rasteriza, así que las
+# etiquetas fijas solo pagan un blit por fotograma.
+_CACHE_FUENTES = _CacheLRU(64)
+_CACHE_TEXTOS = _CacheLRU(512)
+
+
+def fuente_cacheada(tamano, nombre=None, sistema=False):
+    """Devuelve una fuente compartida por (nombre, tamaño).
+
+    Con sistema=True el nombre se resuelve con pygame.font.SysFont.
+    """
+    tamano = max(1, int(tamano))
+    if sistema:
+        return _CACHE_FUENTES.obtener(('sys', nombre, tamano), lambda: pygame.font.SysFont(nombre, tamano))
+    return _CACHE_FUENTES.obtener((nombre, tamano), lambda: pygame.font.Font(nombre, tamano))
+
+
+def texto_cacheado(texto, fuente, color, antialias=True):
+    """Superficie de texto renderizada una sola vez por (texto, fuente, color, antialias).
+
+    La superficie es compartida: no dibujar sobre ella.
+    """
+    color = tuple(color)
+    return _CACHE_TEXTOS.obtener((texto, fuente, color, antialias),
+                                 lambda: fuente.render(texto, antialias, color))
+
+
+def estado_cache_texto():
+    """Tamaño y aciertos/fallos de las cachés de fuentes y textos."""
+    return {
+        'fuentes': {'entradas': len(_CACHE_FUENTES), 'aciertos': _CACHE_FUENTES.aciertos, 'fallos': _CACHE_FUENTES.fallos},
+        'textos': {'entradas': len(_CACHE_TEXTOS), 'aciertos': _CACHE_TEXTOS.aciertos, 'fallos': _CACHE_TEXTOS.fallos},
+    }
+
+
+def limpiar_cache_texto():
+    """Vacía ambas cachés (necesario si se reinicia pygame.font)."""
+    _CACHE_TEXTOS.limpiar()
+    _CACHE_FUENTES.limpiar()
+
+
+def recortar_con_ellipsis(texto, fuente, ancho_max):
+    """Recorta el texto añadiendo … si excede ancho_max."""
+    if fuente.size(texto)[0] <= ancho_max:
+        return texto
+    if ancho_max <= 0:
+        return ""
+    ell = "…"
+    if fuente.size(ell)[0] > ancho_max:
+        return ell
+    # Búsqueda binaria del prefijo más largo que cabe (el ancho crece con n)
+    bajo, alto = 0, len(texto) - 1
+    while bajo < alto:
+        medio = (bajo + alto + 1) // 2
+        if fuente.size(texto[:medio] + ell)[0] <= ancho_max:
+            bajo = medio
+        else:
+            alto = medio - 1
+    return texto[:bajo] + ell
+def ajustar_fuente_a_ancho(texto, ancho_max, tamaño_inicial, tamaño_min=12):
+    """Devuelve una fuente cuyo texto cabe en ancho_max, reduciendo tamaño si es necesario."""
+    tamaño = max(tamaño_min, int(tamaño_inicial))
+    fuente = fuente_cacheada(tamaño)
+    if tamaño <= tamaño_min or fuente.size(texto)[0] <= ancho_max:
+        return fuente
+    # Búsqueda binaria del mayor tamaño que cabe
+    bajo, alto = tamaño_min, tamaño - 1
+    while bajo < alto:
+        medio = (bajo + alto + 1) // 2
+        if fuente_cacheada(medio).size(texto)[0] <= ancho_max:
+            bajo = medio
+        else:
+            alto = medio - 1
+    return fuente_cacheada(bajo)
+
+# === Utilidades de barra inferior de estado (permanente) ===
+def alto_barra_inferior(alto):
+    """Calcula la altura de la barra inferior según el alto de la ventana."""
+    try:
+        return int(max(30, min(alto * 0.08, alto * 0.16)))
+    except Exception:
+        return 40
+
+def dibujar_barra_inferior(pantalla, ancho, alto, conexion_activa, estado_conexion=None, controlador_cnc=None, offset_px=0):
+    """Dibuja una barra inferior permanente con color según conexión y texto centrado.
+
+    - Verde si conectado, rojo si no.
+    - Texto blanco centrado; incluye firmware/puerto si hay controlador y está conectado.
+    """
+    # Barra de estado de conexión CNC eliminada según solicitud
+
+_PANEL_REGISTRO_VISIBLE = False
+
+def alternar_panel_registro():
+    """F12: muestra u oculta el panel con el registro reciente (todas las ventanas)."""
+    global _PANEL_REGISTRO_VISIBLE
+    _PANEL_REGISTRO_VISIBLE = not _PANEL_REGISTRO_VISIBLE
+
+class _SeccionPerfil:
+    __slots__ = ('perfil', 'nombre')
+
+    def __init__(self, perfil, nombre):
+        self.perfil = perfil
+        self.nombre = nombre
+
+    def __enter__(self):
+        self.perfil._abrir_seccion()
+        return self
+
+    def __exit__(self, *exc):
+        self.perfil.marca(self.nombre)
+        return False
+
+class _SeccionNula:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_SECCION_NULA = _SeccionNula()
+
+class PerfilFotogramas:
+    """Perfilador de fotogramas de los bucles pygame (opcional: F10 o REHAB_PERFIL=1).
+
+    Cada bucle llama a fotograma(ventana) al empezar y marca(seccion) al terminar cada parte:
+    el tiempo desde la marca anterior se suma a esa sección ('eventos', 'sensores', 'graficas',
+    'vista_previa', 'estado', 'dibujo', 'flip'); lo que queda hasta el siguiente fotograma es
+    'espera' (clock.tick). Muestra p50/p99 móviles y las secciones más costosas, y guarda una
+    traza CSV en backups/perfil/. Desactivado, cada llamada es un if.
+    """
+
+    def __init__(self, muestras: int = 240):
+        self.activo = False
+        self.muestras = muestras
+        self.historial = {}  # seccion -> deque de ms
+        self.peores = []  # (ms, ventana, fotograma, seccion dominante), los 3 peores
+        self.numero = 0
+        self.ventana = ''
+        self._acum = {}
+        self._inicio = None
+        self._ultima = 0.0
+        self._pendiente = 0.0
+        self._csv = None
+        self._escritor = None
+        self._resumen = []
+        self._resumen_fotograma = -1
+        self._fuente = None
+        if os.environ.get('REHAB_PERFIL', '') not in ('', '0'):
+            self.activar()
+
+    def activar(self):
+        if self.activo:
+            return
+        self.activo = True
+        self._inicio = None
+        self.historial = {}
+        self.peores = []
+        try:
+            carpeta = os.path.join(BASE_DIR, 'perfil')
+            os.makedirs(carpeta, exist_ok=True)
+            ruta = os.path.join(carpeta, f"fotogramas_{time.strftime('%Y%m%d-%H%M%S')}.csv")
+            self._csv = open(ruta, 'w', newline='', encoding='utf-8')
+            self._escritor = csv.writer(self._csv)
+            self._escritor.writerow(['fotograma', 'ventana', 'seccion', 'ms'])
+            print(f"[INFO] Perfil de fotogramas activo: {ruta}")
+        except Exception as e:
+            self._csv = self._escritor = None
+            print(f"[AVISO] Perfil sin traza CSV: {e}")
+
+    def desactivar(self):
+        self.activo = False
+        self._inicio = None
+        if self._csv is not None:
+            try:
+                self._csv.close()
+            except Exception:
+                pass
+        self._csv = self._escritor = None
+
+    def alternar(self):
+        if self.activo:
+            self.desactivar()
+        else:
+            self.activar()
+
+    def fotograma(self, ventana: str):
+        """Cierra el fotograma anterior (su resto es 'espera') y abre uno nuevo."""
+        if not self.activo:
+            return
+        ahora = time.perf_counter()
+        if self._inicio is not None:
+            self._acum['espera'] = self._acum.get('espera', 0.0) + (ahora - self._ultima) + self._pendiente
+            self._cerrar_fotograma(ahora)
+        self.numero += 1
+        self.ventana = ventana
+        self._acum = {}
+        self._pendiente = 0.0
+        self._inicio = self._ultima = ahora
+
+    def marca(self, seccion: str):
+        if not self.activo or self._inicio is None:
+            return
+        ahora = time.perf_counter()
+        self._acum[seccion] = self._acum.get(seccion, 0.0) + (ahora - self._ultima) + self._pendiente
+        self._pendiente = 0.0
+        self._ultima = ahora
+
+    def seccion(self, nombre: str):
+        """Para partes anidadas en otra: lo previo queda para la siguiente marca del bucle."""
+        return _SeccionPerfil(self, nombre) if (self.activo and self._inicio is not None) else _SECCION_NULA
+
+    def _abrir_seccion(self):
+        ahora = time.perf_counter()
+        self._pendiente += ahora - self._ultima
+        self._ultima = ahora
+
+    def _cerrar_fotograma(self, ahora: float):
+        trabajo = sum(v for k, v in self._acum.items() if k != 'espera')
+        self._acum['trabajo'] = trabajo
+        for seccion, seg in self._acum.items():
+            h = self.historial.get(seccion)
+            if h is None:
+                h = self.historial[seccion] = deque(maxlen=self.muestras)
+            h.append(seg * 1000.0)
+            if self._escritor is not None:
+                self._escritor.writerow([self.numero, self.ventana, seccion, f"{seg * 1000.0:.3f}"])
+        secciones = [(v, k) for k, v in self._acum.items() if k not in ('espera', 'trabajo')]
+        dominante = max(secciones)[1] if secciones else '-'
+        self.peores.append((trabajo * 1000.0, self.ventana, self.numero, dominante))
+        self.peores = sorted(self.peores, reverse=True)[:3]
+
+    def resumen(self) -> list:
+        """[(seccion, p50, p99)] ordenado por p99, recalculado cada 15 fotogramas."""
+        if self.numero - self._resumen_fotograma >= 15:
+            filas = []
+            for seccion, h in self.historial.items():
+                if h:
+                    p50, p99 = np.percentile(np.fromiter(h, float), (50, 99))
+                    filas.append((seccion, float(p50), float(p99)))
+            self._resumen = sorted(filas, key=lambda f: f[2], reverse=True)
+            self._resumen_fotograma = self.numero
+        return self._resumen
+
+    def dibujar(self, pantalla):
+        if not self.activo:
+            return
         try:
-            pygame.event.pump()
-            pygame.display.flip()
+            if self._fuente is None:
+                self._fuente = fuente_cacheada(18)
+            fuente = self._fuente
+            lineas = [f"Perfil {self.ventana}  (F10 oculta)   ms p50 / p99"]
+            for seccion, p50, p99 in self.resumen()[:8]:
+                lineas.append(f"{seccion:<13}{p50:7.2f} {p99:7.2f}")
+            for ms, ventana, numero, dominante in self.peores:
+                lineas.append(f"peor #{numero} {ventana}: {ms:.1f} ms ({dominante})")
+            alto_linea = fuente.get_linesize()
+            ancho = max(fuente.size(l)[0] for l in lineas) + 12
+            panel = pygame.Surface((ancho, alto_linea * len(lineas) + 8), pygame.SRCALPHA)
+            panel.fill((0, 0, 0, 190))
+            for i, linea in enumerate(lineas):
+                panel.blit(fuente.render(linea, True, AMARILLO if i == 0 else BLANCO), (6, 4 + i * alto_linea))
+            pantalla.blit(panel, (pantalla.get_width() - ancho - 4, 4))
         except Exception:
             pass
 
-def recortar_con_ellipsis(texto, fuente, ancho_max):
-    """Recorta el texto añadiendo … si excede ancho_max."""
-    if fuente.size(texto)[0] <= ancho_max:
-        return texto
-    if ancho_max <= 0:
-        return ""
-    ell = "…"
-    # Búsqueda decreciente simple
-    for n in range(len(texto), 0, -1):
-        t = texto[:n] + ell
-        if fuente.size(t)[0] <= ancho_max:
-            return t
-    return ell
-def ajustar_fuente_a_ancho(texto, ancho_max, tamaño_inicial, tamaño_min=12):
-    """Devuelve una fuente cuyo texto cabe en ancho_max, reduciendo tamaño si es necesario."""
-    tamaño = max(tamaño_min, int(tamaño_inicial))
-    fuente = pygame.font.Font(None, tamaño)
-    while tamaño > tamaño_min and fuente.size(texto)[0] > ancho_max:
-        tamaño -= 1
-        fuente = pygame.font.Font(None, tamaño)
-    return fuente
-
-def limpiar_linea_gcode(linea: str) -> str:
-    """Elimina comentarios de una línea G-code y normaliza espacios.
-    - Quita comentarios entre paréntesis (...)
-    - Quita comentarios con ';' desde el punto y coma hacia el final
-    - Retorna la línea limpia con espacios normalizados o cadena vacía
+_PERFIL_FOTOGRAMAS = None
+
+def perfil_fotogramas() -> PerfilFotogramas:
+    """Perfilador compartido por todas las ventanas."""
+    global _PERFIL_FOTOGRAMAS
+    if _PERFIL_FOTOGRAMAS is None:
+        _PERFIL_FOTOGRAMAS = PerfilFotogramas()
+        try:
+            import atexit
+            atexit.register(_PERFIL_FOTOGRAMAS.desactivar)
+        except Exception:
+            pass
+    return _PERFIL_FOTOGRAMAS
+
+class PerfilArranque:
+    """Tiempo de arranque hasta la primera pantalla.
+
+    Siempre se mide (son unas pocas marcas); con REHAB_PERFIL_ARRANQUE=1 o
+    --perfil-arranque además se imprime el desglose por etapas, se avisa si se supera
+    PRESUPUESTO_S y se lanza en segundo plano un `python -X importtime` del módulo para
+    resumir qué importaciones pesan más.
     """
-    try:
-        s = str(linea).strip()
-        if not s:
-            return ""
-        # Quitar comentarios entre paréntesis (anidados simple)
-        out = []
-        depth = 0
-        for ch in s:
-            if ch == '(':
-                depth += 1
-                continue
-            if ch == ')':
-                if depth > 0:
-                    depth -= 1
+
+    PRESUPUESTO_S = 1.0
+
+    def __init__(self):
+        self.activo = (os.environ.get('REHAB_PERFIL_ARRANQUE', '') not in ('', '0')
+                       or '--perfil-arranque' in sys.argv)
+        self.marcas = [('inicio', _INICIO_ARRANQUE)]
+        self.primer_fotograma = None
+
+    def marcar(self, etapa: str):
+        self.marcas.append((etapa, time.perf_counter()))
+
+    def etapas(self) -> list:
+        """[(etapa, segundos desde la marca anterior)]."""
+        return [(etapa, t - self.marcas[i][1]) for i, (etapa, t) in enumerate(self.marcas[1:])]
+
+    def fotograma_presentado(self):
+        """Lo llama EscenaRetenida en cada flip; sólo el primero cuenta."""
+        if self.primer_fotograma is not None:
+            return
+        self.marcar('primer_fotograma')
+        self.primer_fotograma = self.marcas[-1][1] - _INICIO_ARRANQUE
+        _LOG_INTERFAZ.info("Primera pantalla en %.0f ms", self.primer_fotograma * 1000)
+        precargar_modulos_pesados()
+        if self.activo:
+            self.informar()
+            Thread(target=self._resumen_importaciones, name='perfil-arranque', daemon=True).start()
+
+    def informar(self):
+        print("[INFO] Perfil de arranque:")
+        for etapa, duracion in self.etapas():
+            print(f"       {etapa:<20} {duracion * 1000:8.1f} ms")
+        total = self.primer_fotograma or 0.0
+        print(f"       {'total':<20} {total * 1000:8.1f} ms (presupuesto {self.PRESUPUESTO_S * 1000:.0f} ms)")
+        if total > self.PRESUPUESTO_S:
+            print("[AVISO] El arranque supera el presupuesto")
+
+    def _resumen_importaciones(self, n: int = 12):
+        """Ejecuta `python -X importtime -c "import programatesis9"` y lista las más lentas."""
+        try:
+            import subprocess
+            modulo = os.path.splitext(os.path.basename(os.path.abspath(__file__)))[0]
+            resultado = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', f"import {modulo}"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                capture_output=True, text=True, timeout=60)
+        except Exception as e:
+            print(f"[AVISO] No se pudo medir -X importtime: {e}")
+            return
+        filas = []
+        for linea in resultado.stderr.splitlines():
+            if not linea.startswith('import time:'):
                 continue
-            if depth > 0:
+            try:
+                propio, acumulado, nombre = linea[len('import time:'):].split('|')
+                filas.append((int(propio), int(acumulado), nombre.rstrip()))
+            except ValueError:
                 continue
-            out.append(ch)
-        s = ''.join(out)
-        # Quitar desde ';' al final
-        if ';' in s:
-            s = s.split(';', 1)[0]
-        # Normalizar espacios
-        s = ' '.join(s.strip().split())
-        return s
-    except Exception:
-        return ""
+        if not filas:
+            return
+        print(f"[INFO] -X importtime ({sum(f[0] for f in filas) / 1000:.0f} ms en total), "
+              f"importaciones más lentas (propio / acumulado):")
+        for propio, acumulado, nombre in sorted(filas, reverse=True)[:n]:
+            print(f"       {propio / 1000:7.1f} / {acumulado / 1000:7.1f} ms  {nombre.strip()}")
+
+_PERFIL_ARRANQUE = None
+
+def perfil_arranque() -> PerfilArranque:
+    global _PERFIL_ARRANQUE
+    if _PERFIL_ARRANQUE is None:
+        _PERFIL_ARRANQUE = PerfilArranque()
+    return _PERFIL_ARRANQUE
+
+def precargar_modulos_pesados(retardo: float = 0.5):
+    """Importa pandas y matplotlib en un hilo tras mostrar la primera pantalla, para que
+    abrir Progreso o Gráficas no se congele en la primera importación."""
+    def _precargar():
+        time.sleep(retardo)
+        inicio = time.perf_counter()
+        pandas_ok = _try_import_pandas()
+        matplotlib_ok = _try_import_matplotlib()
+        _LOG_INTERFAZ.info("Precarga en segundo plano: pandas=%s matplotlib=%s (%.0f ms)",
+                           pandas_ok, matplotlib_ok, (time.perf_counter() - inicio) * 1000)
+    Thread(target=_precargar, name='precarga-modulos', daemon=True).start()
+
+def atajo_depuracion(evento) -> bool:
+    """F10 (perfil de fotogramas) y F12 (registro); True si el evento ya se atendió."""
+    if evento.type != pygame.KEYDOWN:
+        return False
+    if evento.key == pygame.K_F10:
+        perfil_fotogramas().alternar()
+        return True
+    if evento.key == pygame.K_F12:
+        alternar_panel_registro()
+        return True
+    return False
 
-# === Utilidades de barra inferior de estado (permanente) ===
-def alto_barra_inferior(alto):
-    """Calcula la altura de la barra inferior según el alto de la ventana."""
+def dibujar_depuracion(pantalla):
+    """Superposiciones de depuración activas (registro y perfil), justo antes de flip."""
+    dibujar_panel_registro(pantalla)
+    perfil_fotogramas().dibujar(pantalla)
+
+def atender_superposiciones(evento) -> bool:
+    """Avisos en pantalla y atajos de depuración; True si el evento ya se atendió."""
+    if notificaciones().atender_evento(evento):
+        return True
+    return atajo_depuracion(evento)
+
+def dibujar_superposiciones(pantalla):
+    """Todo lo que va encima de la ventana (avisos y depuración), justo antes de flip."""
+    notificaciones().dibujar(pantalla)
+    dibujar_depuracion(pantalla)
+
+def dibujar_panel_registro(pantalla, lineas_max: int = 14):
+    """Panel semitransparente con las últimas entradas del registro en memoria."""
+    if not _PANEL_REGISTRO_VISIBLE:
+        return
     try:
-        return int(max(30, min(alto * 0.08, alto * 0.16)))
+        ancho, alto = pantalla.get_size()
+        fuente = fuente_cacheada(18)
+        alto_linea = fuente.get_linesize()
+        lineas = registros_recientes(lineas_max) or ["(registro vacío)"]
+        panel = pygame.Surface((ancho, alto_linea * len(lineas) + 10), pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 190))
+        for i, linea in enumerate(lineas):
+            texto = recortar_con_ellipsis(linea, fuente, ancho - 12)
+            color = ROJO if ' ERRO ' in linea else (AMARILLO if ' WARN ' in linea else BLANCO)
+            panel.blit(fuente.render(texto, True, color), (6, 5 + i * alto_linea))
+        pantalla.blit(panel, (0, alto - panel.get_height()))
     except Exception:
-        return 40
+        pass
 
-def dibujar_barra_inferior(pantalla, ancho, alto, conexion_activa, estado_conexion=None, controlador_cnc=None, offset_px=0):
-    """Dibuja una barra inferior permanente con color según conexión y texto centrado.
+# Evento pygame con el que los servicios en segundo plano despiertan un bucle en reposo
+EVENTO_DESPERTAR = pygame.USEREVENT + 1
+_DESPERTAR_LOCK = Lock()
+_DESPERTAR_CONTADOR = 0  # avisos recibidos; esperar() lo compara con el último fotograma
+_DESPERTAR_PENDIENTE = False  # hay un EVENTO_DESPERTAR en cola sin atender
+_DESPERTAR_SUSCRITO = False
 
-    - Verde si conectado, rojo si no.
-    - Texto blanco centrado; incluye firmware/puerto si hay controlador y está conectado.
+def despertar_interfaz(_evento=None):
+    """Despierta el bucle pygame que espera en EscenaRetenida.esperar(); seguro desde cualquier hilo.
+
+    Las ráfagas se agrupan sin perder ninguna: cada aviso cuenta, pero sólo se publica un
+    EVENTO_DESPERTAR mientras el anterior siga en cola.
     """
-    # Barra de estado de conexión CNC eliminada según solicitud
+    global _DESPERTAR_CONTADOR, _DESPERTAR_PENDIENTE
+    with _DESPERTAR_LOCK:
+        _DESPERTAR_CONTADOR += 1
+        if _DESPERTAR_PENDIENTE:
+            return
+        _DESPERTAR_PENDIENTE = True
+    try:
+        if pygame.display.get_init():
+            pygame.event.post(pygame.event.Event(EVENTO_DESPERTAR))
+    except Exception:
+        pass
+
+def _suscribir_despertar():
+    """Cualquier evento del bus (CNC, sensores, captura) despierta la interfaz."""
+    global _DESPERTAR_SUSCRITO
+    if _DESPERTAR_SUSCRITO:
+        return
+    _DESPERTAR_SUSCRITO = True
+    bus_eventos().suscribir('interfaz-despertar', callback=despertar_interfaz)
+    # El núcleo no conoce la interfaz: sus avisos al usuario llegan como eventos 'aviso'
+    bus_eventos().suscribir('interfaz-avisos', tipos=('aviso',), callback=_mostrar_aviso_nucleo)
+
+def _mostrar_aviso_nucleo(evento):
+    datos = evento.datos or {}
+    mostrar_aviso_sistema(datos.get('titulo', "Aviso"), datos.get('mensaje', ''), modal=datos.get('modal', True))
+
+class EscenaRetenida:
+    """Redibujo por regiones sucias para los bucles pygame.
+
+    Cada fotograma el bucle entrega la firma de lo que no es widget (textos, datos, tamaño)
+    y la lista de widgets con firma_visual(). Si la firma o un widget no opaco cambiaron se
+    redibuja todo y se hace flip(); si sólo cambiaron widgets opacos (pintan su rect
+    completo, p. ej. el hover de un Boton) se redibujan ellos y se envían sus rects con
+    display.update(); si nada cambió no se dibuja ni se presenta. Cualquier evento que no
+    sea movimiento del ratón invalida la escena, y refresco_max fuerza un redibujo completo
+    periódico para el estado que la firma no recoja.
+
+    esperar() sustituye a clock.tick(60): en reposo bloquea en pygame.event.wait hasta una
+    entrada, un EVENTO_DESPERTAR de los servicios o el siguiente temporizador. La entrada que
+    lo despierta queda retenida y eventos() la entrega la primera, antes que la cola, para
+    no alterar el orden (KEYDOWN/TEXTINPUT, pulsar/soltar botón).
+    """
+
+    def __init__(self, refresco_max: float = 1.0):
+        self.refresco_max = float(refresco_max)
+        self._firma = None
+        self._firmas_widgets = {}
+        self._pendientes = []
+        self._completo = False
+        self._invalida = True
+        self._ultimo_completo = 0.0
+        self._retenido = None
+        self._despertar_visto = 0
+        self.completos = 0
+        self.parciales = 0
+        self.omitidos = 0
+        self.esperas = 0
+        _suscribir_despertar()
+
+    def invalidar(self):
+        self._invalida = True
+
+    def eventos(self) -> list:
+        """Sustituye a pygame.event.get(): el evento retenido por esperar() y después la cola."""
+        eventos = pygame.event.get()
+        if self._retenido is not None:
+            eventos.insert(0, self._retenido)
+            self._retenido = None
+        return eventos
+
+    def evento(self, evento):
+        """Registrar cada evento del bucle: sólo MOUSEMOTION deja la escena válida."""
+        if evento.type != pygame.MOUSEMOTION:
+            self._invalida = True
+
+    def _firma_total(self, pantalla, firma):
+        return (pantalla.get_size(), _PANEL_REGISTRO_VISIBLE, notificaciones().visibles(), firma)
+
+    def _caducada(self) -> bool:
+        return self.refresco_max > 0 and time.time() - self._ultimo_completo >= self.refresco_max
+
+    def preparar(self, pantalla, firma, widgets=()) -> bool:
+        """True si el bucle debe dibujar el fotograma completo antes de presentar()."""
+        self._despertar_visto = _DESPERTAR_CONTADOR
+        firma = self._firma_total(pantalla, firma)
+        self._pendientes = []
+        # Con avisos encima, un redibujo parcial de widgets taparía el aviso
+        completo = (self._invalida or firma != self._firma or self._caducada()
+                    or perfil_fotogramas().activo or bool(firma[2]))
+        if not completo:
+            for w in widgets:
+                if w is None:
+                    continue
+                fw = w.firma_visual()
+                if fw == self._firmas_widgets.get(id(w)):
+                    continue
+                if not getattr(w, 'opaco', False):
+                    completo = True
+                    break
+                self._pendientes.append((w, fw))
+        if completo:
+            self._pendientes = []
+            self._firmas_widgets = {id(w): w.firma_visual() for w in widgets if w is not None}
+            self._firma = firma
+        self._completo = completo
+        return completo
+
+    def omitir_fotograma(self, pantalla, firma) -> bool:
+        """Para bucles sin lista de widgets: True si no hay eventos pendientes, la firma
+        es la misma y no toca refresco, así que el fotograma entero puede saltarse."""
+        self._despertar_visto = _DESPERTAR_CONTADOR
+        firma = self._firma_total(pantalla, firma)
+        if (not self._invalida and firma == self._firma and not self._caducada()
+                and not perfil_fotogramas().activo and self._retenido is None and not pygame.event.peek()):
+            self.omitidos += 1
+            return True
+        self._firma = firma
+        self._invalida = False
+        self._ultimo_completo = time.time()
+        self.completos += 1
+        return False
+
+    def presentar(self, pantalla):
+        """flip() tras un fotograma completo; update(rects) de los widgets sucios si no."""
+        if self._completo:
+            self._invalida = False
+            self._ultimo_completo = time.time()
+            self.completos += 1
+            pygame.display.flip()
+            perfil_arranque().fotograma_presentado()
+            return
+        if not self._pendientes:
+            self.omitidos += 1
+            return
+        rects = []
+        for w, fw in self._pendientes:
+            w.dibujar(pantalla)
+            self._firmas_widgets[id(w)] = fw
+            rects.append(w.rect.copy())
+        self._pendientes = []
+        self.parciales += 1
+        pygame.display.update(rects)
+
+    def esperar(self, clock, activo: bool = False, plazo: float | None = None, fps: int = 60):
+        """Cede la CPU hasta el próximo fotograma.
+
+        activo (rutina, captura, arrastre) mantiene el ritmo fijo de fps. En reposo se duerme
+        hasta una entrada, un aviso del bus o `plazo` segundos (próximo temporizador del
+        bucle), nunca más allá del siguiente refresco completo.
+        """
+        global _DESPERTAR_PENDIENTE
+        clock.tick(fps)
+        if activo or perfil_fotogramas().activo or self._retenido is not None or pygame.event.peek():
+            return
+        espera = self.refresco_max - (time.time() - self._ultimo_completo) if self.refresco_max > 0 else 1.0
+        if plazo is not None:
+            espera = min(espera, plazo)
+        vencimiento = notificaciones().proximo_vencimiento()
+        if vencimiento is not None:
+            espera = min(espera, vencimiento)
+        if espera <= 0:
+            return
+        with _DESPERTAR_LOCK:
+            # La cola está vacía: el EVENTO_DESPERTAR anterior ya se consumió (aquí o en otro bucle)
+            _DESPERTAR_PENDIENTE = False
+            avisos = _DESPERTAR_CONTADOR
+        if avisos != self._despertar_visto:
+            # Llegaron avisos después de empezar el fotograma: volver a dibujar sin dormir
+            self._invalida = True
+            return
+        self.esperas += 1
+        evento = pygame.event.wait(max(1, int(espera * 1000)))
+        if evento.type == EVENTO_DESPERTAR:
+            self._invalida = True
+        elif evento.type != pygame.NOEVENT:
+            # Re-publicarlo lo pondría detrás de lo que ya esté en cola: eventos() lo entrega primero
+            self._retenido = evento
 
 class VentanaPrincipal:
     def __init__(self):
@@ -2908,15 +1939,11 @@ class VentanaPrincipal:
         self.fullscreen = False
         
         # Crear pantalla con tamaño ajustado
-        self.pantalla = pygame.display.set_mode((self.ancho, self.alto), pygame.RESIZABLE | pygame.DOUBLEBUF)
+        self.pantalla = pantalla_app().establecer_modo((self.ancho, self.alto), pygame.RESIZABLE | pygame.DOUBLEBUF)
         pygame.display.set_caption("Registro de Pacientes - Escalado Uniforme")
         
         # Forzar maximizar en Linux si wmctrl está disponible
-        try:
-            import subprocess
-            subprocess.Popen(['wmctrl', '-r', ':ACTIVE:', '-b', 'add,maximized_vert,maximized_horz'])
-        except Exception:
-            pass
+        pantalla_app().maximizar()
 
         # Inicializar gestor de pacientes
         self.gestor_pacientes = GestorPacientes()
@@ -2977,10 +2004,10 @@ class VentanaPrincipal:
         # Crear fuentes escaladas (permite overrides por JSON)
         fcfg = (self.config_layout or {}).get('fuentes', {})
         self._fcfg = fcfg
-        self.fuente = pygame.font.Font(None, self.escalar_fuente(fcfg.get('general', 42)))
-        self.fuente_titulo = pygame.font.Font(None, self.escalar_fuente(fcfg.get('titulo', 100)))
-        self.fuente_pequeña = pygame.font.Font(None, self.escalar_fuente(fcfg.get('pequena', 32)))
-        self.fuente_descripcion = pygame.font.Font(None, self.escalar_fuente(fcfg.get('descripcion', 38)))
+        self.fuente = fuente_cacheada(self.escalar_fuente(fcfg.get('general', 42)))
+        self.fuente_titulo = fuente_cacheada(self.escalar_fuente(fcfg.get('titulo', 100)))
+        self.fuente_pequeña = fuente_cacheada(self.escalar_fuente(fcfg.get('pequena', 32)))
+        self.fuente_descripcion = fuente_cacheada(self.escalar_fuente(fcfg.get('descripcion', 38)))
 
         # Dimensiones base escaladas
         margcfg = (self.config_layout or {}).get('margenes', {})
@@ -3421,15 +2448,20 @@ class VentanaPrincipal:
         clock = pygame.time.Clock()
         ejecutando = True
         
+        perfil = perfil_fotogramas()
+        # Pantalla de paciente: en reposo solo despierta con entradas o al caducar el mensaje
+        escena = EscenaRetenida(refresco_max=5.0)
         while ejecutando:
+            perfil.fotograma('Principal')
             tiempo_actual = pygame.time.get_ticks()
             
-            # Limpiar pantalla ANTES de procesar eventos
-            self.pantalla.fill(BLANCO)
-            
             pos_mouse = pygame.mouse.get_pos()
             
-            for evento in pygame.event.get():
+            perfil.marca('estado')
+            for evento in escena.eventos():
+                escena.evento(evento)
+                if atender_superposiciones(evento):
+                    continue
                 if evento.type == pygame.QUIT:
                     raise CerrarPrograma("Usuario cerró la ventana principal")
                 
@@ -3445,7 +2477,7 @@ class VentanaPrincipal:
                         info = pygame.display.Info()
                         w = max(self.ancho_min, info.current_w)
                         h = max(self.alto_min, info.current_h)
-                        self.pantalla = pygame.display.set_mode((w, h), pygame.RESIZABLE | pygame.DOUBLEBUF)
+                        self.pantalla = pantalla_app().establecer_modo((w, h), pygame.RESIZABLE | pygame.DOUBLEBUF)
                         self.redimensionar(w, h)
                         continue
                     elif evento.key == pygame.K_F5:
@@ -3457,7 +2489,7 @@ class VentanaPrincipal:
                         # Salir de pantalla completa con ESC
                         self.fullscreen = False
                         w, h = ajustar_a_pantalla(self.ancho_base, self.alto_base, self.ancho_min, self.alto_min)
-                        self.pantalla = pygame.display.set_mode((w, h), pygame.RESIZABLE | pygame.DOUBLEBUF)
+                        self.pantalla = pantalla_app().establecer_modo((w, h), pygame.RESIZABLE | pygame.DOUBLEBUF)
                         self.redimensionar(w, h)
                         continue
                     # Manejar entrada de texto para campos activos
@@ -3502,8 +2534,9 @@ class VentanaPrincipal:
                             self.nombre_paciente_guardado = self.campo_busqueda.obtener_valor()
                             
                             # Abrir ventana del sistema con el diseño exacto de interfas1.py
-                            ventana_sistema = VentanaSecundaria(self.paciente_actual)
-                            resultado = ventana_sistema.ejecutar()
+                            with pantalla_app().escena('Secundaria'):
+                                ventana_sistema = VentanaSecundaria(self.paciente_actual)
+                                resultado = ventana_sistema.ejecutar()
                             if resultado == False:
                                 raise CerrarPrograma("Usuario cerró ventana sistema")
                             # Si no se cerró la ventana, continuar normalmente
@@ -3514,22 +2547,34 @@ class VentanaPrincipal:
 
                 # Eventos de arrastre eliminados (modo edición)
             
+            perfil.marca('eventos')
             # Actualizar hover de botones DESPUÉS de eventos
             self.boton_buscar.verificar_hover(pos_mouse)
             self.boton_registrar.verificar_hover(pos_mouse)
             self.boton_continuar.verificar_hover(pos_mouse)
             
-            # Dibujar interfaz
-            self.dibujar_interfaz()
-            # Overlay de edición eliminado
-            
-            # Mostrar mensaje si es necesario
-            if tiempo_actual < self.mostrar_mensaje_tiempo:
-                self.mostrar_mensaje()
-            
+            # Redibujar solo si cambió algo: el hover de un botón actualiza únicamente su rect
+            mensaje_visible = tiempo_actual < self.mostrar_mensaje_tiempo
+            firma = (self.paciente_actual, mensaje_visible and (self.mensaje, self.color_mensaje))
+            widgets = [self.campo_busqueda, self.boton_buscar, self.boton_registrar, self.boton_continuar,
+                       getattr(self, 'boton_salir', None)] + list(self.campos.values())
+            if escena.preparar(self.pantalla, firma, widgets):
+                self.pantalla.fill(BLANCO)
+                # Dibujar interfaz
+                self.dibujar_interfaz()
+                # Overlay de edición eliminado
+                
+                # Mostrar mensaje si es necesario
+                if mensaje_visible:
+                    self.mostrar_mensaje()
+                
+                dibujar_superposiciones(self.pantalla)
+            perfil.marca('dibujo')
             # Actualizar pantalla
-            pygame.display.flip()
-            clock.tick(60)
+            escena.presentar(self.pantalla)
+            perfil.marca('flip')
+            restante_msg = (self.mostrar_mensaje_tiempo - pygame.time.get_ticks()) / 1000.0
+            escena.esperar(clock, plazo=restante_msg if restante_msg > 0 else None)
 
 # CLASE VENTANASECUNDARIA EXACTA DEL ARCHIVO INTERFAS1.PY
 class VentanaSecundaria:
@@ -3546,18 +2591,16 @@ class VentanaSecundaria:
         info = pygame.display.Info()
         self.ancho, self.alto = info.current_w, info.current_h
         centrar_ventana(self.ancho, self.alto)
-        self.pantalla = pygame.display.set_mode((info.current_w, info.current_h), pygame.RESIZABLE)
+        self.pantalla = pantalla_app().establecer_modo((info.current_w, info.current_h), pygame.RESIZABLE)
         pygame.display.set_caption("Control de Robot Cartesiano")
         # Forzar maximizar en Linux si wmctrl está disponible
-        try:
-            import subprocess
-            subprocess.Popen(['wmctrl', '-r', ':ACTIVE:', '-b', 'add,maximized_vert,maximized_horz'])
-        except Exception:
-            pass
+        pantalla_app().maximizar()
         
         self.controlador_cnc = ControladorCNC()
         self.conexion_activa = False
         self.estado_conexion = "CNC no conectada"
+        # Conexión CNC en curso (ConexionCNCAsincrona) o None
+        self.conexion_en_curso = None
         self.color_estado = ROJO
         
         # Inicializar gestor de pacientes
@@ -3571,7 +2614,7 @@ class VentanaSecundaria:
             
             for nombre_fuente in fuentes_posibles:
                 try:
-                    self.fuente_dejavu = pygame.font.SysFont(nombre_fuente, 30)
+                    self.fuente_dejavu = fuente_cacheada(30, nombre_fuente, sistema=True)
                     # Verificar si la fuente se cargó correctamente probando un carácter
                     test_render = self.fuente_dejavu.render("←", True, NEGRO)
                     fuente_cargada = True
@@ -3582,10 +2625,10 @@ class VentanaSecundaria:
             
             if not fuente_cargada:
                 # Si no se pudo cargar ninguna variante, usar una fuente predeterminada
-                self.fuente_dejavu = pygame.font.Font(None, 30)
+                self.fuente_dejavu = fuente_cacheada(30)
                 print("No se pudo cargar DejaVu Sans. Usando fuente predeterminada.")
         except:
-            self.fuente_dejavu = pygame.font.Font(None, 30)
+            self.fuente_dejavu = fuente_cacheada(30)
             print("Error al cargar fuentes. Usando fuente predeterminada.")
         
         # Inicializar botones
@@ -3681,22 +2724,22 @@ class VentanaSecundaria:
         
         # Botón Rutinas
         self.boton_rutinas = Boton(x_derecha, altura_barra_verde + margen, ancho_boton_derecha, alto_boton_direccional, "Rutinas", VERDE_CLARO, self.fuente_dejavu, VERDE_BOTON)
-        self.boton_rutinas.fuente_personalizada = pygame.font.Font(None, 18)
+        self.boton_rutinas.fuente_personalizada = fuente_cacheada(18)
         
         # Botón Gráficas
         y_graficas = altura_barra_verde + margen + alto_boton_direccional + margen
         self.boton_graficas = Boton(x_derecha, y_graficas, ancho_boton_derecha, alto_boton_direccional * 2, "Gráficas de Esfuerzo Muscular", VERDE_CLARO, self.fuente_dejavu, VERDE_BOTON)
-        self.boton_graficas.fuente_personalizada = pygame.font.Font(None, 18)
+        self.boton_graficas.fuente_personalizada = fuente_cacheada(18)
         
         # Botón Progreso
         y_progreso = y_graficas + alto_boton_direccional * 2 + margen
         self.boton_progreso = Boton(x_derecha, y_progreso, ancho_boton_derecha, alto_boton_direccional, "Progreso del Paciente", VERDE_CLARO, self.fuente_dejavu, VERDE_BOTON)
-        self.boton_progreso.fuente_personalizada = pygame.font.Font(None, 18)
+        self.boton_progreso.fuente_personalizada = fuente_cacheada(18)
         
         # Botón Conectar CNC
         y_conectar = y_progreso + alto_boton_direccional + margen
         self.boton_conectar = Boton(x_derecha, y_conectar, ancho_boton_derecha, alto_boton_direccional, "Conectar CNC", VERDE_CLARO, self.fuente_dejavu, VERDE_BOTON)
-        self.boton_conectar.fuente_personalizada = pygame.font.Font(None, 18)
+        self.boton_conectar.fuente_personalizada = fuente_cacheada(18)
         
         # Botón Volver a Login
         y_volver = y_conectar + alto_boton_direccional + margen
@@ -3705,7 +2748,7 @@ class VentanaSecundaria:
         if y_volver > limite_inferior:
             y_volver = max(altura_barra_verde + margen, limite_inferior)
         self.boton_volver = Boton(x_derecha, y_volver, ancho_boton_derecha, alto_boton_direccional, "Volver a Login", VERDE_CLARO, self.fuente_dejavu, VERDE_BOTON)
-        self.boton_volver.fuente_personalizada = pygame.font.Font(None, 18)
+        self.boton_volver.fuente_personalizada = fuente_cacheada(18)
         
         # Guardar proporciones para redimensionamiento
         for boton in self.botones:
@@ -3716,6 +2759,32 @@ class VentanaSecundaria:
                      self.boton_conectar, self.boton_volver]:
             boton.actualizar_proporciones(self.ancho, self.alto)
     
+    def _actualizar_conexion_en_curso(self):
+        """Refleja la etapa de la conexión en segundo plano y aplica su resultado al terminar."""
+        tarea = self.conexion_en_curso
+        if tarea is None:
+            return
+        self.estado_conexion = tarea.texto()
+        if not tarea.terminada:
+            return
+        self.conexion_en_curso = None
+        if tarea.exito:
+            self.conexion_activa = True
+            self.boton_conectar.texto = "Desconectar CNC"
+            self.color_estado = VERDE
+            self.velocidad_actual = self.controlador_cnc.velocidad_actual
+        else:
+            self.conexion_activa = False
+            self.boton_conectar.texto = "Conectar CNC"
+            self.color_estado = ROJO
+
+    def _cancelar_conexion_en_curso(self):
+        """Cancela la conexión pendiente al salir de la ventana y espera a que cierre el puerto."""
+        if self.conexion_en_curso is None:
+            return
+        self.conexion_en_curso.cancelar(esperar=5.0)
+        self._actualizar_conexion_en_curso()
+
     def redimensionar(self, nuevo_ancho, nuevo_alto):
         """Redimensiona todos los elementos de la interfaz."""
         # Actualizar dimensiones y recalcular layout para mantener alineaciones
@@ -3736,7 +2805,7 @@ class VentanaSecundaria:
         info = pygame.display.Info()
         self.ancho, self.alto = info.current_w, info.current_h
         centrar_ventana(self.ancho, self.alto)
-        self.pantalla = pygame.display.set_mode((self.ancho, self.alto), pygame.RESIZABLE)
+        self.pantalla = pantalla_app().establecer_modo((self.ancho, self.alto), pygame.RESIZABLE)
         
         clock = pygame.time.Clock()
         import datetime
@@ -3745,23 +2814,21 @@ class VentanaSecundaria:
         fuente_titulo = ajustar_fuente_a_ancho(texto_titulo, int(self.ancho * 0.7), int(self.alto * 0.06), 14)
         titulo = fuente_titulo.render(texto_titulo, True, BLANCO)
         ejecutando = True
+        perfil = perfil_fotogramas()
+        escena = EscenaRetenida()
+        tamano_fecha = None
+        fuente_fecha = None
         while ejecutando:
-            self.pantalla.fill(VERDE_CLARO)
-            altura_barra_verde = int(self.alto * 0.1)
-            pygame.draw.rect(self.pantalla, VERDE_OSCURO, (0, 0, self.ancho, altura_barra_verde))
-            # Solo actualizar la fecha/hora en cada frame
-            fecha_hora = datetime.datetime.now().strftime("%d/%m/%Y - %H:%M:%S")
-            fuente_fecha = ajustar_fuente_a_ancho(fecha_hora, int(self.ancho * 0.35), int(self.alto * 0.035), 12)
-            texto_fecha = fuente_fecha.render(fecha_hora, True, BLANCO)
-            rect_fecha = texto_fecha.get_rect(right=self.ancho - margen_h, centery=altura_barra_verde // 2)
-            self.pantalla.blit(texto_fecha, rect_fecha)
-            # Título ocupa el espacio restante
-            espacio_titulo = self.ancho - (margen_h + texto_fecha.get_width() + margen_h)
-            rect_titulo = titulo.get_rect(center=((espacio_titulo // 2) + margen_h, altura_barra_verde // 2))
-            self.pantalla.blit(titulo, rect_titulo)
+            perfil.fotograma('Secundaria')
             pos_mouse = pygame.mouse.get_pos()
-            for evento in pygame.event.get():
+            self._actualizar_conexion_en_curso()
+            perfil.marca('estado')
+            for evento in escena.eventos():
+                escena.evento(evento)
+                if atender_superposiciones(evento):
+                    continue
                 if evento.type == pygame.QUIT:
+                    self._cancelar_conexion_en_curso()
                     if self.conexion_activa:
                         self.controlador_cnc.desconectar()
                     raise CerrarPrograma("Usuario cerró la ventana")
@@ -3772,22 +2839,23 @@ class VentanaSecundaria:
                     if evento.key == pygame.K_F11:
                         self.fullscreen = not self.fullscreen
                         if self.fullscreen:
-                            self.pantalla = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
+                            self.pantalla = pantalla_app().establecer_modo((0, 0), pygame.FULLSCREEN)
                             info = pygame.display.Info()
                             self.redimensionar(info.current_w, info.current_h)
                         else:
                             w, h = ajustar_a_pantalla(self.ancho_inicial, self.alto_inicial, 800, 600)
-                            self.pantalla = pygame.display.set_mode((w, h), pygame.RESIZABLE)
+                            self.pantalla = pantalla_app().establecer_modo((w, h), pygame.RESIZABLE)
                             self.redimensionar(w, h)
                         continue
                     if evento.key == pygame.K_ESCAPE and self.fullscreen:
                         self.fullscreen = False
                         w, h = ajustar_a_pantalla(self.ancho_inicial, self.alto_inicial, 800, 600)
-                        self.pantalla = pygame.display.set_mode((w, h), pygame.RESIZABLE)
+                        self.pantalla = pantalla_app().establecer_modo((w, h), pygame.RESIZABLE)
                         self.redimensionar(w, h)
                         continue
                 if evento.type == pygame.MOUSEBUTTONDOWN:
                     if self.boton_volver.verificar_clic(pos_mouse):
+                        self._cancelar_conexion_en_curso()
                         if self.conexion_activa:
                             self.controlador_cnc.desconectar()
                         # Cerrar esta ventana y volver a la principal (Registro del paciente)
@@ -3796,23 +2864,18 @@ class VentanaSecundaria:
                     
                     # Manejar clic en botón conectar
                     if self.boton_conectar.verificar_clic(pos_mouse):
+                        if self.conexion_en_curso is not None:
+                            # Segundo clic mientras conecta: cancelar (el hilo cierra el puerto)
+                            self.conexion_en_curso.cancelar()
+                            continue
                         # Re-evaluar conexión real antes de actuar
                         self.conexion_activa = bool(self.controlador_cnc and self.controlador_cnc.esta_conectado())
                         if not self.conexion_activa:
-                            self.estado_conexion = "Conectando..."
+                            # Conectar en segundo plano: la ventana sigue dibujando y muestra la etapa
+                            self.conexion_en_curso = ConexionCNCAsincrona(self.controlador_cnc)
+                            self.estado_conexion = self.conexion_en_curso.texto()
                             self.color_estado = NARANJA
-                            self.dibujar_interfaz(pos_mouse)
-                            pygame.display.flip()
-                            
-                            if self.controlador_cnc.conectar():
-                                self.conexion_activa = True
-                                self.boton_conectar.texto = "Desconectar CNC"
-                                self.estado_conexion = "CNC conectada"
-                                self.color_estado = VERDE
-                                self.velocidad_actual = self.controlador_cnc.velocidad_actual
-                            else:
-                                self.estado_conexion = "CNC no conectada"
-                                self.color_estado = ROJO
+                            self.boton_conectar.texto = "Cancelar conexión"
                         else:
                             self.controlador_cnc.desconectar()
                             self.conexion_activa = False
@@ -3824,7 +2887,7 @@ class VentanaSecundaria:
                     if self.boton_fijar_origen.verificar_clic(pos_mouse):
                         if self.conexion_activa:
                             if self.controlador_cnc.establecer_origen():
-                                mostrar_aviso_sistema("Éxito", "Origen establecido correctamente en la posición actual.")
+                                mostrar_aviso_sistema("Éxito", "Origen establecido correctamente en la posición actual.", modal=False)
                                 try:
                                     # Sincronizar flags locales tras G92
                                     self.controlador_cnc.origen_establecido = True
@@ -3840,37 +2903,38 @@ class VentanaSecundaria:
                                 # Reenfocar la ventana de pygame tras cerrar el popup de Tk
                                 try:
                                     centrar_ventana(self.ancho, self.alto)
-                                    self.pantalla = pygame.display.set_mode((self.ancho, self.alto), pygame.RESIZABLE)
+                                    self.pantalla = pantalla_app().establecer_modo((self.ancho, self.alto), pygame.RESIZABLE)
                                 except Exception:
                                     pass
                             else:
                                 mostrar_aviso_sistema("Error", "No se pudo establecer el origen.")
                                 try:
                                     centrar_ventana(self.ancho, self.alto)
-                                    self.pantalla = pygame.display.set_mode((self.ancho, self.alto), pygame.RESIZABLE)
+                                    self.pantalla = pantalla_app().establecer_modo((self.ancho, self.alto), pygame.RESIZABLE)
                                 except Exception:
                                     pass
                         else:
                             mostrar_aviso_sistema("Error", "CNC no conectada. Conéctese primero.")
                             try:
                                 centrar_ventana(self.ancho, self.alto)
-                                self.pantalla = pygame.display.set_mode((self.ancho, self.alto), pygame.RESIZABLE)
+                                self.pantalla = pantalla_app().establecer_modo((self.ancho, self.alto), pygame.RESIZABLE)
                             except Exception:
                                 pass
                     
                     # Manejar clic en botón control de velocidad
                     if self.boton_control_velocidad.verificar_clic(pos_mouse):
                         # Abrir la ventana de configuración interna en vez de depender de interfas2.py
-                        ventana_config = VentanaConfiguracionRutina(self.controlador_cnc, self.conexion_activa)
-                        ventana_config.ejecutar()
+                        with pantalla_app().escena('Configuración'):
+                            ventana_config = VentanaConfiguracionRutina(self.controlador_cnc, self.conexion_activa)
+                            ventana_config.ejecutar()
                         centrar_ventana(self.ancho, self.alto)
-                        self.pantalla = pygame.display.set_mode((self.ancho, self.alto), pygame.RESIZABLE)
+                        self.pantalla = pantalla_app().establecer_modo((self.ancho, self.alto), pygame.RESIZABLE)
                     
                     # Manejar clic en botón reanudar
                     if hasattr(self, 'boton_reanudar') and self.boton_reanudar.verificar_clic(pos_mouse):
                         if self.conexion_activa:
                             if self.controlador_cnc.reanudar_movimiento():
-                                mostrar_aviso_sistema("Reanudar", "Movimiento reanudado (Cycle Start).")
+                                mostrar_aviso_sistema("Reanudar", "Movimiento reanudado (Cycle Start).", modal=False)
                             else:
                                 mostrar_aviso_sistema("Error", "No se pudo reanudar el movimiento.")
                         else:
@@ -3880,7 +2944,7 @@ class VentanaSecundaria:
                     if self.boton_emergencia.verificar_clic(pos_mouse):
                         if self.conexion_activa:
                             if self.controlador_cnc.paro_emergencia():
-                                mostrar_aviso_sistema("Emergencia", "Movimiento detenido (Feed Hold). Origen preservado.")
+                                mostrar_aviso_sistema("Emergencia", "Movimiento detenido (Feed Hold). Origen preservado.", modal=False, nivel='aviso')
                             else:
                                 mostrar_aviso_sistema("Error", "No se pudo detener de forma segura.")
                         else:
@@ -3892,10 +2956,18 @@ class VentanaSecundaria:
                         try:
                             # Asegurar foco de la ventana principal antes de abrir Rutinas
                             centrar_ventana(self.ancho, self.alto)
-                            self.pantalla = pygame.display.set_mode((self.ancho, self.alto), pygame.RESIZABLE)
+                            self.pantalla = pantalla_app().establecer_modo((self.ancho, self.alto), pygame.RESIZABLE)
                             conexion_real = bool(self.controlador_cnc and self.controlador_cnc.esta_conectado())
-                            ventana_rutina = VentanaRutina(1, self.controlador_cnc, conexion_real, self.id_paciente, self.gestor_pacientes)
-                            ventana_rutina.ejecutar()
+                            ventana_rutina = None
+                            try:
+                                with pantalla_app().escena('Rutinas'):
+                                    ventana_rutina = VentanaRutina(1, self.controlador_cnc, conexion_real, self.id_paciente, self.gestor_pacientes)
+                                    ventana_rutina.ejecutar()
+                            finally:
+                                # Al salir de Rutinas, cerrar la sesión de una rutina interrumpida no reanudada
+                                if ventana_rutina is not None:
+                                    ventana_rutina._descartar_rutina_interrumpida()
+                                    ventana_rutina._cancelar_suscripciones_sensores()
                         except CerrarPrograma:
                             # Propagar la excepción de cierre para cerrar el programa
                             raise
@@ -3906,13 +2978,20 @@ class VentanaSecundaria:
                                 print(f"Error al abrir Rutinas: {e}")
                         finally:
                             centrar_ventana(self.ancho, self.alto)
-                            self.pantalla = pygame.display.set_mode((self.ancho, self.alto), pygame.RESIZABLE)
+                            self.pantalla = pantalla_app().establecer_modo((self.ancho, self.alto), pygame.RESIZABLE)
 
                     if self.boton_graficas.verificar_clic(pos_mouse):
                         try:
                             conexion_real = bool(self.controlador_cnc and self.controlador_cnc.esta_conectado())
-                            ventana_rutina = VentanaRutina(2, self.controlador_cnc, conexion_real, self.id_paciente, self.gestor_pacientes)
-                            ventana_rutina.ejecutar()
+                            ventana_rutina = None
+                            try:
+                                with pantalla_app().escena('Gráficas'):
+                                    ventana_rutina = VentanaRutina(2, self.controlador_cnc, conexion_real, self.id_paciente, self.gestor_pacientes)
+                                    ventana_rutina.ejecutar()
+                            finally:
+                                # El servicio sigue leyendo; solo se suelta la suscripción de la ventana
+                                if ventana_rutina is not None:
+                                    ventana_rutina._cancelar_suscripciones_sensores()
                         except CerrarPrograma:
                             # Propagar la excepción de cierre para cerrar el programa
                             raise
@@ -3923,13 +3002,14 @@ class VentanaSecundaria:
                                 print(f"Error al abrir Gráficas: {e}")
                         finally:
                             centrar_ventana(self.ancho, self.alto)
-                            self.pantalla = pygame.display.set_mode((self.ancho, self.alto), pygame.RESIZABLE)
+                            self.pantalla = pantalla_app().establecer_modo((self.ancho, self.alto), pygame.RESIZABLE)
                     
                     if self.boton_progreso.verificar_clic(pos_mouse):
                         try:
                             conexion_real = bool(self.controlador_cnc and self.controlador_cnc.esta_conectado())
-                            ventana_rutina = VentanaRutina(3, self.controlador_cnc, conexion_real, self.id_paciente, self.gestor_pacientes)
-                            ventana_rutina.ejecutar()
+                            with pantalla_app().escena('Progreso'):
+                                ventana_rutina = VentanaRutina(3, self.controlador_cnc, conexion_real, self.id_paciente, self.gestor_pacientes)
+                                ventana_rutina.ejecutar()
                         except CerrarPrograma:
                             # Propagar la excepción de cierre para cerrar el programa
                             raise
@@ -3940,7 +3020,7 @@ class VentanaSecundaria:
                                 print(f"Error al abrir Progreso: {e}")
                         finally:
                             centrar_ventana(self.ancho, self.alto)
-                            self.pantalla = pygame.display.set_mode((self.ancho, self.alto), pygame.RESIZABLE)
+                            self.pantalla = pantalla_app().establecer_modo((self.ancho, self.alto), pygame.RESIZABLE)
                     
                     # CORRECCIÓN: Manejar clics en botones de movimiento con debugging
                     for i, boton in enumerate(self.botones):
@@ -3962,11 +3042,66 @@ class VentanaSecundaria:
                             else:
                                 print("CNC no conectada. No se puede mover.")
             
-            self.dibujar_interfaz(pos_mouse)
-            pygame.display.flip()
-            clock.tick(60)
+            perfil.marca('eventos')
+            # La fecha/hora solo cambia de segundo en segundo
+            fecha_hora = datetime.datetime.now().strftime("%d/%m/%Y - %H:%M:%S")
+            if escena.preparar(self.pantalla, self._firma_escena(fecha_hora), self._widgets_escena(pos_mouse)):
+                self.pantalla.fill(VERDE_CLARO)
+                altura_barra_verde = int(self.alto * 0.1)
+                pygame.draw.rect(self.pantalla, VERDE_OSCURO, (0, 0, self.ancho, altura_barra_verde))
+                if tamano_fecha != (self.ancho, self.alto):
+                    # Ancho fijo (dígitos): la fuente se ajusta una vez por tamaño de ventana
+                    tamano_fecha = (self.ancho, self.alto)
+                    fuente_fecha = ajustar_fuente_a_ancho("00/00/0000 - 00:00:00", int(self.ancho * 0.35), int(self.alto * 0.035), 12)
+                texto_fecha = fuente_fecha.render(fecha_hora, True, BLANCO)
+                rect_fecha = texto_fecha.get_rect(right=self.ancho - margen_h, centery=altura_barra_verde // 2)
+                self.pantalla.blit(texto_fecha, rect_fecha)
+                # Título ocupa el espacio restante
+                espacio_titulo = self.ancho - (margen_h + texto_fecha.get_width() + margen_h)
+                rect_titulo = titulo.get_rect(center=((espacio_titulo // 2) + margen_h, altura_barra_verde // 2))
+                self.pantalla.blit(titulo, rect_titulo)
+                perfil.marca('encabezado')
+                self.dibujar_interfaz(pos_mouse)
+                dibujar_superposiciones(self.pantalla)
+            perfil.marca('dibujo')
+            escena.presentar(self.pantalla)
+            perfil.marca('flip')
+            escena.esperar(clock, plazo=self._plazo_reposo())
         
         return not ejecutando  # Retorna False si se cerró la ventana
+
+    def _plazo_reposo(self):
+        """Segundos hasta el próximo cambio esperado: el reloj, la etapa de conexión o las coordenadas."""
+        plazo = 1.0 - (time.time() % 1.0) + 0.005
+        if self.conexion_en_curso is not None:
+            plazo = min(plazo, 0.25)
+        elif self.conexion_activa:
+            plazo = min(plazo, 0.1)
+        return plazo
+
+    def _widgets_escena(self, pos_mouse):
+        """Botones de la ventana con el hover ya actualizado (para EscenaRetenida)."""
+        widgets = [
+            self.boton_fijar_origen, self.boton_emergencia, self.boton_control_velocidad,
+            getattr(self, 'boton_reanudar', None), self.boton_rutinas, self.boton_graficas, self.boton_progreso,
+            self.boton_conectar, self.boton_volver
+        ] + list(self.botones)
+        for btn in widgets:
+            if btn is not None:
+                btn.verificar_hover(pos_mouse)
+        return widgets
+
+    def _firma_escena(self, fecha_hora):
+        """Estado que dibuja la ventana fuera de los botones: reloj, conexión y coordenadas."""
+        coords = None
+        if self.conexion_activa:
+            try:
+                x_log, y_log = self.controlador_cnc.obtener_posicion_logica()
+                coords = (round(x_log, 2), round(y_log, 2))
+            except Exception:
+                pass
+        return (fecha_hora, self.conexion_activa, self.estado_conexion, self.color_estado,
+                self.conexion_en_curso is not None, coords, getattr(self.controlador_cnc, 'en_hold', False))
     
     def dibujar_interfaz(self, pos_mouse):
         # Altura de la barra verde superior
@@ -3993,6 +3128,16 @@ class VentanaSecundaria:
         # Dibujar botones de movimiento
         for boton in self.botones:
             boton.dibujar(self.pantalla)
+
+        # Etapa de la conexión en segundo plano bajo el botón Conectar
+        if self.conexion_en_curso is not None:
+            try:
+                fuente_etapa = fuente_cacheada(20)
+                texto_etapa = recortar_con_ellipsis(self.estado_conexion, fuente_etapa, self.ancho - self.boton_conectar.rect.x - 10)
+                surf_etapa = texto_cacheado(texto_etapa, fuente_etapa, self.color_estado)
+                self.pantalla.blit(surf_etapa, (self.boton_conectar.rect.x, self.boton_conectar.rect.bottom + 4))
+            except Exception:
+                pass
         
         # Definir el área del panel central - MODIFICADO PARA UBICARLO EN LA POSICIÓN INDICADA
         # Ahora el panel se ubicará alineado con la columna de botones que contiene +X
@@ -4020,7 +3165,7 @@ class VentanaSecundaria:
         pygame.draw.rect(self.pantalla, VERDE_BORDE, panel_central, 2)
         
         # Mostrar información en el panel central
-        fuente_info = pygame.font.Font(None, 24)  # Tamaño de fuente para ajustar al panel
+        fuente_info = fuente_cacheada(24)  # Tamaño de fuente para ajustar al panel
         
         # Mostrar estado de conexión
         if not self.conexion_activa:
@@ -4084,12 +3229,13 @@ class VentanaRutina:
             self.ancho, self.alto = ajustar_a_pantalla(1400, 800, 1000, 700)
             self.es_modo_grafica = True
             
-            # Inicializar Arduino para sensores ECG
-            self.arduino_reader = ArduinoSensorReader()
-            if self.arduino_reader.conectar():
+            # Suscribirse al servicio de sensores ECG (la conexión es del proceso, no de la ventana)
+            self.suscripcion_sensores = servicio_sensores().suscribir('graficas', self.id_paciente)
+            self.arduino_reader = self.suscripcion_sensores.lector
+            if self.arduino_reader.conectado:
                 print("[ECG] Arduino conectado correctamente")
             else:
-                print("[ECG] Arduino no conectado - usando simulación")
+                print("[ECG] Arduino aún no conectado - se seguirá buscando en segundo plano")
             self.gpio_disponible = False  # Ya no usamos GPIO
             
             self.max_puntos = 100
@@ -4162,6 +3308,7 @@ class VentanaRutina:
             
             self.datos_sesion_hombro = []
             self.datos_sesion_antebrazo = []
+            self._precargar_historial_graficas()
             
             # Actualizar texto del botón para reflejar que está capturando
             self.boton_captura.texto = "Detener Captura"
@@ -4181,11 +3328,11 @@ class VentanaRutina:
 
             # Iniciar ventana en tamaño de pantalla (no fullscreen) para Rutinas y Progreso
             if self.boton_id in (1, 3):
-                self.pantalla = pygame.display.set_mode((self.ancho, self.alto), pygame.RESIZABLE)
+                self.pantalla = pantalla_app().establecer_modo((self.ancho, self.alto), pygame.RESIZABLE)
                 self.fullscreen = False
             else:
                 centrar_ventana(self.ancho, self.alto)
-                self.pantalla = pygame.display.set_mode((self.ancho, self.alto), pygame.RESIZABLE)
+                self.pantalla = pantalla_app().establecer_modo((self.ancho, self.alto), pygame.RESIZABLE)
             
             # Intentar cargar la fuente DejaVu Sans
             try:
@@ -4195,7 +3342,7 @@ class VentanaRutina:
                 
                 for nombre_fuente in fuentes_posibles:
                     try:
-                        self.fuente_dejavu = pygame.font.SysFont(nombre_fuente, 30)
+                        self.fuente_dejavu = fuente_cacheada(30, nombre_fuente, sistema=True)
                         # Verificar si la fuente se cargó correctamente probando un carácter
                         test_render = self.fuente_dejavu.render("←", True, NEGRO)
                         fuente_cargada = True
@@ -4206,10 +3353,10 @@ class VentanaRutina:
                 
                 if not fuente_cargada:
                     # Si no se pudo cargar ninguna variante, usar una fuente predeterminada
-                    self.fuente_dejavu = pygame.font.Font(None, 30)
+                    self.fuente_dejavu = fuente_cacheada(30)
                     print("No se pudo cargar DejaVu Sans. Usando fuente predeterminada.")
             except:
-                self.fuente_dejavu = pygame.font.Font(None, 30)
+                self.fuente_dejavu = fuente_cacheada(30)
                 print("Error al cargar fuentes. Usando fuente predeterminada.")
             
             # Nombres de menús
@@ -4234,7 +3381,7 @@ class VentanaRutina:
             self.inicializar_botones()
             # Selector de zona (Hombro/Antebrazo) para Rutinas (boton_id==1)
             if self.boton_id == 1:
-                fuente_sel = pygame.font.Font(None, 26)
+                fuente_sel = fuente_cacheada(26)
                 self.radio_hombro = RadioButton(0, 0, 12, "Hombro", seleccionado=True)
                 self.radio_antebrazo = RadioButton(0, 0, 12, "Antebrazo", seleccionado=False)
                 # Posiciones se ajustan en redimensionar()
@@ -4259,7 +3406,7 @@ class VentanaRutina:
                 self.slider_velocidad_rutina = Slider(0, 0, 200, 22, valor_min=10, valor_max=200, valor_inicial=self.velocidad_actual, unidad="")
                 # Botones de Paro y Reanudar en Rutinas con colores modernos y tamaño más grande
                 try:
-                    fuente_btn_accion = pygame.font.Font(None, 24)  # Fuente más grande
+                    fuente_btn_accion = fuente_cacheada(24)  # Fuente más grande
                 except Exception:
                     fuente_btn_accion = None
                 color_texto_blanco = (255, 255, 255)
@@ -4267,13 +3414,13 @@ class VentanaRutina:
                 self.boton_reanudar_mov = Boton(0, 0, 240, 38, "Reanudar", (46, 204, 113), fuente_btn_accion, color_texto_blanco)  # Verde brillante - más ancho
                 # Botón para consultar/ver firmware
                 try:
-                    fuente_btn_fw = pygame.font.Font(None, 22)  # Fuente más grande
+                    fuente_btn_fw = fuente_cacheada(22)  # Fuente más grande
                 except Exception:
                     fuente_btn_fw = None
                 self.boton_ver_fw = Boton(0, 0, 160, 32, "Ver firmware", (155, 89, 182), fuente_btn_fw, color_texto_blanco)  # Morado - se reposicionará abajo
                 # Botones para guardar y restablecer configuración $$
                 try:
-                    fuente_btn_cfg = pygame.font.Font(None, 22)  # Fuente más grande
+                    fuente_btn_cfg = fuente_cacheada(22)  # Fuente más grande
                 except Exception:
                     fuente_btn_cfg = None
                 # Colores modernos para botones de configuración CNC
@@ -4319,41 +3466,49 @@ class VentanaRutina:
         self.datos_ecg_antebrazo_rutina = []
         self.tiempo_inicio_rutina = None
         self.nombre_rutina_actual = ""
-        self.sensor_ecg = None  # Instancia de ArduinoSensorReader
+        self.sensor_ecg = None  # Lector del servicio de sensores (compartido)
+        self.suscripcion_ecg = None
+        # Captura en pausa mientras una rutina interrumpida espera reanudación (misma sesión)
+        self.captura_ecg_pausada = False
+        self._pausa_captura_ts = None
+        self._rutina_interrumpida = None  # (ProgramaGcode, nombre) pendiente de reanudar
 
         # Inicializar sensor ECG si estamos en ventana de Rutinas (boton_id == 1)
         if self.boton_id == 1:
             self._inicializar_sensor_ecg()
 
     def _inicializar_sensor_ecg(self):
-        """Inicializa el sensor ECG a través de Arduino."""
-        if self.sensor_ecg is None:
-            self.sensor_ecg = ArduinoSensorReader()
-            self.sensor_ecg.conectar()
+        """Se suscribe al servicio de sensores ECG; si la placa aún no está, se usará al llegar."""
+        if self.suscripcion_ecg is None:
+            self.suscripcion_ecg = servicio_sensores().suscribir('rutinas', self.id_paciente)
+            self.sensor_ecg = self.suscripcion_ecg.lector
         if not self.sensor_ecg.conectado:
-            print("[ECG] No se pudo conectar al sensor ECG.")
-            self.sensor_ecg = None
+            print("[ECG] Sensor ECG aún no conectado; se captará en cuanto esté disponible.")
         else:
             print("[ECG] Sensor conectado y listo para captura.")
 
+    def _cancelar_suscripciones_sensores(self):
+        """Libera las suscripciones de la ventana; el servicio sigue leyendo."""
+        for nombre in ('suscripcion_ecg', 'suscripcion_sensores'):
+            suscripcion = getattr(self, nombre, None)
+            if suscripcion is not None:
+                try:
+                    suscripcion.cancelar()
+                except Exception:
+                    pass
+                setattr(self, nombre, None)
+
     def _leer_sensor_ecg(self):
         """Lee los datos del sensor ECG y los agrega a las listas de captura."""
-        if not self.captura_ecg_activa or not self.sensor_ecg:
+        if not self.captura_ecg_activa or self.suscripcion_ecg is None:
             return
         
         try:
-            # Los datos ya se están leyendo en un hilo separado.
-            # Aquí solo los agregamos a la lista de la rutina si la captura está activa.
-            # Para no duplicar datos, solo tomamos los más recientes que no hemos procesado.
-            
-            datos_hombro = self.sensor_ecg.obtener_datos_hombro()
-            datos_antebrazo = self.sensor_ecg.obtener_datos_antebrazo()
-
-            # Simplemente tomamos el último valor disponible para mantenerlo simple
-            if datos_hombro:
-                self.datos_ecg_hombro_rutina.append(datos_hombro[-1])
-            if datos_antebrazo:
-                self.datos_ecg_antebrazo_rutina.append(datos_antebrazo[-1])
+            # Los datos ya se están leyendo en un hilo separado; el cursor de la suscripción
+            # entrega todas las muestras llegadas desde el fotograma anterior, sin duplicar.
+            datos_hombro, datos_antebrazo = self.suscripcion_ecg.nuevas()
+            self.datos_ecg_hombro_rutina.extend(datos_hombro.tolist())
+            self.datos_ecg_antebrazo_rutina.extend(datos_antebrazo.tolist())
 
         except Exception as e:
             print(f"[ECG] Error al leer sensores durante rutina: {e}")
@@ -4365,54 +3520,111 @@ class VentanaRutina:
         self.datos_ecg_antebrazo_rutina = []
         self.tiempo_inicio_rutina = time.time()
         self.nombre_rutina_actual = nombre_rutina
+        self._descartar_muestras_ecg()
+        bus_eventos().publicar('captura', 'inicio', {'rutina': nombre_rutina, 'paciente': self.id_paciente})
         print(f"[ECG] Captura iniciada para rutina: {nombre_rutina}")
 
-    def _detener_y_guardar_captura_ecg(self):
-        """Detiene la captura y guarda los datos automáticamente."""
+    def _descartar_muestras_ecg(self):
+        """Adelanta el cursor de la suscripción: lo llegado antes (o durante una pausa) no se capta."""
+        if self.suscripcion_ecg is not None:
+            try:
+                self.suscripcion_ecg.nuevas()
+            except Exception:
+                pass
+
+    def _pausar_captura_ecg(self):
+        """Pausa la captura sin guardar: los datos siguen en la misma sesión al reanudar."""
         if not self.captura_ecg_activa:
             return
-        
+        self._leer_sensor_ecg()  # lo llegado antes de la pausa sí cuenta
         self.captura_ecg_activa = False
-        
-        # Calcular estadísticas
-        if len(self.datos_ecg_hombro_rutina) > 0:
-            esfuerzo_hombro_promedio = sum(self.datos_ecg_hombro_rutina) / len(self.datos_ecg_hombro_rutina)
+        self.captura_ecg_pausada = True
+        self._pausa_captura_ts = time.time()
+        print(f"[ECG] Captura en pausa: {self.nombre_rutina_actual}")
+
+    def _reanudar_captura_ecg(self):
+        """Reanuda una captura en pausa; el tiempo en pausa no cuenta en la duración."""
+        if not self.captura_ecg_pausada:
+            return
+        if self._pausa_captura_ts and self.tiempo_inicio_rutina:
+            self.tiempo_inicio_rutina += time.time() - self._pausa_captura_ts
+        self._pausa_captura_ts = None
+        self.captura_ecg_pausada = False
+        self._descartar_muestras_ecg()
+        self.captura_ecg_activa = True
+        print(f"[ECG] Captura reanudada: {self.nombre_rutina_actual}")
+
+    def _descartar_rutina_interrumpida(self):
+        """Cierra una rutina interrumpida sin reanudar: guarda su captura y borra el punto de control."""
+        if self._rutina_interrumpida is None and not self.captura_ecg_pausada:
+            return
+        self._rutina_interrumpida = None
+        self._detener_y_guardar_captura_ecg()
+        try:
+            if self.controlador_cnc:
+                self.controlador_cnc.limpiar_checkpoint()
+        except Exception:
+            pass
+
+    def _run_rutina_mem(self, programa, nombre_rutina, reanudar: bool = False):
+        """Hilo de ejecución de una rutina (o su reanudación) con cierre de la captura ECG."""
+        if reanudar:
+            exito_local = self.controlador_cnc.reanudar_programa(programa)
         else:
-            esfuerzo_hombro_promedio = 0
+            exito_local = self.controlador_cnc.ejecutar_lineas_gcode(programa, base_tiempo=0.4)
+        # Sólo una interrupción de esta ejecución (motivo_interrupcion se vacía al empezar) deja
+        # un punto de control propio; un fallo previo al envío no debe ofrecer reanudar otra rutina
+        cp = getattr(self.controlador_cnc, 'checkpoint_rutina', None)
+        interrumpida = bool(getattr(self.controlador_cnc, 'motivo_interrupcion', ''))
+        if not exito_local and interrumpida and cp and cp.get('indice', 0) > 0:
+            # Interrumpida a mitad: conservar la sesión para reanudar desde el punto de control
+            self._pausar_captura_ecg()
+            self._rutina_interrumpida = (programa, nombre_rutina)
+            self._aviso_limite_mensaje = f"Rutina interrumpida en línea {cp.get('indice')}/{cp.get('total')}. Pulse Reanudar para continuar."
+            self._aviso_limite_expira_ms = pygame.time.get_ticks() + 6000
+            return
         
-        if len(self.datos_ecg_antebrazo_rutina) > 0:
-            esfuerzo_antebrazo_promedio = sum(self.datos_ecg_antebrazo_rutina) / len(self.datos_ecg_antebrazo_rutina)
+        # Detener y guardar captura ECG automáticamente al finalizar
+        self._detener_y_guardar_captura_ecg()
+        
+        if exito_local:
+            try:
+                mostrar_aviso_sistema("Ejecución Exitosa", f"Rutina {nombre_rutina} ejecutada", modal=False)
+            except Exception:
+                pass
         else:
-            esfuerzo_antebrazo_promedio = 0
+            detalle = ""
+            try:
+                if self.controlador_cnc and getattr(self.controlador_cnc, 'ultimo_limite', ''):
+                    detalle = self.controlador_cnc.ultimo_limite
+            except Exception:
+                detalle = ""
+            self._aviso_limite_mensaje = detalle or "Movimiento fuera de límites. Comando cancelado."
+            self._aviso_limite_expira_ms = pygame.time.get_ticks() + 3000
+
+    def _detener_y_guardar_captura_ecg(self):
+        """Detiene la captura y guarda los datos automáticamente."""
+        if not (self.captura_ecg_activa or self.captura_ecg_pausada):
+            return
         
-        duracion_minutos = (time.time() - self.tiempo_inicio_rutina) / 60.0 if self.tiempo_inicio_rutina else 0
+        if self.captura_ecg_pausada and self._pausa_captura_ts and self.tiempo_inicio_rutina:
+            # No contar el tiempo en pausa
+            self.tiempo_inicio_rutina += time.time() - self._pausa_captura_ts
+        if self.captura_ecg_activa:
+            self._leer_sensor_ecg()  # lo llegado desde el último fotograma
+        self.captura_ecg_activa = False
+        self.captura_ecg_pausada = False
+        self._pausa_captura_ts = None
         
-        if self.gestor_pacientes and self.id_paciente:
-            if len(self.datos_ecg_hombro_rutina) > 0 or len(self.datos_ecg_antebrazo_rutina) > 0:
-                try:
-                    observaciones = f"Rutina: {self.nombre_rutina_actual}"
-                    exito = self.gestor_pacientes.guardar_sesion(
-                        self.id_paciente,
-                        esfuerzo_hombro_promedio,
-                        esfuerzo_antebrazo_promedio,
-                        duracion_minutos,
-                        observaciones
-                    )
-                    
-                    if exito:
-                        print(f"[ECG] Sesión guardada - Hombro: {esfuerzo_hombro_promedio:.1f}, Antebrazo: {esfuerzo_antebrazo_promedio:.1f}, Duración: {duracion_minutos:.2f} min")
-                        try:
-                            mostrar_aviso_sistema("Datos Guardados", f"Sesión guardada automáticamente\nHombro: {esfuerzo_hombro_promedio:.1f}\nAntebrazo: {esfuerzo_antebrazo_promedio:.1f}")
-                        except Exception:
-                            pass
-                    else:
-                        print("[ECG] Error al guardar sesión")
-                except Exception as e:
-                    print(f"[ECG] Error al guardar sesión: {e}")
-            else:
-                print("[ECG] Rutina completada sin captura de datos (sensor no disponible o sin datos).")
-        else:
-            print("[ECG] Rutina completada sin paciente activo - datos no guardados.")
+        duracion_minutos = (time.time() - self.tiempo_inicio_rutina) / 60.0 if self.tiempo_inicio_rutina else 0
+        exito, esfuerzo_hombro_promedio, esfuerzo_antebrazo_promedio = guardar_sesion_captura(
+            self.gestor_pacientes, self.id_paciente, self.nombre_rutina_actual,
+            self.datos_ecg_hombro_rutina, self.datos_ecg_antebrazo_rutina, duracion_minutos)
+        if exito:
+            try:
+                mostrar_aviso_sistema("Datos Guardados", f"Sesión guardada automáticamente\nHombro: {esfuerzo_hombro_promedio:.1f}\nAntebrazo: {esfuerzo_antebrazo_promedio:.1f}", modal=False)
+            except Exception:
+                pass
 
     def _key_rutina(self, boton_id: int, subrutina: int, zona: str | None = None) -> str:
         try:
@@ -4464,7 +3676,7 @@ class VentanaRutina:
             x_centrado = (self.ancho - ancho_boton) // 2
             
             # Fuente más legible
-            fuente_botones = pygame.font.Font(None, 26)
+            fuente_botones = fuente_cacheada(26)
             
             # Colores modernos y atractivos para fondos
             colores_fondo = [
@@ -4519,7 +3731,7 @@ class VentanaRutina:
             fuente_botones = self.fuente_dejavu
             try:
                 if getattr(self, 'boton_id', None) == 1:
-                    fuente_botones = pygame.font.Font(None, 26)  # Fuente más grande para Rutinas
+                    fuente_botones = fuente_cacheada(26)  # Fuente más grande para Rutinas
             except Exception:
                 pass
 
@@ -4571,10 +3783,7 @@ class VentanaRutina:
         self.boton_regresar.actualizar_proporciones(self.ancho, self.alto)
 
     def _nombres_rutinas_por_zona(self, zona: str):
-        # Nombres por zona; Antebrazo con diseños propios
-        if zona == 'Antebrazo':
-            return ["Estrella 5 picos", "Infinito", "Línea curva"]
-        return ["Espiral Cuadrada", "Espiral Circular", "Zig Zag Vertical"]
+        return nombres_rutinas_por_zona(zona)
 
     def _actualizar_textos_rutinas(self):
         if getattr(self, 'boton_id', None) != 1:
@@ -4705,28 +3914,59 @@ class VentanaRutina:
                 boton_volver_y = self.boton_ver_fw.rect.bottom + 25  # Justo debajo de Ver firmware
                 self.boton_volver_izq = Boton(
                     boton_volver_x, boton_volver_y, boton_volver_w, boton_volver_h,
-                    "← Volver", (231, 76, 60), pygame.font.Font(None, 26), (255, 255, 255)
+                    "← Volver", (231, 76, 60), fuente_cacheada(26), (255, 255, 255)
                 )
                 self.boton_volver_izq.actualizar_proporciones(self.ancho, self.alto)
             except Exception:
                 pass
 
+    def _inicializar_calibracion_ecg(self):
+        self._contador_debug = 0  # Para mostrar valores cada cierto tiempo
+        
+        # Calibración dinámica para señales ECG - rangos típicos del Arduino
+        self._min_hombro = 0
+        self._max_hombro = 700  # Valor inicial optimizado para ECG procesado
+        self._min_antebrazo = 0
+        self._max_antebrazo = 700
+        
+        self._ecg_initialized = True
+        print(f"[ECG Arduino] Sistema inicializado")
+        print(f"[ECG Arduino] Los valores se calibrarán automáticamente")
+
+    def _precargar_historial_graficas(self):
+        """Llena las gráficas con el historial del servicio anterior a abrir la ventana,
+        remuestreado al intervalo de captura para que la escala de tiempo no cambie."""
+        try:
+            lector = self.arduino_reader
+            tasa = lector.tasa_muestreo()
+            if tasa <= 0:
+                return
+            paso = max(1, int(round(tasa * self.intervalo_captura / 1000.0)))
+            hombro, antebrazo = lector.historial(self.max_puntos * paso)
+            hombro, antebrazo = hombro[::-1][::paso][::-1], antebrazo[::-1][::paso][::-1]
+            n = min(len(hombro), len(antebrazo), self.max_puntos)
+            if n == 0:
+                return
+            if not hasattr(self, '_ecg_initialized'):
+                self._inicializar_calibracion_ecg()
+            self._max_hombro = max(self._max_hombro, float(hombro.max()))
+            self._max_antebrazo = max(self._max_antebrazo, float(antebrazo.max()))
+            rango_hombro = max(1, self._max_hombro - self._min_hombro)
+            rango_antebrazo = max(1, self._max_antebrazo - self._min_antebrazo)
+            norm_hombro = np.clip(((hombro[-n:] - self._min_hombro) / rango_hombro * 100).astype(int), 0, 100)
+            norm_antebrazo = np.clip(((antebrazo[-n:] - self._min_antebrazo) / rango_antebrazo * 100).astype(int), 0, 100)
+            self.datos_hombro[-n:] = norm_hombro
+            self.datos_antebrazo[-n:] = norm_antebrazo
+            print(f"[ECG] Historial precargado: {n} puntos")
+        except Exception as e:
+            print(f"[ECG] No se pudo precargar el historial: {e}")
+
     def leer_datos_sensores(self):
         """Lee los datos reales de los sensores ECG usando Arduino Nano"""
         try:
             # Inicializar calibración dinámica si no existe
             if not hasattr(self, '_ecg_initialized'):
-                self._contador_debug = 0  # Para mostrar valores cada cierto tiempo
-                
-                # Calibración dinámica para señales ECG - rangos típicos del Arduino
-                self._min_hombro = 0
-                self._max_hombro = 700  # Valor inicial optimizado para ECG procesado
-                self._min_antebrazo = 0
-                self._max_antebrazo = 700
-                
-                self._ecg_initialized = True
-                print(f"[ECG Arduino] Sistema inicializado")
-                print(f"[ECG Arduino] Los valores se calibrarán automáticamente")
+                self._inicializar_calibracion_ecg()
             
             # Verificar si el Arduino está conectado y tiene datos
             if hasattr(self, 'arduino_reader') and self.arduino_reader and self.arduino_reader.conectado:
@@ -4748,8 +3988,9 @@ class VentanaRutina:
                     # Debug: mostrar valores cada 50 lecturas (~5 segundos)
                     self._contador_debug += 1
                     if self._contador_debug % 50 == 0:
-                        print(f"[ECG Arduino DEBUG] Hombro: {valor_hombro:5.1f} (Rango: {self._min_hombro}-{self._max_hombro}) | "
-                              f"Antebrazo: {valor_antebrazo:5.1f} (Rango: {self._min_antebrazo}-{self._max_antebrazo})")
+                        _LOG_ECG_DATOS.debug("Hombro: %5.1f (Rango: %s-%s) | Antebrazo: %5.1f (Rango: %s-%s)",
+                                             valor_hombro, self._min_hombro, self._max_hombro,
+                                             valor_antebrazo, self._min_antebrazo, self._max_antebrazo)
                     
                     # Normalizar a rango 0-100 usando calibración dinámica
                     # Esto permite que valores pequeños (típicos de ECG) se vean en la gráfica
@@ -4768,406 +4009,30 @@ class VentanaRutina:
                     return 0, 0
             else:
                 # Si no hay conexión Arduino, devolver valores en 0
-                print("[ECG Arduino] Sin conexión o sin datos")
+                _LOG_ECG_DATOS.debug("Sin conexión o sin datos")
                 return 0, 0
                 
         except Exception as e:
-            print(f"[ERROR] Error leyendo sensores ECG de Arduino: {e}")
-            import traceback
-            traceback.print_exc()
+            _LOG_ECG.exception("Error leyendo sensores ECG de Arduino: %s", e)
             return 0, 0
 
 
 
-    def _validar_lineas_en_rango(self, lineas, xmin: float = -20.0, xmax: float = 20.0, ymin: float = -20.0, ymax: float = 20.0):
-        """Valida que todas las líneas G0/G1 con X/Y estén dentro del rango permitido.
-        Devuelve (ok: bool, mensaje_error: str|None).
-        """
-        try:
-            for raw in lineas:
-                ln = limpiar_linea_gcode(raw)
-                parts = ln.split() if ln else []
-                if not parts:
-                    continue
-                if parts[0] not in ('G0', 'G1', 'G90', 'G91'):
-                    continue
-                xi = yi = None
-                for p in parts[1:]:
-                    up = p.upper()
-                    if up.startswith('X'):
-                        try:
-                            xi = float(p[1:])
-                        except Exception:
-                            pass
-                    elif up.startswith('Y'):
-                        try:
-                            yi = float(p[1:])
-                        except Exception:
-                            pass
-                if xi is not None and (xi < xmin or xi > xmax):
-                    return False, f"X fuera de rango [{xmin},{xmax}]: {xi:.3f}"
-                if yi is not None and (yi < ymin or yi > ymax):
-                    return False, f"Y fuera de rango [{ymin},{ymax}]: {yi:.3f}"
-            return True, None
-        except Exception as e:
-            return False, f"Error validando rutina: {e}"
+    def _validar_lineas_en_rango(self, lineas, xmin: float = -20.0, xmax: float = 20.0, ymin: float = -20.0, ymax: float = 20.0, invertir: bool = False):
+        return validar_lineas_en_rango(lineas, xmin, xmax, ymin, ymax, invertir=invertir)
 
     def _validar_archivo_rutina_en_rango(self, ruta: str, invertir: bool = False, lim_min: float = -20.0, lim_max: float = 20.0):
-        """Valida que un archivo G-code de rutina, simulando G90/G91 y la inversión opcional,
-        quede dentro del rango [-20..20]. Devuelve (ok, msg).
-        """
-        try:
-            if not os.path.exists(ruta):
-                return False, f"No existe: {ruta}"
-            # Simular trayectoria para validar
-            absoluto = True
-            x = 0.0
-            y = 0.0
-            with open(ruta, 'r') as f:
-                for raw in f:
-                    l = limpiar_linea_gcode(raw)
-                    parts = l.split() if l else []
-                    if not parts:
-                        continue
-                    cmd = parts[0].upper()
-                    if cmd == 'G90':
-                        absoluto = True
-                        continue
-                    if cmd == 'G91':
-                        absoluto = False
-                        continue
-                    if cmd not in ('G0','G1'):
-                        continue
-                    xi = yi = None
-                    for p in parts[1:]:
-                        up = p.upper()
-                        if up.startswith('X'):
-                            try:
-                                xi = float(p[1:])
-                            except Exception:
-                                pass
-                        elif up.startswith('Y'):
-                            try:
-                                yi = float(p[1:])
-                            except Exception:
-                                pass
-                    # aplicar movimiento
-                    if absoluto:
-                        tx = x if xi is None else xi
-                        ty = y if yi is None else yi
-                    else:
-                        tx = x + (0.0 if xi is None else xi)
-                        ty = y + (0.0 if yi is None else yi)
-                    # sin inversión: mantener coordenadas tal cual
-                    # validar rango
-                    if tx < lim_min or tx > lim_max:
-                        return False, f"X fuera de rango [{lim_min},{lim_max}]: {tx:.3f}"
-                    if ty < lim_min or ty > lim_max:
-                        return False, f"Y fuera de rango [{lim_min},{lim_max}]: {ty:.3f}"
-                    # avanzar posición
-                    x, y = tx, ty
-            return True, None
-        except Exception as e:
-            return False, f"Error validando archivo: {e}"
+        return validar_archivo_rutina_en_rango(ruta, invertir, lim_min, lim_max)
 
     def generar_rutina_dinamica(self, zona: str, numero: int, dificultad: int = 5, invertir: bool = False):
-        """Genera una lista de líneas G-code (G90) para una rutina en X/Y.
-        zona: 'Hombro' o 'Antebrazo'
-        numero: 1..5
-        dificultad: 0..10 (escala amplitud/repeticiones)
-        """
-        # Workspace permitido [-20..20]; usar margen de seguridad 2 mm
-        min_xy, max_xy = -20.0, 20.0
-        margin = 2.0
-        low, high = min_xy + margin, max_xy - margin
-        # Escalas por dificultad
-        amp = 5 + (dificultad * 2.5)  # 5..30 aprox
-        amp = max(3.0, min(amp, (high - low)))
-        rep = 3 + (dificultad // 2)   # 3..8
-        # Centro de trabajo en el origen (0, 0)
-        cx, cy = 0.0, 0.0
-        lines = ["G90"]
-        def clamp(v):
-            return max(min_xy, min(max_xy, v))
-        def _map_inv_x(v: float) -> float:
-            return max(min_xy, min(max_xy, (max_xy - v)))
-        def move(x, y, rapid=False):
-            x = clamp(x); y = clamp(y)
-            if invertir:
-                x = _map_inv_x(x)
-                # Y no se invierte cuando invertir=True
-            g = 'G0' if rapid else 'G1'
-            lines.append(f"{g} X{round(x,3)} Y{round(y,3)}")
-        # Patrones por número
-        if numero == 1:
-            # Cuadrado/rectángulo alrededor del centro, con repeticiones
-            w = amp; h = amp
-            for k in range(rep):
-                move(cx - w/2, cy - h/2, rapid=(k==0))
-                move(cx + w/2, cy - h/2)
-                move(cx + w/2, cy + h/2)
-                move(cx - w/2, cy + h/2)
-                move(cx - w/2, cy - h/2)
-        elif numero == 2:
-            # Zig-zag horizontal
-            span = amp
-            y0 = cy - span/2
-            y1 = cy + span/2
-            x_left = max(low, cx - span/2)
-            x_right = min(high, cx + span/2)
-            move(x_left, y0, rapid=True)
-            for k in range(rep):
-                move(x_right, y0)
-                move(x_right, y1)
-                move(x_left, y1)
-                move(x_left, y0)
-        elif numero == 3:
-            # Espiral cuadrada hacia afuera
-            step = max(2.0, amp / max(3, rep))
-            x0, y0 = cx, cy
-            move(x0, y0, rapid=True)
-            length = step
-            for i in range(1, rep*2+1):
-                # derecha, abajo, izquierda, arriba...
-                dx, dy = ((length, 0), (0, length), (-length, 0), (0, -length))[(i-1) % 4]
-                x0 = clamp(x0 + dx)
-                y0 = clamp(y0 + dy)
-                move(x0, y0)
-                if i % 2 == 0:
-                    length += step
-        elif numero == 4:
-            # Barridos verticales
-            span = amp
-            x0 = clamp(cx - span/2)
-            x1 = clamp(cx + span/2)
-            y_bottom = low
-            y_top = high
-            move(x0, y_bottom, rapid=True)
-            for k in range(rep):
-                move(x0, y_top)
-                move(x1, y_top)
-                move(x1, y_bottom)
-                move(x0, y_bottom)
-        else:
-            # numero == 5: L-steps en cuadrante
-            step = max(2.0, amp / max(3, rep))
-            x0, y0 = clamp(cx - amp/2), clamp(cy - amp/2)
-            move(x0, y0, rapid=True)
-            for k in range(rep):
-                x1 = clamp(x0 + step)
-                move(x1, y0)
-                y1 = clamp(y0 + step)
-                move(x1, y1)
-                x0, y0 = x1, y1
-        return lines
+        return generar_rutina_dinamica(zona, numero, dificultad, invertir)
 
     def _map_dificultad_a_lado(self, dificultad: float | int) -> float:
-        try:
-            n = int(round(float(dificultad)))
-        except Exception:
-            n = 1
-        n = max(1, min(5, n))
-        return {1: 10.0, 2: 15.0, 3: 20.0, 4: 30.0, 5: 40.0}[n]
+        return mapear_dificultad_a_lado(dificultad)
 
     def _generar_rutina_por_zona(self, zona: str, numero: int, dificultad: float | int):
-        # Genera G-code (G90) para la rutina seleccionada, dimensionada por dificultad
-        lines = ["G90"]
-        # Centro de trabajo en el origen (0, 0) con límites [-20..20]
-        cx, cy = 0.0, 0.0
-        # Micropaso para suavidad (mm). Se puede exponer luego como ajuste en UI.
-        micro = float(getattr(self, 'micro_step_mm', 0.5) or 0.5)
-        micro = max(0.1, min(2.0, micro))
-        lado = self._map_dificultad_a_lado(dificultad)
-        half = lado / 2.0
-        def clamp(v):
-            return max(-20.0, min(20.0, v))
-        def move(x, y, rapid=False):
-            x = clamp(x); y = clamp(y)
-            g = 'G0' if rapid else 'G1'
-            lines.append(f"{g} X{round(x,3)} Y{round(y,3)}")
-        if zona == 'Hombro':
-            if numero == 1:
-                # Espiral cuadrada desde 1x1 hasta lado final según dificultad
-                half_ini = 0.5
-                half_fin = max(half_ini, half)
-                x, y = cx, cy
-                move(x, y, rapid=True)
-                # Longitud inicial de cada tramo en mm
-                L = 1.0
-                # Direcciones: +X, +Y, -X, -Y repetidamente
-                dirs = [(1,0), (0,1), (-1,0), (0,-1)]
-                di = 0
-                # Continuar hasta alcanzar el radio cuadrado deseado
-                # Incrementa L después de cada dos tramos para formar la espiral cuadrada
-                pasos = 0
-                while True:
-                    for _ in range(2):
-                        dx, dy = dirs[di % 4]
-                        # Avanzar en micro-pasos para suavidad
-                        pasos_segmento = max(1, int(round(L / micro)))
-                        step = micro
-                        for _ in range(pasos_segmento):
-                            x = clamp(x + dx * step)
-                            y = clamp(y + dy * step)
-                            move(x, y)
-                        di += 1
-                        pasos += pasos_segmento
-                        # Condición de salida: cuando alcanzamos o sobrepasamos half_fin
-                        if max(abs(x - cx), abs(y - cy)) >= half_fin:
-                            break
-                    if max(abs(x - cx), abs(y - cy)) >= half_fin:
-                        break
-                    L += 1.0
-            elif numero == 2:
-                # Espiral circular: diámetro inicial 1 y final según mapa de dificultad (lado)
-                # Trazo con paso angular adaptativo para que la cuerda sea ≈ micro
-                d_ini = 1.0
-                d_fin = max(d_ini, min(40.0, lado))
-                r_ini = d_ini / 2.0
-                r_fin = d_fin / 2.0
-                try:
-                    n = int(round(float(dificultad)))
-                except Exception:
-                    n = 1
-                n = max(1, min(5, n))
-                vueltas_map = {1: 2, 2: 3, 3: 3, 4: 4, 5: 4}
-                vueltas = vueltas_map[n]
-                ang_total = 2.0 * math.pi * vueltas
-                ang = 0.0
-                first = True
-                while ang <= ang_total + 1e-6:
-                    t = ang / ang_total if ang_total > 0 else 1.0
-                    r = r_ini + (r_fin - r_ini) * t
-                    x = cx + r * math.cos(ang)
-                    y = cy + r * math.sin(ang)
-                    move(x, y, rapid=first)
-                    first = False
-                    # Δángulo aproximando cuerda ≈ micro: delta = micro / r
-                    if r <= 0.001:
-                        d_ang = 0.2  # evitar demasiados puntos al inicio
-                    else:
-                        d_ang = micro / r
-                    # Limitar paso angular para no exceder segmentos largos/cortos
-                    d_ang = max(0.02, min(0.25, d_ang))
-                    ang += d_ang
-            elif numero == 3:
-                # Zig Zag vertical: trazos principales verticales, con pasos horizontales entre columnas
-                ancho = lado
-                alto = lado
-                x_left = clamp(cx - ancho/2.0)
-                x_right = clamp(cx + ancho/2.0)
-                y_bottom = clamp(cy - alto/2.0)
-                y_top = clamp(cy + alto/2.0)
-                # Densidad por dificultad: más columnas (pasos horizontales)
-                try:
-                    n = int(round(float(dificultad)))
-                except Exception:
-                    n = 1
-                n = max(1, min(5, n))
-                cols_map = {1: 4, 2: 6, 3: 8, 4: 12, 5: 16}
-                cols = max(2, cols_map.get(n, 6))
-                step_x = (x_right - x_left) / cols if cols > 0 else (x_right - x_left)
-                # Iniciar abajo a la izquierda
-                move(x_left, y_bottom, rapid=True)
-                corner = min(micro * 1.2, abs(step_x) / 3.0) if step_x != 0 else micro * 1.2
-                for c in range(cols):
-                    xk = clamp(x_left + c * step_x)
-                    # Trazo vertical principal en micro-pasos de 0.5 mm para suavidad
-                    y_inicio = y_bottom if c % 2 == 0 else y_top
-                    y_fin = y_top if c % 2 == 0 else y_bottom
-                    dy = micro if y_fin > y_inicio else -micro
-                    y = y_inicio
-                    while (dy > 0 and y < y_fin) or (dy < 0 and y > y_fin):
-                        y = clamp(y + dy)
-                        move(xk, y)
-                    # Curvita de enlace antes de mover horizontal (aproximación con 2 puntos)
-                    if c < cols - 1:
-                        x_next = clamp(x_left + (c + 1) * step_x)
-                        y_cur = y_fin
-                        # Pequeño offset para redondear la esquina
-                        # Primero desplaza un poco en X manteniendo Y
-                        mid1_x = clamp(xk + (corner if x_next > xk else -corner))
-                        move(mid1_x, y_cur)
-                        # Luego hasta la columna siguiente en Y constante
-                        move(x_next, y_cur)
-        else:
-            # Antebrazo: nuevas trayectorias, mismas reglas ([-20..20], G90, G0/G1, suavidad con micro)
-            # Helpers para trazar con suavidad
-            last = {'x': None, 'y': None}
-            def goto(x, y, rapid=False):
-                move(x, y, rapid)
-                last['x'], last['y'] = x, y
-            def line_to(x, y):
-                x = clamp(x); y = clamp(y)
-                if last['x'] is None or last['y'] is None:
-                    goto(x, y, rapid=True)
-                    return
-                x0, y0 = last['x'], last['y']
-                dx = x - x0; dy = y - y0
-                dist = math.hypot(dx, dy)
-                pasos = max(1, int(math.ceil(dist / micro)))
-                for i in range(1, pasos + 1):
-                    px = x0 + dx * (i / pasos)
-                    py = y0 + dy * (i / pasos)
-                    move(px, py)
-                last['x'], last['y'] = x, y
-            if numero == 1:
-                # Estrella de 5 picos dentro de un cuadro lado x lado
-                R = half  # radio exterior
-                r = max(half * 0.38, R * 0.38)  # radio interior aproximado a proporción áurea
-                # Generar 10 vértices alternando radio exterior/interior
-                pts = []
-                ang0 = -math.pi / 2.0  # iniciar arriba
-                for k in range(10):
-                    ang = ang0 + k * (math.pi / 5.0)
-                    rad = R if (k % 2 == 0) else r
-                    xk = clamp(cx + rad * math.cos(ang))
-                    yk = clamp(cy + rad * math.sin(ang))
-                    pts.append((xk, yk))
-                # Trazar estrella cerrando la figura
-                if pts:
-                    goto(pts[0][0], pts[0][1], rapid=True)
-                    for p in pts[1:]:
-                        line_to(p[0], p[1])
-                    line_to(pts[0][0], pts[0][1])
-            elif numero == 2:
-                # Símbolo de infinito (Lissajous)
-                ax = half
-                ay = half
-                # Paso paramétrico acorde a micro
-                dt = max(0.02, min(0.12, micro / max(1e-3, half)))
-                t = 0.0
-                t_max = 2.0 * math.pi
-                x0 = clamp(cx + ax * math.sin(0.0))
-                y0 = clamp(cy + ay * math.sin(2.0 * 0.0))
-                goto(x0, y0, rapid=True)
-                while t <= t_max + 1e-6:
-                    x = clamp(cx + ax * math.sin(t))
-                    y = clamp(cy + ay * math.sin(2.0 * t))
-                    move(x, y)
-                    last['x'], last['y'] = x, y
-                    t += dt
-                # cerrar suave al inicio
-                line_to(x0, y0)
-            elif numero == 3:
-                # Línea curva (S-curve) dentro del cuadro lado x lado
-                x_start = cx - half
-                x_end = cx + half
-                A = half  # amplitud vertical
-                # Muestras según micro
-                long_x = max(1e-6, x_end - x_start)
-                pasos = max(20, int(math.ceil(long_x / micro) * 2))
-                for i in range(pasos + 1):
-                    s = i / pasos
-                    x = x_start + long_x * s
-                    # Onda suave: seno de dos medias ondas (S)
-                    y = cy + A * math.sin(math.pi * (2.0 * s - 1.0))
-                    if i == 0:
-                        goto(x, y, rapid=True)
-                    else:
-                        move(clamp(x), clamp(y))
-                        last['x'], last['y'] = x, y
-        return lines
+        # Los generadores viven en nucleo_rehab (sin interfaz)
+        return generar_rutina_por_zona(zona, numero, dificultad, getattr(self, 'micro_step_mm', 0.5))
 
     def dibujar_vista_previa(self, zona: str, numero: int, dificultad: int):
         """Dibuja una vista previa de la rutina en un panel.
@@ -5244,7 +4109,7 @@ class VentanaRutina:
             
             # Dibujar título "Vista Previa" arriba del panel
             try:
-                fuente_titulo_panel = pygame.font.Font(None, 26)
+                fuente_titulo_panel = fuente_cacheada(26)
                 titulo_preview = fuente_titulo_panel.render("Vista Previa", True, (0, 100, 0))
                 titulo_rect = titulo_preview.get_rect(centerx=panel_x + panel_w // 2, bottom=panel_y - 8)
                 self.pantalla.blit(titulo_preview, titulo_rect)
@@ -5291,8 +4156,8 @@ class VentanaRutina:
         
         # Dibujar título "Vista Previa" arriba del panel
         try:
-            fuente_titulo_panel = pygame.font.Font(None, 26)
-            titulo_preview = fuente_titulo_panel.render("Vista Previa", True, (0, 100, 0))
+            fuente_titulo_panel = fuente_cacheada(26)
+            titulo_preview = texto_cacheado("Vista Previa", fuente_titulo_panel, (0, 100, 0))
             titulo_rect = titulo_preview.get_rect(centerx=panel_x + panel_w // 2, bottom=panel_y - 8)
             self.pantalla.blit(titulo_preview, titulo_rect)
         except Exception:
@@ -5334,7 +4199,9 @@ class VentanaRutina:
             self.ultimo_tiempo_captura = tiempo_actual
             
             # Intentar leer datos reales del Arduino ECG
-            valor_hombro, valor_antebrazo = self.leer_datos_sensores()
+            perfil = perfil_fotogramas()
+            with perfil.seccion('sensores'):
+                valor_hombro, valor_antebrazo = self.leer_datos_sensores()
             
             # Si no hay datos del Arduino, mantener valores en 0 (sin simulación)
             # Las gráficas permanecerán estáticas hasta que se conecte el Arduino
@@ -5348,7 +4215,8 @@ class VentanaRutina:
             self.datos_antebrazo = np.roll(self.datos_antebrazo, -1)
             self.datos_antebrazo[-1] = valor_antebrazo
             
-            self.generar_graficas()
+            with perfil.seccion('graficas'):
+                self.generar_graficas()
 
     def generar_graficas(self):
         """Genera las gráficas de matplotlib y las convierte a superficies de pygame"""
@@ -5532,13 +4400,14 @@ class VentanaRutina:
             # Guardar el estado de la pantalla actual
             pantalla_actual = pygame.display.get_surface()
             
-            ventana_graficas = GraficasMusculares(self.id_paciente)
-            ventana_graficas.ejecutar()
+            with pantalla_app().escena('Gráficas musculares'):
+                ventana_graficas = GraficasMusculares(self.id_paciente)
+                ventana_graficas.ejecutar()
             
             # Después de cerrar la ventana de gráficas, restaurar la ventana principal
             # Recrear la superficie de display con las dimensiones originales
             if pantalla_actual:
-                self.pantalla = pygame.display.set_mode((self.ancho, self.alto), pygame.RESIZABLE)
+                self.pantalla = pantalla_app().establecer_modo((self.ancho, self.alto), pygame.RESIZABLE)
                 pygame.display.set_caption("Sistema de Control CNC - Rehabilitación")
         except CerrarPrograma:
             # Propagar la excepción de cierre para cerrar el programa
@@ -5693,7 +4562,8 @@ class VentanaRutina:
                     'esfuerzo_hombro': promedio_hombro,
                     'esfuerzo_antebrazo': promedio_antebrazo,
                     'duracion': duracion,
-                    'observaciones': f'Archivo CSV: {nombre_archivo}'
+                    'observaciones': f'Archivo CSV: {nombre_archivo}',
+                    'archivo_datos': nombre_archivo,
                 }
                 
                 exito, numero_sesion = self.gestor_pacientes.registrar_sesion(self.id_paciente, datos_sesion)
@@ -5711,7 +4581,7 @@ class VentanaRutina:
         if self.boton_id == 2:
             info = pygame.display.Info()
             self.ancho, self.alto = info.current_w, info.current_h
-            self.pantalla = pygame.display.set_mode((self.ancho, self.alto), pygame.RESIZABLE)
+            self.pantalla = pantalla_app().establecer_modo((self.ancho, self.alto), pygame.RESIZABLE)
             pygame.display.set_caption("Gráficas de Esfuerzo Muscular")
             self.fullscreen = False
             # Ajustar layout inicial para cubrir ventana maximizada
@@ -5720,7 +4590,7 @@ class VentanaRutina:
             # Título con fuente más grande y color amarillo brillante
             fuente_titulo = ajustar_fuente_a_ancho("Gráficas de Esfuerzo Muscular", int(self.ancho * 0.95), 48, 20)
             color_titulo = (255, 255, 0)  # Amarillo brillante para mejor contraste
-            fuente_mensaje = pygame.font.Font(None, 24)
+            fuente_mensaje = fuente_cacheada(24)
             mensaje_texto = None
             mensaje_tiempo = 0
             
@@ -5732,7 +4602,19 @@ class VentanaRutina:
             clock = pygame.time.Clock()
             
             ejecutando = True
+            perfil = perfil_fotogramas()
+            # Sin eventos ni datos nuevos el fotograma se salta entero (ni fill ni flip)
+            escena = EscenaRetenida(refresco_max=0.5)
             while ejecutando:
+                # Capturando, el muestreo va ligado al fotograma: un tick por intervalo_captura
+                muestreo = pygame.time.get_ticks() // max(1, int(self.intervalo_captura)) if self.capturando else None
+                firma = self._firma_escena(mostrar_progreso, mensaje_texto if pygame.time.get_ticks() < mensaje_tiempo else None,
+                                           self.capturando, self.modo_visualizacion, muestreo,
+                                           id(self.superficie_grafica_hombro), id(self.superficie_grafica_antebrazo))
+                if escena.omitir_fotograma(self.pantalla, firma):
+                    escena.esperar(clock, plazo=self.intervalo_captura / 1000.0 if self.capturando else None)
+                    continue
+                perfil.fotograma('Gráficas')
                 tiempo_actual = pygame.time.get_ticks()
                 
                 self.pantalla.fill(self.color_fondo)
@@ -5743,6 +4625,7 @@ class VentanaRutina:
                     titulo_rect = titulo_texto.get_rect(topleft=(20, 8))
                     self.pantalla.blit(titulo_texto, titulo_rect)
                     
+                    perfil.marca('dibujo')
                     self.actualizar_datos()
                     
                     if self.modo_visualizacion == "hombro" or self.modo_visualizacion == "ambos":
@@ -5776,7 +4659,7 @@ class VentanaRutina:
                     self.pantalla.blit(titulo_texto, titulo_rect)
                     
                     # Subtítulo explicativo más visible
-                    fuente_subtitulo = pygame.font.Font(None, 24)
+                    fuente_subtitulo = fuente_cacheada(24)
                     subtitulo_texto = fuente_subtitulo.render("Progreso de Rehabilitación", True, (200, 200, 100))
                     subtitulo_rect = subtitulo_texto.get_rect(center=(self.ancho // 2, 75))
                     self.pantalla.blit(subtitulo_texto, subtitulo_rect)
@@ -5861,13 +4744,17 @@ class VentanaRutina:
                     texto_rect = texto.get_rect(center=(self.ancho // 2, y_msg))
                     self.pantalla.blit(texto, texto_rect)
                 
-                for evento in pygame.event.get():
+                perfil.marca('dibujo')
+                for evento in escena.eventos():
+                    escena.evento(evento)
+                    if atender_superposiciones(evento):
+                        continue
                     if evento.type == pygame.QUIT:
                         # Ya no se usa GPIO
                         raise CerrarPrograma("Usuario cerró ventana gráficas")
                     if evento.type == pygame.VIDEORESIZE:
                         nuevo_w, nuevo_h = ajustar_a_pantalla(evento.w, evento.h, 1000, 700)
-                        self.pantalla = pygame.display.set_mode((nuevo_w, nuevo_h), pygame.RESIZABLE)
+                        self.pantalla = pantalla_app().establecer_modo((nuevo_w, nuevo_h), pygame.RESIZABLE)
                         # Recalcular layout de controles de gráfica para evitar desajustes
                         if hasattr(self, 'redimensionar_grafica'):
                             self.redimensionar_grafica(nuevo_w, nuevo_h)
@@ -5875,19 +4762,19 @@ class VentanaRutina:
                         if evento.key == pygame.K_F11:
                             self.fullscreen = not self.fullscreen
                             if self.fullscreen:
-                                self.pantalla = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
+                                self.pantalla = pantalla_app().establecer_modo((0, 0), pygame.FULLSCREEN)
                                 info = pygame.display.Info()
                                 self.ancho, self.alto = info.current_w, info.current_h
                             else:
                                 w, h = ajustar_a_pantalla(1400, 800, 1000, 700)
-                                self.pantalla = pygame.display.set_mode((w, h), pygame.RESIZABLE)
+                                self.pantalla = pantalla_app().establecer_modo((w, h), pygame.RESIZABLE)
                                 if hasattr(self, 'redimensionar_grafica'):
                                     self.redimensionar_grafica(w, h)
                             continue
                         if evento.key == pygame.K_ESCAPE and self.fullscreen:
                             self.fullscreen = False
                             w, h = ajustar_a_pantalla(1200, 700, 900, 600)
-                            self.pantalla = pygame.display.set_mode((w, h), pygame.RESIZABLE)
+                            self.pantalla = pantalla_app().establecer_modo((w, h), pygame.RESIZABLE)
                             if hasattr(self, 'redimensionar_grafica'):
                                 self.redimensionar_grafica(w, h)
                             continue
@@ -5952,6 +4839,7 @@ class VentanaRutina:
                                     mensaje_texto = f"Error al guardar: {resultado}"
                                 mensaje_tiempo = tiempo_actual + 5000
                 
+                perfil.marca('eventos')
                 # Barra inferior permanente
                 dibujar_barra_inferior(
                     self.pantalla, self.ancho, self.alto,
@@ -5959,8 +4847,11 @@ class VentanaRutina:
                     None,
                     getattr(self, 'controlador_cnc', None)
                 )
+                dibujar_superposiciones(self.pantalla)
+                perfil.marca('dibujo')
                 pygame.display.flip()
-                clock.tick(60)
+                perfil.marca('flip')
+                escena.esperar(clock, plazo=self.intervalo_captura / 1000.0 if self.capturando else None)
         else:
             # Funcionalidad original para otros botones
             # Para Progreso del Paciente usar un mínimo mayor; otros mantienen mínimos anteriores
@@ -5968,7 +4859,7 @@ class VentanaRutina:
             self.ancho, self.alto = ajustar_a_pantalla(self.ancho_inicial, self.alto_inicial, min_w, min_h)
             info = pygame.display.Info()
             self.ancho, self.alto = info.current_w, info.current_h
-            self.pantalla = pygame.display.set_mode((self.ancho, self.alto), pygame.RESIZABLE)
+            self.pantalla = pantalla_app().establecer_modo((self.ancho, self.alto), pygame.RESIZABLE)
             self.fullscreen = False
             # Ajustar layout inicial para cubrir ventana maximizada
             self.redimensionar(self.ancho, self.alto)
@@ -5984,13 +4875,21 @@ class VentanaRutina:
                 color_titulo = VERDE_BOTON
             titulo_texto = fuente_titulo.render(titulo_str, True, color_titulo)
             
-            fuente_mensaje = pygame.font.Font(None, 24)
+            fuente_mensaje = fuente_cacheada(24)
             mensaje_texto = None
             
             clock = pygame.time.Clock()
             ejecutando = True
             
+            perfil = perfil_fotogramas()
+            escena = EscenaRetenida(refresco_max=0.5)
             while ejecutando:
+                firma = self._firma_escena(mensaje_texto, getattr(self, 'velocidad_actual', None), getattr(self, 'dificultad', None),
+                                           pygame.time.get_ticks() < getattr(self, '_aviso_limite_expira_ms', 0))
+                if escena.omitir_fotograma(self.pantalla, firma):
+                    escena.esperar(clock, activo=self._ui_activa())
+                    continue
+                perfil.fotograma(self.nombres_menus.get(self.boton_id, 'Rutinas'))
                 self.pantalla.fill(self.color_fondo)
                 # Título más arriba para "Rutinas" y "Progreso del Paciente"
                 if self.boton_id in (1, 3):
@@ -6008,7 +4907,11 @@ class VentanaRutina:
                     if cambio:
                         self.velocidad_actual = nueva_velocidad
                 
-                for evento in pygame.event.get():
+                perfil.marca('estado')
+                for evento in escena.eventos():
+                    escena.evento(evento)
+                    if atender_superposiciones(evento):
+                        continue
                     if evento.type == pygame.QUIT:
                         raise CerrarPrograma("Usuario cerró la ventana")
                     
@@ -6020,7 +4923,7 @@ class VentanaRutina:
                         if evento.key == pygame.K_F11:
                             self.fullscreen = not self.fullscreen
                             if self.fullscreen:
-                                self.pantalla = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
+                                self.pantalla = pantalla_app().establecer_modo((0, 0), pygame.FULLSCREEN)
                                 info = pygame.display.Info()
                                 self.redimensionar(info.current_w, info.current_h)
                             else:
@@ -6030,7 +4933,7 @@ class VentanaRutina:
                                     w, h = max(min_w, info.current_w), max(min_h, info.current_h)
                                 else:
                                     w, h = ajustar_a_pantalla(self.ancho_inicial, self.alto_inicial, min_w, min_h)
-                                self.pantalla = pygame.display.set_mode((w, h), pygame.RESIZABLE)
+                                self.pantalla = pantalla_app().establecer_modo((w, h), pygame.RESIZABLE)
                                 self.redimensionar(w, h)
                             continue
                         if evento.key == pygame.K_ESCAPE and self.fullscreen:
@@ -6041,7 +4944,7 @@ class VentanaRutina:
                                 w, h = max(min_w, info.current_w), max(min_h, info.current_h)
                             else:
                                 w, h = ajustar_a_pantalla(self.ancho_inicial, self.alto_inicial, min_w, min_h)
-                            self.pantalla = pygame.display.set_mode((w, h), pygame.RESIZABLE)
+                            self.pantalla = pantalla_app().establecer_modo((w, h), pygame.RESIZABLE)
                             self.redimensionar(w, h)
                             continue
                     
@@ -6066,7 +4969,15 @@ class VentanaRutina:
                                         continue
                                     if self.boton_reanudar_mov.verificar_clic(pos_mouse):
                                         if self.conexion_activa and self.controlador_cnc:
-                                            self.controlador_cnc.reanudar_movimiento()
+                                            if (self._rutina_interrumpida and not self.controlador_cnc.en_hold
+                                                    and not self.controlador_cnc.ejecutando_rutina):
+                                                # Retomar la rutina interrumpida desde su punto de control
+                                                programa_int, nombre_int = self._rutina_interrumpida
+                                                self._rutina_interrumpida = None
+                                                self._reanudar_captura_ecg()
+                                                Thread(target=self._run_rutina_mem, args=(programa_int, nombre_int, True), daemon=True).start()
+                                            else:
+                                                self.controlador_cnc.reanudar_movimiento()
                                         continue
                                 except Exception:
                                     pass
@@ -6117,7 +5028,7 @@ class VentanaRutina:
                                         ok, msg = self.controlador_cnc.guardar_configuracion_grbl()
                                         try:
                                             if ok:
-                                                mostrar_aviso_sistema("Respaldo GRBL", f"Guardado en:\n{msg}")
+                                                mostrar_aviso_sistema("Respaldo GRBL", f"Guardado en:\n{msg}", modal=False)
                                             else:
                                                 mostrar_aviso_sistema("Respaldo GRBL", f"No se pudo guardar: {msg}")
                                         except Exception:
@@ -6179,8 +5090,12 @@ class VentanaRutina:
                                             self._aviso_limite_mensaje = "Rutina vacía. Defínela primero."
                                             self._aviso_limite_expira_ms = pygame.time.get_ticks() + 3000
                                             return
-                                        # Validar rango de seguridad
-                                        ok_rng, msg_rng = self._validar_lineas_en_rango(lineas)
+                                        # Determinar si hay que invertir según la mano seleccionada
+                                        invertir_rutina = (self.mano_actual == 'Izquierda')
+                                        
+                                        # Compilar una vez (limpieza + inversión) y validar rango de seguridad
+                                        programa = compilar_programa_gcode(lineas, invertir=invertir_rutina)
+                                        ok_rng, msg_rng = self._validar_lineas_en_rango(programa, *self.controlador_cnc._limites_vigentes())
                                         if not ok_rng:
                                             self._aviso_limite_mensaje = msg_rng or "Rutina fuera de rango"
                                             self._aviso_limite_expira_ms = pygame.time.get_ticks() + 3000
@@ -6189,34 +5104,14 @@ class VentanaRutina:
                                         # Preparar nombre de rutina para la captura
                                         nombre_rutina = f"{self.mano_actual} - {self.zona_actual} - {self._nombres_rutinas_por_zona(self.zona_actual)[subrutina-1]}"
                                         
-                                        # Determinar si hay que invertir según la mano seleccionada
-                                        invertir_rutina = (self.mano_actual == 'Izquierda')
+                                        # Una rutina interrumpida pendiente se da por terminada al lanzar otra
+                                        self._descartar_rutina_interrumpida()
                                         
                                         # Iniciar captura ECG automáticamente
                                         self._iniciar_captura_ecg(nombre_rutina)
                                         
                                         # Ejecutar en hilo para no bloquear la UI
-                                        def _run_rutina_mem():
-                                            exito_local = self.controlador_cnc.ejecutar_lineas_gcode(lineas, base_tiempo=0.4, invert=invertir_rutina)
-                                            
-                                            # Detener y guardar captura ECG automáticamente al finalizar
-                                            self._detener_y_guardar_captura_ecg()
-                                            
-                                            if exito_local:
-                                                try:
-                                                    mostrar_aviso_sistema("Ejecución Exitosa", f"Rutina {nombre_rutina} ejecutada")
-                                                except Exception:
-                                                    pass
-                                            else:
-                                                detalle = ""
-                                                try:
-                                                    if self.controlador_cnc and getattr(self.controlador_cnc, 'ultimo_limite', ''):
-                                                        detalle = self.controlador_cnc.ultimo_limite
-                                                except Exception:
-                                                    detalle = ""
-                                                self._aviso_limite_mensaje = detalle or "Movimiento fuera de límites. Comando cancelado."
-                                                self._aviso_limite_expira_ms = pygame.time.get_ticks() + 3000
-                                        Thread(target=_run_rutina_mem, daemon=True).start()
+                                        Thread(target=self._run_rutina_mem, args=(programa, nombre_rutina), daemon=True).start()
                                     else:
                                         mensaje_texto = "CNC no conectada"
                     
@@ -6248,9 +5143,11 @@ class VentanaRutina:
                                     print(f"Error al ajustar velocidad: {e}")
                         # No ejecutar rutinas en MOUSEMOTION; sólo actualizar sliders/hover
                 
+                perfil.marca('eventos')
                 # Leer sensores ECG si la captura está activa (para ventana Rutinas)
                 if self.boton_id == 1 and self.captura_ecg_activa:
                     self._leer_sensor_ecg()
+                perfil.marca('sensores')
                 
                 # Actualizar hover y dibujar botones
                 for boton in self.botones:
@@ -6287,8 +5184,8 @@ class VentanaRutina:
                 # Dibujar selector zona/dificultad si aplica
                 if self.boton_id == 1:
                     # Dibujar etiqueta "Zona de ejercicio:" antes de los radio buttons - MÁS ARRIBA
-                    fuente_etiqueta_zona = pygame.font.Font(None, 28)
-                    etiqueta_zona = fuente_etiqueta_zona.render("Zona de ejercicio:", True, (0, 100, 0))
+                    fuente_etiqueta_zona = fuente_cacheada(28)
+                    etiqueta_zona = texto_cacheado("Zona de ejercicio:", fuente_etiqueta_zona, (0, 100, 0))
                     # Posicionar más arriba (cambio de -28 a -35)
                     y_etiqueta_zona = self.radio_hombro.y - 35
                     self.pantalla.blit(etiqueta_zona, (self.radio_hombro.x, y_etiqueta_zona))
@@ -6297,7 +5194,7 @@ class VentanaRutina:
                     self.radio_antebrazo.dibujar(self.pantalla)
                     
                     # Dibujar etiqueta "Mano:" antes de los radio buttons de mano - MÁS SEPARACIÓN
-                    etiqueta_mano = fuente_etiqueta_zona.render("Mano:", True, (0, 100, 0))
+                    etiqueta_mano = texto_cacheado("Mano:", fuente_etiqueta_zona, (0, 100, 0))
                     y_etiqueta_mano = self.radio_derecha.y - 40  # Aumentado de -35 a -40
                     self.pantalla.blit(etiqueta_mano, (self.radio_derecha.x, y_etiqueta_mano))
                     
@@ -6307,8 +5204,8 @@ class VentanaRutina:
                     self.slider_dificultad.dibujar(self.pantalla)
                     # Mostrar el nivel de dificultad (solo número, sin %)
                     try:
-                        fuente_val_dif = pygame.font.Font(None, 22)
-                        dif_surface = fuente_val_dif.render(f"{int(self.dificultad)}", True, NEGRO)
+                        fuente_val_dif = fuente_cacheada(22)
+                        dif_surface = texto_cacheado(f"{int(self.dificultad)}", fuente_val_dif, NEGRO)
                         dif_rect = dif_surface.get_rect()
                         dif_rect.midleft = (self.slider_dificultad.rect.right + 10, self.slider_dificultad.rect.centery)
                         # Evitar invadir la columna de botones derecha
@@ -6320,8 +5217,8 @@ class VentanaRutina:
                     except Exception:
                         pass
                     # Etiqueta y slider de velocidad
-                    fuente_lbl = pygame.font.Font(None, 28)
-                    lblv = fuente_lbl.render("Velocidad", True, (0, 100, 0))
+                    fuente_lbl = fuente_cacheada(28)
+                    lblv = texto_cacheado("Velocidad", fuente_lbl, (0, 100, 0))
                     label_pos = (self.slider_velocidad_rutina.rect.x, self.slider_velocidad_rutina.rect.y - 24)
                     self.pantalla.blit(lblv, label_pos)
                     self.slider_velocidad_rutina.dibujar(self.pantalla)
@@ -6345,8 +5242,8 @@ class VentanaRutina:
                                     self.controlador_cnc._ultimo_aplicar_ov = ahora
                                 except Exception:
                                     pass
-                        fuente_val = pygame.font.Font(None, 22)
-                        val_surface = fuente_val.render(f"{int(self.velocidad_actual)}%", True, NEGRO)
+                        fuente_val = fuente_cacheada(22)
+                        val_surface = texto_cacheado(f"{int(self.velocidad_actual)}%", fuente_val, NEGRO)
                         val_rect = val_surface.get_rect()
                         val_rect.midleft = (self.slider_velocidad_rutina.rect.right + 10, self.slider_velocidad_rutina.rect.centery)
                         # Evitar invadir la columna de botones derecha
@@ -6361,9 +5258,9 @@ class VentanaRutina:
                     try:
                         if self.controlador_cnc:
                             ov, f_act = self.controlador_cnc.obtener_estado_velocidad()
-                            fuente_stat = pygame.font.Font(None, 18)
+                            fuente_stat = fuente_cacheada(18)
                             txt = f"Ov:{ov}%  F:{int(f_act)}"
-                            stat_surface = fuente_stat.render(txt, True, (30, 100, 30))
+                            stat_surface = texto_cacheado(txt, fuente_stat, (30, 100, 30))
                             stat_rect = stat_surface.get_rect()
                             # Colocar a la derecha del porcentaje actual
                             stat_rect.midleft = (val_rect.right + 12, val_rect.centery)
@@ -6376,16 +5273,18 @@ class VentanaRutina:
                     except Exception:
                         pass
                     # Etiqueta dificultad con fuente más grande y color verde oscuro
-                    fuente_lbl_dif = pygame.font.Font(None, 28)
-                    lbl = fuente_lbl_dif.render("Dificultad", True, (0, 100, 0))
+                    fuente_lbl_dif = fuente_cacheada(28)
+                    lbl = texto_cacheado("Dificultad", fuente_lbl_dif, (0, 100, 0))
                     self.pantalla.blit(lbl, (self.slider_dificultad.rect.x, self.slider_dificultad.rect.y - 24))
                     # Vista previa del patrón
+                    perfil.marca('dibujo')
                     self.dibujar_vista_previa(self.zona_actual, rutina_hover, self.dificultad)
+                    perfil.marca('vista_previa')
                 
                 # Mostrar mensaje si existe (subido respecto a la barra inferior)
                 if mensaje_texto:
                     fuente_mensaje = ajustar_fuente_a_ancho(mensaje_texto, int(self.ancho * 0.9), 24, 12)
-                    texto = fuente_mensaje.render(mensaje_texto, True, ROJO)
+                    texto = texto_cacheado(mensaje_texto, fuente_mensaje, ROJO)
                     # Elevar el mensaje dejando mayor margen sobre la barra
                     margen_inferior_msg = 100
                     y_msg = self.alto - alto_barra_inferior(self.alto) - margen_inferior_msg
@@ -6394,8 +5293,8 @@ class VentanaRutina:
                 # Aviso discreto de límites (solo Rutinas)
                 if self.boton_id == 1 and self._aviso_limite_mensaje and ahora_ms < self._aviso_limite_expira_ms:
                     try:
-                        fuente_tip = pygame.font.Font(None, 22)
-                        txt = fuente_tip.render(self._aviso_limite_mensaje, True, ROJO)
+                        fuente_tip = fuente_cacheada(22)
+                        txt = texto_cacheado(self._aviso_limite_mensaje, fuente_tip, ROJO)
                         # Colocar sobre la barra inferior, margen izquierdo
                         margen = 10
                         y_tip = self.alto - alto_barra_inferior(self.alto) - 30
@@ -6411,10 +5310,10 @@ class VentanaRutina:
                     and getattr(self.controlador_cnc, 'debug_limites', False)
                 ):
                     try:
-                        fuente_det = pygame.font.Font(None, 20)
+                        fuente_det = fuente_cacheada(20)
                         det = self.controlador_cnc.ultimo_limite
                         det_fit = recortar_con_ellipsis(det, fuente_det, int(self.ancho * 0.9))
-                        surf = fuente_det.render(det_fit, True, (200, 80, 80))
+                        surf = texto_cacheado(det_fit, fuente_det, (200, 80, 80))
                         y_det = self.alto - alto_barra_inferior(self.alto) - 52
                         self.pantalla.blit(surf, (10, y_det))
                     except Exception:
@@ -6427,7 +5326,7 @@ class VentanaRutina:
                         estado_texto = "Conectado"
                         estado_color = VERDE
                         fuente_estado = ajustar_fuente_a_ancho(estado_texto, int(self.ancho * 0.5), 24, 12)
-                        texto_estado = fuente_estado.render(estado_texto, True, estado_color)
+                        texto_estado = texto_cacheado(estado_texto, fuente_estado, estado_color)
                         # Elevar sobre la barra levantada
                         offset_barra_local = max(60, int(self.alto * 0.10))
                         rect_estado = texto_estado.get_rect(bottomleft=(10, self.alto - alto_barra_inferior(self.alto) - offset_barra_local - 10))
@@ -6437,22 +5336,22 @@ class VentanaRutina:
                     estado_texto = "Estado: Conectado" if self.conexion_activa else "Estado: Desconectado"
                     estado_color = VERDE if self.conexion_activa else ROJO
                     fuente_estado = ajustar_fuente_a_ancho(estado_texto, int(self.ancho * 0.5), 24, 12)
-                    texto_estado = fuente_estado.render(estado_texto, True, estado_color)
+                    texto_estado = texto_cacheado(estado_texto, fuente_estado, estado_color)
                     rect_estado = texto_estado.get_rect(bottomleft=(10, self.alto - alto_barra_inferior(self.alto) - 10))
                     self.pantalla.blit(texto_estado, rect_estado)
                 
                 # Mostrar indicador de captura ECG activa (solo para ventana Rutinas)
                 if self.boton_id == 1 and self.captura_ecg_activa:
                     try:
-                        fuente_captura = pygame.font.Font(None, 26)
-                        texto_captura = fuente_captura.render("● Capturando datos ECG...", True, ROJO)
+                        fuente_captura = fuente_cacheada(26)
+                        texto_captura = texto_cacheado("● Capturando datos ECG...", fuente_captura, ROJO)
                         rect_captura = texto_captura.get_rect(topright=(self.ancho - 10, 10))
                         self.pantalla.blit(texto_captura, rect_captura)
                         
                         # Mostrar nombre de la rutina
                         if self.nombre_rutina_actual:
-                            fuente_rutina = pygame.font.Font(None, 22)
-                            texto_rutina = fuente_rutina.render(f"Rutina: {self.nombre_rutina_actual}", True, (100, 100, 100))
+                            fuente_rutina = fuente_cacheada(22)
+                            texto_rutina = texto_cacheado(f"Rutina: {self.nombre_rutina_actual}", fuente_rutina, (100, 100, 100))
                             rect_rutina = texto_rutina.get_rect(topright=(self.ancho - 10, 36))
                             self.pantalla.blit(texto_rutina, rect_rutina)
                     except Exception:
@@ -6462,7 +5361,7 @@ class VentanaRutina:
                 if self.conexion_activa and self.boton_id != 1:
                     vel_str = f"Velocidad: {self.velocidad_actual}%"
                     fuente_vel = ajustar_fuente_a_ancho(vel_str, int(self.ancho * 0.4), 24, 12)
-                    texto_velocidad = fuente_vel.render(vel_str, True, VERDE)
+                    texto_velocidad = texto_cacheado(vel_str, fuente_vel, VERDE)
                     rect_velocidad = texto_velocidad.get_rect(topright=(self.ancho - 10, 10))
                     self.pantalla.blit(texto_velocidad, rect_velocidad)
                     
@@ -6489,15 +5388,46 @@ class VentanaRutina:
                     getattr(self, 'controlador_cnc', None),
                     offset_px=offset_barra_local
                 )
+                dibujar_superposiciones(self.pantalla)
+                perfil.marca('dibujo')
                 pygame.display.flip()
-                clock.tick(60)
+                perfil.marca('flip')
+                escena.esperar(clock, activo=self._ui_activa())
             
             return not ejecutando  # Retorna False si se cerró la ventana
 
+    def _ui_activa(self) -> bool:
+        """Rutina en marcha, captura ECG o slider arrastrándose: ritmo fijo de 60 fps."""
+        cnc = self.controlador_cnc
+        if cnc is not None and getattr(cnc, 'ejecutando_rutina', False):
+            return True
+        if getattr(self, 'captura_ecg_activa', False):
+            return True
+        return any(getattr(getattr(self, nombre, None), 'arrastrando', False)
+                   for nombre in ('slider_dificultad', 'slider_velocidad_rutina'))
+
+    def _firma_escena(self, *extra):
+        """Estado que cambia sin eventos (CNC, captura ECG, avisos) más el de cada bucle."""
+        cnc = self.controlador_cnc
+        estado_cnc = None
+        if cnc is not None:
+            try:
+                estado_cnc = (
+                    round(float(cnc.posicion_x), 2), round(float(cnc.posicion_y), 2),
+                    cnc.conectado, cnc.ejecutando_rutina, getattr(cnc, 'en_hold', False),
+                    cnc.override_actual, int(cnc.feed_reportado or 0), getattr(cnc, 'ultimo_limite', ''),
+                )
+            except Exception:
+                estado_cnc = None
+        return (estado_cnc, self.conexion_activa, getattr(self, 'captura_ecg_activa', False),
+                getattr(self, 'nombre_rutina_actual', None), getattr(self, '_aviso_limite_mensaje', ''), extra)
+
     def __del__(self):
         """Limpia los recursos al finalizar"""
-        if hasattr(self, 'sensor_arduino') and self.sensor_arduino:
-            self.sensor_arduino.desconectar()
+        try:
+            self._cancelar_suscripciones_sensores()
+        except Exception:
+            pass
 
 class GraficasMusculares:
     def __init__(self, id_paciente):
@@ -6511,13 +5441,13 @@ class GraficasMusculares:
         info = pygame.display.Info()
         self.ancho, self.alto = info.current_w, info.current_h
         self.fullscreen = False
-        self.pantalla = pygame.display.set_mode((self.ancho, self.alto), pygame.RESIZABLE)
+        self.pantalla = pantalla_app().establecer_modo((self.ancho, self.alto), pygame.RESIZABLE)
         pygame.display.set_caption(f"Gráficas Musculares - Paciente: {id_paciente}")
         
         # Fuentes
-        self.fuente = pygame.font.Font(None, 24)
-        self.fuente_titulo = pygame.font.Font(None, 32)
-        self.fuente_pequeña = pygame.font.Font(None, 20)
+        self.fuente = fuente_cacheada(24)
+        self.fuente_titulo = fuente_cacheada(32)
+        self.fuente_pequeña = fuente_cacheada(20)
         
         # Variables de control
         self.tipo_grafica = "progreso"  # "progreso", "comparacion", "sesion"
@@ -6607,6 +5537,10 @@ class GraficasMusculares:
 
     def generar_graficas(self):
         """Genera las gráficas según el tipo seleccionado"""
+        with perfil_fotogramas().seccion('graficas'):
+            self._generar_graficas()
+
+    def _generar_graficas(self):
         if not _try_import_matplotlib():
             self.superficie_grafica = None
             return
@@ -6924,16 +5858,20 @@ class GraficasMusculares:
         clock = pygame.time.Clock()
         ejecutando = True
         
+        perfil = perfil_fotogramas()
         while ejecutando:
+            perfil.fotograma('Progreso')
             tiempo_actual = pygame.time.get_ticks()
             
             # Procesar eventos
             for evento in pygame.event.get():
+                if atender_superposiciones(evento):
+                    continue
                 if evento.type == pygame.QUIT:
                     raise CerrarPrograma("Usuario cerró ventana rutinas")
                 elif evento.type == pygame.VIDEORESIZE and not self.fullscreen:
                     # Ajustar superficie en modo ventana
-                    self.pantalla = pygame.display.set_mode((evento.w, evento.h), pygame.RESIZABLE)
+                    self.pantalla = pantalla_app().establecer_modo((evento.w, evento.h), pygame.RESIZABLE)
                     self.ancho, self.alto = evento.w, evento.h
                     # Reposicionar botones al cambiar tamaño de ventana
                     self.crear_botones()
@@ -6976,7 +5914,7 @@ class GraficasMusculares:
                     if evento.key == pygame.K_F11:
                         self.fullscreen = not self.fullscreen
                         if self.fullscreen:
-                            self.pantalla = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
+                            self.pantalla = pantalla_app().establecer_modo((0, 0), pygame.FULLSCREEN)
                             info = pygame.display.Info()
                             self.ancho, self.alto = info.current_w, info.current_h
                             # Reposicionar botones al cambiar a fullscreen
@@ -6986,13 +5924,14 @@ class GraficasMusculares:
                         else:
                             # Salir a un tamaño base y permitir redimensionar
                             w, h = 1200, 700
-                            self.pantalla = pygame.display.set_mode((w, h), pygame.RESIZABLE)
+                            self.pantalla = pantalla_app().establecer_modo((w, h), pygame.RESIZABLE)
                             self.ancho, self.alto = w, h
                             # Reposicionar botones al salir de fullscreen
                             self.crear_botones()
                             # Regenerar gráfica con el nuevo tamaño
                             self.generar_graficas()
             
+            perfil.marca('eventos')
             # Limpiar pantalla
             self.pantalla.fill(VERDE_CLARO)
             
@@ -7007,7 +5946,10 @@ class GraficasMusculares:
             dibujar_barra_inferior(self.pantalla, self.ancho, self.alto, False, "CNC no conectada")
 
             # Actualizar pantalla
+            dibujar_superposiciones(self.pantalla)
+            perfil.marca('dibujo')
             pygame.display.flip()
+            perfil.marca('flip')
             
             # Controlar FPS
             clock.tick(60)
@@ -7023,10 +5965,21 @@ class GraficasMusculares:
 def main():
     """Función principal del programa"""
     try:
-        # Inicializar pygame
-        pygame.init()
+        arranque = perfil_arranque()
+        arranque.marcar('importacion')
+        configurar_registro()
+
+        # Sólo los subsistemas que se usan: pygame.init() también abre audio y joystick
+        pygame.display.init()
+        pygame.font.init()
+        arranque.marcar('pygame')
+        
+        # Identificar placas (ECG / CNC) en paralelo mientras se muestra la interfaz
+        descubrimiento_dispositivos().descubrir_en_segundo_plano()
         
-        # Ya no se usa GPIO - Arduino ECG se inicializa automáticamente en la ventana de gráficas
+        # El ECG se conecta una vez para todo el programa; las ventanas se suscriben
+        servicio_sensores().iniciar()
+        arranque.marcar('servicios')
         
         # Mostrar mensaje de bienvenida
         print("=" * 60)
@@ -7044,6 +5997,7 @@ def main():
         
         # Crear y ejecutar la ventana principal
         ventana_principal = VentanaPrincipal()
+        arranque.marcar('ventana_principal')
         resultado = ventana_principal.ejecutar()
         # Si la ventana se cerró con X o se salió normalmente, cerrar programa
         pygame.quit()
@@ -7061,6 +6015,7 @@ def main():
         traceback.print_exc()
     finally:
         # Limpiar recursos
+        cerrar_servicios()
         try:
             pygame.quit()
         except:
@@ -7068,6 +6023,9 @@ def main():
         print("Programa finalizado correctamente")
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in ('run', 'migrar'):
+        # Ejecución sin pantalla: no se inicializa pygame
+        sys.exit(main_linea_ordenes())
     main()
 
     
\ No newline at end of file